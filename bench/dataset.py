@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Синтетический набор данных «milk» для локального PostgreSQL: все таблицы, к которым обращается
+бот (profit, orders, debt, stock, products, clients, sales_representatives, managers_plan,
+bot_autorized_chats, agent_logs, training_clicks), с размерами по коэффициенту масштаба.
+
+Данные детерминированные: при одном масштабе набор всегда одинаковый, так что замеры
+bench.e2e_bench сравнимы между версиями. Даты отсчитываются от текущего дня — запросы
+«за прошлый месяц» и «за год» находят данные. Колонки повторяют те, что используют SQL бота,
+справочники и миграции; бонусные клиенты (marker = 'Бонус') и private-label товары есть,
+чтобы guard_sql фильтровал как в бою.
+
+Таблицы создаются в схеме --schema (по умолчанию public — так их видят execute_sql и guard_sql),
+поэтому запускать нужно на отдельной локальной базе (PG_DB=milk_bench и т.п.). Уже существующие
+таблицы не трогаются без --drop.
+
+Запуск:
+    PG_DB=milk_bench python -m bench.dataset --scale 0.1 [--drop] [--schema public]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+from bench.synthetic import PROFIT_DDL, PROFIT_INDEXES, ProfitDistribution, fill_profit
+from src.db.pool import close_pool, get_pool
+
+MANAGERS = 25
+CHATS = 20
+MONTHS = 24        # глубина истории profit, debt, managers_plan
+ORDER_DAYS = 120   # заказы — только свежие
+STOCK_DAYS = 60    # ежедневные остатки по складам
+
+# Размеры при --scale 1 и нижняя граница при малом масштабе
+_BASE_SIZES: Dict[str, Tuple[int, int]] = {
+    "clients": (5000, 100),
+    "products": (1500, 50),
+    "profit": (2_000_000, 10_000),
+    "orders": (300_000, 2_000),
+    "agent_logs": (50_000, 500),
+}
+
+_SURNAMES = (
+    "Альборов", "Хашев", "Кудаев", "Шогенов", "Тхагапсоев", "Канокова", "Бжахов", "Мальбахов",
+    "Кушхов", "Бекалдиев", "Гергоков", "Атабиев", "Унежев", "Жилов", "Бозиев", "Ципинов",
+    "Тлостанов", "Карданов", "Хамурзов", "Нагоев", "Иванов", "Петров", "Соколов", "Морозов", "Волков",
+)
+_FIRST_NAMES = ("Азамат", "Мурат", "Аслан", "Залим", "Руслан", "Тимур", "Мадина", "Ислам", "Артур", "Алим", "Марат")
+_CLIENT_WORDS = ("Ромашка", "Магнит", "Эльбрус", "Долина", "Нарт", "Терек", "Кавказ", "Юг", "Лавка", "Созвездие", "Пятёрочка", "Оазис")
+_CLIENT_PREFIXES = ("ООО ", "ИП ", "", "АО ")
+REGIONS = ("Нальчик", "Прохладный", "Баксан", "Майский", "Терек", "Чегем", "Нарткала", "Тырныауз")
+BRANDS = ("Чабан", "Горная долина", "Эльбрус", "Нальчикский", "Сырный двор", "Молочный край", "Кавказ", "Балкария")
+_CATEGORIES = (
+    ("Сыр", "Молочная продукция"), ("Молоко", "Молочная продукция"), ("Кефир", "Молочная продукция"),
+    ("Сметана", "Молочная продукция"), ("Творог", "Молочная продукция"), ("Йогурт", "Молочная продукция"),
+    ("Масло", "Молочная продукция"), ("Айран", "Молочная продукция"), ("Колбаса", "Мясная продукция"),
+    ("Мясо", "Мясная продукция"), ("Напитки", "Прочее"),
+)
+CHANNELS = ("Розница", "Опт", "HoReCa", "Сети")
+WAREHOUSES = ("Нальчик", "Прохладный", "Баксан")
+_BONUS_EVERY = 30
+
+_REQUESTS = (
+    "выручка по менеджерам за прошлый месяц", "продажи чабан по регионам за год", "динамика веса по месяцам",
+    "дебиторка по менеджерам", "остатки на складе нальчик", "выполнение плана за текущий месяц",
+    "топ-10 клиентов по выручке", "возвраты по каналам за квартал", "неотгруженные заказы",
+)
+
+# Порядок создания: справочники раньше фактов, логи раньше кликов
+TABLES = (
+    "clients", "products", "sales_representatives", "profit", "orders", "debt", "stock",
+    "managers_plan", "bot_autorized_chats", "agent_logs", "training_clicks",
+)
+
+_DDL: Dict[str, str] = {
+    "clients": """
+CREATE TABLE {s}.clients (
+    client_code text PRIMARY KEY,
+    client_name text,
+    public_name text,
+    region      text,
+    manager     text,
+    marker      text
+);""",
+    "products": """
+CREATE TABLE {s}.products (
+    product_code     text PRIMARY KEY,
+    product_name     text,
+    brand            text,
+    category_1       text,
+    category_group_1 text,
+    client_code      text
+);""",
+    "sales_representatives": """
+CREATE TABLE {s}.sales_representatives (
+    id        serial PRIMARY KEY,
+    full_name text,
+    phone     text,
+    email     text,
+    region    text
+);""",
+    "profit": PROFIT_DDL + PROFIT_INDEXES,
+    "orders": """
+CREATE TABLE {s}.orders (
+    order_number  text,
+    client_code   text,
+    product_code  text,
+    order_date    date,
+    shipment_date date,
+    quantity      numeric(14, 3),
+    weight_kg     numeric(14, 3),
+    revenue       numeric(14, 2),
+    manager       text,
+    channel       text,
+    warehouse     text
+);
+CREATE INDEX ON {s}.orders (order_date);""",
+    "debt": """
+CREATE TABLE {s}.debt (
+    debt_date    date,
+    client_code  text,
+    manager      text,
+    total_debt   numeric(14, 2),
+    overdue_debt numeric(14, 2)
+);
+CREATE INDEX ON {s}.debt (debt_date);""",
+    "stock": """
+CREATE TABLE {s}.stock (
+    stock_date      date,
+    product_code    text,
+    warehouse       text,
+    final_quantity  numeric(14, 3),
+    final_weight_kg numeric(14, 3)
+);
+CREATE INDEX ON {s}.stock (stock_date);""",
+    "managers_plan": """
+CREATE TABLE {s}.managers_plan (
+    period      date,
+    manager     text,
+    client_code text,
+    plan        numeric(14, 3)
+);
+CREATE INDEX ON {s}.managers_plan (period);""",
+    "bot_autorized_chats": """
+CREATE TABLE {s}.bot_autorized_chats (
+    chat_id    bigint PRIMARY KEY,
+    chat_name  text,
+    created_at timestamptz NOT NULL DEFAULT now()
+);""",
+    "agent_logs": """
+CREATE TABLE {s}.agent_logs (
+    id             bigserial PRIMARY KEY,
+    chat_id        bigint,
+    user_id        bigint,
+    user_name      text,
+    user_request   text,
+    agent_response text,
+    n8n_execution  text,
+    created_at     timestamptz NOT NULL DEFAULT now()
+);""",
+    "training_clicks": """
+CREATE TABLE {s}.training_clicks (
+    id         bigserial PRIMARY KEY,
+    log_id     bigint,
+    chat_id    bigint,
+    clicked_by bigint,
+    status     text,
+    comment    text,
+    clicked_at timestamptz
+);
+CREATE INDEX ON {s}.training_clicks (log_id);""",
+}
+
+# Факты генерируются в PostgreSQL (generate_series): клиент и товар строки — псевдослучайные
+# по номеру строки, менеджер и канал — клиента, как в боевых выгрузках (profit — bench.synthetic)
+_FILL_SQL: Dict[str, str] = {
+    "orders": """
+INSERT INTO {s}.orders
+SELECT
+    'ZK-' || lpad((g / 4)::text, 9, '0'),
+    'CL-' || lpad(ci::text, 5, '0'),
+    'PR-' || lpad(pi::text, 5, '0'),
+    d,
+    -- каждый 10-й заказ ещё не отгружен
+    CASE WHEN g % 10 = 0 THEN NULL ELSE d + (1 + g % 3)::int END,
+    q,
+    round(q * (0.2 + (pi % 10) / 10.0), 3),
+    round(q * (50 + pi % 400), 2),
+    ($4::text[])[(1 + ci % cardinality($4::text[]))::int],
+    ($5::text[])[(1 + ci % cardinality($5::text[]))::int],
+    ($6::text[])[(1 + g % cardinality($6::text[]))::int]
+FROM (
+    SELECT g, (g * 6151) % $2 AS ci, (g * 7927) % $3 AS pi,
+           current_date - (g % $7)::int AS d, (1 + g % 30)::numeric AS q
+    FROM generate_series(1, $1::bigint) AS g
+) s;""",
+    "debt": """
+INSERT INTO {s}.debt
+SELECT
+    (date_trunc('month', current_date) - make_interval(months => m))::date,
+    'CL-' || lpad(c::text, 5, '0'),
+    ($3::text[])[1 + c % cardinality($3::text[])],
+    round(((c * 37 + m * 11) % 500) * 100.0, 2),
+    round(((c * 37 + m * 11) % 500) * 100.0 * CASE WHEN (c + m) % 4 = 0 THEN 0.3 ELSE 0 END, 2)
+FROM generate_series(0, $2 - 1) AS m, generate_series(0, $1 - 1) AS c;""",
+    "stock": """
+INSERT INTO {s}.stock
+SELECT
+    current_date - d,
+    'PR-' || lpad(p::text, 5, '0'),
+    ($3::text[])[w],
+    q,
+    round(q * (0.2 + (p % 10) / 10.0), 3)
+FROM generate_series(0, $2 - 1) AS d,
+     generate_series(0, $1 - 1) AS p,
+     generate_series(1, cardinality($3::text[])) AS w,
+     LATERAL (SELECT ((p * 31 + d * 7 + w * 13) % 400)::numeric AS q) s;""",
+    "managers_plan": """
+INSERT INTO {s}.managers_plan
+SELECT
+    (date_trunc('month', current_date) - make_interval(months => m))::date,
+    ($3::text[])[1 + c % cardinality($3::text[])],
+    'CL-' || lpad(c::text, 5, '0'),
+    ((c * 13 + m * 7) % 300 + 20)::numeric
+FROM generate_series(0, $2 - 1) AS m, generate_series(0, $1 - 1) AS c;""",
+    "agent_logs": """
+INSERT INTO {s}.agent_logs (chat_id, user_id, user_name, user_request, agent_response, n8n_execution, created_at)
+SELECT
+    ($2::bigint[])[1 + g % cardinality($2::bigint[])],
+    ($2::bigint[])[1 + g % cardinality($2::bigint[])],
+    'user' || (g % cardinality($2::bigint[])),
+    ($3::text[])[1 + g % cardinality($3::text[])],
+    '<b>Отчёт</b>' || repeat(E'\\n<b>Строка</b> — Выручка: 123 456 ₽', 1 + g % 20),
+    'python-bot',
+    now() - make_interval(mins => ($1 - g)::int)
+FROM generate_series(1, $1) AS g;""",
+    "training_clicks": """
+INSERT INTO {s}.training_clicks (log_id, chat_id, clicked_by, status, comment, clicked_at)
+SELECT id, chat_id, user_id,
+       CASE WHEN id % 40 = 0 THEN 'обработано' ELSE 'в очереди' END,
+       CASE WHEN id % 60 = 0 THEN 'неверный период' END,
+       created_at + interval '1 minute'
+FROM {s}.agent_logs
+WHERE id % 20 = 0;""",
+}
+
+
+def dataset_sizes(scale: float) -> Dict[str, int]:
+    """Число строк основных таблиц при масштабе scale"""
+    return {table: max(minimum, int(base * scale)) for table, (base, minimum) in _BASE_SIZES.items()}
+
+
+def manager_name(i: int) -> str:
+    return f"{_SURNAMES[i % len(_SURNAMES)]} {_FIRST_NAMES[i % len(_FIRST_NAMES)]}"
+
+
+def client_name(i: int) -> str:
+    return f"{_CLIENT_PREFIXES[i % len(_CLIENT_PREFIXES)]}{_CLIENT_WORDS[i % len(_CLIENT_WORDS)]} {i}"
+
+
+def is_bonus_client(i: int) -> bool:
+    return i % _BONUS_EVERY == 0
+
+
+def _managers() -> List[str]:
+    return [manager_name(i) for i in range(MANAGERS)]
+
+
+def _chat_ids() -> List[int]:
+    return [100_000_000 + i for i in range(CHATS)]
+
+
+def _clients(n: int) -> List[tuple]:
+    return [
+        (
+            f"CL-{i:05d}",
+            client_name(i),
+            f"{_CLIENT_WORDS[i % len(_CLIENT_WORDS)]} {i}" if i % 3 == 0 else "",
+            REGIONS[i % len(REGIONS)],
+            manager_name(i % MANAGERS),
+            "Бонус" if is_bonus_client(i) else None,
+        )
+        for i in range(n)
+    ]
+
+
+def _products(n: int, clients: int) -> List[tuple]:
+    rows = []
+    for i in range(n):
+        brand = BRANDS[i % len(BRANDS)]
+        category, group = _CATEGORIES[(i // len(BRANDS)) % len(_CATEGORIES)]
+        # каждый 10-й товар — private-label клиента
+        owner = f"CL-{(i * 13) % clients:05d}" if i % 10 == 0 else None
+        rows.append((f"PR-{i:05d}", f"{category} {brand} {i}", brand, category, group, owner))
+    return rows
+
+
+def _sales_representatives() -> List[tuple]:
+    return [
+        (manager_name(i), f"+7 928 {700 + i:03d}-{i:02d}-{(i * 7) % 100:02d}", f"manager{i}@milk.local", REGIONS[i % len(REGIONS)])
+        for i in range(MANAGERS)
+    ]
+
+
+async def _existing(conn, schema: str) -> List[str]:
+    found = []
+    for table in TABLES:
+        if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", f"{schema}.{table}"):
+            found.append(table)
+    return found
+
+
+async def _fill(conn, table: str, schema: str, sizes: Dict[str, int]) -> None:
+    s = schema
+    if table == "clients":
+        await conn.copy_records_to_table(table, schema_name=s, records=_clients(sizes["clients"]))
+    elif table == "products":
+        await conn.copy_records_to_table(table, schema_name=s, records=_products(sizes["products"], sizes["clients"]))
+    elif table == "sales_representatives":
+        await conn.copy_records_to_table(
+            table, schema_name=s, records=_sales_representatives(),
+            columns=("full_name", "phone", "email", "region"),
+        )
+    elif table == "bot_autorized_chats":
+        await conn.copy_records_to_table(
+            table, schema_name=s, records=[(cid, f"Чат {cid}") for cid in _chat_ids()],
+            columns=("chat_id", "chat_name"),
+        )
+    elif table == "profit":
+        await fill_profit(conn, s, sizes["profit"], sizes["clients"], sizes["products"], ProfitDistribution(
+            managers=tuple(_managers()), channels=CHANNELS, warehouses=WAREHOUSES,
+            client_step=7919, product_step=104729, first_day=None, days=MONTHS * 365 // 12, by_client=True,
+        ))
+    elif table == "orders":
+        await conn.execute(
+            _FILL_SQL[table].format(s=s), sizes["orders"], sizes["clients"], sizes["products"],
+            _managers(), list(CHANNELS), list(WAREHOUSES), ORDER_DAYS,
+        )
+    elif table == "debt" or table == "managers_plan":
+        await conn.execute(_FILL_SQL[table].format(s=s), sizes["clients"], MONTHS, _managers())
+    elif table == "stock":
+        await conn.execute(_FILL_SQL[table].format(s=s), sizes["products"], STOCK_DAYS, list(WAREHOUSES))
+    elif table == "agent_logs":
+        await conn.execute(_FILL_SQL[table].format(s=s), sizes["agent_logs"], _chat_ids(), list(_REQUESTS))
+    elif table == "training_clicks":
+        await conn.execute(_FILL_SQL[table].format(s=s))
+
+
+async def create_dataset(scale: float, schema: str = "public", drop: bool = False) -> Dict[str, Tuple[int, float]]:
+    """Создать и заполнить все таблицы; {таблица: (строк, секунд)}.
+
+    Без drop существующие таблицы не трогаются — RuntimeError со списком.
+    """
+    sizes = dataset_sizes(scale)
+    pool = await get_pool()
+    result: Dict[str, Tuple[int, float]] = {}
+    async with pool.acquire() as conn:
+        existing = await _existing(conn, schema)
+        if existing and not drop:
+            raise RuntimeError(f"В схеме {schema} уже есть таблицы: {', '.join(existing)} (пересоздать — --drop)")
+        await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
+        for table in reversed(TABLES):
+            await conn.execute(f"DROP TABLE IF EXISTS {schema}.{table};")
+        for table in TABLES:
+            start = time.perf_counter()
+            await conn.execute(_DDL[table].format(s=schema))
+            await _fill(conn, table, schema, sizes)
+            await conn.execute(f"ANALYZE {schema}.{table};")
+            rows = await conn.fetchval(f"SELECT count(*) FROM {schema}.{table}")
+            result[table] = (rows, time.perf_counter() - start)
+    return result
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=float, default=0.1, help="1 — около 2 млн строк profit")
+    parser.add_argument("--schema", default="public")
+    parser.add_argument("--drop", action="store_true", help="пересоздать существующие таблицы")
+    args = parser.parse_args()
+    try:
+        try:
+            created = await create_dataset(args.scale, args.schema, args.drop)
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        print(f"{'таблица':<24}{'строк':>12}{'сек':>8}")
+        for table, (rows, seconds) in created.items():
+            print(f"{table:<24}{rows:>12}{seconds:>8.1f}")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк диспетчера апдейтов: пропускная способность при N одновременно пишущих чатах.
+
+Запуск:
+    python -m bench.dispatcher_bench --chats 50 --messages 4 --latency 0.2 --limit 16
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+from telegram.ext import SimpleUpdateProcessor
+
+from src.bot.dispatcher import ChatOrderedUpdateProcessor
+
+
+def _make_updates(chats: int, messages: int) -> List[SimpleNamespace]:
+    """Апдейты перемешаны между чатами, но внутри чата идут по возрастанию seq."""
+    updates = []
+    for seq in range(messages):
+        for chat_id in range(chats):
+            updates.append(SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=None, seq=seq))
+    return updates
+
+
+async def _run(processor, updates: List[SimpleNamespace], latency: float, jitter: float) -> Dict[str, float]:
+    seen: Dict[int, List[int]] = {}
+    rnd = random.Random(42)
+
+    async def _handler(upd: SimpleNamespace) -> None:
+        await asyncio.sleep(latency + rnd.uniform(0, jitter))
+        seen.setdefault(upd.effective_chat.id, []).append(upd.seq)
+
+    await processor.initialize()
+    start = time.perf_counter()
+    # Как в PTB: на каждый апдейт — отдельная задача в порядке получения
+    tasks = [asyncio.create_task(processor.process_update(u, _handler(u))) for u in updates]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    await processor.shutdown()
+
+    ordered = all(v == sorted(v) for v in seen.values())
+    return {"elapsed": elapsed, "throughput": len(updates) / elapsed, "ordered": ordered}
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=4, help="сообщений на чат")
+    parser.add_argument("--latency", type=float, default=0.2, help="среднее время обработки, сек")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--limit", type=int, default=16, help="MAX_CONCURRENT_UPDATES")
+    args = parser.parse_args()
+
+    updates = _make_updates(args.chats, args.messages)
+    print(f"{len(updates)} апдейтов, {args.chats} чатов, обработка ~{args.latency:.2f}с (+{args.jitter:.2f}с)")
+    print(f"{'режим':<32}{'время, с':>10}{'апд/с':>10}{'порядок':>10}")
+
+    variants = [
+        ("последовательно (PTB default)", SimpleUpdateProcessor(1)),
+        (f"ChatOrdered, limit={args.limit}", ChatOrderedUpdateProcessor(args.limit)),
+        (f"ChatOrdered, limit={args.limit * 4}", ChatOrderedUpdateProcessor(args.limit * 4)),
+    ]
+    for name, processor in variants:
+        res = await _run(processor, updates, args.latency, args.jitter)
+        print(f"{name:<32}{res['elapsed']:>10.2f}{res['throughput']:>10.1f}{'ok' if res['ordered'] else 'FAIL':>10}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
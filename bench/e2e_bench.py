@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Сквозной бенчмарк на синтетическом наборе bench.dataset: guard_sql, execute_sql (без кэша
+и из кэша результатов), extract_entities, build_html_from_rows, Excel целиком (build_excel_bytes)
+и потоковая выгрузка (iter_sql -> write_excel_from_batches) на фиксированном корпусе запросов
+и фраз. Печатает таблицы задержек (p50/p95) и пиковой памяти; с --json сохраняет их в файл,
+чтобы сравнивать между версиями.
+
+Память — пик Python-аллокаций (tracemalloc) в отдельном прогоне, без буферов libpq/asyncpg;
+задержки замеряются без tracemalloc. Настройки бота (SQL_GUARD_MODE, SQL_ROLLUPS,
+SQL_COST_GATE, RESULT_CACHE_BACKEND…) берутся из окружения, как при обычном запуске.
+
+Запуск (на отдельной локальной базе):
+    PG_DB=milk_bench python -m bench.e2e_bench [--create --scale 0.1] [--repeat 5] [--json out.json]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import datetime as _dt
+import gc
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import aclosing
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bench.dataset import BRANDS, REGIONS, client_name, create_dataset, manager_name
+from src.db.guarded_relations import start_guarded_relations, stop_guarded_relations
+from src.db.pool import close_pool
+from src.db.result_cache import invalidate_result_cache
+from src.db.rollups import start_rollups, stop_rollups
+from src.db.sql import execute_sql, iter_sql
+from src.db.sql_guard import _guard_cached, guard_sql
+from src.services.excel.service import build_excel_bytes, write_excel_from_batches
+from src.utils.formatter import build_html_from_rows
+from src.utils.reference_data import extract_entities, load_references_from_db
+
+# Запросы в том виде, в каком их пишет агент: агрегаты для ответа в чат и одна детальная выгрузка
+_CORPUS: Dict[str, str] = {
+    "выручка менеджеров, прошлый месяц": """
+        SELECT p.manager, SUM(p.revenue) AS revenue
+        FROM public.profit p
+        WHERE p.profit_date >= date_trunc('month', CURRENT_DATE) - INTERVAL '1 month'
+          AND p.profit_date < date_trunc('month', CURRENT_DATE) AND p.revenue > 0
+        GROUP BY p.manager ORDER BY revenue DESC""",
+    "вес брендов по месяцам, год": """
+        SELECT to_char(date_trunc('month', p.profit_date), 'YYYY-MM') AS period, pr.brand, SUM(p.weight_kg) AS weight_kg
+        FROM public.profit p JOIN public.products pr ON pr.product_code = p.product_code
+        WHERE p.profit_date >= CURRENT_DATE - INTERVAL '1 year'
+        GROUP BY 1, 2 ORDER BY 1, 2""",
+    "топ-10 клиентов, квартал": """
+        SELECT COALESCE(NULLIF(c.public_name, ''), c.client_name) AS client, SUM(p.revenue) AS revenue
+        FROM public.profit p JOIN public.clients c ON c.client_code = p.client_code
+        WHERE p.profit_date >= date_trunc('quarter', CURRENT_DATE) AND p.revenue > 0
+        GROUP BY 1 ORDER BY revenue DESC LIMIT 10""",
+    "возвраты по каналам и регионам": """
+        SELECT p.channel, c.region, SUM(p.revenue) AS returns
+        FROM public.profit p JOIN public.clients c ON c.client_code = p.client_code
+        WHERE p.revenue < 0 AND p.profit_date >= CURRENT_DATE - INTERVAL '90 days'
+        GROUP BY 1, 2 ORDER BY returns""",
+    "план/факт менеджеров, месяц": """
+        WITH plan AS (
+            SELECT manager, SUM(plan) AS plan_kg FROM public.managers_plan
+            WHERE period = date_trunc('month', CURRENT_DATE)::date GROUP BY manager
+        ), fact AS (
+            SELECT manager, SUM(weight_kg) AS fact_kg FROM public.profit
+            WHERE profit_date >= date_trunc('month', CURRENT_DATE) GROUP BY manager
+        )
+        SELECT plan.manager, plan_kg, fact_kg, ROUND(fact_kg / NULLIF(plan_kg, 0) * 100, 1) AS pct
+        FROM plan LEFT JOIN fact ON fact.manager = plan.manager ORDER BY pct DESC""",
+    "дебиторка на последнюю дату": """
+        SELECT manager, SUM(total_debt) AS total_debt, SUM(overdue_debt) AS overdue_debt
+        FROM public.debt WHERE debt_date = (SELECT MAX(debt_date) FROM public.debt)
+        GROUP BY manager ORDER BY overdue_debt DESC""",
+    "остатки по складам и брендам": """
+        SELECT s.warehouse, pr.brand, SUM(s.final_quantity) AS quantity, SUM(s.final_weight_kg) AS weight_kg
+        FROM public.stock s JOIN public.products pr ON pr.product_code = s.product_code
+        WHERE s.stock_date = (SELECT MAX(stock_date) FROM public.stock)
+        GROUP BY 1, 2 ORDER BY 1, 2""",
+    "неотгруженные заказы": """
+        SELECT o.warehouse, COUNT(DISTINCT o.order_number) AS orders, SUM(o.weight_kg) AS weight_kg
+        FROM public.orders o WHERE o.shipment_date IS NULL GROUP BY o.warehouse""",
+    "контакты менеджера": f"""
+        SELECT full_name, phone, email FROM public.sales_representatives
+        WHERE full_name ILIKE '%{manager_name(1).split()[0].lower()}%'""",
+    "детализация за неделю": """
+        SELECT p.profit_date, p.order_number, c.client_name, pr.product_name, p.quantity, p.weight_kg, p.revenue, p.manager
+        FROM public.profit p
+        JOIN public.clients c ON c.client_code = p.client_code
+        JOIN public.products pr ON pr.product_code = p.product_code
+        WHERE p.profit_date >= CURRENT_DATE - 7
+        ORDER BY p.profit_date, p.order_number""",
+}
+
+# Детальная выгрузка — для Excel целиком и потоково
+_EXPORT_QUERY = "детализация за неделю"
+
+_PHRASES = [
+    "выручка по менеджерам за прошлый месяц",
+    f"продажи {BRANDS[0].lower()} в розница по региону {REGIONS[0].lower()} за год",
+    f"покажи отгрузки клиенту {client_name(17).lower()} за квартал",
+    f"сколько продал {manager_name(3).lower()} по сырам в опт",
+    f"остатки {BRANDS[1].lower()} на складе {REGIONS[1].lower()}",
+    f"сравни бренд {BRANDS[2].lower()} и бренд {BRANDS[5].lower()} по весу",
+    f"дебиторка {manager_name(7).split()[0].lower()} и {client_name(42).lower()}",
+    "динамика продаж категории молочная продукция по месяцам",
+]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def _measure(
+    stage: str, name: str, fn: Callable[[], Awaitable[Any]], repeat: int,
+    before: Optional[Callable[[], Awaitable[None]]] = None,
+) -> Dict[str, Any]:
+    """p50/p95 задержки за repeat прогонов и пик памяти в отдельном прогоне"""
+    result = None
+    times: List[float] = []
+    for _ in range(repeat):
+        if before:
+            await before()
+        start = time.perf_counter()
+        result = await fn()
+        times.append((time.perf_counter() - start) * 1000)
+    if before:
+        await before()
+    gc.collect()
+    tracemalloc.start()
+    await fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "stage": stage, "name": name,
+        "rows": len(result) if hasattr(result, "__len__") else result,
+        "p50_ms": statistics.median(times), "p95_ms": _percentile(times, 0.95),
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+
+async def _cold() -> None:
+    await invalidate_result_cache()
+
+
+async def _run(repeat: int) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+
+    async def _guard_all() -> int:
+        _guard_cached.cache_clear()
+        for query in _CORPUS.values():
+            guard_sql(query)
+        return len(_CORPUS)
+
+    results.append(await _measure("guard_sql", f"корпус ({len(_CORPUS)} запросов), без кэша", _guard_all, repeat * 20))
+
+    await load_references_from_db()
+
+    async def _entities() -> int:
+        found = 0
+        for phrase in _PHRASES:
+            entities = await extract_entities(phrase)
+            found += sum(len(v) for k, v in entities.items() if k != "unknown")
+        return found
+
+    results.append(await _measure("extract_entities", f"{len(_PHRASES)} фраз (найдено сущностей)", _entities, repeat * 20))
+
+    rowsets = {}
+    for name, query in _CORPUS.items():
+        results.append(await _measure("execute_sql", name, lambda q=query: execute_sql(q), repeat, before=_cold))
+        results.append(await _measure("execute_sql (кэш)", name, lambda q=query: execute_sql(q), repeat))
+        rowsets[name] = await execute_sql(query)
+
+    for name, rows in rowsets.items():
+        async def _render(r=rows) -> int:
+            return len(build_html_from_rows(r))
+        results.append(await _measure("build_html_from_rows", name, _render, repeat))
+
+    export_rows = rowsets[_EXPORT_QUERY]
+
+    async def _excel_bytes() -> int:
+        build_excel_bytes(export_rows)
+        return len(export_rows)
+
+    results.append(await _measure("build_excel_bytes", _EXPORT_QUERY, _excel_bytes, repeat))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.xlsx")
+
+        async def _excel_stream() -> int:
+            async with aclosing(iter_sql(_CORPUS[_EXPORT_QUERY])) as batches:
+                rows, _ = await write_excel_from_batches(batches, path)
+            return rows
+
+        results.append(await _measure("iter_sql -> xlsx", _EXPORT_QUERY, _excel_stream, repeat))
+    return results
+
+
+def _print(results: List[Dict[str, Any]]) -> None:
+    print(f"{'этап':<22}{'операция':<40}{'строк':>8}{'p50, мс':>10}{'p95, мс':>10}{'пик, МБ':>10}")
+    for r in results:
+        print(
+            f"{r['stage']:<22}{r['name'][:39]:<40}{r['rows']:>8}"
+            f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['peak_mb']:>10.2f}"
+        )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--create", action="store_true", help="сначала создать набор данных (bench.dataset)")
+    parser.add_argument("--scale", type=float, default=0.1)
+    parser.add_argument("--drop", action="store_true", help="с --create: пересоздать существующие таблицы")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="сохранить результаты в файл для сравнения между версиями")
+    args = parser.parse_args()
+
+    try:
+        if args.create:
+            try:
+                created = await create_dataset(args.scale, drop=args.drop)
+            except RuntimeError as e:
+                raise SystemExit(str(e))
+            print("Набор данных: " + ", ".join(f"{table} {rows}" for table, (rows, _) in created.items()))
+        await start_guarded_relations()
+        await start_rollups()
+        results = await _run(args.repeat)
+        _print(results)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({
+                    "created_at": _dt.datetime.now().isoformat(timespec="seconds"),
+                    "scale": args.scale if args.create else None,
+                    "repeat": args.repeat,
+                    "results": results,
+                }, f, ensure_ascii=False, indent=2)
+            print(f"Результаты сохранены в {args.json}")
+    finally:
+        await stop_rollups()
+        await stop_guarded_relations()
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
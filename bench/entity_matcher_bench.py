@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк extract_entities: прежний цикл с regex \\b…\\b на каждое название против
+автомата Aho-Corasick (EntityMatcher) на синтетических справочниках с 10k клиентов.
+
+Заодно сверяет, что оба варианта возвращают одинаковые сущности (то же проверяет
+tests/test_entity_matcher.py).
+
+Запуск:
+    python -m bench.entity_matcher_bench --clients 10000 --repeat 200
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import random
+import re
+import time
+from typing import Dict, List
+
+import src.utils.reference_data as rd
+
+TEXTS = [
+    "выручка по брендам за февраль",
+    "продажи чабан в розница по региону нальчик за прошлый месяц",
+    "покажи динамику отгрузок клиенту ромашка 17 и ип петров 42 за квартал",
+    "сколько продал иванов иван по сырам в опт",
+    "остатки по категории молочная продукция на складе прохладный",
+    "топ-10 клиентов по выручке в сети магнит 3 за 2024 год",
+    "сравни бренд горная долина и бренд эльбрус 12 по весу",
+]
+
+_WORDS = ["ромашка", "магнит", "эльбрус", "долина", "нарт", "терек", "кавказ", "юг", "сырный двор", "лавка"]
+
+
+def synthetic_snapshot(clients: int) -> Dict[str, Dict[str, str]]:
+    rnd = random.Random(7)
+    snapshot = {
+        "brands": {f"{rnd.choice(_WORDS)} {i}": "brand" for i in range(200)},
+        "categories": {f"категория {i}": "category" for i in range(300)},
+        "channels": {name: "channel" for name in ("розница", "опт", "horeca", "сети", "интернет")},
+        "regions": {f"регион {i}": "region" for i in range(50)},
+        "clients": {},
+        "managers": {f"иванов{i} иван": "manager" for i in range(50)},
+        "last_update": time.time(),
+    }
+    snapshot["brands"].update({"чабан": "brand", "горная долина": "brand", "эльбрус 12": "brand"})
+    snapshot["categories"]["молочная продукция"] = "category"
+    snapshot["regions"]["нальчик"] = "region"
+    snapshot["managers"]["иванов иван"] = "manager"
+    for i in range(clients):
+        prefix = rnd.choice(["ооо ", "ип ", "", "ао "])
+        snapshot["clients"][f"{prefix}{rnd.choice(_WORDS)} {i}"] = "client"
+    snapshot["clients"].update({"ромашка 17": "client", "ип петров 42": "client", "магнит 3": "client"})
+    return snapshot
+
+
+def legacy_extract(text: str, cache: Dict[str, Dict[str, str]]) -> Dict[str, List[str]]:
+    """Прежняя реализация: по регулярке на каждое название"""
+    text_lower = rd._norm(text)
+    entities: Dict[str, List[str]] = {k: [] for k in ("brands", "categories", "channels", "regions", "managers", "clients", "unknown")}
+    for key in ("brands", "categories", "channels", "regions"):
+        for name in cache[key]:
+            n = rd._norm(name)
+            if rd._has_word(text_lower, n):
+                entities[key].append(n)
+    stems = [rd._stem_simple(t) for t in rd._tokenize(text)]
+    for manager in cache["managers"]:
+        m = rd._norm(manager)
+        if rd._has_word(text_lower, m):
+            entities["managers"].append(m)
+            continue
+        parts = [p for p in re.split(r"\s+", m) if p]
+        if parts and any(rd._tokens_match_approx(parts[0], st) for st in stems):
+            entities["managers"].append(m)
+    for name in cache["clients"]:
+        cl = rd._norm(name)
+        if rd._has_word(text_lower, cl):
+            entities["clients"].append(cl)
+    return entities
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    snapshot = synthetic_snapshot(args.clients)
+    start = time.perf_counter()
+    snapshot["matcher"] = rd._build_matcher(snapshot)
+    build_ms = (time.perf_counter() - start) * 1000
+    rd._REFERENCE_CACHE = snapshot
+    rd._loaded_from_db = True
+
+    for text in TEXTS:
+        new = await rd.extract_entities(text)
+        old = legacy_extract(text, snapshot)
+        if new != old:
+            raise SystemExit(f"Результаты расходятся для {text!r}:\n{old}\n{new}")
+
+    calls = args.repeat * len(TEXTS)
+    begin = time.perf_counter()
+    for _ in range(args.repeat):
+        for text in TEXTS:
+            legacy_extract(text, snapshot)
+    legacy_ms = (time.perf_counter() - begin) * 1000 / calls
+
+    begin = time.perf_counter()
+    for _ in range(args.repeat):
+        for text in TEXTS:
+            await rd.extract_entities(text)
+    matcher_ms = (time.perf_counter() - begin) * 1000 / calls
+
+    names = sum(len(snapshot[k]) for k in rd._MATCHED_TYPES)
+    print(f"{names} названий, из них {args.clients} клиентов; результаты совпадают на {len(TEXTS)} запросах")
+    print(f"построение автомата: {build_ms:.0f} мс (один раз на снимок)")
+    print(f"{'вариант':<28}{'мс/сообщение':>14}")
+    print(f"{'regex на каждое название':<28}{legacy_ms:>14.2f}")
+    print(f"{'Aho-Corasick':<28}{matcher_ms:>14.3f}")
+    print(f"ускорение: {legacy_ms / matcher_ms:.0f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти: выгрузка bench.profit в Excel целиком (fetch_all -> pandas) против
+потоковой выгрузки (fetch_iter -> xlsxwriter constant_memory).
+
+Пиковая память считается через tracemalloc (только Python-аллокации, без учёта
+буферов libpq/asyncpg), так что цифры — нижняя граница реального RSS.
+
+Запуск:
+    python -m bench.fetch_iter_memory --rows 200000 [--skip-create]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import aclosing
+from typing import Awaitable, Callable, Dict
+
+from src.db.pool import fetch_all, fetch_iter, close_pool
+from src.services.excel.service import build_excel_bytes, write_excel_from_batches, write_csv_from_batches
+from bench.synthetic import BENCH_SCHEMA, create_profit
+
+_QUERY = f"SELECT * FROM {BENCH_SCHEMA}.profit ORDER BY order_date"
+
+
+async def _measure(fn: Callable[[], Awaitable[int]]) -> Dict[str, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = await fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"rows": rows, "elapsed": elapsed, "peak_mb": peak / 1024 / 1024}
+
+
+async def _rows_fetch_all() -> int:
+    rows = await fetch_all(_QUERY)
+    return len(rows)
+
+
+async def _rows_fetch_iter(batch_size: int) -> int:
+    total = 0
+    async with aclosing(fetch_iter(_QUERY, batch_size=batch_size)) as batches:
+        async for batch in batches:
+            total += len(batch)
+    return total
+
+
+async def _excel_fetch_all() -> int:
+    rows = await fetch_all(_QUERY)
+    build_excel_bytes(rows)
+    return len(rows)
+
+
+async def _excel_stream(batch_size: int, path: str) -> int:
+    async with aclosing(fetch_iter(_QUERY, batch_size=batch_size)) as batches:
+        rows, _ = await write_excel_from_batches(batches, path)
+    return rows
+
+
+async def _csv_stream(batch_size: int, path: str) -> int:
+    return await write_csv_from_batches(fetch_iter(_QUERY, batch_size=batch_size), path)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--skip-create", action="store_true", help="не пересоздавать bench.profit")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="fetch_iter_bench_")
+    try:
+        if not args.skip_create:
+            elapsed = await create_profit(args.rows)
+            print(f"{BENCH_SCHEMA}.profit: {args.rows} строк за {elapsed:.1f}с")
+
+        variants = [
+            ("fetch_all -> list[dict]", _rows_fetch_all),
+            (f"fetch_iter({args.batch_size})", lambda: _rows_fetch_iter(args.batch_size)),
+            ("fetch_all -> pandas xlsx", _excel_fetch_all),
+            ("fetch_iter -> xlsx stream", lambda: _excel_stream(args.batch_size, os.path.join(tmp_dir, "r.xlsx"))),
+            ("fetch_iter -> csv stream", lambda: _csv_stream(args.batch_size, os.path.join(tmp_dir, "r.csv"))),
+        ]
+        print(f"{'вариант':<30}{'строк':>10}{'время, с':>10}{'пик, МБ':>10}")
+        for name, fn in variants:
+            res = await _measure(fn)
+            print(f"{name:<30}{res['rows']:>10}{res['elapsed']:>10.2f}{res['peak_mb']:>10.1f}")
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Фильтр бонусных клиентов: подзапрос NOT IN на каждую ссылку (SQL_GUARD_MODE=subquery)
+против представления (view) и материализованного представления (matview) из
+migrations/002_bonus_excluded_relations.sql на синтетических данных.
+
+Отношения создаются из самой миграции (операторы для profit) в схеме bench_bonus_excluded
+поверх bench.profit / bench.clients / bench.products — боевые таблицы не затрагиваются.
+Запросы — типичные агрегаты агента по менеджерам, брендам и клиентам (справочники записаны
+с public., схема подменяется на bench); guard_sql переписывает их для каждого режима,
+результаты всех режимов сверяются.
+
+Запуск:
+    python -m bench.guarded_relations_bench --rows 1000000 [--skip-create] [--repeat 5]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from typing import Dict, List, Tuple
+
+from bench.synthetic import BENCH_SCHEMA, create_profit, create_references
+from src.db.pool import close_pool, fetch_all, get_pool
+from src.db.sql_guard import _guard_cached
+from src.db.sql_tokenizer import OP, tokenize
+
+_MIGRATION = os.path.join(os.path.dirname(__file__), "..", "migrations", "002_bonus_excluded_relations.sql")
+_TARGET_SCHEMA = "bench_bonus_excluded"
+
+_QUERIES: Dict[str, str] = {
+    "выручка менеджеров по месяцам": """
+        SELECT manager, date_trunc('month', profit_date) AS month, SUM(revenue) AS revenue
+        FROM profit WHERE revenue > 0 AND profit_date >= DATE '2024-01-01'
+        GROUP BY 1, 2 ORDER BY 1, 2""",
+    "вес по брендам": """
+        SELECT pr.brand, SUM(p.weight_kg) AS weight
+        FROM profit p JOIN public.products pr ON pr.product_code = p.product_code
+        WHERE p.profit_date >= DATE '2024-06-01'
+        GROUP BY pr.brand ORDER BY weight DESC""",
+    "топ-10 клиентов за месяц": """
+        SELECT c.client_name, SUM(p.revenue) AS revenue
+        FROM profit p JOIN public.clients c ON c.client_code = p.client_code
+        WHERE p.revenue > 0 AND p.profit_date >= DATE '2024-11-01' AND p.profit_date < DATE '2024-12-01'
+        GROUP BY c.client_name ORDER BY revenue DESC, c.client_name LIMIT 10""",
+    "один менеджер за квартал": """
+        SELECT channel, SUM(revenue) AS revenue, SUM(weight_kg) AS weight
+        FROM profit WHERE manager = 'Менеджер 7' AND profit_date >= DATE '2024-10-01'
+        GROUP BY channel ORDER BY channel""",
+    "месяц к месяцу (две ссылки)": """
+        WITH cur AS (
+            SELECT manager, SUM(revenue) AS r FROM profit
+            WHERE profit_date >= DATE '2024-12-01' AND profit_date < DATE '2025-01-01' GROUP BY manager
+        ), prev AS (
+            SELECT manager, SUM(revenue) AS r FROM profit
+            WHERE profit_date >= DATE '2024-11-01' AND profit_date < DATE '2024-12-01' GROUP BY manager
+        )
+        SELECT cur.manager, cur.r, prev.r, round(cur.r / NULLIF(prev.r, 0) * 100 - 100, 1) AS growth
+        FROM cur LEFT JOIN prev ON prev.manager = cur.manager ORDER BY cur.manager""",
+}
+
+_MODES: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "subquery": (),
+    "view": (("profit", f"{_TARGET_SCHEMA}.profit"),),
+    "matview": (("profit", f"{_TARGET_SCHEMA}.profit_mv"),),
+}
+
+
+def _migration_statements() -> List[str]:
+    """Операторы миграции, относящиеся к profit, с заменой схем на бенчмарочные"""
+    with open(_MIGRATION, encoding="utf-8") as f:
+        text = f.read()
+    statements, start = [], 0
+    for tok in tokenize(text, trivia=False):
+        if tok.kind == OP and tok.text == ";":
+            statements.append(text[start:tok.end])
+            start = tok.end
+    keep = []
+    for statement in statements:
+        body = "\n".join(line for line in statement.splitlines() if not line.lstrip().startswith("--")).strip()
+        if body.startswith("CREATE SCHEMA") or "profit" in body:
+            keep.append(body.replace("bonus_excluded.", f"{_TARGET_SCHEMA}.")
+                        .replace("SCHEMA IF NOT EXISTS bonus_excluded", f"SCHEMA IF NOT EXISTS {_TARGET_SCHEMA}")
+                        .replace("public.", f"{BENCH_SCHEMA}."))
+    return keep
+
+
+def _guarded(query: str, mode: str) -> str:
+    return _guard_cached(query.strip(), _MODES[mode]).replace("public.", f"{BENCH_SCHEMA}.")
+
+
+async def _create_relations() -> float:
+    pool = await get_pool()
+    start = time.perf_counter()
+    async with pool.acquire() as conn:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {_TARGET_SCHEMA} CASCADE;")
+        for statement in _migration_statements():
+            await conn.execute(statement)
+    return time.perf_counter() - start
+
+
+async def _refresh_ms() -> float:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        start = time.perf_counter()
+        await conn.execute(f"REFRESH MATERIALIZED VIEW {_TARGET_SCHEMA}.profit_mv;")
+        return (time.perf_counter() - start) * 1000
+
+
+async def _time_query(sql: str, repeat: int) -> Tuple[float, list]:
+    rows = await fetch_all(sql)  # прогрев кэша страниц и плана
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fetch_all(sql)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), rows
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-create", action="store_true", help="использовать уже созданные bench.* и отношения")
+    args = parser.parse_args()
+
+    try:
+        if not args.skip_create:
+            gen = await create_references() + await create_profit(args.rows)
+            build = await _create_relations()
+            print(f"{BENCH_SCHEMA}: {args.rows} строк за {gen:.1f}с, представления и индексы — {build:.1f}с")
+        print(f"REFRESH MATERIALIZED VIEW profit_mv: {await _refresh_ms():.0f} мс")
+
+        print(f"{'запрос':<32}" + "".join(f"{m + ', мс':>14}" for m in _MODES) + f"{'ускорение':>12}")
+        for name, query in _QUERIES.items():
+            results: Dict[str, float] = {}
+            reference = None
+            for mode in _MODES:
+                ms, rows = await _time_query(_guarded(query, mode), args.repeat)
+                results[mode] = ms
+                values = [tuple(r.values()) for r in rows]
+                if reference is None:
+                    reference = values
+                elif values != reference:
+                    raise SystemExit(f"Результаты режима {mode} расходятся с subquery для «{name}»")
+            speedup = results["subquery"] / results["matview"] if results["matview"] else 0.0
+            print(f"{name:<32}" + "".join(f"{results[m]:>14.1f}" for m in _MODES) + f"{speedup:>11.1f}x")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Поиск менеджеров в тексте: прежний перебор (каждый токен × каждая фамилия через
+_tokens_match_approx) против индекса ManagerIndex.
+
+Сначала сверяет результаты resolve_manager_name_from_text и менеджеров из
+extract_entities на золотом наборе фраз (и случайных фразах из тех же слов), затем
+меряет задержку. Любое расхождение — ошибка; тот же набор проверяет
+tests/test_manager_resolver.py.
+
+Запуск:
+    python -m bench.manager_resolver_bench --managers 300 --random 500
+"""
+from __future__ import annotations
+import argparse
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import src.utils.reference_data as rd
+
+_SURNAMES = [
+    "иванов", "петров", "сидоров", "альборов", "кузнецов", "смирнов", "хашев", "кодзоков",
+    "шогенов", "тхагапсоев", "ёлкин", "орлов", "соколов", "лебедев", "ким", "ли", "бжахов",
+    "гуашев", "карданов", "мальбахов", "эльмесов", "шериев", "абазов", "маремуков", "жеруков",
+]
+_FIRST = ["иван", "феликс", "мурат", "азамат", "алексей", "руслан", "анна", "мадина", "залим", "олег"]
+_PATRONYMIC = ["олегович", "иванович", "муратович", "петровна", "асланович"]
+
+# Падежи/формы, которыми менеджеров упоминают в запросах
+GOLDEN = [
+    "продажи иванова за март",
+    "сколько продал петров в опт",
+    "выручка альборова феликса по брендам",
+    "карточка торгового Альборов Феликс Олегович",
+    "отгрузки менеджера кузнецовой анны",
+    "динамика по хашеву и кодзокову",
+    "план шогенова мурата на апрель",
+    "сравни смирнова и соколова по весу",
+    "ёлкин продажи за неделю",
+    "покажи ли и кима",
+    "продажи по менеджерам за прошлый месяц",
+    "отправь в excel гуашеву",
+    "выручка по каналу розница",
+    "мальбахова залима дебиторка",
+    "",
+    "в за по на",
+]
+
+
+def make_managers(n: int) -> List[str]:
+    rnd = random.Random(11)
+    names = []
+    for i in range(n):
+        surname = _SURNAMES[i % len(_SURNAMES)] + ("а" if rnd.random() < 0.2 else "")
+        if i >= len(_SURNAMES):
+            surname += rnd.choice(["", "ов", "ин", "ко", "ев"]) + (str(i) if rnd.random() < 0.1 else "")
+        names.append(f"{surname} {rnd.choice(_FIRST)} {rnd.choice(_PATRONYMIC)}")
+    # Справочник — словарь, повторов в нём нет
+    return list(dict.fromkeys(names))
+
+
+def managers_snapshot(managers: List[str]) -> Dict[str, Any]:
+    """Снимок справочников только с менеджерами — подменяет rd._REFERENCE_CACHE"""
+    snapshot: Dict[str, Any] = {k: {} for k in ("brands", "categories", "channels", "regions", "clients")}
+    snapshot["managers"] = {name: "manager" for name in managers}
+    snapshot["last_update"] = time.time()
+    snapshot["matcher"], snapshot["manager_index"] = rd._build_indexes(snapshot)
+    return snapshot
+
+
+def make_texts(managers: List[str], random_count: int) -> List[str]:
+    """Золотой набор и случайные фразы из тех же слов и фамилий"""
+    rnd = random.Random(5)
+    vocab = [w for phrase in GOLDEN for w in phrase.split()] + [n.split()[0] for n in managers[:50]]
+    return list(GOLDEN) + [" ".join(rnd.choice(vocab) for _ in range(rnd.randint(1, 8))) for _ in range(random_count)]
+
+
+def legacy_resolve(text: str, managers: List[str]) -> Optional[str]:
+    stems = [rd._stem_simple(t) for t in rd._tokenize(text or "")]
+    if not stems:
+        return None
+    candidates = []
+    for name in managers:
+        parts = [p for p in (name or "").split() if p]
+        if parts and any(rd._tokens_match_approx(parts[0], st) for st in stems):
+            candidates.append(name)
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        return candidates[0]
+    filtered = []
+    for cand in candidates:
+        parts = [p for p in cand.split() if p]
+        first = parts[1] if len(parts) >= 2 else ""
+        if first and any(rd._tokens_match_approx(first, st) for st in stems):
+            filtered.append(cand)
+    return filtered[0] if len(filtered) == 1 else None
+
+
+def legacy_extract_managers(text: str, managers: List[str]) -> List[str]:
+    text_lower = rd._norm(text)
+    stems = [rd._stem_simple(t) for t in rd._tokenize(text)]
+    out = []
+    for manager in managers:
+        m = rd._norm(manager)
+        if rd._has_word(text_lower, m):
+            out.append(m)
+            continue
+        parts = [p for p in re.split(r"\s+", m) if p]
+        if parts and any(rd._tokens_match_approx(parts[0], st) for st in stems):
+            out.append(m)
+    return out
+
+
+def new_extract_managers(text: str) -> List[str]:
+    found = rd._get_matcher().match(rd._norm(text))
+    index = rd._get_manager_index()
+    stems = [rd._stem_simple(t) for t in rd._tokenize(text)]
+    matched = index.exact_indices(found["managers"]) | index.match_surnames(index.query_stems(stems))
+    return [index.norm_names[i] for i in sorted(matched)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--managers", type=int, default=300)
+    parser.add_argument("--random", type=int, default=500, help="сколько случайных фраз добавить к золотому набору")
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    managers = make_managers(args.managers)
+    rd._REFERENCE_CACHE = managers_snapshot(managers)
+    texts = make_texts(managers, args.random)
+
+    mismatches = 0
+    for text in texts:
+        if rd.resolve_manager_name_from_text(text) != legacy_resolve(text, managers):
+            mismatches += 1
+            print(f"resolve расходится: {text!r}")
+        if new_extract_managers(text) != legacy_extract_managers(text, managers):
+            mismatches += 1
+            print(f"extract расходится: {text!r}")
+    if mismatches:
+        raise SystemExit(f"{mismatches} расхождений")
+    print(f"{len(managers)} менеджеров, {len(texts)} фраз ({len(GOLDEN)} золотых): результаты идентичны")
+
+    def _bench(fn) -> float:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for text in texts:
+                fn(text)
+        return (time.perf_counter() - start) * 1e6 / (args.repeat * len(texts))
+
+    rows = [
+        ("resolve: перебор", _bench(lambda t: legacy_resolve(t, managers))),
+        ("resolve: индекс", _bench(rd.resolve_manager_name_from_text)),
+        ("extract: перебор", _bench(lambda t: legacy_extract_managers(t, managers))),
+        ("extract: индекс", _bench(new_extract_managers)),
+    ]
+    print(f"{'вариант':<24}{'мкс/фраза':>12}")
+    for name, us in rows:
+        print(f"{name:<24}{us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
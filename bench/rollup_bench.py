@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Сводные таблицы profit по месяцам (SQL_ROLLUPS): агрегаты по profit с фильтром бонусных клиентов
+(guard_sql, режим subquery) против тех же запросов, переписанных src.db.rollups на сводные таблицы.
+
+Таблицы создаются из migrations/004_profit_rollups.sql в схеме bench_rollup и заполняются из
+bench.profit / bench.clients / bench.products тем же кодом, что и в боте, — боевые таблицы
+не затрагиваются. Результаты обоих вариантов сверяются. Отдельно замеряются полная сборка
+и обновление только нового месяца после догрузки строк в profit.
+
+Запуск:
+    python -m bench.rollup_bench --rows 5000000 [--skip-create] [--repeat 5]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import datetime as _dt
+import os
+import statistics
+import time
+from typing import Dict, List, Tuple
+
+from bench.synthetic import BENCH_SCHEMA, create_profit, create_references
+from src.db.pool import close_pool, fetch_all, get_pool
+from src.db.rollups import ROLLUP_SCHEMA, ROLLUPS, _route, refresh_rollup
+from src.db.sql_guard import _guard_cached
+from src.db.sql_tokenizer import OP, tokenize
+
+_MIGRATION = os.path.join(os.path.dirname(__file__), "..", "migrations", "004_profit_rollups.sql")
+_TARGET_SCHEMA = "bench_rollup"
+
+_QUERIES: Dict[str, str] = {
+    "выручка менеджеров за квартал": """
+        SELECT p.manager AS manager, SUM(p.revenue) AS revenue
+        FROM public.profit p
+        WHERE p.profit_date >= DATE '2024-10-01' AND p.profit_date < DATE '2025-01-01' AND p.revenue > 0
+        GROUP BY 1 ORDER BY revenue DESC""",
+    "вес брендов по месяцам": """
+        SELECT pr.brand AS brand, to_char(date_trunc('month', p.profit_date), 'YYYY-MM') AS period,
+               SUM(p.weight_kg) AS weight_kg
+        FROM public.profit p
+        JOIN public.products pr ON pr.product_code = p.product_code
+        WHERE p.profit_date >= DATE '2024-01-01' AND p.profit_date < DATE '2025-01-01'
+        GROUP BY 1, 2 ORDER BY 1, 2""",
+    "выручка регионов за год": """
+        SELECT c.region AS region, SUM(p.revenue) AS revenue
+        FROM public.profit p
+        JOIN public.clients c ON c.client_code = p.client_code
+        WHERE p.profit_date BETWEEN '2024-01-01' AND '2024-12-31' AND p.revenue > 0
+        GROUP BY 1 ORDER BY revenue DESC""",
+    "возвраты по каналам помесячно": """
+        SELECT channel, date_trunc('month', profit_date)::date AS month_start,
+               SUM(CASE WHEN revenue < 0 THEN revenue ELSE 0 END) AS returns
+        FROM public.profit
+        WHERE profit_date >= DATE '2024-01-01'
+        GROUP BY 1, 2 ORDER BY 1, 2""",
+    "менеджер: регион × бренд": """
+        SELECT c.region, pr.brand, SUM(p.revenue) AS revenue, SUM(p.quantity) AS quantity
+        FROM public.profit p
+        JOIN public.clients c ON c.client_code = p.client_code
+        JOIN public.products pr ON pr.product_code = p.product_code
+        WHERE p.manager = 'Менеджер 7' AND p.revenue > 0
+        GROUP BY 1, 2 ORDER BY 1, 2""",
+}
+
+# Догрузка месяца после последнего в bench.profit — для замера обновления только новых периодов
+_APPEND_MONTH_SQL = f"""
+INSERT INTO {BENCH_SCHEMA}.profit
+SELECT order_number, client_code, product_code, order_date + 31, $1::date + (profit_date - $2::date),
+       quantity, weight_kg, revenue, manager, channel, warehouse
+FROM {BENCH_SCHEMA}.profit
+WHERE profit_date >= $2::date AND profit_date < $1::date;
+"""
+
+
+def _migration_statements() -> List[str]:
+    """Операторы миграции со схемой rollup, заменённой на бенчмарочную"""
+    with open(_MIGRATION, encoding="utf-8") as f:
+        text = f.read()
+    statements, start = [], 0
+    for tok in tokenize(text, trivia=False):
+        if tok.kind == OP and tok.text == ";":
+            statements.append(text[start:tok.end])
+            start = tok.end
+    keep = []
+    for statement in statements:
+        body = "\n".join(line for line in statement.splitlines() if not line.lstrip().startswith("--")).strip()
+        if body:
+            keep.append(body.replace(f"{ROLLUP_SCHEMA}.", f"{_TARGET_SCHEMA}.")
+                        .replace(f"SCHEMA IF NOT EXISTS {ROLLUP_SCHEMA}", f"SCHEMA IF NOT EXISTS {_TARGET_SCHEMA}"))
+    return keep
+
+
+async def _create_rollups() -> Dict[str, float]:
+    """Создать и полностью заполнить сводные таблицы; время сборки каждой в секундах"""
+    pool = await get_pool()
+    timings: Dict[str, float] = {}
+    async with pool.acquire() as conn:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {_TARGET_SCHEMA} CASCADE;")
+        for statement in _migration_statements():
+            await conn.execute(statement)
+        for rollup in ROLLUPS:
+            start = time.perf_counter()
+            await refresh_rollup(conn, rollup, None, source_schema=BENCH_SCHEMA, target_schema=_TARGET_SCHEMA)
+            timings[rollup.name] = time.perf_counter() - start
+    return timings
+
+
+async def _append_and_refresh() -> Tuple[int, float]:
+    """Догрузить месяц в bench.profit и обновить сводные только с этого месяца"""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        newest = await conn.fetchval(f"SELECT max(profit_date) FROM {BENCH_SCHEMA}.profit")
+        month = (newest.replace(day=1) + _dt.timedelta(days=32)).replace(day=1)
+        source = (month - _dt.timedelta(days=1)).replace(day=1)
+        status = await conn.execute(_APPEND_MONTH_SQL, month, source)
+        start = time.perf_counter()
+        for rollup in ROLLUPS:
+            await refresh_rollup(conn, rollup, month, source_schema=BENCH_SCHEMA, target_schema=_TARGET_SCHEMA)
+        return int(status.split()[-1]), time.perf_counter() - start
+
+
+async def _available() -> Tuple[Tuple[str, Tuple[str, ...], float], ...]:
+    rows = await fetch_all(
+        "SELECT c.relname, greatest(c.reltuples, 0) AS reltuples FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = $1;",
+        (_TARGET_SCHEMA,),
+    )
+    sizes = {row["relname"]: float(row["reltuples"]) for row in rows}
+    return tuple((r.name, r.dimensions, sizes.get(r.name, 0.0)) for r in ROLLUPS)
+
+
+async def _time_query(sql: str, repeat: int) -> Tuple[float, list]:
+    rows = await fetch_all(sql)  # прогрев кэша страниц и плана
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fetch_all(sql)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), rows
+
+
+def _canonical(rows: list) -> list:
+    return sorted(tuple(str(v) for v in r.values()) for r in rows)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-create", action="store_true", help="использовать уже созданные bench.* и сводные")
+    args = parser.parse_args()
+
+    try:
+        if not args.skip_create:
+            gen = await create_references() + await create_profit(args.rows)
+            print(f"{BENCH_SCHEMA}.profit: {args.rows} строк за {gen:.1f}с")
+            for name, seconds in (await _create_rollups()).items():
+                print(f"  полная сборка {_TARGET_SCHEMA}.{name}: {seconds:.1f}с")
+        available = await _available()
+        print("Строк в сводных: " + ", ".join(f"{name} {int(rows)}" for name, _, rows in available))
+
+        print(f"{'запрос':<32}{'profit, мс':>12}{'сводная, мс':>14}{'ускорение':>12}  таблица")
+        for name, query in _QUERIES.items():
+            raw_sql = _guard_cached(query.strip(), ()).replace("public.", f"{BENCH_SCHEMA}.")
+            route = _route(query.strip(), available)
+            if route is None:
+                raise SystemExit(f"Запрос «{name}» не переписан на сводную таблицу")
+            rollup_sql = route.sql.replace(f"{ROLLUP_SCHEMA}.", f"{_TARGET_SCHEMA}.")
+            raw_ms, raw_rows = await _time_query(raw_sql, args.repeat)
+            rollup_ms, rollup_rows = await _time_query(rollup_sql, args.repeat)
+            if _canonical(raw_rows) != _canonical(rollup_rows):
+                raise SystemExit(f"Результаты по сводной таблице расходятся с profit для «{name}»")
+            speedup = raw_ms / rollup_ms if rollup_ms else 0.0
+            print(f"{name:<32}{raw_ms:>12.1f}{rollup_ms:>14.1f}{speedup:>11.1f}x  {route.rollup}")
+
+        if not args.skip_create:
+            appended, seconds = await _append_and_refresh()
+            print(f"Догружено {appended} строк за новый месяц, обновление сводных с этого месяца: {seconds:.2f}с")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
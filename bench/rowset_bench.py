@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк RowSet против list[dict]: память результата и CPU на типовых путях
+(рендер HTML, DataFrame для Excel, подготовка JSON для скрипта генерации Excel).
+
+Строки имитируют выборку из profit (Decimal, даты, строки), БД не нужна.
+
+Запуск:
+    python -m bench.rowset_bench --rows 10000 100000
+"""
+from __future__ import annotations
+import argparse
+import datetime as _dt
+import gc
+import time
+import tracemalloc
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Tuple
+
+import pandas as pd
+
+from src.models.rowset import RowSet
+from src.services.excel.script_runner import _convert_decimals
+from src.utils.formatter import build_html_from_rows
+
+_COLUMNS = ("order_number", "client_code", "product_code", "profit_date", "quantity", "weight_kg", "revenue", "manager")
+
+
+def _make_records(n: int) -> List[Dict[str, Any]]:
+    base = _dt.date(2024, 1, 1)
+    return [
+        dict(zip(_COLUMNS, (
+            f"ORD-{i // 5:08d}",
+            f"CL-{i % 5000:05d}",
+            f"PR-{(i * 7) % 1500:05d}",
+            base + _dt.timedelta(days=i % 365),
+            Decimal(1 + i % 50),
+            Decimal(f"{(1 + i % 50) * 0.35:.3f}"),
+            Decimal(f"{(1 + i % 50) * (50 + i % 400):.2f}"),
+            f"Менеджер {i % 25}",
+        )))
+        for i in range(n)
+    ]
+
+
+def _retained(build: Callable[[], Any]) -> Tuple[Any, float, float]:
+    """(объект, удержанная память МБ, время построения с)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    obj = build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, current / 1024 / 1024, elapsed
+
+
+def _timed(fn: Callable[[], Any], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _bench(n: int) -> Dict[str, Tuple[float, float]]:
+    # Записи (как asyncpg.Record) создаются внутри замера и отбрасываются: в удержанную
+    # память попадает только то, что живёт в результате (у RowSet Decimal уже не нужны)
+    dicts, dicts_mb, _ = _retained(lambda: [dict(r) for r in _make_records(n)])
+    rowset, rowset_mb, _ = _retained(lambda: RowSet.from_records(_make_records(n)))
+
+    records = _make_records(n)
+    return {
+        "память результата, МБ": (dicts_mb, rowset_mb),
+        "построение из записей, с": (_timed(lambda: [dict(r) for r in records]), _timed(lambda: RowSet.from_records(records))),
+        "рендер HTML, с": (_timed(lambda: build_html_from_rows(dicts)), _timed(lambda: build_html_from_rows(rowset))),
+        "DataFrame для Excel, с": (_timed(lambda: pd.DataFrame(dicts)), _timed(rowset.to_dataframe)),
+        "JSON для скрипта Excel, с": (_timed(lambda: _convert_decimals(dicts)), _timed(rowset.to_dicts)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    for n in args.rows:
+        print(f"\n{n} строк")
+        print(f"{'метрика':<30}{'list[dict]':>12}{'RowSet':>12}{'выигрыш':>10}")
+        for name, (before, after) in _bench(n).items():
+            ratio = before / after if after else float("inf")
+            print(f"{name:<30}{before:>12.3f}{after:>12.3f}{ratio:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
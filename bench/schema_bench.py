@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Схема в промпте: описание всех таблиц (исходный промпт) против только нужных вопросу
+(AI_SCHEMA_PRUNING: select_tables + render_schema) на корпусе вопросов.
+
+Без сети и БД считает размер промпта в токенах (полный / без схемы + выбранные таблицы),
+задержку выбора таблиц (p50/p95) и полноту выбора: все ли таблицы, нужные правильному SQL,
+попали в промпт. С --llm спрашивает модель с обоими промптами и сверяет SQL: таблицы
+в ответе против размеченных, а если в корпусе есть эталонный sql и задан --execute —
+результаты обоих запросов против эталона в БД.
+
+Корпус — встроенный или JSONL (--corpus): {"question": "...", "tables": ["profit", ...], "sql": "..."};
+--from-logs N берёт последние N вопросов из agent_logs (без разметки: только размер и задержка).
+Полноту выбора на встроенном корпусе проверяет tests/test_schema_catalog.py.
+Сущности из справочников (extract_entities) — только с --entities, им нужна БД.
+
+Запуск:
+    python -m bench.schema_bench [--corpus replay.jsonl] [--from-logs 500] [--entities] [--llm [--execute]]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import datetime as _dt
+import json
+import os
+import re
+import statistics
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from src.ai.messages import AI_SYSTEM_PROMPT_FILE, _normalize, _read_prompt_file, count_tokens
+from src.ai.openai_client import close_client, create_chat_completion
+from src.ai.schema_catalog import CATALOG, render_schema, select_tables, strip_schema_sections
+from src.db.pool import close_pool, fetch_all
+from src.db.sql import execute_sql
+from src.services.nlu.parser import parse_intent
+from src.utils.reference_data import extract_entities
+
+# Вопрос -> таблицы, без которых правильный SQL не написать (clients для фильтра бонусных — тоже)
+CORPUS: List[Dict[str, Any]] = [
+    {"question": "остатки по складу", "tables": ["stock", "products"]},
+    {"question": "остатки сыра на складе на сегодня", "tables": ["stock", "products"]},
+    {"question": "выручка по брендам за март", "tables": ["profit", "products", "clients"]},
+    {"question": "продажи по менеджерам за прошлый месяц", "tables": ["profit", "clients"]},
+    {"question": "вес по регионам за 2025", "tables": ["profit", "clients"]},
+    {"question": "возвраты по каналам за квартал", "tables": ["profit", "clients"]},
+    {"question": "топ-10 клиентов по выручке за год", "tables": ["profit", "clients"]},
+    {"question": "динамика продаж по месяцам", "tables": ["profit", "clients"]},
+    {"question": "продажи по категориям в розницу", "tables": ["profit", "products", "clients"]},
+    {"question": "АКБ за май", "tables": ["profit", "clients"]},
+    {"question": "дебиторка по менеджерам", "tables": ["debt", "clients"]},
+    {"question": "просроченная задолженность клиентов", "tables": ["debt", "clients"]},
+    {"question": "неотгруженные заказы по складам", "tables": ["orders", "clients"]},
+    {"question": "недогруз за вчера", "tables": ["orders", "profit", "clients"]},
+    {"question": "закупочные цены на молоко", "tables": ["purchase_prices", "products"]},
+    {"question": "маржа по товарам: закупка и продажи", "tables": ["purchase_prices", "products", "profit", "clients"]},
+    {"question": "телефон и почта менеджеров", "tables": ["sales_representatives"]},
+    {"question": "план продаж на июнь по менеджерам", "tables": ["managers_plan", "clients"]},
+    {"question": "выполнение плана за май", "tables": ["plan_perf_manager_reports"]},
+    {"question": "уровень сервиса за эту неделю", "tables": ["service_level_reports"]},
+    {"question": "проблемные товары CZ", "tables": ["product_abcxyz"]},
+    {"question": "что на предприятии?", "tables": ["plan_perf_manager_reports", "service_level_reports", "product_abcxyz"]},
+    {"question": "карточка торгового Альборова", "tables": ["managers_plan"]},
+    {"question": "сколько штук продали по товарам за неделю", "tables": ["profit", "products", "clients"]},
+]
+
+_TABLE_RE = re.compile(r"\b(?:from|join)\s+(?:public\.)?([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _load_corpus(path: Optional[str]) -> List[Dict[str, Any]]:
+    if not path:
+        return list(CORPUS)
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def _from_logs(limit: int) -> List[Dict[str, Any]]:
+    rows = await fetch_all(
+        "SELECT user_request FROM (SELECT DISTINCT ON (user_request) user_request, id FROM public.agent_logs "
+        "WHERE user_request IS NOT NULL AND user_request <> '' ORDER BY user_request, id DESC) q "
+        "ORDER BY id DESC LIMIT $1",
+        (limit,),
+    )
+    return [{"question": r["user_request"]} for r in rows]
+
+
+async def _select(question: str, use_entities: bool):
+    intent = parse_intent(question, _dt.date.today())
+    entities = await extract_entities(question) if use_entities else None
+    return select_tables(question, intent, entities)
+
+
+async def _offline(corpus: List[Dict[str, Any]], full_prompt: str, use_entities: bool, repeat: int) -> None:
+    rules, ok = strip_schema_sections(full_prompt)
+    if not ok:
+        raise SystemExit("В промпте нет разделов со схемой — сокращать нечего")
+    full_tokens = count_tokens(full_prompt)
+    rules_tokens = count_tokens(rules)
+    catalog_tokens = count_tokens(render_schema(tuple(CATALOG)))
+    print(f"Промпт целиком: {full_tokens} токенов; правила без схемы: {rules_tokens}; весь каталог: {catalog_tokens}")
+
+    sizes: List[int] = []
+    times: List[float] = []
+    labeled = hits = fallbacks = 0
+    print(f"{'вопрос':<45}{'таблицы':<60}{'токены':>8}{'полнота':>9}")
+    for item in corpus:
+        question = item["question"]
+        for _ in range(repeat):
+            start = time.perf_counter()
+            selection = await _select(question, use_entities)
+            schema = render_schema(selection.tables)
+            times.append((time.perf_counter() - start) * 1000)
+        total = rules_tokens + count_tokens(schema)
+        sizes.append(total)
+        fallbacks += selection.full
+        mark = ""
+        if item.get("tables"):
+            labeled += 1
+            missing = set(item["tables"]) - set(selection.tables)
+            hits += not missing
+            mark = "да" if not missing else "нет: " + ",".join(sorted(missing))
+        tables = "ВСЕ" if selection.full else ",".join(selection.tables)
+        print(f"{question[:44]:<45}{tables[:59]:<60}{total:>8}{mark:>9}")
+
+    avg = statistics.mean(sizes)
+    print()
+    print(f"Промпт: в среднем {avg:.0f} токенов против {full_tokens} ({1 - avg / full_tokens:.1%} меньше), "
+          f"весь каталог — в {fallbacks} из {len(corpus)} вопросов")
+    print(f"Выбор таблиц и сборка схемы: p50 {statistics.median(times):.3f} мс, p95 {_percentile(times, 0.95):.3f} мс")
+    if labeled:
+        print(f"Полнота выбора: {hits} из {labeled} ({hits / labeled:.1%}) — все нужные таблицы в промпте")
+
+
+def _tables_in(sql: str) -> Set[str]:
+    return {t.lower() for t in _TABLE_RE.findall(sql or "") if t.lower() in CATALOG}
+
+
+async def _ask(system: List[str], question: str) -> Dict[str, Any]:
+    messages = [{"role": "system", "content": s} for s in system] + [
+        {"role": "user", "content": question},
+        {"role": "system", "content": "Если нужна БД — ОБЯЗАТЕЛЬНО верни sql_query в JSON. Не добавляй лишних полей."},
+    ]
+    start = time.perf_counter()
+    r = await create_chat_completion(
+        model=os.environ.get("OPENAI_MODEL_CHAT", "gpt-4.1"),
+        messages=messages,
+        response_format={"type": "json_object"},
+        temperature=0.0,
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    try:
+        sql = json.loads(r.choices[0].message.content or "{}").get("sql_query") or ""
+    except ValueError:
+        sql = ""
+    usage = getattr(r, "usage", None)
+    return {"ms": elapsed, "sql": sql, "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0}
+
+
+async def _same_result(sql: str, reference: str) -> bool:
+    try:
+        got, want = await execute_sql(sql), await execute_sql(reference)
+    except Exception:
+        return False
+    normalize = lambda rows: sorted(tuple(str(v) for v in row.values()) for row in rows)  # noqa: E731
+    return normalize(got) == normalize(want)
+
+
+async def _with_llm(corpus: List[Dict[str, Any]], full_prompt: str, use_entities: bool, execute: bool) -> None:
+    rules, _ = strip_schema_sections(full_prompt)
+    today = f"Сегодня {_dt.date.today().isoformat()}."
+    stats: Dict[str, Dict[str, List[float]]] = {
+        v: {"ms": [], "tokens": [], "ok": []} for v in ("целиком", "только нужные")
+    }
+    for item in corpus:
+        if not item.get("tables"):
+            continue
+        question = item["question"]
+        selection = await _select(question, use_entities)
+        variants = {
+            "целиком": [full_prompt, today],
+            "только нужные": [rules, today, render_schema(selection.tables)],
+        }
+        for name, system in variants.items():
+            answer = await _ask(system, question)
+            if execute and item.get("sql"):
+                ok = await _same_result(answer["sql"], item["sql"])
+            else:
+                expected = set(item["tables"]) - {"clients"}
+                ok = bool(answer["sql"]) and expected <= _tables_in(answer["sql"])
+            stats[name]["ms"].append(answer["ms"])
+            stats[name]["tokens"].append(answer["prompt_tokens"])
+            stats[name]["ok"].append(1.0 if ok else 0.0)
+            print(f"{name:<15}{question[:44]:<45}{'верно' if ok else 'ОШИБКА':>8}  {answer['sql'][:70]!r}")
+    print()
+    print(f"{'промпт':<15}{'вопросов':>9}{'токены':>9}{'p50, мс':>10}{'p95, мс':>10}{'точность':>10}")
+    for name, s in stats.items():
+        if s["ms"]:
+            print(f"{name:<15}{len(s['ms']):>9}{statistics.mean(s['tokens']):>9.0f}{statistics.median(s['ms']):>10.0f}"
+                  f"{_percentile(s['ms'], 0.95):>10.0f}{statistics.mean(s['ok']):>10.1%}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", help="JSONL: question, tables, sql (необязательно)")
+    parser.add_argument("--from-logs", type=int, default=0, help="добавить N последних вопросов из agent_logs")
+    parser.add_argument("--entities", action="store_true", help="учитывать сущности из справочников (нужна БД)")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--llm", action="store_true", help="сверить SQL модели с полным и сокращённым промптом")
+    parser.add_argument("--execute", action="store_true", help="с --llm: сравнить результаты с эталонным sql в БД")
+    args = parser.parse_args()
+
+    try:
+        full_prompt = _normalize(_read_prompt_file(AI_SYSTEM_PROMPT_FILE))
+        corpus = _load_corpus(args.corpus)
+        if args.from_logs:
+            corpus += await _from_logs(args.from_logs)
+        await _offline(corpus, full_prompt, args.entities, args.repeat)
+        if args.llm:
+            print()
+            await _with_llm(corpus, full_prompt, args.entities, args.execute)
+    finally:
+        await close_client()
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+guard_sql: прежние регулярки против разбора токенизатором на корпусе запросов.
+
+Корпус — типичные запросы агента (CTE, подзапрос sub, соединения через запятую,
+кавычки, EXTRACT(... FROM ...), литералы с ключевыми словами). Свой корпус из
+логов подаётся файлом: запросы через ';', например выгрузка
+    psql -Atc "SELECT sql_query || ';' FROM ..." > corpus.sql
+
+Проверки (любое нарушение — ошибка):
+  - guard_sql(guard_sql(q)) == guard_sql(q) — повторный разбор ничего не меняет,
+    т.е. в результате не осталось необёрнутых ссылок на profit/orders/debt/managers_plan/stock;
+  - запросы, которые отклоняла прежняя версия, отклоняются и новой (кроме ложных
+    срабатываний на ключевые слова внутри строк);
+  - если прежняя версия добавила фильтр бонусных клиентов, новая тоже его добавляет;
+  - запросы из MUST_REJECT отклоняются;
+  - с --explain каждый результат проходит EXPLAIN в PostgreSQL.
+
+Те же проверки на встроенном корпусе выполняет tests/test_sql_guard.py.
+
+Затем печатает, где прежняя версия пропускала фильтр или ломала запрос, и задержку
+(холодную — без мемоизации, и повторную).
+
+Запуск:
+    python -m bench.sql_guard_bench [--corpus corpus.sql] [--explain] [--repeat 200]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import re
+import time
+from typing import List, Optional
+
+from src.db import sql_guard
+from src.db.sql_guard import guard_sql
+from src.db.sql_tokenizer import OP, significant, tokenize
+
+CORPUS = [
+    "SELECT CURRENT_DATE AS current_date, NOW() AS current_datetime;",
+    """SELECT c.region, SUM(p.revenue) AS total_revenue
+FROM public.profit p
+JOIN public.clients c ON p.client_code = c.client_code
+WHERE p.revenue > 0
+  AND p.profit_date BETWEEN DATE '2025-01-01' AND DATE '2025-01-31'
+  AND p.client_code NOT IN (SELECT client_code FROM public.clients WHERE marker = 'Бонус')
+GROUP BY c.region
+ORDER BY total_revenue DESC;""",
+    """SELECT sub.month, c.region, SUM(sub.revenue) AS revenue
+FROM (SELECT DATE_TRUNC('month', p.profit_date) AS month, p.client_code, p.revenue FROM public.profit p WHERE p.revenue > 0) sub
+JOIN public.clients c ON c.client_code = sub.client_code
+GROUP BY sub.month, c.region ORDER BY sub.month""",
+    "SELECT pr.brand, SUM(p.weight_kg) FROM profit p JOIN products pr ON pr.product_code = p.product_code GROUP BY pr.brand",
+    "SELECT SUM(revenue) FROM profit WHERE revenue < 0 AND EXTRACT(YEAR FROM profit_date) = 2025",
+    "SELECT manager, SUM(total_debt), SUM(overdue_debt) FROM debt WHERE debt_date = (SELECT MAX(debt_date) FROM debt) GROUP BY manager",
+    "SELECT s.warehouse, SUM(s.final_quantity) FROM stock s WHERE s.stock_date = CURRENT_DATE GROUP BY s.warehouse",
+    "SELECT * FROM orders o, clients c, profit WHERE o.client_code = c.client_code AND profit.order_number = o.order_number",
+    """WITH plan AS (
+    SELECT manager, SUM(plan) AS plan_kg FROM managers_plan
+    WHERE period >= '2025-05-01' AND period < '2025-06-01' GROUP BY manager
+), fact AS (
+    SELECT manager, SUM(weight_kg) AS fact_kg FROM profit
+    WHERE profit_date >= '2025-05-01' AND profit_date < '2025-06-01' GROUP BY manager
+)
+SELECT plan.manager, plan_kg, fact_kg, ROUND(fact_kg / NULLIF(plan_kg, 0) * 100, 1) AS pct
+FROM plan LEFT JOIN fact ON fact.manager = plan.manager ORDER BY pct DESC""",
+    "WITH profit AS (SELECT * FROM profit WHERE revenue > 0) SELECT channel, SUM(revenue) FROM profit GROUP BY channel",
+    "SELECT * FROM \"profit\" p WHERE p.channel = 'Розница'",
+    "SELECT * FROM public.\"orders\" AS o WHERE o.order_date >= date_trunc('month', CURRENT_DATE)",
+    "SELECT 'delete from profit; drop table x' AS note, COUNT(*) FROM profit",
+    "SELECT COUNT(*) FROM profit WHERE manager IS DISTINCT FROM 'Иванов Иван'",
+    "SELECT x FROM (profit p JOIN clients c ON c.client_code = p.client_code) WHERE c.region = 'Нальчик'",
+    "SELECT g, (SELECT SUM(revenue) FROM profit WHERE EXTRACT(MONTH FROM profit_date) = g) FROM generate_series(1, 12) g",
+    "SELECT * FROM profit p LEFT JOIN LATERAL (SELECT * FROM orders o WHERE o.order_number = p.order_number LIMIT 1) o ON true",
+    """SELECT p.manager, COUNT(DISTINCT p.client_code) AS clients
+FROM profit AS p
+WHERE p.profit_date >= CURRENT_DATE - INTERVAL '30 days'
+GROUP BY p.manager HAVING COUNT(DISTINCT p.client_code) > 10""",
+    """WITH RECURSIVE months(m) AS (
+    SELECT DATE '2025-01-01' UNION ALL SELECT (m + INTERVAL '1 month')::date FROM months WHERE m < DATE '2025-12-01'
+)
+SELECT months.m, COALESCE(SUM(o.weight_kg), 0) FROM months LEFT JOIN orders o ON date_trunc('month', o.order_date) = months.m GROUP BY months.m""",
+    "SELECT c.client_name, SUM(p.revenue) FROM profit p, clients c WHERE p.client_code = c.client_code GROUP BY 1 ORDER BY 2 DESC LIMIT 10",
+    "SELECT product_code, SUM(quantity) FROM purchase_prices WHERE order_date >= '2025-01-01' GROUP BY product_code",
+    "SELECT full_name, phone, email FROM sales_representatives WHERE full_name ILIKE '%альборов%'",
+    "SELECT * FROM profit UNION ALL SELECT * FROM profit",
+    "select sum(p.revenue) from PUBLIC.PROFIT p where p.revenue>0",
+    "SELECT p.channel, SUM(p.revenue) FROM profit p /* from orders */ -- join debt\nGROUP BY p.channel",
+    "SELECT d.manager, d.total_debt FROM debt d WHERE d.manager = 'Хашев'; ",
+    "SELECT * FROM profit WHERE created_at > now()",
+    "SELECT 1; SELECT 2",
+    "UPDATE profit SET revenue = 0",
+    "SELECT * FROM profit; DROP TABLE profit",
+    "SELECT s.* FROM stock s JOIN products pr ON pr.product_code = s.product_code WHERE pr.brand = 'Чабан'",
+    "SELECT o.warehouse, COUNT(*) FROM orders o WHERE o.shipment_date IS NULL GROUP BY o.warehouse",
+    "SELECT COUNT(*) FROM (TABLE debt) d",
+    # В E'…' \' — экранированная кавычка: строка на ней не заканчивается
+    "SELECT E'\\'', revenue FROM profit --'",
+]
+
+# Должны отклоняться при любом разборе
+MUST_REJECT = [
+    "SELECT E'\\'' ; DELETE FROM profit --'",
+]
+
+BONUS = "marker = 'Бонус'"
+
+
+def legacy_guard_sql(sql: str) -> str:
+    """Прежняя реализация guard_sql (регулярки по тексту)"""
+    if not sql or not sql.strip():
+        raise ValueError("Empty SQL query")
+    query = sql.strip()
+    if query.endswith(";"):
+        query = query[:-1]
+    if re.search(r";\s*\S", query):
+        raise ValueError("Multiple SQL statements are not allowed")
+    if not re.match(r"^\s*(select|with)\b", query, re.IGNORECASE):
+        raise ValueError("Only SELECT or WITH (CTE) statements are allowed")
+    if re.search(r"\b(insert|update|delete|merge|alter|drop|truncate|create|grant|revoke|call|copy)\b", query, re.IGNORECASE):
+        raise ValueError("DDL/DML statements are not allowed")
+
+    def _replace(q: str, table: str, wrapped: str) -> str:
+        for kw in ("FROM", "JOIN"):
+            pattern = re.compile(
+                rf"\b{kw}\s+(?:public\.)?{table}\b(\s+(?:AS\s+)?(?P<alias>[a-zA-Z_][a-zA-Z0-9_]*))?", re.IGNORECASE
+            )
+            q = pattern.sub(lambda m: f"{kw} {wrapped} {m.group('alias') or table}", q)
+        return q
+
+    for table in ("profit", "orders", "debt", "managers_plan"):
+        query = _replace(query, table, sql_guard._wrap_table_with_filter(table, "client_code"))
+    return _replace(query, "stock", sql_guard._wrap_stock())
+
+
+def _split_corpus(text: str) -> List[str]:
+    """Запросы файла, разделённые ';' (точки с запятой в строках и комментариях не считаются)"""
+    queries, start = [], 0
+    for tok in significant(tokenize(text)):
+        if tok.kind == OP and tok.text == ";":
+            queries.append(text[start:tok.end].strip())
+            start = tok.end
+    if text[start:].strip():
+        queries.append(text[start:].strip())
+    return [q for q in queries if q.strip("; \n\t")]
+
+
+def _try(fn, query: str) -> Optional[str]:
+    try:
+        return fn(query)
+    except ValueError:
+        return None
+
+
+async def _explain(queries: List[str]) -> int:
+    from src.db.pool import close_pool, fetch_all
+
+    failed = 0
+    for q in queries:
+        try:
+            await fetch_all("EXPLAIN " + q)
+        except Exception as e:
+            failed += 1
+            print(f"EXPLAIN не прошёл: {e}\n  {q[:300]}")
+    await close_pool()
+    return failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", help="файл с запросами через ';' (например, выгрузка SQL из логов)")
+    parser.add_argument("--explain", action="store_true", help="проверить результаты EXPLAIN в PostgreSQL")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = list(CORPUS) + MUST_REJECT
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus += _split_corpus(f.read())
+
+    problems = 0
+    legacy_leaks = legacy_diff = rejected = 0
+    guarded: List[str] = []
+    for q in corpus:
+        new, old = _try(guard_sql, q), _try(legacy_guard_sql, q)
+        if new is not None and q in MUST_REJECT:
+            problems += 1
+            print(f"Принят запрос, который должен отклоняться:\n  {q[:300]}")
+            continue
+        if new is None:
+            rejected += 1
+            if old is not None:
+                problems += 1
+                print(f"Отклонён новой версией, но принят прежней:\n  {q[:300]}")
+            continue
+        guarded.append(new)
+        if guard_sql(new) != new:
+            problems += 1
+            print(f"Повторный guard_sql меняет результат (остались необёрнутые таблицы):\n  {q[:300]}")
+        if old is not None and old.count(BONUS) > q.count(BONUS) and new.count(BONUS) == q.count(BONUS):
+            problems += 1
+            print(f"Прежняя версия добавляла фильтр, новая — нет:\n  {q[:300]}")
+        if old is None:
+            print(f"Прежняя версия ложно отклоняла:\n  {q[:200]}")
+        elif old != new:
+            legacy_diff += 1
+            if _try(guard_sql, old) != old:
+                legacy_leaks += 1
+                print(f"Прежняя версия пропускала фильтр или ломала запрос:\n  {q[:200]}")
+
+    if args.explain:
+        problems += asyncio.run(_explain(guarded))
+    if problems:
+        raise SystemExit(f"{problems} проблем на корпусе из {len(corpus)} запросов")
+    print(
+        f"{len(corpus)} запросов: отклонено {rejected}, результат отличается от прежнего в {legacy_diff}, "
+        f"из них прежняя версия оставляла таблицу без фильтра или ломала запрос в {legacy_leaks}"
+    )
+
+    def _bench(fn, cold: bool) -> float:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            if cold:
+                sql_guard._guard_cached.cache_clear()
+            for q in corpus:
+                _try(fn, q)
+        return (time.perf_counter() - start) * 1e6 / (args.repeat * len(corpus))
+
+    rows = [
+        ("регулярки (прежний)", _bench(legacy_guard_sql, cold=False)),
+        ("токенизатор, без кэша", _bench(guard_sql, cold=True)),
+        ("токенизатор, повтор", _bench(guard_sql, cold=False)),
+    ]
+    print(f"{'вариант':<26}{'мкс/запрос':>12}")
+    for name, us in rows:
+        print(f"{name:<26}{us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Синтетические таблицы для бенчмарков: bench.profit с теми же колонками, что и public.profit,
+и справочники bench.clients / bench.products (часть клиентов — с меткой «Бонус»).
+
+Данные генерируются на стороне Postgres (generate_series), так что 1 млн строк создаётся
+за секунды и не гоняется через сеть. Боевые таблицы не затрагиваются — всё в схеме bench.
+Тот же генератор profit (fill_profit) с другим ProfitDistribution заполняет набор bench.dataset.
+
+Запуск:
+    python -m bench.synthetic --rows 200000
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import datetime as _dt
+import time
+from typing import NamedTuple, Optional, Tuple
+
+from src.db.pool import get_pool, close_pool
+
+BENCH_SCHEMA = "bench"
+
+PROFIT_DDL = """
+CREATE TABLE {s}.profit (
+    order_number text,
+    client_code  text,
+    product_code text,
+    order_date   date,
+    profit_date  date,
+    quantity     numeric(14, 3),
+    weight_kg    numeric(14, 3),
+    revenue      numeric(14, 2),
+    manager      text,
+    channel      text,
+    warehouse    text
+);"""
+
+PROFIT_INDEXES = """
+CREATE INDEX ON {s}.profit (profit_date);
+CREATE INDEX ON {s}.profit (manager);"""
+
+# Строка g: клиент и товар — (g * шаг) по модулю числа клиентов/товаров, дата продажи — день
+# first_day + g % days, заказ — на 0–2 дня раньше; {owner} — по чему выбираются менеджер и канал
+_FILL_PROFIT_SQL = """
+INSERT INTO {s}.profit
+SELECT
+    'ORD-' || lpad((g / 5)::text, 9, '0'),
+    'CL-' || lpad(ci::text, 5, '0'),
+    'PR-' || lpad(pi::text, 5, '0'),
+    d - (g % 3)::int,
+    d,
+    q,
+    round(q * (0.2 + (pi % 10) / 10.0), 3),
+    -- каждая 20-я строка — возврат
+    round(q * (50 + pi % 400) * CASE WHEN g % 20 = 0 THEN -1 ELSE 1 END, 2),
+    ($4::text[])[(1 + {owner} % cardinality($4::text[]))::int],
+    ($5::text[])[(1 + {owner} % cardinality($5::text[]))::int],
+    ($6::text[])[(1 + g % cardinality($6::text[]))::int]
+FROM (
+    SELECT g, (g * $9) % $2 AS ci, (g * $10) % $3 AS pi,
+           $8::date + (g % $7)::int AS d, (1 + g % 50)::numeric AS q
+    FROM generate_series(1, $1::bigint) AS g
+) s;"""
+
+
+class ProfitDistribution(NamedTuple):
+    """Как строки profit распределяются по клиентам, товарам, датам и справочникам"""
+    managers: Tuple[str, ...] = tuple(f"Менеджер {i}" for i in range(25))
+    channels: Tuple[str, ...] = ("Розница", "Опт", "HoReCa", "Сети")
+    warehouses: Tuple[str, ...] = ("Нальчик", "Прохладный", "Баксан")
+    client_step: int = 1                           # 1 — клиенты подряд, большое простое — вразброс
+    product_step: int = 7
+    first_day: Optional[_dt.date] = _dt.date(2023, 1, 1)   # None — последние days дней до сегодня
+    days: int = 730
+    by_client: bool = False                        # менеджер и канал — клиента, а не номера строки
+
+
+async def fill_profit(
+    conn, schema: str, rows: int, clients: int, products: int, dist: ProfitDistribution = ProfitDistribution(),
+) -> None:
+    """Заполнить уже созданную {schema}.profit на rows строк (генерация — в PostgreSQL)"""
+    first_day = dist.first_day or _dt.date.today() - _dt.timedelta(days=dist.days - 1)
+    await conn.execute(
+        _FILL_PROFIT_SQL.format(s=schema, owner="ci" if dist.by_client else "g"),
+        rows, clients, products, list(dist.managers), list(dist.channels), list(dist.warehouses),
+        dist.days, first_day, dist.client_step, dist.product_step,
+    )
+
+
+_CREATE_REFERENCES_SQL = f"""
+CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA};
+DROP TABLE IF EXISTS {BENCH_SCHEMA}.clients;
+CREATE TABLE {BENCH_SCHEMA}.clients (
+    client_code text PRIMARY KEY,
+    client_name text,
+    region      text,
+    manager     text,
+    marker      text
+);
+DROP TABLE IF EXISTS {BENCH_SCHEMA}.products;
+CREATE TABLE {BENCH_SCHEMA}.products (
+    product_code text PRIMARY KEY,
+    product_name text,
+    brand        text,
+    category_1   text,
+    client_code  text
+);
+"""
+
+_FILL_CLIENTS_SQL = f"""
+INSERT INTO {BENCH_SCHEMA}.clients
+SELECT
+    'CL-' || lpad(g::text, 5, '0'),
+    'Клиент ' || g,
+    (ARRAY['Нальчик', 'Прохладный', 'Баксан', 'Майский'])[1 + g % 4],
+    'Менеджер ' || (g % 25),
+    CASE WHEN g % $2 = 0 THEN 'Бонус' END
+FROM generate_series(0, $1 - 1) AS g;
+"""
+
+_FILL_PRODUCTS_SQL = f"""
+INSERT INTO {BENCH_SCHEMA}.products
+SELECT
+    'PR-' || lpad(g::text, 5, '0'),
+    'Товар ' || g,
+    'Бренд ' || (g % 40),
+    'Категория ' || (g % 12),
+    -- каждый 10-й товар — private-label клиента
+    CASE WHEN g % 10 = 0 THEN 'CL-' || lpad(((g * 13) % $2)::text, 5, '0') END
+FROM generate_series(0, $1 - 1) AS g;
+"""
+
+
+async def create_references(clients: int = 5000, products: int = 1500, bonus_every: int = 30) -> float:
+    """Пересоздать bench.clients и bench.products (каждый bonus_every-й клиент — «Бонус»)"""
+    pool = await get_pool()
+    start = time.perf_counter()
+    async with pool.acquire() as conn:
+        await conn.execute(_CREATE_REFERENCES_SQL)
+        await conn.execute(_FILL_CLIENTS_SQL, clients, bonus_every)
+        await conn.execute(_FILL_PRODUCTS_SQL, products, clients)
+        await conn.execute(f"ANALYZE {BENCH_SCHEMA}.clients; ANALYZE {BENCH_SCHEMA}.products;")
+    return time.perf_counter() - start
+
+
+async def create_profit(
+    rows: int, clients: int = 5000, products: int = 1500, dist: ProfitDistribution = ProfitDistribution(),
+) -> float:
+    """Пересоздать bench.profit на rows строк; возвращает время генерации в секундах"""
+    pool = await get_pool()
+    start = time.perf_counter()
+    async with pool.acquire() as conn:
+        await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA}; DROP TABLE IF EXISTS {BENCH_SCHEMA}.profit;")
+        await conn.execute(PROFIT_DDL.format(s=BENCH_SCHEMA))
+        await fill_profit(conn, BENCH_SCHEMA, rows, clients, products, dist)
+        await conn.execute(f"ANALYZE {BENCH_SCHEMA}.profit;")
+    return time.perf_counter() - start
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=1500)
+    parser.add_argument("--scatter", action="store_true",
+                        help="клиенты и товары строк вразброс, менеджер и канал — клиента")
+    parser.add_argument("--with-references", action="store_true", help="создать также bench.clients и bench.products")
+    args = parser.parse_args()
+    try:
+        dist = (ProfitDistribution(client_step=7919, product_step=104729, by_client=True)
+                if args.scatter else ProfitDistribution())
+        elapsed = await create_profit(args.rows, args.clients, args.products, dist)
+        print(f"{BENCH_SCHEMA}.profit: {args.rows} строк за {elapsed:.1f}с")
+        if args.with_references:
+            elapsed = await create_references(args.clients, args.products)
+            print(f"{BENCH_SCHEMA}.clients, {BENCH_SCHEMA}.products за {elapsed:.1f}с")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
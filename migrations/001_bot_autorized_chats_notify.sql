@@ -0,0 +1,42 @@
+-- Уведомления об изменении списка авторизованных чатов.
+-- Бот держит LISTEN bot_autorized_chats_changed и применяет изменения к кэшу в памяти
+-- (src/db/auth.py), поэтому отзыв доступа срабатывает за секунды без запросов к БД
+-- на каждое сообщение.
+--
+-- Формат payload: '<TG_OP>:<chat_id>', например 'DELETE:123456789'.
+
+CREATE OR REPLACE FUNCTION public.notify_bot_autorized_chats_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('bot_autorized_chats_changed', 'DELETE:' || OLD.chat_id);
+    ELSIF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('bot_autorized_chats_changed', 'INSERT:' || NEW.chat_id);
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM pg_notify('bot_autorized_chats_changed', 'UPDATE:' || NEW.chat_id);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_bot_autorized_chats_notify ON public.bot_autorized_chats;
+CREATE TRIGGER trg_bot_autorized_chats_notify
+AFTER INSERT OR UPDATE OR DELETE ON public.bot_autorized_chats
+FOR EACH ROW EXECUTE FUNCTION public.notify_bot_autorized_chats_changed();
+
+CREATE OR REPLACE FUNCTION public.notify_bot_autorized_chats_truncated()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_notify('bot_autorized_chats_changed', 'TRUNCATE:');
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_bot_autorized_chats_truncate ON public.bot_autorized_chats;
+CREATE TRIGGER trg_bot_autorized_chats_truncate
+AFTER TRUNCATE ON public.bot_autorized_chats
+FOR EACH STATEMENT EXECUTE FUNCTION public.notify_bot_autorized_chats_truncated();
@@ -0,0 +1,84 @@
+-- Таблицы без бонусных клиентов, на которые guard_sql переписывает ссылки
+-- (src/db/guarded_relations.py, SQL_GUARD_MODE=view | matview).
+--
+-- Без миграции (SQL_GUARD_MODE=subquery) каждая ссылка на profit/orders/debt/managers_plan/stock
+-- оборачивается подзапросом с NOT IN (...) — в запросе с несколькими ссылками фильтр
+-- вычисляется заново для каждой, а для stock это ещё и LEFT JOIN products/clients.
+--
+--   bonus_excluded.<таблица>     — обычные представления: всегда актуальны, фильтр записан
+--                                  через NOT EXISTS, планировщик строит hash anti join;
+--   bonus_excluded.<таблица>_mv  — материализованные представления с индексами: фильтр уже
+--                                  применён, бот обновляет их после изменения исходных таблиц
+--                                  (пока идёт обновление, запросы идут в обычное представление).
+--
+-- Отличие от NOT IN: строки с client_code IS NULL исключаются так же, как раньше исключались
+-- при наличии хотя бы одного бонусного клиента.
+--
+-- REFRESH MATERIALIZED VIEW доступен только владельцу — миграцию нужно применять от имени
+-- пользователя бота (PG_USER) или передать ему владение:
+--   ALTER MATERIALIZED VIEW bonus_excluded.profit_mv OWNER TO <PG_USER>;  -- и т.д.
+
+CREATE SCHEMA IF NOT EXISTS bonus_excluded;
+
+-- ---------- представления ----------
+
+CREATE OR REPLACE VIEW bonus_excluded.profit AS
+SELECT t.* FROM public.profit t
+WHERE t.client_code IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM public.clients c WHERE c.client_code = t.client_code AND c.marker = 'Бонус');
+
+CREATE OR REPLACE VIEW bonus_excluded.orders AS
+SELECT t.* FROM public.orders t
+WHERE t.client_code IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM public.clients c WHERE c.client_code = t.client_code AND c.marker = 'Бонус');
+
+CREATE OR REPLACE VIEW bonus_excluded.debt AS
+SELECT t.* FROM public.debt t
+WHERE t.client_code IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM public.clients c WHERE c.client_code = t.client_code AND c.marker = 'Бонус');
+
+CREATE OR REPLACE VIEW bonus_excluded.managers_plan AS
+SELECT t.* FROM public.managers_plan t
+WHERE t.client_code IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM public.clients c WHERE c.client_code = t.client_code AND c.marker = 'Бонус');
+
+-- Остатки: продукция без клиента (не private-label) или клиента без метки «Бонус»
+CREATE OR REPLACE VIEW bonus_excluded.stock AS
+SELECT t.* FROM public.stock t
+WHERE EXISTS (
+    SELECT 1 FROM public.products pr
+    LEFT JOIN public.clients c ON c.client_code = pr.client_code
+    WHERE pr.product_code = t.product_code
+      AND (c.client_code IS NULL OR c.marker <> 'Бонус')
+);
+
+-- ---------- материализованные представления ----------
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS bonus_excluded.profit_mv AS SELECT * FROM bonus_excluded.profit;
+CREATE INDEX IF NOT EXISTS profit_mv_profit_date_idx ON bonus_excluded.profit_mv (profit_date);
+CREATE INDEX IF NOT EXISTS profit_mv_manager_idx ON bonus_excluded.profit_mv (manager);
+CREATE INDEX IF NOT EXISTS profit_mv_client_code_idx ON bonus_excluded.profit_mv (client_code);
+CREATE INDEX IF NOT EXISTS profit_mv_product_code_idx ON bonus_excluded.profit_mv (product_code);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS bonus_excluded.orders_mv AS SELECT * FROM bonus_excluded.orders;
+CREATE INDEX IF NOT EXISTS orders_mv_order_date_idx ON bonus_excluded.orders_mv (order_date);
+CREATE INDEX IF NOT EXISTS orders_mv_client_code_idx ON bonus_excluded.orders_mv (client_code);
+CREATE INDEX IF NOT EXISTS orders_mv_product_code_idx ON bonus_excluded.orders_mv (product_code);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS bonus_excluded.debt_mv AS SELECT * FROM bonus_excluded.debt;
+CREATE INDEX IF NOT EXISTS debt_mv_debt_date_idx ON bonus_excluded.debt_mv (debt_date);
+CREATE INDEX IF NOT EXISTS debt_mv_manager_idx ON bonus_excluded.debt_mv (manager);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS bonus_excluded.managers_plan_mv AS SELECT * FROM bonus_excluded.managers_plan;
+CREATE INDEX IF NOT EXISTS managers_plan_mv_period_idx ON bonus_excluded.managers_plan_mv (period);
+CREATE INDEX IF NOT EXISTS managers_plan_mv_manager_idx ON bonus_excluded.managers_plan_mv (manager);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS bonus_excluded.stock_mv AS SELECT * FROM bonus_excluded.stock;
+CREATE INDEX IF NOT EXISTS stock_mv_stock_date_idx ON bonus_excluded.stock_mv (stock_date);
+CREATE INDEX IF NOT EXISTS stock_mv_product_code_idx ON bonus_excluded.stock_mv (product_code);
+
+ANALYZE bonus_excluded.profit_mv;
+ANALYZE bonus_excluded.orders_mv;
+ANALYZE bonus_excluded.debt_mv;
+ANALYZE bonus_excluded.managers_plan_mv;
+ANALYZE bonus_excluded.stock_mv;
@@ -0,0 +1,29 @@
+-- Статистика SQL-запросов агента по форме запроса (src/db/query_stats.py).
+--
+-- Форма — текст запроса без литералов (строки и числа заменены на ?, списки IN (...) свёрнуты),
+-- fingerprint — её хэш. Бот копит счётчики в памяти и раз в QUERY_STATS_FLUSH_INTERVAL
+-- записывает по строке на каждую форму, встречавшуюся за окно. Перцентили считаются
+-- по задержкам окна (запросы, отданные из кэша результатов, учитываются только в calls/cached).
+--
+-- Самые тяжёлые формы за последние часы: /slow_queries <часы>.
+
+CREATE TABLE IF NOT EXISTS public.bot_query_stats (
+    id           bigserial PRIMARY KEY,
+    window_start timestamptz      NOT NULL,
+    window_end   timestamptz      NOT NULL,
+    fingerprint  text             NOT NULL,
+    query_shape  text             NOT NULL,
+    calls        integer          NOT NULL,
+    cached       integer          NOT NULL DEFAULT 0,
+    errors       integer          NOT NULL DEFAULT 0,
+    rows_total   bigint           NOT NULL DEFAULT 0,
+    rows_max     integer          NOT NULL DEFAULT 0,
+    total_ms     double precision NOT NULL DEFAULT 0,
+    p50_ms       double precision NOT NULL DEFAULT 0,
+    p95_ms       double precision NOT NULL DEFAULT 0,
+    p99_ms       double precision NOT NULL DEFAULT 0,
+    max_ms       double precision NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS bot_query_stats_window_end_idx ON public.bot_query_stats (window_end);
+CREATE INDEX IF NOT EXISTS bot_query_stats_fingerprint_idx ON public.bot_query_stats (fingerprint, window_end);
@@ -0,0 +1,90 @@
+-- Сводные таблицы profit по месяцам (src/db/rollups.py, SQL_ROLLUPS=true).
+--
+-- Большинство вопросов — выручка, вес и количество по месяцам в разрезе менеджера, бренда,
+-- региона и канала. С SQL_ROLLUPS такие агрегаты из profit (с JOIN clients/products по ключу)
+-- переписываются после guard_sql на самую маленькую подходящую таблицу:
+--
+--   rollup.profit_month_brand            — месяц × бренд
+--   rollup.profit_month_region           — месяц × регион
+--   rollup.profit_month_manager_channel  — месяц × менеджер × канал
+--   rollup.profit_month_full             — месяц × менеджер × бренд × регион × канал
+--
+-- В каждой строке — суммы revenue / weight_kg / quantity и число строк profit для комбинации
+-- разрезов и знака выручки (revenue_sign: 1 — продажи, -1 — возвраты), поэтому SUM(revenue)
+-- с условием revenue > 0 считается точно так же, как по profit. has_client / has_product —
+-- нашёлся ли клиент / товар (JOIN в исходном запросе отбрасывает строки без них).
+-- Бонусные клиенты исключены при сборке, как в bonus_excluded.profit (migrations/002).
+--
+-- Таблицы заполняет бот: при первом запуске и после изменения clients/products — целиком,
+-- после загрузки profit — только последние месяцы (ROLLUP_REFRESH_LOOKBACK_MONTHS), раз в
+-- ROLLUP_FULL_REFRESH_HOURS — снова целиком. Пока таблица не заполнена (нет строки
+-- в rollup.refresh_state), запросы идут в profit.
+--
+-- Пользователю бота (PG_USER) нужны права на запись:
+--   GRANT USAGE ON SCHEMA rollup TO <PG_USER>;
+--   GRANT SELECT, INSERT, DELETE ON ALL TABLES IN SCHEMA rollup TO <PG_USER>;
+-- и владение таблицами для ANALYZE (или выполнить миграцию от его имени).
+
+CREATE SCHEMA IF NOT EXISTS rollup;
+
+CREATE TABLE IF NOT EXISTS rollup.refresh_state (
+    rollup_name    text PRIMARY KEY,
+    refreshed_from date,              -- NULL — последнее обновление было полным
+    refreshed_at   timestamptz NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rollup.profit_month_brand (
+    period_month date,
+    brand        text,
+    has_product  boolean  NOT NULL,
+    revenue_sign smallint,
+    revenue      numeric,
+    weight_kg    numeric,
+    quantity     numeric,
+    rows_count   bigint   NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profit_month_brand_period_idx ON rollup.profit_month_brand (period_month);
+
+CREATE TABLE IF NOT EXISTS rollup.profit_month_region (
+    period_month date,
+    region       text,
+    has_client   boolean  NOT NULL,
+    revenue_sign smallint,
+    revenue      numeric,
+    weight_kg    numeric,
+    quantity     numeric,
+    rows_count   bigint   NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profit_month_region_period_idx ON rollup.profit_month_region (period_month);
+
+CREATE TABLE IF NOT EXISTS rollup.profit_month_manager_channel (
+    period_month date,
+    manager      text,
+    channel      text,
+    revenue_sign smallint,
+    revenue      numeric,
+    weight_kg    numeric,
+    quantity     numeric,
+    rows_count   bigint   NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profit_month_manager_channel_period_idx
+    ON rollup.profit_month_manager_channel (period_month);
+CREATE INDEX IF NOT EXISTS profit_month_manager_channel_manager_idx
+    ON rollup.profit_month_manager_channel (manager);
+
+CREATE TABLE IF NOT EXISTS rollup.profit_month_full (
+    period_month date,
+    manager      text,
+    brand        text,
+    region       text,
+    channel      text,
+    has_client   boolean  NOT NULL,
+    has_product  boolean  NOT NULL,
+    revenue_sign smallint,
+    revenue      numeric,
+    weight_kg    numeric,
+    quantity     numeric,
+    rows_count   bigint   NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profit_month_full_period_idx ON rollup.profit_month_full (period_month);
+CREATE INDEX IF NOT EXISTS profit_month_full_manager_idx ON rollup.profit_month_full (manager);
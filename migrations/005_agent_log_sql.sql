@@ -0,0 +1,17 @@
+-- SQL ответов агента к логам (src/db/logs.py, AGENT_LOG_SQL=true).
+--
+-- В agent_logs пишутся вопрос и HTML ответа, но не SQL, по которому ответ собран. Здесь хранится
+-- проверенный SQL (после validate_and_sanitize_sql, ответ с данными) для каждого такого лога.
+-- Из пар «вопрос → SQL» без отметки в training_clicks («Отправить на обучение») собирается
+-- индекс примеров для промпта (src/ai/few_shot.py, AI_FEW_SHOT=true).
+--
+-- Строки пишет бот пачками (COPY) после записи самого лога; индекс дочитывает новые
+-- по возрастанию log_id.
+
+CREATE TABLE IF NOT EXISTS public.agent_log_sql (
+    log_id     bigint      PRIMARY KEY,
+    sql_query  text        NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS training_clicks_log_id_idx ON public.training_clicks (log_id);
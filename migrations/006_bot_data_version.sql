@@ -0,0 +1,66 @@
+-- Номера версий бизнес-таблиц (src/db/data_version.py).
+--
+-- Триггер на каждую команду INSERT / UPDATE / DELETE / TRUNCATE увеличивает version
+-- строки таблицы в bot_data_version в той же транзакции и шлёт NOTIFY bot_data_changed
+-- с payload '<таблица>:<version>'. Номер становится виден вместе с данными при commit
+-- (в отличие от счётчиков pg_stat_user_tables, которые отправляются в статистику
+-- с задержкой и обнуляются pg_stat_reset), не уменьшается и не повторяется, поэтому
+-- по нему бот сразу сбрасывает кэш результатов и перестаёт читать устаревшие
+-- сводные таблицы и материализованные представления.
+--
+-- Команды, меняющие одну таблицу, ждут друг друга на строке bot_data_version до commit;
+-- загрузка ETL одной транзакцией этого не замечает.
+--
+-- Боту (PG_USER) достаточно SELECT на bot_data_version.
+--
+-- Триггеры ставятся на существующие таблицы из списка ниже; после добавления новой
+-- бизнес-таблицы миграцию можно выполнить повторно.
+
+CREATE TABLE IF NOT EXISTS public.bot_data_version (
+    table_name text PRIMARY KEY,
+    version bigint NOT NULL DEFAULT 0,
+    changed_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION public.bump_bot_data_version()
+RETURNS trigger
+LANGUAGE plpgsql
+-- ETL пишет от своей роли: права на bot_data_version ей не нужны
+SECURITY DEFINER
+SET search_path = pg_catalog, public
+AS $$
+DECLARE
+    new_version bigint;
+BEGIN
+    INSERT INTO public.bot_data_version AS d (table_name, version, changed_at)
+    VALUES (TG_TABLE_NAME, 1, now())
+    ON CONFLICT (table_name) DO UPDATE SET version = d.version + 1, changed_at = now()
+    RETURNING d.version INTO new_version;
+    PERFORM pg_notify('bot_data_changed', TG_TABLE_NAME || ':' || new_version);
+    RETURN NULL;
+END;
+$$;
+
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'profit', 'orders', 'debt', 'stock', 'managers_plan', 'clients', 'products',
+        'purchase_prices', 'sales_representatives'
+    ]
+    LOOP
+        IF to_regclass('public.' || t) IS NOT NULL THEN
+            EXECUTE format('DROP TRIGGER IF EXISTS trg_bot_data_version ON public.%I', t);
+            EXECUTE format(
+                'CREATE TRIGGER trg_bot_data_version AFTER INSERT OR UPDATE OR DELETE ON public.%I '
+                'FOR EACH STATEMENT EXECUTE FUNCTION public.bump_bot_data_version()', t);
+            EXECUTE format('DROP TRIGGER IF EXISTS trg_bot_data_version_truncate ON public.%I', t);
+            EXECUTE format(
+                'CREATE TRIGGER trg_bot_data_version_truncate AFTER TRUNCATE ON public.%I '
+                'FOR EACH STATEMENT EXECUTE FUNCTION public.bump_bot_data_version()', t);
+            INSERT INTO public.bot_data_version (table_name) VALUES (t) ON CONFLICT DO NOTHING;
+        END IF;
+    END LOOP;
+END;
+$$;
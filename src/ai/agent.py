@@ -3,47 +3,137 @@ from __future__ import annotations
 
 import os
 import json
-from typing import List, Dict, Any, Optional
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 from src.utils.logger import get_logger
 from src.utils.memory import append_message
-from src.db.sql import execute_sql
+from src.db.query_cost import QueryCostError
+from src.db.sql import estimated_rows, execute_sql
+from src.models.rowset import RowSet
 
 from .models import AgentResult
-from .openai_client import get_client
+from .openai_client import create_chat_completion
 from .classifier import requires_database
-from .messages import build_messages  # уже включает текущую дату из БД
+from .messages import build_messages, record_prompt_usage  # уже включает текущую дату из БД
 from .sql_tools import strict_retry_sql_query, validate_and_sanitize_sql
 from .renderer import render_rows, render_no_data, render_text_info
+from .fast_path import (
+    analyze_question,
+    fast_path_enabled,
+    fast_path_sql,
+    record_answer_latency,
+    record_fast_path_result,
+)
+from .streaming import JsonFieldStream, streaming_enabled
+from .intent_cache import (
+    drop_cached_sql,
+    get_cached_sql,
+    intent_cache_enabled,
+    intent_key,
+    put_cached_sql,
+    record_uncacheable,
+)
 
 logger = get_logger("ai.agent")
 
+# Сколько строк держим в памяти для ответа; всё, что больше, выгружается в Excel потоково
+SQL_INLINE_MAX_ROWS = int(os.getenv("SQL_INLINE_MAX_ROWS", "5000"))
 
-async def run_ai_for_text(chat_id: int, text: str, user_id: Optional[int] = None, **kwargs) -> AgentResult:
+
+async def run_ai_for_text(
+    chat_id: int,
+    text: str,
+    user_id: Optional[int] = None,
+    on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+    **kwargs,
+) -> AgentResult:
     """Тонкий оркестратор: LLM -> (sql_query) -> DB -> красивый HTML.
+    Типовые вопросы (метрика + период + фильтры из справочников) закрываются шаблоном SQL без LLM,
+    повторные по смыслу — проверенным SQL из кэша вопросов (intent_cache).
+    on_partial — получает поле output ответа LLM по мере генерации (AI_STREAM), чтобы показать
+    его пользователю до окончания ответа и запроса в БД.
     user_id оставлен для обратной совместимости с обработчиками, не используется.
     """
     if not text or not text.strip():
         return AgentResult(output="Пожалуйста, введите текст для обработки.")
 
+    start = time.perf_counter()
+    analyzed = await analyze_question(text) if fast_path_enabled() or intent_cache_enabled() else None
+
+    fast_sql = fast_path_sql(text, analyzed)
+    if fast_sql:
+        result, outcome = await _answer_with_sql(chat_id, text, fast_sql)
+        # Пустой результат — скорее всего, название из справочника записано в profit иначе
+        record_fast_path_result(result is not None, outcome)
+        if result is not None:
+            record_answer_latency("fast", (time.perf_counter() - start) * 1000)
+            return result
+
+    cache_key = intent_key(text, *analyzed) if analyzed and intent_cache_enabled() else None
+    if cache_key:
+        cached_sql = await get_cached_sql(cache_key)
+        if cached_sql:
+            logger.info("🎯 SQL из кэша вопросов, без LLM")
+            result, _ = await _answer_with_sql(chat_id, text, cached_sql)
+            if result is not None:
+                record_answer_latency("cache", (time.perf_counter() - start) * 1000)
+                return result
+            await drop_cached_sql(cache_key)
+    elif analyzed and intent_cache_enabled():
+        record_uncacheable()
+
+    result = await _run_llm(chat_id, text, cache_key, on_partial, start, analyzed)
+    record_answer_latency("llm", (time.perf_counter() - start) * 1000)
+    return result
+
+
+async def _answer_with_sql(chat_id: int, text: str, sql: str) -> Tuple[Optional[AgentResult], str]:
+    """Ответ по готовому SQL (шаблон или кэш вопросов) без LLM; (None, причина) — спрашиваем LLM"""
+    try:
+        rows = await execute_sql(sql, max_rows=SQL_INLINE_MAX_ROWS)
+    except Exception as e:
+        # QueryCostError в том числе: LLM может сузить запрос или объяснить, что не так
+        logger.warning(f"⚠️ SQL без LLM не выполнен, спрашиваем LLM: {e}")
+        return None, "sql_error"
+    if not rows:
+        return None, "empty"
+    result = _render_db_rows(rows, text, sql)
+    await _remember(chat_id, text, result.output)
+    return result, "ok"
+
+
+async def _run_llm(
+    chat_id: int,
+    text: str,
+    cache_key: Optional[str] = None,
+    on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+    started: Optional[float] = None,
+    analyzed: Optional[Tuple[Dict[str, Any], Dict[str, List[str]]]] = None,
+) -> AgentResult:
     need_db = requires_database(text)
-    messages = await build_messages(text, chat_id)
+    messages = await build_messages(text, chat_id, analyzed)
 
-    client = get_client()
     model = os.environ.get("OPENAI_MODEL_CHAT", "gpt-4.1")
 
     # 1) Первый проход: строгий JSON (output/send_excel/table_data/sql_query)
+    request = dict(
+        model=model,
+        messages=messages + [{
+            "role": "system",
+            "content": "Если нужна БД — ОБЯЗАТЕЛЬНО верни sql_query в JSON. Не добавляй лишних полей."
+        }],
+        response_format={"type": "json_object"},
+        temperature=0.0,
+    )
     try:
-        r = await client.chat.completions.create(
-            model=model,
-            messages=messages + [{
-                "role": "system",
-                "content": "Если нужна БД — ОБЯЗАТЕЛЬНО верни sql_query в JSON. Не добавляй лишних полей."
-            }],
-            response_format={"type": "json_object"},
-            temperature=0.0,
-        )
-        data = json.loads((r.choices[0].message.content if r.choices else "{}") or "{}")
+        if on_partial is not None and streaming_enabled():
+            content = await _stream_completion(request, on_partial, started or time.perf_counter())
+        else:
+            r = await create_chat_completion(**request)
+            record_prompt_usage(getattr(r, "usage", None))
+            content = r.choices[0].message.content if r.choices else "{}"
+        data = json.loads(content or "{}")
         logger.info(f"✅ AI ответ получен. send_excel={data.get('send_excel')}, send_card={data.get('send_card')}")
     except Exception as e:
         logger.error(f"AI request error: {e}")
@@ -93,8 +183,12 @@ async def run_ai_for_text(chat_id: int, text: str, user_id: Optional[int] = None
     sanitized_sql = val.sanitized_sql
     try:
         logger.info("🚀 CALLING DATABASE WITH SQL QUERY...")
-        rows = await execute_sql(sanitized_sql)
-        logger.info(f"✅ DATABASE RESPONSE: {len(rows) if isinstance(rows, list) else 'unknown'} rows received")
+        rows = await execute_sql(sanitized_sql, max_rows=SQL_INLINE_MAX_ROWS)
+        logger.info(f"✅ DATABASE RESPONSE: {len(rows)} rows received")
+    except QueryCostError as e:
+        res = render_text_info(f"<b>{e.hint}</b>")
+        await _remember(chat_id, text, res.output)
+        return res
     except Exception as e:
         logger.error(f"SQL execution error: {e}")
         res = render_text_info("<b>Пока не могу получить данные из базы.</b>")
@@ -106,8 +200,12 @@ async def run_ai_for_text(chat_id: int, text: str, user_id: Optional[int] = None
         await _remember(chat_id, text, res.output)
         return res
 
+    # Проверенный SQL с данными — следующий такой же по смыслу вопрос обойдётся без LLM
+    if cache_key:
+        await put_cached_sql(cache_key, sanitized_sql)
+
     # 5) Красивый HTML как в n8n (единицы/тысячи/запятые), Excel при больших выборках
-    result = render_rows(rows, text, existing_title=None, sql_query=sanitized_sql)
+    result = _render_db_rows(rows, text, sanitized_sql)
 
     # Мягко показываем предупреждения валидатора (если были) — внизу мелким текстом
     if val.warnings:
@@ -118,6 +216,56 @@ async def run_ai_for_text(chat_id: int, text: str, user_id: Optional[int] = None
     return result
 
 
+async def _stream_completion(
+    request: Dict[str, Any],
+    on_partial: Callable[[str], Awaitable[None]],
+    started: float,
+) -> str:
+    """Ответ модели потоком: поле output по мере генерации отдаётся в on_partial.
+
+    Возвращает полный текст ответа (тот же JSON, что и без потока). Время до первых символов
+    output — то, что видит пользователь, — пишется в статистику как ttft.
+    """
+    parser = JsonFieldStream("output")
+    parts: List[str] = []
+    first_text = True
+    stream = await create_chat_completion(**request, stream=True, stream_options={"include_usage": True})
+    async for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            # Последний кусок потока — без текста, только usage
+            record_prompt_usage(chunk.usage)
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            continue
+        parts.append(delta)
+        if not parser.feed(delta) or not parser.value.strip():
+            continue
+        if first_text:
+            first_text = False
+            record_answer_latency("ttft", (time.perf_counter() - started) * 1000)
+        try:
+            await on_partial(parser.value)
+        except Exception as e:
+            logger.debug(f"Промежуточный ответ не показан: {e}")
+    return "".join(parts)
+
+
+def _render_db_rows(rows: RowSet, text: str, sql: str) -> AgentResult:
+    """HTML по строкам из БД; сверх SQL_INLINE_MAX_ROWS — начало выборки и Excel потоково"""
+    truncated = len(rows) > SQL_INLINE_MAX_ROWS
+    if truncated:
+        rows = rows.head(SQL_INLINE_MAX_ROWS)
+    result = render_rows(rows, text, existing_title=None, sql_query=sql, truncated=truncated)
+    estimate = estimated_rows(sql) if truncated else None
+    if estimate:
+        approx = f"{estimate:,}".replace(",", " ")
+        result.output += (
+            f"\n\n<i>По оценке базы в результате около {approx} строк — "
+            f"чтобы ответ поместился в чат, уточните период или добавьте фильтры.</i>"
+        )
+    return result
+
+
 async def _remember(chat_id: int, user_text: str, assistant_text: str) -> None:
     """Короткий лог общения в память."""
     try:
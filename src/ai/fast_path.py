@@ -0,0 +1,345 @@
+from __future__ import annotations
+import datetime as _dt
+import os
+import re
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from src.services.nlu.parser import RU_MONTHS, parse_intent
+from src.utils.logger import get_logger
+from src.utils.reference_data import extract_entities
+
+logger = get_logger("ai.fast_path")
+
+# Ответы на типовые вопросы по шаблонам SQL без обращения к LLM (AI_FAST_PATH=false — выключить)
+AI_FAST_PATH = os.getenv("AI_FAST_PATH", "true").lower() in ("1", "true", "yes", "on")
+# Вопросы длиннее (в словах) всегда уходят в LLM
+AI_FAST_PATH_MAX_WORDS = int(os.getenv("AI_FAST_PATH_MAX_WORDS", "15"))
+
+# Сколько последних ответов каждого пути держать для перцентилей задержки
+_LATENCY_SAMPLES = 1000
+
+# Метрика -> (выражение, имя колонки, обязательное условие)
+_METRICS: Dict[str, Tuple[str, str, Optional[str]]] = {
+    "revenue": ("SUM(p.revenue)", "revenue", "p.revenue > 0"),
+    "weight_kg": ("SUM(p.weight_kg)", "weight_kg", None),
+    "quantity": ("SUM(p.quantity)", "quantity", None),
+}
+
+# Слова каждой метрики: вопрос сразу про две метрики шаблоны не покрывают
+_METRIC_STEMS: Dict[str, Tuple[str, ...]] = {
+    "revenue": ("выручк", "продаж", "доход", "оборот"),
+    "weight_kg": ("вес", "кг", "тонн"),
+    "quantity": ("шт", "штук", "количеств"),
+}
+
+# Разрез из parse_intent -> (выражение, нужная таблица, имя колонки)
+_DIMENSIONS: Dict[str, Tuple[str, Optional[str], str]] = {
+    "manager": ("p.manager", None, "manager"),
+    "channel": ("p.channel", None, "channel"),
+    "region": ("c.region", "clients", "region"),
+    "client": ("COALESCE(NULLIF(c.public_name, ''), c.client_name)", "clients", "client_name"),
+    "brand": ("pr.brand", "products", "brand"),
+    "product": ("pr.product_name", "products", "product_name"),
+    "category": ("pr.category_1", "products", "category"),
+}
+
+# Сущности из справочников -> (колонки, нужная таблица); значения в справочниках — в нижнем регистре
+_FILTERS: Dict[str, Tuple[Tuple[str, ...], Optional[str]]] = {
+    "managers": (("p.manager",), None),
+    "channels": (("p.channel",), None),
+    "regions": (("c.region",), "clients"),
+    "brands": (("pr.brand",), "products"),
+    "categories": (("pr.category_1", "pr.category_group_1"), "products"),
+}
+
+# Слово -> разрез (и для ключа кэша вопросов): «выручка брендов» без «по» parse_intent не распознаёт,
+# а ответ нужен по брендам
+_DIMENSION_STEMS: Tuple[Tuple[str, str], ...] = (
+    ("менедж", "manager"), ("торгов", "manager"), ("представител", "manager"),
+    ("бренд", "brand"), ("клиент", "client"), ("регион", "region"), ("канал", "channel"),
+    ("товар", "product"), ("продукт", "product"), ("категор", "category"),
+)
+
+# Разрез -> сущности того же справочника в _FILTERS
+_DIMENSION_FILTERS: Dict[str, str] = {
+    "manager": "managers", "brand": "brands", "region": "regions", "channel": "channels", "category": "categories",
+}
+
+_JOINS: Dict[str, str] = {
+    "clients": "JOIN public.clients c ON c.client_code = p.client_code",
+    "products": "JOIN public.products pr ON pr.product_code = p.product_code",
+}
+
+_TRUNC = {"month": "month", "week": "week", "day": "day"}
+
+# Слова, которые шаблоны понимают целиком; всё прочее (топ, сравнение, возвраты, «без», «прошлый»…)
+# означает, что вопрос сложнее шаблона, и он уходит в LLM
+_KNOWN_WORDS = frozenset((
+    "по", "за", "в", "во", "на", "и", "у", "с", "год", "года", "году", "мне", "нам", "пожалуйста",
+    "какая", "какой", "какие", "каков", "какова", "сколько", "была", "был", "были", "было",
+    "всего", "итого", "общая", "общий", "общее", "общую", "сумма", "сумму", "суммарная", "суммарный",
+    "покажи", "показать", "выведи", "дай", "посчитай", "скажи", "нужна", "нужен", "нужно",
+    "кг", "шт", "дням", "дня", "дней", "дни", "день", "май",
+))
+_KNOWN_STEMS = (
+    *(stem for stems in _METRIC_STEMS.values() for stem in stems if len(stem) > 2),
+    "менедж", "торгов", "представител", "бренд", "клиент", "регион", "канал", "товар", "продукт", "категор",
+    "месяц", "недел", "динамик", "тренд", "квартал",
+    *RU_MONTHS,
+)
+
+_WORD_RE = re.compile(r"[a-zа-я0-9]+")
+
+_STATS: Dict[str, Any] = {"questions": 0, "hits": 0, "fallbacks": Counter()}
+_LATENCY: Dict[str, Deque[float]] = {
+    "fast": deque(maxlen=_LATENCY_SAMPLES),
+    "cache": deque(maxlen=_LATENCY_SAMPLES),
+    "llm": deque(maxlen=_LATENCY_SAMPLES),
+    "ttft": deque(maxlen=_LATENCY_SAMPLES),
+}
+
+
+def fast_path_enabled() -> bool:
+    return AI_FAST_PATH
+
+
+def _norm(s: str) -> str:
+    return (s or "").lower().replace("ё", "е")
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _is_known(word: str) -> bool:
+    if word in _KNOWN_WORDS or word.startswith(_KNOWN_STEMS):
+        return True
+    # год (2025) или номер квартала
+    return word.isdigit() and (len(word) == 1 or (len(word) == 4 and word.startswith("20")))
+
+
+def _same_word(word: str, name_word: str) -> bool:
+    """Слово вопроса — форма слова из названия сущности («иванова» ~ «иванов», «молочной» ~ «молочная»)"""
+    if word == name_word:
+        return True
+    common = len(os.path.commonprefix((word, name_word)))
+    return common >= max(4, len(name_word) - 2)
+
+
+def _names_surname(words: List[str], full_name: str) -> bool:
+    """Фамилия менеджера — отдельным словом вопроса, допускаются падежные окончания
+    («иванов», «иванова», «ивановой»); кусок слова или однобуквенный предлог не считается"""
+    surname = full_name.split()[0] if full_name.split() else ""
+    if len(surname) < 3:
+        return False
+    stems = {surname, surname[:-1]} if surname.endswith("а") else {surname}
+    return any(w.startswith(stem) and len(w) - len(stem) <= 2 for w in words for stem in stems)
+
+
+class QuestionWords(NamedTuple):
+    words: List[str]        # все слова вопроса (нижний регистр, ё -> е)
+    metrics: List[str]      # метрики, названные словами, в порядке упоминания
+    dimensions: List[str]   # разрезы, названные словами, без повторов
+    uncovered: List[str]    # слова, которые не объясняют ни словарь шаблонов, ни найденные сущности
+
+
+def _word_metric(word: str) -> Optional[str]:
+    return next((m for m, stems in _METRIC_STEMS.items() if word in stems or any(
+        len(stem) > 2 and word.startswith(stem) for stem in stems)), None)
+
+
+def question_words(text: str, entities: Dict[str, List[str]]) -> QuestionWords:
+    """Разбор слов вопроса словарём шаблонов — общий для быстрого пути и ключа кэша вопросов"""
+    words = _WORD_RE.findall(_norm(text))
+    name_words = [w for names in entities.values() for name in names for w in _WORD_RE.findall(name)]
+    metrics: List[str] = []
+    dimensions: List[str] = []
+    uncovered: List[str] = []
+    for w in words:
+        metric = _word_metric(w)
+        dimension = None if metric else next((d for stem, d in _DIMENSION_STEMS if w.startswith(stem)), None)
+        if metric:
+            metrics.append(metric)
+        elif dimension and dimension not in dimensions:
+            dimensions.append(dimension)
+        if not _is_known(w) and not any(_same_word(w, nw) for nw in name_words):
+            uncovered.append(w)
+    return QuestionWords(words, metrics, dimensions, uncovered)
+
+
+def _question_dimensions(intent: Dict[str, Any], entities: Dict[str, List[str]], qw: QuestionWords) -> List[str]:
+    """Разрезы вопроса: из parse_intent («по брендам») и названные словом без «по» («выручка брендов»).
+    Слово при найденном значении того же справочника — это фильтр («бренда Чабан»), не разрез."""
+    dims = [intent["dimension"]] if intent.get("dimension") else []
+    for dim in qw.dimensions:
+        if dim not in dims and not entities.get(_DIMENSION_FILTERS.get(dim, "")):
+            dims.append(dim)
+    return dims
+
+
+def _rejection(text: str, intent: Dict[str, Any], entities: Dict[str, List[str]]) -> Optional[str]:
+    """Почему вопрос нельзя уверенно закрыть шаблоном (None — можно)"""
+    qw = question_words(text, entities)
+    if len(qw.words) > AI_FAST_PATH_MAX_WORDS:
+        return "too_long"
+    if not intent["period"]["start"] or not intent["period"]["end"]:
+        return "no_period"
+    if not intent.get("metric_explicit"):
+        return "no_metric"
+    if len(set(qw.metrics)) > 1:
+        return "several_metrics"
+    if entities.get("clients") or entities.get("unknown"):
+        return "client"
+    if len(entities.get("managers") or ()) > 1:
+        return "ambiguous_manager"
+    # менеджер из справочника — жёсткий фильтр SQL, поэтому только если фамилия названа в вопросе
+    if any(not _names_surname(qw.words, name) for name in entities.get("managers") or ()):
+        return "manager_not_named"
+    if len(_question_dimensions(intent, entities, qw)) > 1:
+        return "several_dimensions"
+    # одно и то же слово — и бренд, и категория (или канал…): какой фильтр имелся в виду, неясно
+    seen = Counter(name for key in _FILTERS for name in entities.get(key) or ())
+    if any(count > 1 for count in seen.values()):
+        return "ambiguous_entity"
+    if qw.uncovered:
+        return "unknown_words"
+    return None
+
+
+def build_template_sql(intent: Dict[str, Any], entities: Dict[str, List[str]]) -> str:
+    """SQL по шаблону: сумма метрики из profit за период, фильтры по справочникам, разрез и/или динамика.
+
+    В запрос попадают только проверенные значения — даты периода и названия из справочников
+    (никакого текста пользователя); бонусный фильтр и стоимость проверяет execute_sql, как обычно.
+    """
+    metric_sql, metric_col, metric_cond = _METRICS[intent["metric"]]
+    start = _dt.date.fromisoformat(intent["period"]["start"])
+    end = _dt.date.fromisoformat(intent["period"]["end"])
+
+    tables: List[str] = []
+    select: List[str] = []
+    group: List[str] = []
+    where = [f"p.profit_date >= DATE '{start.isoformat()}'", f"p.profit_date < DATE '{end.isoformat()}'"]
+    if metric_cond:
+        where.append(metric_cond)
+
+    dimension = _DIMENSIONS.get(intent.get("dimension") or "")
+    if dimension:
+        expr, table, col = dimension
+        if table:
+            tables.append(table)
+        select.append(f"{expr} AS {col}")
+        group.append(expr)
+
+    trunc = _TRUNC.get(intent.get("time_granularity") or "")
+    if trunc:
+        bucket = f"date_trunc('{trunc}', p.profit_date)"
+        if dimension:
+            # второй текстовый столбец: форматтер группирует строки по первому
+            fmt = "YYYY-MM" if trunc == "month" else "YYYY-MM-DD"
+            select.append(f"to_char({bucket}, '{fmt}') AS period")
+        else:
+            select.append(f"{bucket}::date AS {'month_start' if trunc == 'month' else 'date'}")
+        group.append(bucket)
+
+    for key, (columns, table) in _FILTERS.items():
+        values = entities.get(key) or []
+        if not values:
+            continue
+        if table and table not in tables:
+            tables.append(table)
+        in_list = ", ".join(_literal(v) for v in values)
+        conds = [f"replace(lower({col}), 'ё', 'е') IN ({in_list})" for col in columns]
+        where.append(conds[0] if len(conds) == 1 else "(" + " OR ".join(conds) + ")")
+
+    select.append(f"{metric_sql} AS {metric_col}")
+    lines = [f"SELECT {', '.join(select)}", "FROM public.profit p"]
+    lines += [_JOINS[t] for t in ("clients", "products") if t in tables]
+    lines.append("WHERE " + "\n  AND ".join(where))
+    if group:
+        lines.append("GROUP BY " + ", ".join(str(i + 1) for i in range(len(group))))
+        if trunc:
+            lines.append("ORDER BY " + ", ".join(str(i + 1) for i in range(len(group))))
+        else:
+            lines.append(f"ORDER BY {metric_col} DESC")
+    return "\n".join(lines)
+
+
+async def analyze_question(
+    text: str, current_date: Optional[_dt.date] = None,
+) -> Optional[Tuple[Dict[str, Any], Dict[str, List[str]]]]:
+    """(intent, сущности) вопроса для быстрого ответа и кэша SQL; None — разобрать не удалось"""
+    try:
+        intent = parse_intent(text, current_date or _dt.date.today())
+        return intent, await extract_entities(text)
+    except Exception as e:
+        logger.warning(f"⚠️ Разбор вопроса без LLM не удался: {e}")
+        return None
+
+
+def fast_path_sql(
+    text: str, analyzed: Optional[Tuple[Dict[str, Any], Dict[str, List[str]]]],
+) -> Optional[str]:
+    """SQL по шаблону, если вопрос уверенно разобран без LLM; иначе None"""
+    if not fast_path_enabled():
+        return None
+    _STATS["questions"] += 1
+    if analyzed is None:
+        _STATS["fallbacks"]["error"] += 1
+        return None
+    intent, entities = analyzed
+    reason = _rejection(text, intent, entities)
+    if reason is not None:
+        _STATS["fallbacks"][reason] += 1
+        return None
+    dims = _question_dimensions(intent, entities, question_words(text, entities))
+    if dims and not intent.get("dimension"):
+        intent = {**intent, "dimension": dims[0]}
+    logger.info(f"⚡ Быстрый ответ без LLM: {intent['metric']}, разрез {intent['dimension']}, "
+                f"период {intent['period']['start']}…{intent['period']['end']}")
+    return build_template_sql(intent, entities)
+
+
+def record_fast_path_result(ok: bool, reason: Optional[str] = None) -> None:
+    """Итог выполнения шаблонного SQL: ok=False — ответ всё-таки пошёл через LLM (reason: empty/sql_error)"""
+    if ok:
+        _STATS["hits"] += 1
+    else:
+        _STATS["fallbacks"][reason or "sql_error"] += 1
+
+
+def record_answer_latency(path: str, duration_ms: float) -> None:
+    """Полное время ответа: path — fast (по шаблону), cache (SQL из кэша вопросов) или llm;
+    ttft — время до первого текста ответа LLM, показанного потоком"""
+    _LATENCY[path].append(duration_ms)
+
+
+def _latency_summary(samples: Deque[float]) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0, "avg_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0}
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+
+    return {"count": len(ordered), "avg_ms": sum(ordered) / len(ordered), "p50_ms": rank(0.50), "p95_ms": rank(0.95)}
+
+
+def get_fast_path_stats() -> Dict[str, Any]:
+    fast = _latency_summary(_LATENCY["fast"])
+    cache = _latency_summary(_LATENCY["cache"])
+    llm = _latency_summary(_LATENCY["llm"])
+    questions = _STATS["questions"]
+    return {
+        "enabled": fast_path_enabled(),
+        "questions": questions,
+        "hits": _STATS["hits"],
+        "coverage": _STATS["hits"] / questions if questions else 0.0,
+        "fallbacks": dict(_STATS["fallbacks"].most_common()),
+        "fast": fast,
+        "cache": cache,
+        "llm": llm,
+        "ttft": _latency_summary(_LATENCY["ttft"]),
+        "speedup_p50": llm["p50_ms"] / fast["p50_ms"] if fast["p50_ms"] and llm["p50_ms"] else None,
+    }
@@ -0,0 +1,420 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+import zlib
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from src.db.pool import close_pool, fetch_all
+from src.utils.logger import get_logger
+
+from .openai_client import create_embeddings
+
+logger = get_logger("ai.few_shot")
+
+# Похожие проверенные пары «вопрос → SQL» из agent_logs/agent_log_sql — примерами в промпт
+AI_FEW_SHOT = os.getenv("AI_FEW_SHOT", "false").lower() in ("1", "true", "yes", "on")
+AI_FEW_SHOT_K = int(os.getenv("AI_FEW_SHOT_K", "3"))
+# Косинусная близость, ниже которой пример не показываем
+AI_FEW_SHOT_MIN_SCORE = float(os.getenv("AI_FEW_SHOT_MIN_SCORE", "0.45"))
+# local — детерминированные эмбеддинги по n-граммам без сети, openai — модель AI_FEW_SHOT_EMBEDDING_MODEL
+AI_FEW_SHOT_EMBEDDER = os.getenv("AI_FEW_SHOT_EMBEDDER", "local").lower()
+AI_FEW_SHOT_EMBEDDING_MODEL = os.getenv("AI_FEW_SHOT_EMBEDDING_MODEL", "text-embedding-3-small")
+AI_FEW_SHOT_REFRESH_INTERVAL = float(os.getenv("AI_FEW_SHOT_REFRESH_INTERVAL", "60"))
+AI_FEW_SHOT_MAX_EXAMPLES = int(os.getenv("AI_FEW_SHOT_MAX_EXAMPLES", "20000"))
+# Файл индекса (.npz): собирается заранее (python -m src.ai.few_shot --out …) и дописывается ботом
+AI_FEW_SHOT_INDEX_PATH = os.getenv("AI_FEW_SHOT_INDEX_PATH", "")
+AI_FEW_SHOT_MAX_SQL_CHARS = int(os.getenv("AI_FEW_SHOT_MAX_SQL_CHARS", "2000"))
+
+_BATCH = 500
+_SAMPLES = 1000
+_WORD_RE = re.compile(r"[a-zа-я0-9]+")
+
+# Новые пары по возрастанию log_id; ответы, отправленные на обучение, не берём.
+# Несколько экземпляров бота могут дописать меньший log_id позже — такой пример пропустится.
+_NEW_EXAMPLES_SQL = """
+    SELECT s.log_id, l.user_request AS question, s.sql_query
+    FROM public.agent_log_sql s
+    JOIN public.agent_logs l ON l.id = s.log_id
+    WHERE s.log_id > $1
+      AND l.user_request IS NOT NULL AND l.user_request <> ''
+      AND NOT EXISTS (SELECT 1 FROM public.training_clicks t WHERE t.log_id = s.log_id)
+    ORDER BY s.log_id
+    LIMIT $2
+"""
+_NEW_CLICKS_SQL = "SELECT id, log_id FROM public.training_clicks WHERE id > $1 ORDER BY id LIMIT $2"
+_LAST_CLICK_SQL = "SELECT COALESCE(MAX(id), 0) AS id FROM public.training_clicks"
+# С какого log_id начинать пустой индекс, чтобы взять только AI_FEW_SHOT_MAX_EXAMPLES последних
+_START_LOG_SQL = "SELECT log_id FROM public.agent_log_sql ORDER BY log_id DESC OFFSET $1 LIMIT 1"
+
+
+def _norm(s: str) -> str:
+    return (s or "").lower().replace("ё", "е")
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """Локальная замена модели эмбеддингов: слова (основа — первые 6 букв) и символьные триграммы,
+    разложенные хэшем crc32 по dim координатам со знаком. Без сети и случайности — один и тот же
+    текст всегда даёт один и тот же вектор, поэтому годится для проверок и сборки индекса офлайн;
+    опечатки и падежи сглаживаются триграммами."""
+
+    def __init__(self, dim: int = 1024) -> None:
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        features: List[str] = []
+        for word in _WORD_RE.findall(_norm(text)):
+            features.append("w:" + word[:6])
+            padded = f" {word} "
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return _normalize_rows(out)
+
+    async def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        return self.embed(texts)
+
+
+class OpenAIEmbedder:
+    """Эмбеддинги модели OpenAI через общий клиент"""
+
+    def __init__(self, model: str = AI_FEW_SHOT_EMBEDDING_MODEL) -> None:
+        self.model = model
+        self.name = f"openai-{model}"
+
+    async def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        r = await create_embeddings(model=self.model, input=list(texts))
+        return _normalize_rows(np.array([d.embedding for d in r.data], dtype=np.float32))
+
+
+class Example(NamedTuple):
+    log_id: int
+    question: str
+    sql: str
+    score: float
+
+
+class FewShotIndex:
+    """Векторы вопросов в одной матрице NumPy (строки нормированы, близость — скалярное произведение).
+
+    add() дописывает примеры с запасом ёмкости (без копирования всей матрицы на каждый пример);
+    тот же вопрос (без учёта регистра) заменяет прежний — остаётся самый свежий SQL.
+    dim=0 — размерность берётся по первым добавленным векторам.
+    """
+
+    def __init__(self, dim: int, max_examples: int = AI_FEW_SHOT_MAX_EXAMPLES) -> None:
+        self.dim = dim
+        self.max_examples = max_examples
+        self.last_log_id = 0
+        self.last_click_id = 0
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._log_ids: List[int] = []
+        self._questions: List[str] = []
+        self._sqls: List[str] = []
+        self._by_question: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _append(self, vector: np.ndarray) -> None:
+        if self._size == len(self._vectors):
+            grown = np.zeros((max(64, 2 * len(self._vectors)), self.dim), dtype=np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._vectors[self._size] = vector
+        self._size += 1
+
+    def add(self, log_ids: Sequence[int], questions: Sequence[str], sqls: Sequence[str], vectors: np.ndarray) -> int:
+        if self.dim == 0 and len(vectors):
+            self.dim = vectors.shape[1]
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        for log_id, question, sql, vector in zip(log_ids, questions, sqls, vectors):
+            key = _norm(question).strip()
+            idx = self._by_question.get(key)
+            if idx is None:
+                self._by_question[key] = self._size
+                self._log_ids.append(log_id)
+                self._questions.append(question)
+                self._sqls.append(sql)
+                self._append(vector)
+            else:
+                self._log_ids[idx], self._sqls[idx] = log_id, sql
+                self._vectors[idx] = vector
+            self.last_log_id = max(self.last_log_id, log_id)
+        if self._size > self.max_examples:
+            # Вытесняем самые старые по log_id
+            order = np.argsort(np.array(self._log_ids, dtype=np.int64))
+            keep = np.zeros(self._size, dtype=bool)
+            keep[order[-self.max_examples:]] = True
+            self._compact(keep)
+        return len(log_ids)
+
+    def remove(self, log_ids: Set[int]) -> int:
+        keep = np.array([log_id not in log_ids for log_id in self._log_ids], dtype=bool)
+        removed = int(self._size - keep.sum())
+        if removed:
+            self._compact(keep)
+        return removed
+
+    def _compact(self, keep: np.ndarray) -> None:
+        idx = np.flatnonzero(keep)
+        self._vectors = self._vectors[idx].copy()
+        self._log_ids = [self._log_ids[i] for i in idx]
+        self._questions = [self._questions[i] for i in idx]
+        self._sqls = [self._sqls[i] for i in idx]
+        self._size = len(idx)
+        self._by_question = {_norm(q).strip(): i for i, q in enumerate(self._questions)}
+
+    def search(self, vector: np.ndarray, k: int = AI_FEW_SHOT_K, min_score: float = AI_FEW_SHOT_MIN_SCORE) -> List[Example]:
+        if self._size == 0 or k <= 0:
+            return []
+        scores = self._vectors[:self._size] @ vector
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            Example(self._log_ids[i], self._questions[i], self._sqls[i], float(scores[i]))
+            for i in top if scores[i] >= min_score
+        ]
+
+    def save(self, path: str, embedder_name: str) -> None:
+        meta = {
+            "embedder": embedder_name, "last_log_id": self.last_log_id, "last_click_id": self.last_click_id,
+            "questions": self._questions, "sqls": self._sqls,
+        }
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            vectors=self._vectors[:self._size],
+            log_ids=np.array(self._log_ids, dtype=np.int64),
+            meta=np.array(json.dumps(meta, ensure_ascii=False)),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, max_examples: int = AI_FEW_SHOT_MAX_EXAMPLES) -> Tuple["FewShotIndex", str]:
+        """(индекс, имя эмбеддера, которым он собран)"""
+        with np.load(path) as data:
+            vectors = data["vectors"].astype(np.float32)
+            log_ids = data["log_ids"].tolist()
+            meta = json.loads(str(data["meta"]))
+        index = cls(vectors.shape[1], max_examples)
+        index.add(log_ids, meta["questions"], meta["sqls"], vectors)
+        index.last_log_id = meta["last_log_id"]
+        index.last_click_id = meta["last_click_id"]
+        return index, meta["embedder"]
+
+
+_embedder: Optional[Any] = None
+_index: Optional[FewShotIndex] = None
+_lock: Optional[asyncio.Lock] = None
+_task: Optional[asyncio.Task] = None
+
+_SEARCH_MS: Deque[float] = deque(maxlen=_SAMPLES)
+_STATS: Dict[str, Any] = {
+    "added": 0, "removed": 0, "syncs": 0, "sync_errors": 0, "last_sync_ms": None,
+    "searches": 0, "with_examples": 0, "shown": 0, "errors": 0,
+}
+
+
+def few_shot_enabled() -> bool:
+    return AI_FEW_SHOT
+
+
+def get_embedder() -> Any:
+    global _embedder
+    if _embedder is None:
+        _embedder = OpenAIEmbedder() if AI_FEW_SHOT_EMBEDDER == "openai" else HashingEmbedder()
+    return _embedder
+
+
+def set_embedder(embedder: Any) -> None:
+    """Подменить функцию эмбеддингов: любой объект с name и async __call__(texts) -> np.ndarray
+    (строки — нормированные векторы). До start_few_shot: векторы разных эмбеддеров несравнимы."""
+    global _embedder, _index
+    _embedder = embedder
+    _index = None
+
+
+async def sync_index(index: FewShotIndex, embedder: Any) -> Tuple[int, int]:
+    """Дочитать в индекс новые пары из БД и убрать отправленные на обучение; (добавлено, убрано)"""
+    removed = 0
+    if index.last_click_id == 0:
+        rows = await fetch_all(_LAST_CLICK_SQL)
+        index.last_click_id = int(rows[0]["id"]) if rows else 0
+    else:
+        while True:
+            rows = await fetch_all(_NEW_CLICKS_SQL, (index.last_click_id, _BATCH))
+            if rows:
+                index.last_click_id = int(rows[-1]["id"])
+                removed += index.remove({int(r["log_id"]) for r in rows if r["log_id"] is not None})
+            if len(rows) < _BATCH:
+                break
+    if index.last_log_id == 0:
+        rows = await fetch_all(_START_LOG_SQL, (index.max_examples,))
+        index.last_log_id = int(rows[0]["log_id"]) if rows else 0
+
+    added = 0
+    while True:
+        rows = await fetch_all(_NEW_EXAMPLES_SQL, (index.last_log_id, _BATCH))
+        rows_ok = [r for r in rows if len(r["sql_query"] or "") <= AI_FEW_SHOT_MAX_SQL_CHARS]
+        if rows_ok:
+            vectors = await embedder([r["question"] for r in rows_ok])
+            added += index.add(
+                [int(r["log_id"]) for r in rows_ok], [r["question"] for r in rows_ok],
+                [r["sql_query"] for r in rows_ok], vectors,
+            )
+        if rows:
+            index.last_log_id = max(index.last_log_id, int(rows[-1]["log_id"]))
+        if len(rows) < _BATCH:
+            break
+    return added, removed
+
+
+async def _sync_once() -> None:
+    global _lock
+    if _index is None:
+        return
+    if _lock is None:
+        _lock = asyncio.Lock()
+    async with _lock:
+        start = time.perf_counter()
+        try:
+            added, removed = await sync_index(_index, get_embedder())
+        except Exception as e:
+            _STATS["sync_errors"] += 1
+            logger.warning(f"⚠️ Индекс примеров SQL не обновлён: {e}")
+            return
+        _STATS["syncs"] += 1
+        _STATS["added"] += added
+        _STATS["removed"] += removed
+        _STATS["last_sync_ms"] = int((time.perf_counter() - start) * 1000)
+        if added or removed:
+            logger.info(f"📚 Примеры SQL: +{added}, −{removed}, всего {len(_index)} ({_STATS['last_sync_ms']} мс)")
+
+
+async def _refresh_loop() -> None:
+    while True:
+        await _sync_once()
+        await asyncio.sleep(AI_FEW_SHOT_REFRESH_INTERVAL)
+
+
+def _load_or_create(embedder: Any, path: str = AI_FEW_SHOT_INDEX_PATH) -> FewShotIndex:
+    if path and os.path.exists(path):
+        try:
+            index, name = FewShotIndex.load(path)
+            if name == embedder.name:
+                logger.info(f"📚 Индекс примеров SQL загружен: {len(index)} из {path}")
+                return index
+            logger.warning(f"⚠️ Индекс {path} собран эмбеддером {name}, нужен {embedder.name} — собираем заново")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось загрузить индекс примеров SQL: {e}")
+    return FewShotIndex(getattr(embedder, "dim", 0))
+
+
+async def start_few_shot() -> None:
+    """Загрузить или собрать индекс и дочитывать новые логи раз в AI_FEW_SHOT_REFRESH_INTERVAL"""
+    global _index, _task
+    if not AI_FEW_SHOT or _task is not None:
+        return
+    _index = _load_or_create(get_embedder())
+    _task = asyncio.get_running_loop().create_task(_refresh_loop())
+
+
+async def stop_few_shot() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _task = None
+    if _index is not None and AI_FEW_SHOT_INDEX_PATH and len(_index):
+        try:
+            _index.save(AI_FEW_SHOT_INDEX_PATH, get_embedder().name)
+        except Exception as e:
+            logger.warning(f"⚠️ Индекс примеров SQL не сохранён: {e}")
+
+
+async def few_shot_message(text: str) -> Tuple[Optional[str], int]:
+    """Системное сообщение с top-k похожими проверенными примерами «вопрос → SQL»; (None, 0) — нечего показать"""
+    if not AI_FEW_SHOT or _index is None or not len(_index):
+        return None, 0
+    _STATS["searches"] += 1
+    start = time.perf_counter()
+    try:
+        vector = (await get_embedder()([text]))[0]
+        examples = _index.search(vector)
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Поиск примеров SQL не удался: {e}")
+        return None, 0
+    _SEARCH_MS.append((time.perf_counter() - start) * 1000)
+    if not examples:
+        return None, 0
+    _STATS["with_examples"] += 1
+    _STATS["shown"] += len(examples)
+    lines = [
+        "Проверенные SQL для похожих вопросов (образец структуры запроса; период, фильтры и названия "
+        "бери из текущего вопроса):"
+    ]
+    for ex in examples:
+        lines.append(f"Вопрос: {ex.question}\nSQL: {ex.sql}")
+    return "\n\n".join(lines), len(examples)
+
+
+def get_few_shot_stats() -> Dict[str, Any]:
+    ordered = sorted(_SEARCH_MS)
+    searches = _STATS["searches"]
+    return {
+        "enabled": AI_FEW_SHOT,
+        "embedder": get_embedder().name if AI_FEW_SHOT else None,
+        "examples": len(_index) if _index is not None else 0,
+        **_STATS,
+        "hit_ratio": _STATS["with_examples"] / searches if searches else 0.0,
+        "search_p50_ms": ordered[len(ordered) // 2] if ordered else 0.0,
+        "search_p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0,
+    }
+
+
+async def _build(path: str, max_examples: int) -> None:
+    embedder = get_embedder()
+    index = _load_or_create(embedder, path)
+    index.max_examples = max_examples
+    start = time.perf_counter()
+    try:
+        added, removed = await sync_index(index, embedder)
+    finally:
+        await close_pool()
+    index.save(path, embedder.name)
+    print(f"Индекс {path}: {len(index)} примеров (+{added}, −{removed}), эмбеддер {embedder.name}, "
+          f"{time.perf_counter() - start:.1f} с")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Собрать или дополнить индекс примеров «вопрос → SQL» (AI_FEW_SHOT)")
+    parser.add_argument("--out", default=AI_FEW_SHOT_INDEX_PATH or "few_shot_index.npz")
+    parser.add_argument("--max-examples", type=int, default=AI_FEW_SHOT_MAX_EXAMPLES)
+    args = parser.parse_args()
+    asyncio.run(_build(args.out, args.max_examples))
@@ -0,0 +1,221 @@
+from __future__ import annotations
+import datetime as _dt
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.db.pool import sql_fingerprint
+from src.services.nlu.parser import RU_MONTHS
+from src.utils.logger import get_logger
+from src.utils.memory import get_redis
+
+from .fast_path import question_words
+
+logger = get_logger("ai.intent_cache")
+
+# Кэш «смысл вопроса -> проверенный SQL»: повторный вопрос другими словами не идёт в LLM
+AI_SQL_CACHE = os.getenv("AI_SQL_CACHE", "true").lower() in ("1", "true", "yes", "on")
+# Сколько хранить SQL в Redis (сек); сбрасывается раньше, если ответ отправили на обучение
+AI_SQL_CACHE_TTL = int(os.getenv("AI_SQL_CACHE_TTL", str(7 * 24 * 3600)))
+
+_PREFIX = "intent_sql"
+
+# Порядок разрезов в вопросе (_DIMENSION_STEMS) входит в ключ: «менеджеры по брендам» ≠ «бренды по менеджерам»
+_GRANULARITY_STEMS: Tuple[Tuple[str, str], ...] = (
+    ("месяц", "month"), ("динамик", "month"), ("тренд", "month"), ("недел", "week"),
+    ("дн", "day"), ("день", "day"), ("квартал", "quarter"),
+)
+
+# Какой SQL последним ответил на какой ключ — чтобы по log_id ответа найти запись кэша
+_MAX_TRACKED_ANSWERS = 1000
+_KEY_BY_SQL: "OrderedDict[str, str]" = OrderedDict()
+
+_STATS: Dict[str, Any] = {
+    "lookups": 0, "hits": 0, "misses": 0, "uncacheable": 0, "stores": 0, "skipped_bad": 0,
+    "failed_hits": 0, "invalidations": 0, "errors": 0,
+}
+
+
+def intent_cache_enabled() -> bool:
+    return AI_SQL_CACHE and AI_SQL_CACHE_TTL > 0
+
+
+def _stem(word: str) -> str:
+    return word[:6]
+
+
+def intent_key(
+    text: str, intent: Dict[str, Any], entities: Dict[str, List[str]], today: Optional[_dt.date] = None,
+) -> Optional[str]:
+    """Канонический ключ вопроса: метрики, разрезы, детализация, период, сущности и остальные слова.
+
+    Слова-связки и формы слов не различаются («продажи по брендам за март» = «выручка брендов
+    в марте»), а всё, что разбор не понял, входит в ключ основой слова — поэтому «топ-10 клиентов»
+    и «клиенты без возвратов» не совпадут с «клиентами». None — вопрос без метрики не кэшируем.
+    """
+    if not intent.get("metric_explicit"):
+        return None
+    qw = question_words(text, entities)
+    period = intent["period"]
+
+    granularity = set()
+    months = set()
+    numbers: List[str] = []
+    # Слова периода с предыдущим словом: «за неделю» ≠ «по неделям», «с марта» ≠ «на март»
+    period_words: List[str] = []
+    time_words = set()
+    for i, w in enumerate(qw.words):
+        gran = next((g for stem, g in _GRANULARITY_STEMS if w.startswith(stem)), None)
+        month = next((mm for stem, mm in RU_MONTHS.items() if w.startswith(stem)), None)
+        if month or w == "май":
+            months.add(month or 5)
+        elif gran:
+            granularity.add(gran)
+        elif w.isdigit():
+            numbers.append(w)
+        elif not w.startswith("год"):
+            continue
+        time_words.add(w)
+        period_words.append(f"{qw.words[i - 1] if i else ''} {month or gran or w[:3]}")
+
+    canonical = {
+        "metrics": sorted(set(qw.metrics)),
+        "dimensions": qw.dimensions,
+        "granularity": sorted(granularity),
+        "months": sorted(months),
+        "numbers": numbers,
+        "period": [period["start"], period["end"]],
+        "entities": {k: sorted(v) for k, v in sorted(entities.items()) if v},
+        "rest": sorted(_stem(w) for w in qw.uncovered if w not in time_words),
+    }
+    if not period["start"]:
+        # Период parse_intent не понял: его слова входят в ключ вместе с предлогом, а «вчера»,
+        # «этот месяц» — SQL мог вписать даты, поэтому такой ключ действует один день
+        canonical["period_words"] = period_words
+        canonical["today"] = (today or _dt.date.today()).isoformat()
+    raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def _sql_key(key: str) -> str:
+    return f"{_PREFIX}:{key}"
+
+
+def _bad_key(key: str) -> str:
+    return f"{_PREFIX}:bad:{key}"
+
+
+def _log_key(log_id: int) -> str:
+    return f"{_PREFIX}:log:{log_id}"
+
+
+def _track_answer(sql: str, key: str) -> None:
+    fingerprint = sql_fingerprint(sql)
+    _KEY_BY_SQL[fingerprint] = key
+    _KEY_BY_SQL.move_to_end(fingerprint)
+    while len(_KEY_BY_SQL) > _MAX_TRACKED_ANSWERS:
+        _KEY_BY_SQL.popitem(last=False)
+
+
+async def get_cached_sql(key: str) -> Optional[str]:
+    """Проверенный SQL для ключа вопроса или None"""
+    if not intent_cache_enabled():
+        return None
+    _STATS["lookups"] += 1
+    try:
+        sql = await get_redis().get(_sql_key(key))
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Кэш вопросов недоступен: {e}")
+        return None
+    if sql is None:
+        _STATS["misses"] += 1
+        return None
+    _STATS["hits"] += 1
+    _track_answer(sql, key)
+    return sql
+
+
+async def put_cached_sql(key: str, sql: str) -> None:
+    """Запомнить SQL, который успешно ответил на вопрос (после валидации и с данными)"""
+    if not intent_cache_enabled():
+        return
+    _track_answer(sql, key)
+    try:
+        r = get_redis()
+        # Этот же SQL уже отправляли на обучение — не возвращаем его в кэш
+        if await r.get(_bad_key(key)) == sql_fingerprint(sql):
+            _STATS["skipped_bad"] += 1
+            return
+        await r.set(_sql_key(key), sql, ex=AI_SQL_CACHE_TTL)
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Не удалось сохранить SQL в кэш вопросов: {e}")
+        return
+    _STATS["stores"] += 1
+
+
+async def drop_cached_sql(key: str) -> None:
+    """SQL из кэша не сработал (ошибка или пустой результат) — забываем его, ответ идёт через LLM"""
+    _STATS["failed_hits"] += 1
+    try:
+        await get_redis().delete(_sql_key(key))
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Не удалось удалить SQL из кэша вопросов: {e}")
+
+
+async def link_answer(log_id: Optional[int], sql: Optional[str]) -> None:
+    """Связать log_id отправленного ответа с ключом кэша, чтобы обратная связь могла его сбросить"""
+    if not intent_cache_enabled() or log_id is None or not sql:
+        return
+    key = _KEY_BY_SQL.get(sql_fingerprint(sql))
+    if key is None:
+        return
+    try:
+        await get_redis().set(_log_key(log_id), json.dumps([key, sql_fingerprint(sql)]), ex=AI_SQL_CACHE_TTL)
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Не удалось связать ответ {log_id} с кэшем вопросов: {e}")
+
+
+async def invalidate_answer(log_id: int) -> bool:
+    """Ответ отправлен на обучение: убрать его SQL из кэша и не класть этот SQL обратно"""
+    if not intent_cache_enabled():
+        return False
+    try:
+        r = get_redis()
+        linked = await r.get(_log_key(log_id))
+        if not linked:
+            return False
+        key, fingerprint = json.loads(linked)
+        cached = await r.get(_sql_key(key))
+        pipe = r.pipeline(transaction=False)
+        if cached is not None and sql_fingerprint(cached) == fingerprint:
+            pipe.delete(_sql_key(key))
+        pipe.set(_bad_key(key), fingerprint, ex=AI_SQL_CACHE_TTL)
+        pipe.delete(_log_key(log_id))
+        await pipe.execute()
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Не удалось сбросить кэш вопросов для ответа {log_id}: {e}")
+        return False
+    _STATS["invalidations"] += 1
+    logger.info(f"🧹 SQL ответа {log_id} убран из кэша вопросов")
+    return True
+
+
+def record_uncacheable() -> None:
+    _STATS["uncacheable"] += 1
+
+
+def get_intent_cache_stats() -> Dict[str, Any]:
+    lookups = _STATS["lookups"]
+    return {
+        "enabled": intent_cache_enabled(),
+        "ttl": AI_SQL_CACHE_TTL,
+        **_STATS,
+        "hit_ratio": _STATS["hits"] / lookups if lookups else 0.0,
+    }
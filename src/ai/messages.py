@@ -0,0 +1,292 @@
+from __future__ import annotations
+import datetime as _dt
+import hashlib
+import json
+import math
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from src.db.pool import fetch_all
+from src.utils.logger import get_logger
+from src.utils.memory import get_history
+
+from .fast_path import analyze_question
+from .few_shot import few_shot_message
+from .schema_catalog import AI_SCHEMA_PRUNING, CATALOG, render_schema, select_tables, strip_schema_sections
+
+logger = get_logger("ai.messages")
+
+# Системный промпт: экспорт n8n (берётся systemMessage узла AI Agent) или обычный текстовый файл
+AI_SYSTEM_PROMPT_FILE = os.getenv("AI_SYSTEM_PROMPT_FILE") or str(Path(__file__).resolve().parents[2] / "workflow")
+# Сколько последних сообщений чата читать из Redis и сколько токенов они могут занять в промпте
+AI_HISTORY_MESSAGES = int(os.getenv("AI_HISTORY_MESSAGES", "20"))
+AI_HISTORY_TOKEN_BUDGET = int(os.getenv("AI_HISTORY_TOKEN_BUDGET", "3000"))
+# Строк таблицы в последнем ответе бота; от более старых ответов остаётся только заголовок
+AI_HISTORY_TABLE_LINES = int(os.getenv("AI_HISTORY_TABLE_LINES", "10"))
+
+_OLD_ANSWER_LINES = 2       # заголовок и строка «Период: …»
+_MESSAGE_OVERHEAD = 4       # служебные токены роли и разделителей на сообщение
+_DATE_TTL = 60.0
+_SAMPLES = 1000
+
+_FALLBACK_PROMPT = (
+    "Ты — аналитик, встроенный в Telegram-бота. Работаешь с PostgreSQL-базой milk, схема public. "
+    "Не выдумывай данные: если нужен ответ из базы, верни sql_query. "
+    "Отвечай JSON-объектом с полями output, send_excel, table_data, sql_query."
+)
+
+_static_prompt: Optional[str] = None
+_static_hash: Optional[str] = None
+_schema_pruned = False       # разделы со схемой вынесены из промпта в каталог
+_encoder: Any = None
+_encoder_loaded = False
+_date_note: Tuple[float, str] = (0.0, "")
+
+_PROMPT_TOKENS: Deque[int] = deque(maxlen=_SAMPLES)
+_HISTORY_TOKENS: Deque[int] = deque(maxlen=_SAMPLES)
+_SCHEMA_TOKENS: Deque[int] = deque(maxlen=_SAMPLES)
+_STATS: Dict[str, Any] = {
+    "built": 0, "compacted": 0, "dropped": 0, "history_errors": 0, "schema_full": 0,
+    "usage_reports": 0, "prompt_tokens": 0, "cached_tokens": 0,
+}
+
+
+def _normalize(text: str) -> str:
+    """Один и тот же текст — одни и те же байты: переводы строк и хвостовые пробелы"""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def _read_prompt_file(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        raw = f.read()
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return raw
+    for node in data.get("nodes", []) if isinstance(data, dict) else []:
+        message = ((node.get("parameters") or {}).get("options") or {}).get("systemMessage")
+        if node.get("type", "").endswith(".agent") and message:
+            # В n8n текст-выражение начинается с «=»
+            return message[1:] if message.startswith("=") else message
+    return ""
+
+
+def get_static_prompt() -> str:
+    """Неизменная часть промпта (схема и правила): читается один раз и дальше не меняется ни на байт,
+    чтобы кэш промптов на стороне провайдера совпадал по префиксу между запросами."""
+    global _static_prompt, _static_hash, _schema_pruned
+    if _static_prompt is None:
+        try:
+            text = _normalize(_read_prompt_file(AI_SYSTEM_PROMPT_FILE))
+        except Exception as e:
+            logger.error(f"❌ Не удалось прочитать системный промпт {AI_SYSTEM_PROMPT_FILE}: {e}")
+            text = ""
+        if not text:
+            logger.warning("⚠️ Системный промпт не найден, используется краткий встроенный")
+            text = _FALLBACK_PROMPT
+        elif AI_SCHEMA_PRUNING:
+            text, _schema_pruned = strip_schema_sections(text)
+        _static_prompt = text
+        _static_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        logger.info(f"📜 Системный промпт: {len(text)} символов, ~{count_tokens(text)} токенов, {_static_hash}")
+    return _static_prompt
+
+
+def _get_encoder() -> Any:
+    """Токенизатор tiktoken, если пакет установлен и словарь доступен; иначе None (оценка по длине)"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken
+            model = os.getenv("OPENAI_MODEL_CHAT", "gpt-4.1")
+            try:
+                _encoder = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.info(f"ℹ️ tiktoken недоступен ({e}), токены считаются приблизительно")
+            _encoder = None
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    # Русский текст — в среднем около трёх символов на токен; оценка с запасом
+    return math.ceil(len(text) / 3)
+
+
+def _message_tokens(content: str) -> int:
+    return count_tokens(content) + _MESSAGE_OVERHEAD
+
+
+def _compact_answer(content: str, keep_lines: int) -> str:
+    """Ответ бота с длинным списком/таблицей: первые keep_lines строк и сколько строк опущено"""
+    lines = content.split("\n")
+    if len(lines) <= keep_lines + 1:
+        return content
+    return "\n".join(lines[:keep_lines] + [f"… (опущено строк ответа: {len(lines) - keep_lines})"])
+
+
+def fit_history(
+    history: List[Dict[str, str]],
+    budget: int = AI_HISTORY_TOKEN_BUDGET,
+    table_lines: int = AI_HISTORY_TABLE_LINES,
+) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+    """История чата в бюджете токенов: от новых сообщений к старым.
+
+    Последний ответ бота обрезается до table_lines строк, более старые — до заголовка;
+    всё, что не помещается в budget, отбрасывается целиком (вместе с более старыми).
+    История не начинается с ответа бота без вопроса.
+    """
+    items = [h for h in history if h.get("role") in ("user", "assistant") and h.get("content")]
+    kept: List[Tuple[Dict[str, str], int]] = []
+    used = 0
+    compacted = 0
+    answers = 0
+    for item in reversed(items):
+        content = item["content"]
+        if item["role"] == "assistant":
+            short = _compact_answer(content, table_lines if answers == 0 else _OLD_ANSWER_LINES)
+            answers += 1
+            if short != content:
+                compacted += 1
+                content = short
+        tokens = _message_tokens(content)
+        if used + tokens > budget:
+            break
+        kept.append(({"role": item["role"], "content": content}, tokens))
+        used += tokens
+    kept.reverse()
+    while kept and kept[0][0]["role"] == "assistant":
+        used -= kept.pop(0)[1]
+    info = {"tokens": used, "kept": len(kept), "compacted": compacted, "dropped": len(items) - len(kept)}
+    return [message for message, _ in kept], info
+
+
+async def _current_date_note() -> str:
+    """Текущая дата из БД (её часовой пояс) — отдельным сообщением после неизменного префикса"""
+    global _date_note
+    now = time.monotonic()
+    if now - _date_note[0] < _DATE_TTL and _date_note[1]:
+        return _date_note[1]
+    try:
+        rows = await fetch_all("SELECT CURRENT_DATE AS today")
+        today = rows[0]["today"]
+    except Exception as e:
+        logger.warning(f"⚠️ Дата из БД недоступна, берём локальную: {e}")
+        today = _dt.date.today()
+    note = f"Сегодня {today.isoformat()}."
+    _date_note = (now, note)
+    return note
+
+
+async def _schema_message(
+    text: str, analyzed: Optional[Tuple[Dict[str, Any], Dict[str, List[str]]]],
+) -> Tuple[str, str]:
+    """(описание таблиц, нужных вопросу; пояснение для лога) — AI_SCHEMA_PRUNING"""
+    if analyzed is None:
+        analyzed = await analyze_question(text)
+    intent, entities = analyzed if analyzed is not None else (None, None)
+    selection = select_tables(text, intent, entities)
+    if selection.full:
+        _STATS["schema_full"] += 1
+        return render_schema(selection.tables), "все таблицы"
+    return render_schema(selection.tables), ", ".join(selection.tables)
+
+
+async def build_messages(
+    text: str,
+    chat_id: int,
+    analyzed: Optional[Tuple[Dict[str, Any], Dict[str, List[str]]]] = None,
+) -> List[Dict[str, str]]:
+    """Сообщения для LLM: неизменный префикс (правила), дата, схема нужных таблиц, похожие примеры SQL,
+    история в бюджете, вопрос.
+
+    Всё, что меняется от запроса к запросу, идёт после префикса, чтобы провайдер мог
+    переиспользовать кэш промпта; размер промпта в токенах пишется в лог и /db_stats.
+    analyzed — разбор вопроса (parse_intent, extract_entities), если он уже сделан.
+    """
+    static = get_static_prompt()
+    messages: List[Dict[str, str]] = [
+        {"role": "system", "content": static},
+        {"role": "system", "content": await _current_date_note()},
+    ]
+    schema_note = "в промпте"
+    if _schema_pruned:
+        schema, schema_note = await _schema_message(text, analyzed)
+        messages.append({"role": "system", "content": schema})
+        _SCHEMA_TOKENS.append(_message_tokens(schema))
+    examples, shown = await few_shot_message(text)
+    if examples:
+        messages.append({"role": "system", "content": examples})
+    try:
+        history = await get_history(chat_id, limit=AI_HISTORY_MESSAGES)
+    except Exception as e:
+        _STATS["history_errors"] += 1
+        logger.warning(f"⚠️ История чата недоступна: {e}")
+        history = []
+    fitted, info = fit_history(history)
+    messages.extend(fitted)
+    messages.append({"role": "user", "content": text})
+
+    prefix_tokens = _message_tokens(static)
+    total = sum(_message_tokens(m["content"]) for m in messages)
+    _STATS["built"] += 1
+    _STATS["compacted"] += info["compacted"]
+    _STATS["dropped"] += info["dropped"]
+    _PROMPT_TOKENS.append(total)
+    _HISTORY_TOKENS.append(info["tokens"])
+    logger.info(
+        f"🧮 Промпт ~{total} токенов: префикс {prefix_tokens}, схема — {schema_note}, примеров SQL {shown}, история {info['tokens']} "
+        f"({info['kept']} сообщ., сжато {info['compacted']}, отброшено {info['dropped']})"
+    )
+    return messages
+
+
+def record_prompt_usage(usage: Any) -> None:
+    """usage из ответа OpenAI: сколько токенов промпта реально ушло и сколько из них взято из кэша"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    _STATS["usage_reports"] += 1
+    _STATS["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+    _STATS["cached_tokens"] += cached
+    logger.info(f"🧾 Токены промпта: {getattr(usage, 'prompt_tokens', '?')}, из кэша провайдера {cached}")
+
+
+def _summary(samples: Deque[int]) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0, "avg": 0, "p95": 0}
+    return {
+        "count": len(ordered),
+        "avg": int(sum(ordered) / len(ordered)),
+        "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+    }
+
+
+def get_prompt_stats() -> Dict[str, Any]:
+    static = get_static_prompt()
+    reports = _STATS["usage_reports"]
+    return {
+        "prefix_tokens": _message_tokens(static),
+        "prefix_hash": _static_hash,
+        "tokenizer": "tiktoken" if _get_encoder() is not None else "оценка",
+        "history_budget": AI_HISTORY_TOKEN_BUDGET,
+        **_STATS,
+        "prompt": _summary(_PROMPT_TOKENS),
+        "history": _summary(_HISTORY_TOKENS),
+        "schema_pruning": _schema_pruned,
+        "schema": _summary(_SCHEMA_TOKENS),
+        "schema_full_tokens": _message_tokens(render_schema(tuple(CATALOG))),
+        "avg_billed_prompt_tokens": int(_STATS["prompt_tokens"] / reports) if reports else 0,
+        "cached_ratio": _STATS["cached_tokens"] / _STATS["prompt_tokens"] if _STATS["prompt_tokens"] else 0.0,
+    }
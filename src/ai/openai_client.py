@@ -0,0 +1,239 @@
+from __future__ import annotations
+import asyncio
+import importlib.util
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+import httpx
+from openai import APITimeoutError, AsyncOpenAI
+
+from src.utils.logger import get_logger
+
+logger = get_logger("ai.openai_client")
+
+# Таймауты одного запроса (сек): чат, распознавание речи и установка соединения
+OPENAI_CHAT_TIMEOUT = float(os.getenv("OPENAI_CHAT_TIMEOUT", "60"))
+OPENAI_AUDIO_TIMEOUT = float(os.getenv("OPENAI_AUDIO_TIMEOUT", "120"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Пул соединений: HTTP/2 (если установлен h2) или HTTP/1.1 keep-alive
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() in ("1", "true", "yes", "on")
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120"))
+# Сколько соединений открыть при старте бота (для HTTP/2 хватает одного)
+OPENAI_WARM_CONNECTIONS = int(os.getenv("OPENAI_WARM_CONNECTIONS", "2"))
+# Дублирующий запрос к чату, если первый не ответил за наблюдаемый p95 (не раньше OPENAI_HEDGE_MIN_DELAY)
+OPENAI_HEDGE = os.getenv("OPENAI_HEDGE", "false").lower() in ("1", "true", "yes", "on")
+OPENAI_HEDGE_MIN_DELAY = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "2.0"))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+
+_LATENCY_SAMPLES = 1000
+
+_client: Optional[AsyncOpenAI] = None
+_http_client: Optional[httpx.AsyncClient] = None
+
+_LATENCY: Dict[str, Deque[float]] = {
+    "chat": deque(maxlen=_LATENCY_SAMPLES),
+    "chat_stream": deque(maxlen=_LATENCY_SAMPLES),   # до начала потока (заголовков ответа)
+    "audio": deque(maxlen=_LATENCY_SAMPLES),
+    "embeddings": deque(maxlen=_LATENCY_SAMPLES),
+}
+_STATS: Dict[str, Any] = {
+    "requests": 0, "errors": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0,
+    "warmed_connections": 0, "warm_up_ms": None, "last_error": None,
+}
+
+
+def _http2_available() -> bool:
+    return OPENAI_HTTP2 and importlib.util.find_spec("h2") is not None
+
+
+def get_client() -> AsyncOpenAI:
+    """Общий на процесс клиент OpenAI: один пул соединений для чата и распознавания речи"""
+    global _client, _http_client
+    if _client is None:
+        http2 = _http2_available()
+        if OPENAI_HTTP2 and not http2:
+            logger.warning("⚠️ Пакет h2 не установлен — соединения с OpenAI по HTTP/1.1 keep-alive")
+        _http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(OPENAI_CHAT_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        )
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            http_client=_http_client,
+            max_retries=OPENAI_MAX_RETRIES,
+            timeout=httpx.Timeout(OPENAI_CHAT_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        )
+    return _client
+
+
+def reset_client() -> None:
+    """Забыть клиента (например, после смены ключа); старые соединения закрываются в фоне"""
+    global _client, _http_client
+    old = _http_client
+    _client = None
+    _http_client = None
+    if old is not None:
+        try:
+            asyncio.get_running_loop().create_task(old.aclose())
+        except RuntimeError:
+            pass
+
+
+async def warm_up_client() -> None:
+    """Открыть соединения с API заранее, чтобы первый вопрос не ждал TCP+TLS"""
+    client = get_client()
+    url = f"{str(client.base_url).rstrip('/')}/models"
+    headers = {"Authorization": f"Bearer {client.api_key}"}
+    start = time.perf_counter()
+
+    async def _connect() -> bool:
+        try:
+            # Ответ не важен (даже 401/404): соединение остаётся в пуле
+            await _http_client.get(url, headers=headers, timeout=OPENAI_CONNECT_TIMEOUT * 2)
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось заранее подключиться к OpenAI: {e}")
+            return False
+
+    connections = 1 if _http2_available() else max(1, OPENAI_WARM_CONNECTIONS)
+    ok = await asyncio.gather(*[_connect() for _ in range(connections)])
+    _STATS["warmed_connections"] = sum(ok)
+    _STATS["warm_up_ms"] = int((time.perf_counter() - start) * 1000)
+    if any(ok):
+        logger.info(f"🔌 Соединения с OpenAI открыты заранее: {sum(ok)} за {_STATS['warm_up_ms']} мс")
+
+
+async def close_client() -> None:
+    global _client, _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _client = None
+    _http_client = None
+
+
+def _hedge_delay(kind: str = "chat") -> Optional[float]:
+    """Через сколько секунд дублировать запрос к чату: p95 наблюдаемых задержек того же вида"""
+    samples = _LATENCY[kind]
+    if not OPENAI_HEDGE or len(samples) < OPENAI_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+    return max(OPENAI_HEDGE_MIN_DELAY, p95 / 1000)
+
+
+def _discard(task: "asyncio.Task[Any]") -> None:
+    """Проигравший запрос: отменить, а если уже ответил потоком — закрыть поток"""
+    if not task.done():
+        task.cancel()
+        return
+    if task.cancelled() or task.exception() is not None:
+        return
+    close = getattr(task.result(), "close", None)
+    if close is not None:
+        asyncio.get_running_loop().create_task(close())
+
+
+async def _race(call: Callable[[], Awaitable[Any]], delay: float) -> Any:
+    """Запрос; если он не ответил за delay — такой же второй, результат — первый успешный"""
+    first = asyncio.ensure_future(call())
+    tasks: List["asyncio.Task[Any]"] = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            _STATS["hedges"] += 1
+            tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                if task is not first:
+                    _STATS["hedge_wins"] += 1
+                for other in tasks:
+                    if other is not task:
+                        _discard(other)
+                return task.result()
+        raise error
+    except asyncio.CancelledError:
+        for task in tasks:
+            _discard(task)
+        raise
+
+
+async def _timed(kind: str, call: Callable[[], Awaitable[Any]], hedge: bool) -> Any:
+    _STATS["requests"] += 1
+    start = time.perf_counter()
+    delay = _hedge_delay(kind) if hedge else None
+    try:
+        result = await (_race(call, delay) if delay is not None else call())
+    except Exception as e:
+        _STATS["errors"] += 1
+        if isinstance(e, (APITimeoutError, httpx.TimeoutException, asyncio.TimeoutError)):
+            _STATS["timeouts"] += 1
+        _STATS["last_error"] = str(e)
+        raise
+    _LATENCY[kind].append((time.perf_counter() - start) * 1000)
+    return result
+
+
+async def create_chat_completion(**kwargs: Any) -> Any:
+    """chat.completions.create через общий клиент: таймаут OPENAI_CHAT_TIMEOUT и, с OPENAI_HEDGE,
+    дублирующий запрос после p95. Для stream=True задержка — до начала ответа (заголовков)."""
+    kwargs.setdefault("timeout", httpx.Timeout(OPENAI_CHAT_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT))
+    client = get_client()
+    kind = "chat_stream" if kwargs.get("stream") else "chat"
+    return await _timed(kind, lambda: client.chat.completions.create(**kwargs), hedge=True)
+
+
+async def create_transcription(**kwargs: Any) -> Any:
+    """audio.transcriptions.create через общий клиент (без дублирования: файл читается один раз)"""
+    kwargs.setdefault("timeout", httpx.Timeout(OPENAI_AUDIO_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT))
+    client = get_client()
+    return await _timed("audio", lambda: client.audio.transcriptions.create(**kwargs), hedge=False)
+
+
+async def create_embeddings(**kwargs: Any) -> Any:
+    """embeddings.create через общий клиент (примеры для промпта, AI_FEW_SHOT_EMBEDDER=openai)"""
+    kwargs.setdefault("timeout", httpx.Timeout(OPENAI_CHAT_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT))
+    client = get_client()
+    return await _timed("embeddings", lambda: client.embeddings.create(**kwargs), hedge=False)
+
+
+def _latency_summary(samples: Deque[float]) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0, "avg_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0}
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+
+    return {"count": len(ordered), "avg_ms": sum(ordered) / len(ordered), "p50_ms": rank(0.50), "p95_ms": rank(0.95)}
+
+
+def get_llm_client_stats() -> Dict[str, Any]:
+    hedges = _STATS["hedges"]
+    delay = _hedge_delay()
+    return {
+        "http2": _http2_available(),
+        "hedge_enabled": OPENAI_HEDGE,
+        "hedge_delay_ms": int(delay * 1000) if delay is not None else None,
+        **_STATS,
+        "hedge_win_rate": _STATS["hedge_wins"] / hedges if hedges else 0.0,
+        "chat": _latency_summary(_LATENCY["chat"]),
+        "chat_stream": _latency_summary(_LATENCY["chat_stream"]),
+        "audio": _latency_summary(_LATENCY["audio"]),
+        "embeddings": _latency_summary(_LATENCY["embeddings"]),
+    }
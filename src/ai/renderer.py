@@ -2,10 +2,12 @@
 from __future__ import annotations
 
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 
-from src.utils.formatter import build_html_from_rows
+from src.models.rowset import RowSet
+from src.utils.formatter import build_html_from_rows, build_html_pages
 from src.utils.html_sanitize import sanitize_html
+from src.utils.pager import PAGER_MAX_PAGES, pager_enabled
 from .models import AgentResult
 
 # Порог, после которого предлагаем Excel
@@ -39,27 +41,51 @@ def _title_from_user(text: str) -> Optional[str]:
     return f"<b>{t[0].upper() + t[1:]}</b>"
 
 
+class PagedResult(AgentResult):
+    """Ответ из нескольких страниц: output — первая, pages — все (для кнопок ◀ ▶)"""
+    pages: Optional[List[str]] = None
+
+
 def render_rows(
-    rows: List[Dict[str, Any]],
+    rows: Union[RowSet, List[Dict[str, Any]]],
     user_text: str,
     *,
     existing_title: Optional[str] = None,
     sql_query: Optional[str] = None,
+    truncated: bool = False,
 ) -> AgentResult:
     """
     Главный рендерер для ответов из БД:
     - строит аккуратный HTML через formatter.build_html_from_rows,
     - санитизирует,
     - добавляет table_data и флаг send_excel по порогу.
+
+    truncated=True — rows только начало выборки: показываем его, а полный
+    результат уходит в Excel потоковой выгрузкой по sql_query (table_data=None).
+
+    Если ответ без Excel не помещается в одно сообщение, возвращается PagedResult:
+    обработчик сохраняет страницы и листает их кнопками без повторного запроса.
     """
     if not rows:
         return render_no_data(sql_query)
 
     title = existing_title or _title_from_user(user_text)
-    html = build_html_from_rows(rows, existing_title=title)
-    html = sanitize_html(html)
+    send_excel = truncated or len(rows) > EXCEL_THRESHOLD
+    if not send_excel and pager_enabled():
+        pages = [sanitize_html(p) for p in build_html_pages(rows, existing_title=title, max_pages=PAGER_MAX_PAGES)]
+        if len(pages) > 1:
+            result = PagedResult(output=pages[0], send_excel=False, table_data=None, sql_query=sql_query)
+            result.pages = pages
+            return result
+        html = pages[0]
+    else:
+        html = build_html_from_rows(rows, existing_title=title)
+        html = sanitize_html(html)
+
+    if truncated:
+        html += f"\n\n<i>Показаны первые {len(rows)} строк, полный результат — в файле.</i>"
+        return AgentResult(output=html, send_excel=True, table_data=None, sql_query=sql_query)
 
-    send_excel = len(rows) > EXCEL_THRESHOLD
     return AgentResult(
         output=html,
         send_excel=send_excel,
@@ -0,0 +1,345 @@
+from __future__ import annotations
+import os
+import re
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from src.utils.logger import get_logger
+
+logger = get_logger("ai.schema_catalog")
+
+# Отправлять в LLM описание только тех таблиц, которые нужны вопросу (остальное — из каталога ниже)
+AI_SCHEMA_PRUNING = os.getenv("AI_SCHEMA_PRUNING", "true").lower() in ("1", "true", "yes", "on")
+
+
+class Table(NamedTuple):
+    name: str
+    title: str
+    columns: Tuple[Tuple[str, str], ...]   # (колонка, пояснение; пусто — без пояснения)
+    keywords: Tuple[str, ...]              # основы слов вопроса, по которым таблица нужна
+    notes: Tuple[str, ...] = ()
+    report: bool = False                   # агрегированный отчёт («точки контроля»)
+
+
+def _cols(*names: str, **described: str) -> Tuple[Tuple[str, str], ...]:
+    return tuple((n, described.get(n, "")) for n in names)
+
+
+CATALOG: Dict[str, Table] = {t.name: t for t in (
+    Table(
+        "clients", "справочник клиентов",
+        _cols("client_code", "client_name", "public_name", "region", "manager", "is_client", "is_supplier",
+              "legal_type", "registration_date", "marker",
+              public_name="название для людей", marker="'Бонус' — бонусные клиенты, исключаются из отчётов"),
+        ("клиент", "контрагент", "покупател", "акб", "регион", "район"),
+    ),
+    Table(
+        "products", "справочник продукции",
+        _cols("product_code", "product_name", "print_name", "unit", "type", "brand", "weight", "client_code",
+              "category_1", "category_group_1", "product_group",
+              client_code="владелец private-label", category_1="категория",
+              category_group_1="группа категорий"),
+        ("товар", "продукт", "бренд", "категор", "номенклатур", "sku", "артикул"),
+    ),
+    Table(
+        "orders", "заказы",
+        _cols("order_number", "client_code", "product_code", "order_date", "shipment_date", "planned_quantity",
+              "weight_kg", "warehouse", shipment_date="плановая отгрузка; NULL — не отгружен"),
+        ("заказ", "отгруз", "недогруз"),
+    ),
+    Table(
+        "profit", "продажи и возвраты",
+        _cols("order_number", "client_code", "product_code", "order_date", "profit_date", "quantity", "weight_kg",
+              "revenue", "manager", "channel", "warehouse",
+              profit_date="дата продажи/возврата", revenue="> 0 продажа, < 0 возврат"),
+        ("продаж", "продал", "выручк", "возврат", "оборот", "доход", "реализ", "недогруз", "канал"),
+    ),
+    Table(
+        "debt", "дебиторка",
+        _cols("client_code", "contractor", "payment_term", "manager", "total_debt", "overdue_debt",
+              "not_overdue_debt", "debt_date", debt_date="дата среза"),
+        ("дебитор", "долг", "задолж", "просроч"),
+    ),
+    Table(
+        "stock", "остатки",
+        _cols("product_code", "warehouse", "stock_date", "income", "outcome", "initial_quantity",
+              "final_quantity", stock_date="дата среза"),
+        ("остат", "запас", "складск"),
+    ),
+    Table(
+        "purchase_prices", "закупки",
+        _cols("product_code", "order_date", "order_number", "quantity", "client_code", "price_per_unit",
+              "var_rate", "warehouse", "contract_type",
+              var_rate="процент НДС или текст \"Без НДС\"", client_code="поставщик"),
+        ("закуп", "себестоим", "поставщ", "ндс", "входн"),
+    ),
+    Table(
+        "sales_representatives", "справочник менеджеров",
+        _cols("full_name", "phone", "email", "department", "user_photo", user_photo="фото менеджера"),
+        ("телефон", "почт", "email", "e-mail", "контакт", "фото", "отдел"),
+    ),
+    Table(
+        "managers_plan", "план продаж в кг",
+        _cols("period", "manager", "client_code", "categories", "plan",
+              period="DATE, месяц плана: >= 'YYYY-MM-01' AND < 'YYYY-MM+1-01'"),
+        ("план", "карточк"),
+    ),
+    Table(
+        "plan_perf_manager_reports", "выполнение плана менеджерами",
+        _cols("period", "manager", "plan_kg", "fact_kg", "kpi", "bad_categories", "ai_recommendation",
+              period="последний день месяца", manager="ФИО", plan_kg="план, кг", fact_kg="факт, кг",
+              kpi="% выполнения плана от 0 до 100, уже рассчитан — не умножать на 100",
+              bad_categories="jsonb, категории с недогрузами", ai_recommendation="рекомендация от ИИ"),
+        ("выполнен", "kpi", "кпи"),
+        ("Для фильтрации используй kpi < 95; период: period = 'YYYY-MM-DD'.",),
+        report=True,
+    ),
+    Table(
+        "service_level_reports", "уровень сервиса (дневной + MTD)",
+        _cols("report_date", "total_order_kg", "total_sales_kg", "service_level", "status", "mtd_order_kg",
+              "mtd_sales_kg", "mtd_service_level", "top10_sku", "top10_reasons", "ai_recommendation", "created_at",
+              report_date="дата отчёта", total_order_kg="заказы за день", total_sales_kg="продажи за день",
+              service_level="за день = продажи / заказы × 100", status="'OK' если service_level ≥ 98, иначе 'ALERT'",
+              mtd_service_level="с 1-го числа по report_date",
+              top10_sku="jsonb, топ-10 товаров по недогрузу за MTD",
+              top10_reasons="jsonb, топ-10 причин недогруза за MTD",
+              ai_recommendation="только в последний день месяца, если mtd_service_level < 98",
+              created_at="время расчёта"),
+        ("сервис", "недогруз", "недовоз"),
+        (
+            "Одна строка в день с накопительным расчётом на report_date; top10_* — с начала месяца.",
+            "Срез на день: WHERE report_date = 'YYYY-MM-DD'; JSON: jsonb_array_elements(top10_sku).",
+        ),
+        report=True,
+    ),
+    Table(
+        "product_abcxyz", "ABC/XYZ-анализ по товарам",
+        _cols("product_code", "product_name", "total_revenue", "abc_group", "xyz_group",
+              total_revenue="суммарная выручка по товару", abc_group="A / B / C", xyz_group="X / Y / Z"),
+        ("abc", "xyz", "абц", "проблемн"),
+        ("Фильтры: abc_group = 'A'; проблемные товары — abc_group = 'C' AND xyz_group = 'Z'.",),
+        report=True,
+    ),
+)}
+
+# Связи (как в промпте): ребро — колонка слева ссылается на колонку справа
+JOINS: Tuple[Tuple[str, str], ...] = (
+    ("profit.product_code", "products.product_code"),
+    ("products.product_code", "purchase_prices.product_code"),
+    ("profit.client_code", "clients.client_code"),
+    ("orders.product_code", "products.product_code"),
+    ("orders.client_code", "clients.client_code"),
+    ("debt.client_code", "clients.client_code"),
+    ("stock.product_code", "products.product_code"),
+    ("products.client_code", "clients.client_code"),
+)
+
+# Таблицы с клиентом: к ним нужен clients для фильтра marker = 'Бонус'
+_CLIENT_FACTS = ("profit", "orders", "debt", "managers_plan")
+# Строки по товарам без названий: в ответе нужны названия из products
+_PRODUCT_FACTS = ("stock", "purchase_prices")
+_FACTS = ("profit", "orders", "debt", "stock", "purchase_prices", "managers_plan")
+_REPORTS = tuple(name for name, t in CATALOG.items() if t.report)
+
+# Общий вопрос «что на предприятии?» — сводка по всем точкам контроля
+_OVERVIEW_RE = re.compile(r"на предприят|проблем|отклонен|как ситуац|что происходит|аномал")
+
+# Разрезы parse_intent и сущности extract_entities -> таблица с нужной колонкой
+_DIMENSION_TABLES = {
+    "brand": "products", "category": "products", "product": "products",
+    "client": "clients", "region": "clients", "channel": "profit", "manager": None,
+}
+_ENTITY_TABLES = {
+    "brands": "products", "categories": "products", "clients": "clients",
+    "regions": "clients", "channels": "profit", "managers": None,
+}
+
+# Разделы исходного промпта, которые заменяет каталог: (начало, начало следующего раздела)
+_SECTIONS = (("📦 Структура базы данных", "🔒 ВАЖНОЕ ПРАВИЛО"), ("📍 Точки контроля", "📣 Общий вопрос"))
+_SECTION_STUB = "{title}: описание нужных таблиц и связей — в отдельном сообщении «Схема» после этих правил.\n\n"
+# Строка таблицы в разделе структуры: «имя(пояснение) — колонки» (тире или дефис)
+_TABLE_LINE_RE = re.compile(r"^\s*(\w+)\s*\([^)]*\)\s*[—-]\s*(.+)$")
+_COLUMN_RE = re.compile(r"\w+\.\w+")
+_WORD_RE = re.compile(r"[a-z_][a-z0-9_]*")
+
+
+class SchemaSelection(NamedTuple):
+    tables: Tuple[str, ...]
+    reasons: Dict[str, str]
+    full: bool                 # ничего не распознано — весь каталог
+
+
+def _norm(s: str) -> str:
+    return (s or "").lower().replace("ё", "е")
+
+
+def _join_graph() -> Dict[str, Set[str]]:
+    graph: Dict[str, Set[str]] = {}
+    for left, right in JOINS:
+        a, b = left.split(".")[0], right.split(".")[0]
+        graph.setdefault(a, set()).add(b)
+        graph.setdefault(b, set()).add(a)
+    return graph
+
+
+_GRAPH = _join_graph()
+
+
+def _path(a: str, b: str) -> List[str]:
+    """Кратчайшая цепочка JOIN между таблицами (включая концы); пусто — не связаны"""
+    prev: Dict[str, Optional[str]] = {a: None}
+    queue = deque([a])
+    while queue:
+        node = queue.popleft()
+        if node == b:
+            path = []
+            while node is not None:
+                path.append(node)
+                node = prev[node]
+            return path[::-1]
+        for nxt in sorted(_GRAPH.get(node, ())):
+            if nxt not in prev:
+                prev[nxt] = node
+                queue.append(nxt)
+    return []
+
+
+def select_tables(
+    text: str,
+    intent: Optional[Dict[str, object]] = None,
+    entities: Optional[Dict[str, List[str]]] = None,
+) -> SchemaSelection:
+    """Какие таблицы описать LLM для вопроса: ключевые слова, сущности из справочников и разбор
+    parse_intent (метрика/разрез), затем таблицы-посредники по связям и clients для фильтра бонусных.
+    Если ничего не распознано — весь каталог."""
+    t = _norm(text)
+    reasons: Dict[str, str] = {}
+
+    def add(table: Optional[str], reason: str) -> None:
+        if table and table not in reasons:
+            reasons[table] = reason
+
+    for table in CATALOG.values():
+        for kw in table.keywords:
+            if kw in t:
+                add(table.name, f"«{kw}»")
+                break
+    if _OVERVIEW_RE.search(t):
+        for name in _REPORTS:
+            add(name, "общий вопрос")
+    for kind, values in (entities or {}).items():
+        if values and kind in _ENTITY_TABLES:
+            add(_ENTITY_TABLES[kind], f"{kind}: {values[0]}")
+    dimension = (intent or {}).get("dimension")
+    if dimension in _DIMENSION_TABLES:
+        add(_DIMENSION_TABLES[dimension], f"разрез {dimension}")
+
+    # Метрика, менеджер или справочник без явной таблицы фактов — это продажи
+    has_fact = any(name in reasons for name in _FACTS + _REPORTS + ("sales_representatives",))
+    named_manager = bool((entities or {}).get("managers")) or dimension == "manager"
+    if not has_fact and (
+        (intent or {}).get("metric_explicit") or named_manager or "products" in reasons or "clients" in reasons
+    ):
+        add("profit", "метрика продаж")
+
+    if not reasons:
+        return SchemaSelection(tuple(CATALOG), {}, True)
+
+    for name in _CLIENT_FACTS:
+        if name in reasons:
+            add("clients", "фильтр marker = 'Бонус'")
+    for name in _PRODUCT_FACTS:
+        if name in reasons:
+            add("products", "названия товаров")
+    selected = [name for name in reasons if not CATALOG[name].report]
+    for i, a in enumerate(selected):
+        for b in selected[i + 1:]:
+            for mid in _path(a, b)[1:-1]:
+                add(mid, f"связь {a} → {b}")
+    tables = tuple(name for name in CATALOG if name in reasons)
+    return SchemaSelection(tables, reasons, False)
+
+
+def _render_table(table: Table) -> str:
+    cols = ", ".join(f"{c} ({d})" if d else c for c, d in table.columns)
+    line = f"{table.name}({table.title}) — {cols}"
+    return "\n".join([line, *(f"📌 {note}" for note in table.notes)])
+
+
+def render_schema(tables: Tuple[str, ...]) -> str:
+    """Описание таблиц и связей между ними в том же виде, что и в исходном промпте"""
+    chosen = set(tables)
+    base = [CATALOG[n] for n in CATALOG if n in chosen and not CATALOG[n].report]
+    reports = [CATALOG[n] for n in CATALOG if n in chosen and CATALOG[n].report]
+    parts: List[str] = ["Схема. 📦 Структура базы данных (схема public, только таблицы этого вопроса):"]
+    parts.extend(_render_table(t) for t in base)
+    joins = [f"{left} → {right}" for left, right in JOINS
+             if left.split(".")[0] in chosen and right.split(".")[0] in chosen]
+    if joins:
+        parts.append("Связи между таблицами:")
+        parts.extend(joins)
+    if reports:
+        parts.append("📍 Точки контроля — агрегированные отчёты в отдельных таблицах:")
+        parts.extend(_render_table(t) for t in reports)
+    return "\n".join(parts)
+
+
+def _catalog_mismatches(structure: str, reports: str) -> List[str]:
+    """Расхождения каталога с вырезаемыми разделами промпта: таблицы, колонки, связи"""
+    problems: List[str] = []
+    prompt_tables: Dict[str, Set[str]] = {}
+    prompt_joins: Set[Tuple[str, str]] = set()
+    for line in structure.splitlines():
+        m = _TABLE_LINE_RE.match(line)
+        if m and "→" not in line:
+            columns = re.sub(r"\([^)]*\)", "", m.group(2))
+            prompt_tables[m.group(1)] = {c.strip() for c in columns.split(",") if c.strip()}
+        elif "→" in line:
+            chain = [_COLUMN_RE.search(part) for part in line.split("→")]
+            names = [c.group() for c in chain if c]
+            prompt_joins.update(zip(names, names[1:]))
+    base = {name: {c for c, _ in t.columns} for name, t in CATALOG.items() if not t.report}
+    for name in sorted(set(base) | set(prompt_tables)):
+        if name not in prompt_tables:
+            problems.append(f"{name}: нет в промпте")
+        elif name not in base:
+            problems.append(f"{name}: нет в каталоге")
+        elif base[name] != prompt_tables[name]:
+            diff = sorted(base[name] ^ prompt_tables[name])
+            problems.append(f"{name}: колонки {', '.join(diff)}")
+    if prompt_joins != set(JOINS):
+        diff = sorted(f"{a} → {b}" for a, b in prompt_joins ^ set(JOINS))
+        problems.append(f"связи: {', '.join(diff)}")
+    words = set(_WORD_RE.findall(reports))
+    for name in _REPORTS:
+        missing = [c for c in (name, *(c for c, _ in CATALOG[name].columns)) if c not in words]
+        if missing:
+            problems.append(f"{name}: нет в промпте {', '.join(missing)}")
+    return problems
+
+
+def strip_schema_sections(prompt: str) -> Tuple[str, bool]:
+    """Промпт без разделов со структурой таблиц (их заменяет render_schema); False — промпт как есть.
+
+    Разделы вырезаются, только если найдены оба и каталог совпадает с ними по таблицам, колонкам
+    и связям: иначе LLM получила бы схему, которая расходится с промптом.
+    """
+    stripped = prompt
+    sections: List[str] = []
+    for start_marker, end_marker in _SECTIONS:
+        start = stripped.find(start_marker)
+        end = stripped.find(end_marker, start + 1) if start >= 0 else -1
+        if start < 0 or end < 0:
+            missing = start_marker if start < 0 else end_marker
+            logger.warning(f"⚠️ В промпте нет раздела «{missing}» — схема отправляется целиком")
+            return prompt, False
+        sections.append(stripped[start:end])
+        stripped = stripped[:start] + _SECTION_STUB.format(title=start_marker) + stripped[end:]
+    problems = _catalog_mismatches(*sections)
+    if problems:
+        logger.warning(
+            f"⚠️ Каталог таблиц (src/ai/schema_catalog.py) расходится с промптом: {'; '.join(problems)} — "
+            f"схема отправляется целиком"
+        )
+        return prompt, False
+    return stripped, True
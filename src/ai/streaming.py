@@ -0,0 +1,173 @@
+from __future__ import annotations
+import os
+import re
+from typing import List, Optional
+
+# Показывать ответ LLM по мере генерации (правками сообщения «⌛ Ваш запрос принят»)
+AI_STREAM = os.getenv("AI_STREAM", "true").lower() in ("1", "true", "yes", "on")
+# Не чаще одной правки сообщения за интервал (сек) — лимиты Telegram на редактирование
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.0"))
+# Сколько новых символов нужно, чтобы правка имела смысл
+AI_STREAM_MIN_CHARS = int(os.getenv("AI_STREAM_MIN_CHARS", "20"))
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_STRING_STOP = re.compile(r'["\\]')
+
+
+def streaming_enabled() -> bool:
+    return AI_STREAM
+
+
+class JsonFieldStream:
+    """Достаёт строковое поле верхнего уровня из JSON-объекта, который приходит кусками.
+
+    feed() принимает очередной кусок ответа модели и возвращает новые символы значения поля
+    (уже без экранирования); value — всё, что получено к этому моменту. Экранирование,
+    разрезанное между кусками (\\n, \\uXXXX, суррогатные пары), собирается корректно.
+    Вложенные объекты и строки других полей пропускаются, поле с тем же именем во вложенном
+    объекте не считается.
+    """
+
+    def __init__(self, field: str = "output") -> None:
+        self.field = field
+        self.done = False
+        self._parts: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode: Optional[str] = None   # накопленные hex-цифры \uXXXX
+        self._high_surrogate: Optional[int] = None
+        self._expect_key = False
+        self._after_colon = False
+        self._reading_key = False
+        self._key: List[str] = []
+        self._last_key: Optional[str] = None
+        self._capture = False
+
+    @property
+    def value(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def _emit(self, text: str, out: List[str]) -> None:
+        if self._reading_key:
+            self._key.append(text)
+        elif self._capture:
+            out.append(text)
+
+    def _emit_code_point(self, code: int, out: List[str]) -> None:
+        if self._high_surrogate is not None:
+            high, self._high_surrogate = self._high_surrogate, None
+            if 0xDC00 <= code <= 0xDFFF:
+                self._emit(chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00)), out)
+                return
+            self._emit("\ufffd", out)
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+        else:
+            self._emit(chr(code), out)
+
+    def _flush_surrogate(self, out: List[str]) -> None:
+        if self._high_surrogate is not None:
+            self._high_surrogate = None
+            self._emit("\ufffd", out)
+
+    def _end_string(self) -> None:
+        self._in_string = False
+        if self._reading_key:
+            self._reading_key = False
+            self._last_key = "".join(self._key)
+            self._key = []
+        elif self._capture:
+            self._capture = False
+            self.done = True
+
+    def feed(self, chunk: str) -> str:
+        out: List[str] = []
+        i, n = 0, len(chunk)
+        while i < n:
+            if self._in_string:
+                if self._unicode is not None:
+                    self._unicode += chunk[i]
+                    i += 1
+                    if len(self._unicode) == 4:
+                        try:
+                            code = int(self._unicode, 16)
+                        except ValueError:
+                            code = 0xFFFD
+                        self._unicode = None
+                        self._emit_code_point(code, out)
+                    continue
+                if self._escape:
+                    self._escape = False
+                    ch = chunk[i]
+                    i += 1
+                    if ch == "u":
+                        self._unicode = ""
+                    else:
+                        self._flush_surrogate(out)
+                        self._emit(_ESCAPES.get(ch, ch), out)
+                    continue
+                m = _STRING_STOP.search(chunk, i)
+                end = m.start() if m else n
+                if end > i:
+                    self._flush_surrogate(out)
+                    self._emit(chunk[i:end], out)
+                if not m:
+                    break
+                i = end + 1
+                if m.group() == "\\":
+                    self._escape = True
+                else:
+                    self._flush_surrogate(out)
+                    self._end_string()
+                continue
+
+            ch = chunk[i]
+            i += 1
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._expect_key = False
+                    self._reading_key = True
+                elif self._depth == 1 and self._after_colon:
+                    self._after_colon = False
+                    self._capture = self._last_key == self.field and not self.done
+            elif ch in "{[":
+                self._depth += 1
+                self._after_colon = False
+                if ch == "{" and self._depth == 1:
+                    self._expect_key = True
+            elif ch in "}]":
+                self._depth -= 1
+            elif self._depth == 1 and ch == ",":
+                self._expect_key = True
+                self._after_colon = False
+            elif self._depth == 1 and ch == ":":
+                self._after_colon = True
+
+        delta = "".join(out)
+        if delta:
+            self._parts.append(delta)
+        return delta
+
+
+_TAG = re.compile(r"<[^<>]*>")
+_OPEN_TAG_TAIL = re.compile(r"<[^<>]*$")
+_ENTITIES = (("&lt;", "<"), ("&gt;", ">"), ("&quot;", '"'), ("&amp;", "&"))
+
+
+def preview_text(partial_html: str, limit: int = 4000) -> str:
+    """Незаконченный HTML-ответ как простой текст для промежуточной правки сообщения.
+
+    Теги отбрасываются (незакрытый <b> сломал бы parse_mode=HTML), хвост с недописанным
+    тегом — тоже; длинный текст обрезается с начала, чтобы было видно, что пишется сейчас.
+    """
+    text = _OPEN_TAG_TAIL.sub("", _TAG.sub("", partial_html))
+    for entity, char in _ENTITIES:
+        text = text.replace(entity, char)
+    text = text.strip()
+    if len(text) > limit:
+        text = "…" + text[-(limit - 1):]
+    return text
@@ -2,16 +2,16 @@ from __future__ import annotations
 import os
 import aiohttp
 import aiofiles
-from openai import AsyncOpenAI
 from src.utils.logger import get_logger
 
+from .openai_client import create_transcription
+
 logger = get_logger("ai.transcribe")
 
 
 async def transcribe_voice(file_path: str) -> str:
     """Транскрибировать голосовое сообщение через Whisper API"""
     try:
-        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         model = os.environ.get("OPENAI_MODEL_WHISPER", "whisper-1")
 
         # Скачиваем файл во временную директорию
@@ -29,7 +29,8 @@ async def transcribe_voice(file_path: str) -> str:
         try:
             # Транскрибируем через OpenAI
             with open(temp_file_path, 'rb') as audio_file:
-                transcript = await client.audio.transcriptions.create(
+                # Общий клиент: соединение с API уже открыто, новый TLS-handshake не нужен
+                transcript = await create_transcription(
                     model=model,
                     file=audio_file,
                     language="ru"
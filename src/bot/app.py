@@ -3,6 +3,7 @@ import asyncio
 import os
 from dataclasses import dataclass
 from datetime import datetime
+from typing import List, Optional
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.constants import ParseMode
@@ -14,9 +15,37 @@ from src.utils.html_sanitize import sanitize_html
 from src.handlers.router import handle_text_message, handle_voice_message
 from src.handlers.inline_handlers import handle_card_callback
 from src.handlers.training_feedback import handle_training_feedback, handle_comment_form
+from src.handlers.pages import handle_page_callback
+from src.ai.fast_path import get_fast_path_stats
+from src.ai.few_shot import get_few_shot_stats, start_few_shot, stop_few_shot
+from src.ai.intent_cache import get_intent_cache_stats
+from src.ai.messages import get_prompt_stats
+from src.ai.openai_client import close_client, get_llm_client_stats, warm_up_client
 from src.utils.logger import setup_logging, get_logger
-from src.db.pool import close_pool
+from src.db.pool import close_pool, get_statement_cache_stats
+from src.db.auth import check_admin_chat, start_auth_cache, stop_auth_cache
+from src.db.data_version import start_data_version, stop_data_version
+from src.db.guarded_relations import get_guarded_relations_stats, start_guarded_relations, stop_guarded_relations
+from src.db.query_cost import get_query_cost_stats
+from src.db.query_stats import (
+    get_query_stats_summary,
+    get_top_queries,
+    get_top_queries_from_db,
+    start_query_stats,
+    stop_query_stats,
+)
+from src.db.result_cache import get_result_cache_stats
+from src.db.rollups import get_rollup_stats, start_rollups, stop_rollups
+from src.db.write_behind import start_write_behind, stop_write_behind, get_write_behind_stats
+from src.utils.reference_data import (
+    force_refresh_references,
+    get_references_stats,
+    start_reference_refresher,
+    stop_reference_refresher,
+)
+from src.bot.dispatcher import ChatOrderedUpdateProcessor
 from src.utils.debug import set_debug, is_debug
+from src.utils.pager import get_pager_stats
  
 
 load_dotenv(dotenv_path=os.path.join(os.getcwd(), ".env"), override=True)
@@ -29,15 +58,48 @@ logger = get_logger("bot")
 class Settings:
     telegram_token: str
     polling_interval: float
+    mode: str = "polling"
+    webhook_listen: str = "0.0.0.0"
+    webhook_port: int = 8443
+    webhook_path: str = "/telegram/webhook"
+    webhook_url: Optional[str] = None
+    webhook_secret: str = ""
+    webhook_max_connections: int = 40
+    webhook_max_body: int = 1024 * 1024
+    max_concurrent_updates: int = 16
+    telegram_pool_size: int = 0
 
 
 def read_settings() -> Settings:
     token = os.environ.get("TELEGRAM_BOT_TOKEN", "").strip()
     if not token:
         raise RuntimeError("TELEGRAM_BOT_TOKEN is not set")
+
+    mode = os.environ.get("TELEGRAM_MODE", "polling").strip().lower() or "polling"
+    if mode not in ("polling", "webhook"):
+        raise RuntimeError(f"TELEGRAM_MODE must be 'polling' or 'webhook', got: {mode}")
+
+    webhook_secret = os.environ.get("WEBHOOK_SECRET_TOKEN", "").strip()
+    if mode == "webhook" and not webhook_secret:
+        raise RuntimeError("WEBHOOK_SECRET_TOKEN is not set (required in webhook mode)")
+
+    webhook_path = os.environ.get("WEBHOOK_PATH", "/telegram/webhook").strip() or "/telegram/webhook"
+    if not webhook_path.startswith("/"):
+        webhook_path = "/" + webhook_path
+
     return Settings(
         telegram_token=token,
         polling_interval=float(os.environ.get("POLLING_INTERVAL_SECONDS", "5")),
+        mode=mode,
+        webhook_listen=os.environ.get("WEBHOOK_LISTEN", "0.0.0.0"),
+        webhook_port=int(os.environ.get("WEBHOOK_PORT", "8443")),
+        webhook_path=webhook_path,
+        webhook_url=os.environ.get("WEBHOOK_URL", "").strip() or None,
+        webhook_secret=webhook_secret,
+        webhook_max_connections=int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40")),
+        webhook_max_body=int(os.environ.get("WEBHOOK_MAX_BODY_BYTES", str(1024 * 1024))),
+        max_concurrent_updates=max(1, int(os.environ.get("MAX_CONCURRENT_UPDATES", "16"))),
+        telegram_pool_size=int(os.environ.get("TELEGRAM_POOL_SIZE", "0")),
     )
 
 
@@ -56,10 +118,16 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             "— Для Excel напишите: отправь в Excel/эксель/таблицей кому-то\n"
             "— Кнопка \"🚀 Отправить на обучение\" добавляется к каждому ответу\n\n"
             "Команды:\n"
-            "• /debug_on, /debug_off — включить/выключить отладку\n"
-            "• /refresh_refs — обновить справочники из БД\n"
-            "• /refs_stats — статистика справочников"
+            "• /debug_on, /debug_off — включить/выключить отладку"
         )
+        # Служебные команды видны только администраторам — остальным они всё равно не ответят
+        if await check_admin_chat(update.effective_chat.id):
+            help_html += (
+                "\n• /refresh_refs — обновить справочники из БД\n"
+                "• /refs_stats — статистика справочников\n"
+                "• /db_stats — статистика кэшей БД и отложенной записи\n"
+                "• /slow_queries [часы] — самые тяжёлые SQL-запросы"
+            )
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text=help_html,
@@ -98,27 +166,364 @@ async def show_cards_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
  
 
 
+# Лимит Telegram — 4096 символов на сообщение; HTML-разметка в длину входит с запасом
+_MESSAGE_LIMIT = 4000
+
+
+async def _send_lines(context: ContextTypes.DEFAULT_TYPE, chat_id: int, lines: List[str]) -> None:
+    """Отправить строки HTML несколькими сообщениями, не разрывая строку (теги в каждой строке закрыты)"""
+    chunk: List[str] = []
+    size = 0
+    for line in lines:
+        line = line[:_MESSAGE_LIMIT]
+        if chunk and size + len(line) + 1 > _MESSAGE_LIMIT:
+            await context.bot.send_message(chat_id=chat_id, text="\n".join(chunk), parse_mode=ParseMode.HTML)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        await context.bot.send_message(chat_id=chat_id, text="\n".join(chunk), parse_mode=ParseMode.HTML)
+
+
+async def db_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Статистика кэшей слоя БД (для администраторов из ADMIN_CHAT_IDS)."""
+    chat_id = update.effective_chat.id
+    if not await check_admin_chat(chat_id):
+        return
+    try:
+        st = get_statement_cache_stats()
+        lines = [
+            "<b>Кэш подготовленных запросов</b>",
+            f"Включён: {'да' if st['enabled'] else 'нет'}" + (" (режим PgBouncer)" if st["pgbouncer_mode"] else ""),
+            f"Попадания: {st['hits']}, промахи: {st['misses']}, hit ratio: {st['hit_ratio']:.1%}",
+            f"Вытеснено: {st['evictions']}, прогрето: {st['warmed']}, устарело: {st['invalidated']}",
+        ]
+        for item in st["top"][:5]:
+            lines.append(
+                f"• <code>{sanitize_html(item['sql'][:80])}</code> — {item['hits']}/{item['hits'] + item['misses']}"
+            )
+        rc = get_result_cache_stats()
+        lines.append("")
+        lines.append(f"<b>Кэш результатов SQL</b> ({rc['backend']})")
+        if rc["enabled"]:
+            size = f", записей {rc['entries']} ({rc['size_mb']} МБ)" if rc["entries"] is not None else ""
+            lines.append(
+                f"Попадания: {rc['hits']}, промахи: {rc['misses']}, устарело: {rc['stale']}, "
+                f"hit ratio: {rc['hit_ratio']:.1%}{size}"
+            )
+            lines.append(
+                f"Сохранено: {rc['stores']}, не кэшируется: {rc['skipped']}, вытеснено: {rc['evictions']}, "
+                f"сбросов по свежести: {rc['invalidations']}, ошибок: {rc['errors']}"
+            )
+            for item in rc["top"][:5]:
+                lines.append(
+                    f"• <code>{sanitize_html(item['sql'][:80])}</code> — {item['hits']}/{item['lookups']} "
+                    f"({item['hit_ratio']:.0%})"
+                )
+        else:
+            lines.append("Выключен")
+        qc = get_query_cost_stats()
+        lines.append("")
+        lines.append("<b>Оценка запросов (EXPLAIN)</b>")
+        if qc["enabled"]:
+            lines.append(
+                f"EXPLAIN: {qc['explains']} (в среднем {qc['avg_explain_ms']:.0f} мс), из кэша планов: {qc['plan_hits']} "
+                f"({qc['plan_hit_ratio']:.1%}), ошибок: {qc['errors']}"
+            )
+            lines.append(
+                f"Отклонено: {qc['rejected']} (порог {qc['max_cost']:.0f}), с автоматическим LIMIT: {qc['limited']}"
+            )
+            for item in qc["rejections"][:5]:
+                lines.append(f"• <code>{sanitize_html(item['sql'][:80])}</code> — {item['cost']:.0f}, ~{item['rows']} строк")
+        else:
+            lines.append("Выключена")
+        gr = get_guarded_relations_stats()
+        lines.append("")
+        lines.append(f"<b>Фильтр бонусных клиентов</b> (SQL_GUARD_MODE={gr['mode']})")
+        for table, t in gr["tables"].items():
+            line = f"• {table} → {t['target']}"
+            if t["refreshes"] or t["failures"]:
+                line += f", обновлений {t['refreshes']} (последнее {t['last_refresh_ms']} мс), ошибок {t['failures']}"
+            if t["refreshing"]:
+                line += ", обновляется"
+            lines.append(line)
+        ro = get_rollup_stats()
+        lines.append("")
+        lines.append("<b>Сводные таблицы</b>")
+        if ro["enabled"]:
+            lines.append(
+                f"Переписано запросов: {ro['routed']}, не подошло: {ro['not_eligible']}, "
+                f"обновлений: {ro['refreshes']} (полных {ro['full_refreshes']}, последнее {ro['last_refresh_ms']} мс), "
+                f"ошибок: {ro['failures']}"
+            )
+            if not ro["in_sync"]:
+                lines.append("Исходные таблицы изменились: до пересчёта запросы идут в profit")
+            for r in ro["rollups"]:
+                stale = ", обновляется" if r["stale"] else ""
+                lines.append(f"• {r['name']}: ~{r['rows']} строк, запросов {r['routed']}{stale}")
+        else:
+            lines.append("Выключены")
+        fp = get_fast_path_stats()
+        lines.append("")
+        lines.append("<b>Быстрые ответы без LLM</b>")
+        if fp["enabled"]:
+            lines.append(f"По шаблону: {fp['hits']} из {fp['questions']} вопросов ({fp['coverage']:.1%})")
+            if fp["fallbacks"]:
+                lines.append("В LLM: " + ", ".join(f"{reason} {count}" for reason, count in fp["fallbacks"].items()))
+            for path, title in (
+                ("fast", "шаблон"), ("cache", "кэш вопросов"), ("llm", "LLM"), ("ttft", "первый текст LLM"),
+            ):
+                lat = fp[path]
+                if lat["count"]:
+                    lines.append(
+                        f"• {title}: {lat['count']} ответов, p50 {lat['p50_ms']:.0f} мс, p95 {lat['p95_ms']:.0f} мс, "
+                        f"в среднем {lat['avg_ms']:.0f} мс"
+                    )
+            if fp["speedup_p50"]:
+                lines.append(f"Шаблон быстрее LLM по медиане в {fp['speedup_p50']:.1f} раза")
+        else:
+            lines.append("Выключены")
+        oc = get_llm_client_stats()
+        lines.append("")
+        lines.append(f"<b>OpenAI</b> ({'HTTP/2' if oc['http2'] else 'HTTP/1.1'}, открыто заранее: {oc['warmed_connections']})")
+        for kind, title in (("chat", "чат"), ("chat_stream", "чат, до начала потока"), ("audio", "речь"), ("embeddings", "эмбеддинги")):
+            lat = oc[kind]
+            if lat["count"]:
+                lines.append(
+                    f"• {title}: {lat['count']} запросов, p50 {lat['p50_ms']:.0f} мс, p95 {lat['p95_ms']:.0f} мс"
+                )
+        lines.append(f"Ошибок: {oc['errors']}, из них таймаутов: {oc['timeouts']}")
+        if oc["hedge_enabled"]:
+            delay = f"{oc['hedge_delay_ms']} мс" if oc["hedge_delay_ms"] is not None else "мало замеров"
+            lines.append(
+                f"Дублирующих запросов: {oc['hedges']} (порог {delay}), "
+                f"дубль ответил первым: {oc['hedge_wins']} ({oc['hedge_win_rate']:.0%})"
+            )
+        ps = get_prompt_stats()
+        lines.append("")
+        lines.append(f"<b>Промпт LLM</b> (токены: {ps['tokenizer']})")
+        lines.append(f"Неизменный префикс: {ps['prefix_tokens']} токенов, <code>{ps['prefix_hash']}</code>")
+        if ps["built"]:
+            lines.append(
+                f"Промптов: {ps['built']}, в среднем {ps['prompt']['avg']} токенов (p95 {ps['prompt']['p95']}), "
+                f"история {ps['history']['avg']} из {ps['history_budget']}"
+            )
+            lines.append(f"Ответов бота сжато: {ps['compacted']}, сообщений истории отброшено: {ps['dropped']}")
+        if ps["schema_pruning"] and ps["schema"]["count"]:
+            saved = 1 - ps["schema"]["avg"] / ps["schema_full_tokens"] if ps["schema_full_tokens"] else 0.0
+            lines.append(
+                f"Схема: в среднем {ps['schema']['avg']} токенов из {ps['schema_full_tokens']} ({saved:.0%} экономии), "
+                f"целиком: {ps['schema_full']} раз"
+            )
+        if ps["usage_reports"]:
+            lines.append(
+                f"По данным API: {ps['avg_billed_prompt_tokens']} токенов на запрос, "
+                f"из кэша провайдера {ps['cached_ratio']:.1%}"
+            )
+        fs = get_few_shot_stats()
+        lines.append("")
+        lines.append("<b>Примеры вопрос → SQL в промпте</b>")
+        if fs["enabled"]:
+            lines.append(
+                f"В индексе: {fs['examples']} ({fs['embedder']}), добавлено {fs['added']}, убрано по обратной связи "
+                f"{fs['removed']}, обновлений {fs['syncs']} (последнее {fs['last_sync_ms']} мс), ошибок {fs['sync_errors']}"
+            )
+            lines.append(
+                f"Поисков: {fs['searches']}, с примерами {fs['with_examples']} ({fs['hit_ratio']:.1%}), "
+                f"p50 {fs['search_p50_ms']:.1f} мс, p95 {fs['search_p95_ms']:.1f} мс, ошибок {fs['errors']}"
+            )
+        else:
+            lines.append("Выключены")
+        ic = get_intent_cache_stats()
+        lines.append("")
+        lines.append("<b>Кэш вопрос → SQL</b>")
+        if ic["enabled"]:
+            lines.append(
+                f"Попадания: {ic['hits']}, промахи: {ic['misses']}, hit ratio: {ic['hit_ratio']:.1%}, "
+                f"без ключа: {ic['uncacheable']}"
+            )
+            lines.append(
+                f"Сохранено: {ic['stores']}, сброшено обратной связью: {ic['invalidations']}, "
+                f"не сработало из кэша: {ic['failed_hits']}, ошибок: {ic['errors']}"
+            )
+        else:
+            lines.append("Выключен")
+        pg = await get_pager_stats()
+        lines.append("")
+        lines.append("<b>Страницы длинных ответов</b>")
+        if pg["enabled"]:
+            stored = f", в Redis {pg['results']} ({pg['size_mb']} МБ)" if pg["results"] is not None else ""
+            lines.append(
+                f"Сохранено: {pg['stored']}, листаний: {pg['flips']}, устарело: {pg['expired']}, "
+                f"вытеснено: {pg['evictions']}, ошибок: {pg['errors']}{stored}"
+            )
+        else:
+            lines.append("Выключены")
+        lines.append("")
+        lines.append("<b>Отложенная запись</b>")
+        for q in get_write_behind_stats():
+            lines.append(
+                f"• {q['name']}: записано {q['written']} за {q['flushes']} пачек, в очереди {q['pending']}, "
+                f"отброшено {q['dropped']}, ошибок {q['failed_flushes']}, последняя пачка {q['last_flush_ms']} мс"
+            )
+        await _send_lines(context, chat_id, lines)
+    except Exception as e:
+        logger.error(f"Error in db_stats command: {e}")
+
+
+async def refresh_refs_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Принудительное обновление справочников (для администраторов из ADMIN_CHAT_IDS)."""
+    chat_id = update.effective_chat.id
+    if not await check_admin_chat(chat_id):
+        return
+    try:
+        await force_refresh_references()
+        st = get_references_stats()
+        if st["last_error"]:
+            text = f"⚠️ Не удалось обновить справочники: {sanitize_html(st['last_error'])}"
+        else:
+            text = f"✅ Справочники обновлены за {st['last_duration_ms']} мс"
+        await context.bot.send_message(chat_id=chat_id, text=text)
+    except Exception as e:
+        logger.error(f"Error in refresh_refs command: {e}")
+
+
+async def refs_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Статистика справочников и их обновлений (для администраторов из ADMIN_CHAT_IDS)."""
+    chat_id = update.effective_chat.id
+    if not await check_admin_chat(chat_id):
+        return
+    try:
+        st = get_references_stats()
+        age = f"{int(datetime.now().timestamp() - st['last_update'])} с назад" if st["last_update"] else "нет"
+        lines = [
+            "<b>Справочники</b>",
+            f"Бренды: {st['brands_count']}, категории: {st['categories_count']}, каналы: {st['channels_count']}",
+            f"Регионы: {st['regions_count']}, клиенты: {st['clients_count']}, менеджеры: {st['managers_count']}",
+            f"Обновлены: {age}" + (" (устарели, обновляются)" if st["refresh_in_progress"] else ""),
+            "",
+            "<b>Обновления</b>",
+            f"Успешных: {st['refreshes']}, ошибок: {st['failures']}, "
+            f"в фоне: {st['background_refreshes']}, запросов ждали загрузку: {st['blocked_requests']}",
+            f"Длительность: последняя {st['last_duration_ms']} мс, средняя {st['avg_duration_ms']} мс, "
+            f"максимум {st['max_duration_ms']} мс",
+        ]
+        if st["queries_ms"]:
+            lines.append("Запросы: " + ", ".join(f"{k} {v} мс" for k, v in st["queries_ms"].items()))
+        if st["last_error"]:
+            lines.append(f"Последняя ошибка: {sanitize_html(st['last_error'])}")
+        await _send_lines(context, chat_id, lines)
+    except Exception as e:
+        logger.error(f"Error in refs_stats command: {e}")
+
+
+async def slow_queries_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Самые тяжёлые формы SQL: с запуска бота или из bot_query_stats за N часов (для администраторов из ADMIN_CHAT_IDS)."""
+    chat_id = update.effective_chat.id
+    if not await check_admin_chat(chat_id):
+        return
+    try:
+        hours = int(context.args[0]) if context.args and context.args[0].isdigit() else 0
+        if hours:
+            top = await get_top_queries_from_db(hours, limit=10)
+            lines = [f"<b>Тяжёлые SQL-запросы за {hours} ч</b> (по суммарному времени; p95/p99 — худшее окно)"]
+        else:
+            summary = get_query_stats_summary()
+            if not summary["enabled"]:
+                await context.bot.send_message(chat_id=chat_id, text="Статистика запросов выключена (QUERY_STATS=false)")
+                return
+            top = get_top_queries(limit=10)
+            lines = [
+                "<b>Тяжёлые SQL-запросы с запуска бота</b> (по суммарному времени)",
+                f"Форм запросов: {summary['shapes']}, выполнений: {summary['calls']}, ошибок: {summary['errors']}",
+            ]
+        if not top:
+            lines.append("Пока нет данных")
+        for i, q in enumerate(top, 1):
+            p50 = f"p50 {q['p50_ms']:.0f} / " if q["p50_ms"] is not None else ""
+            lines.append("")
+            lines.append(
+                f"{i}. {q['calls']} раз (из кэша {q['cached']}), всего {q['total_ms'] / 1000:.1f} с, "
+                f"{p50}p95 {q['p95_ms']:.0f} / p99 {q['p99_ms']:.0f} / max {q['max_ms']:.0f} мс"
+            )
+            lines.append(
+                f"строк в среднем {q['avg_rows']:.0f} (макс. {q['rows_max']}), ошибок {q['errors']} ({q['error_rate']:.0%})"
+            )
+            lines.append(f"<code>{sanitize_html(q['shape'][:200])}</code>")
+        await _send_lines(context, chat_id, lines)
+    except Exception as e:
+        logger.error(f"Error in slow_queries command: {e}")
+
+
+async def _post_init(app: Application) -> None:
+    """Прогрев кэшей после инициализации бота"""
+    await start_auth_cache()
+    await start_data_version()
+    await start_guarded_relations()
+    await start_rollups()
+    await warm_up_client()
+    start_query_stats()
+    start_write_behind()
+    start_reference_refresher()
+    await start_few_shot()
+
+
+async def _post_shutdown(app: Application) -> None:
+    """Остановка фоновых задач и закрытие соединений"""
+    await stop_auth_cache()
+    await stop_data_version()
+    await stop_guarded_relations()
+    await stop_rollups()
+    await stop_reference_refresher()
+    await stop_few_shot()
+    await stop_query_stats()
+    await stop_write_behind()
+    await close_client()
+    await close_pool()
+
+
 def main() -> None:
     """Главная функция приложения (синхронная для корректной работы run_polling)."""
     try:
         settings = read_settings()
 
+        # Каждый параллельно обрабатываемый чат держит 1-2 запроса к Bot API (ответ + ack/удаление),
+        # поэтому пул HTTPX подстраиваем под лимит диспетчера.
+        pool_size = settings.telegram_pool_size or settings.max_concurrent_updates * 2 + 4
+        builder = (
+            Application.builder()
+            .token(settings.telegram_token)
+            .concurrent_updates(ChatOrderedUpdateProcessor(settings.max_concurrent_updates))
+            .connection_pool_size(pool_size)
+            .pool_timeout(10.0)
+            .post_init(_post_init)
+            .post_shutdown(_post_shutdown)
+        )
+        logger.info(
+            f"Dispatcher: {settings.max_concurrent_updates} concurrent chats, HTTPX pool size {pool_size}"
+        )
+
         telegram_base_url = os.getenv("TELEGRAM_API_BASE_URL")
         if telegram_base_url:
-            app = Application.builder().token(settings.telegram_token).base_url(telegram_base_url).build()
+            app = builder.base_url(telegram_base_url).build()
             logger.info(f"Using Telegram API proxy: {telegram_base_url}")
         else:
-            app = Application.builder().token(settings.telegram_token).build()
+            app = builder.build()
             logger.info("Using standard Telegram API")
 
         app.add_handler(CommandHandler("start", start_command))
         app.add_handler(CommandHandler("debug_on", debug_on))
         app.add_handler(CommandHandler("debug_off", debug_off))
+        app.add_handler(CommandHandler("db_stats", db_stats_command))
+        app.add_handler(CommandHandler("refresh_refs", refresh_refs_command))
+        app.add_handler(CommandHandler("refs_stats", refs_stats_command))
+        app.add_handler(CommandHandler("slow_queries", slow_queries_command))
         
         app.add_handler(CommandHandler("cards", show_cards_command))
         app.add_handler(CallbackQueryHandler(handle_card_callback, pattern="^card_"))
         app.add_handler(CallbackQueryHandler(handle_training_feedback, pattern="^training_"))
         app.add_handler(CallbackQueryHandler(handle_comment_form, pattern="^comment_"))
+        app.add_handler(CallbackQueryHandler(handle_page_callback, pattern="^page:"))
         app.add_handler(MessageHandler(filters.VOICE, handle_voice_message))
         app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
 
@@ -128,7 +533,7 @@ def main() -> None:
             # Простая синхронная инициализация без event loop
             import time
             time.sleep(0.1)  # Небольшая пауза для стабилизации
-            logger.info("✅ Справочники будут загружены при первом запросе")
+            logger.info("✅ Справочники загружаются в фоне при старте и обновляются по TTL")
         except Exception as e:
             logger.error(f"❌ Ошибка инициализации справочников: {e}")
             
@@ -142,11 +547,16 @@ def main() -> None:
         # import time
         # time.sleep(1)
 
-        logger.info("Starting polling (PTB v21 run_polling)...")
-        app.run_polling(
-            poll_interval=settings.polling_interval,
-            allowed_updates=Update.ALL_TYPES
-        )
+        if settings.mode == "webhook":
+            from src.bot.webhook import serve_webhook
+            logger.info("Starting webhook mode (embedded aiohttp listener)...")
+            asyncio.run(serve_webhook(app, settings))
+        else:
+            logger.info("Starting polling (PTB v21 run_polling)...")
+            app.run_polling(
+                poll_interval=settings.polling_interval,
+                allowed_updates=Update.ALL_TYPES
+            )
 
     except Exception as e:
         logger.error(f"Critical error in main: {e}")
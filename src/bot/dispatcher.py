@@ -0,0 +1,95 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+from src.utils.logger import get_logger
+
+logger = get_logger("bot.dispatcher")
+
+
+def chat_key(update: object) -> Optional[Hashable]:
+    """Ключ упорядочивания апдейта: id чата, иначе id пользователя, иначе None."""
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return ("user", user.id)
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает апдейты разных чатов параллельно, а апдейты одного чата — строго по очереди.
+
+    - max_concurrent — сколько апдейтов реально выполняется одновременно (глобальный лимит);
+    - max_pending — сколько апдейтов может ждать своей очереди (передаётся в PTB как
+      max_concurrent_updates, чтобы ожидающие в очереди своего чата не занимали рабочие слоты).
+
+    Порядок внутри чата держится на asyncio.Lock: PTB создаёт задачи в порядке получения
+    апдейтов, а Lock отдаёт владение ожидающим строго FIFO.
+    """
+
+    __slots__ = ("_max_concurrent", "_running", "_chat_locks", "_chat_waiters", "_stats")
+
+    def __init__(self, max_concurrent: int, max_pending: Optional[int] = None):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be a positive integer")
+        super().__init__(max_pending or max_concurrent * 8)
+        self._max_concurrent = max_concurrent
+        self._running = asyncio.BoundedSemaphore(max_concurrent)
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Hashable, int] = {}
+        self._stats = {"processed": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    @property
+    def max_concurrent(self) -> int:
+        return self._max_concurrent
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "max_concurrent": self._max_concurrent,
+            "active_chats": len(self._chat_locks),
+        }
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = chat_key(update)
+        if key is None:
+            async with self._running:
+                await self._run(coroutine)
+            return
+
+        lock = self._chat_locks.get(key)
+        if lock is None:
+            lock = self._chat_locks[key] = asyncio.Lock()
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._running:
+                    await self._run(coroutine)
+        finally:
+            left = self._chat_waiters[key] - 1
+            if left:
+                self._chat_waiters[key] = left
+            else:
+                # Последний апдейт чата — освобождаем lock, чтобы словарь не рос бесконечно
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        self._stats["in_flight"] += 1
+        self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._stats["in_flight"])
+        try:
+            await coroutine
+        finally:
+            self._stats["in_flight"] -= 1
+            self._stats["processed"] += 1
+
+    async def initialize(self) -> None:
+        logger.info(f"🚦 Диспетчер апдейтов: до {self._max_concurrent} чатов параллельно")
+
+    async def shutdown(self) -> None:
+        self._chat_locks.clear()
+        self._chat_waiters.clear()
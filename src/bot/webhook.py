@@ -0,0 +1,102 @@
+from __future__ import annotations
+import asyncio
+import hmac
+import signal
+from typing import TYPE_CHECKING
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from src.utils.logger import get_logger
+
+if TYPE_CHECKING:
+    from src.bot.app import Settings
+
+logger = get_logger("bot.webhook")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def build_webhook_app(app: Application, settings: "Settings") -> web.Application:
+    """Собирает aiohttp-приложение, принимающее апдейты Telegram.
+
+    Обработчик только проверяет секрет, разбирает JSON и кладёт Update в очередь PTB —
+    сама обработка идёт в фоне, поэтому Telegram получает 200 OK сразу.
+    """
+    secret = settings.webhook_secret.encode("utf-8")
+
+    async def _receive(request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "").encode("utf-8")
+        if not hmac.compare_digest(token, secret):
+            logger.warning(f"⛔ Webhook: неверный secret token от {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, app.bot)
+        except Exception as e:
+            logger.warning(f"⚠️ Webhook: некорректный Update JSON: {e}")
+            return web.Response(status=400)
+
+        if update is None:
+            return web.Response(status=400)
+
+        await app.update_queue.put(update)
+        return web.Response(status=200)
+
+    async def _health(request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "pending_updates": app.update_queue.qsize()})
+
+    web_app = web.Application(client_max_size=settings.webhook_max_body)
+    web_app.router.add_post(settings.webhook_path, _receive)
+    web_app.router.add_get("/healthz", _health)
+    return web_app
+
+
+async def serve_webhook(app: Application, settings: "Settings") -> None:
+    """Жизненный цикл бота в режиме webhook (аналог run_polling, но со встроенным HTTP-сервером)."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    runner = web.AppRunner(build_webhook_app(app, settings), access_log=None)
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+
+        await runner.setup()
+        site = web.TCPSite(runner, host=settings.webhook_listen, port=settings.webhook_port)
+        await site.start()
+        logger.info(
+            f"🌐 Webhook слушает http://{settings.webhook_listen}:{settings.webhook_port}{settings.webhook_path}"
+        )
+
+        if settings.webhook_url:
+            await app.bot.set_webhook(
+                url=settings.webhook_url,
+                secret_token=settings.webhook_secret,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=settings.webhook_max_connections,
+            )
+            logger.info(f"✅ Webhook зарегистрирован в Telegram: {settings.webhook_url}")
+        else:
+            logger.info("ℹ️ WEBHOOK_URL не задан — регистрация в Telegram пропущена (локальный режим)")
+
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, завершаем webhook...")
+    finally:
+        await runner.cleanup()
+        if app.running:
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
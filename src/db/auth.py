@@ -1,26 +1,197 @@
 from __future__ import annotations
-from src.db.pool import fetch_one
+import asyncio
+import os
+import time
+from typing import FrozenSet, Optional, Set
 
+from src.db.pool import fetch_all, connect, register_hot_statement
+from src.utils.logger import get_logger
 
-async def check_authorized_chat(chat_id: int) -> bool:
-    """Проверить авторизацию чата"""
-    from src.utils.logger import get_logger
-    logger = get_logger("auth")
-    
-    logger.info(f"🔐 Проверка авторизации для chat_id: {chat_id}")
-    
+logger = get_logger("auth")
+
+# Канал, в который триггер на bot_autorized_chats шлёт "<TG_OP>:<chat_id>"
+# (см. migrations/001_bot_autorized_chats_notify.sql)
+AUTH_NOTIFY_CHANNEL = "bot_autorized_chats_changed"
+
+# Плановое обновление кэша, пока LISTEN-подписка жива (страховка от потерянных уведомлений)
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))
+# Если подписки нет — перечитываем таблицу часто, чтобы отзыв доступа доходил за секунды
+AUTH_CACHE_POLL_TTL = int(os.getenv("AUTH_CACHE_POLL_TTL", "10"))
+# Чаты администраторов (через запятую): служебные команды /db_stats, /slow_queries, /refs_stats,
+# /refresh_refs. Пусто — служебные команды выключены
+ADMIN_CHAT_IDS: FrozenSet[int] = frozenset(
+    int(x) for x in os.getenv("ADMIN_CHAT_IDS", "").replace(";", ",").split(",") if x.strip()
+)
+# Как часто проверяем живость LISTEN-соединения
+_LISTEN_PING_INTERVAL = 15
+# Сколько раз перечитать таблицу, если во время чтения пришли уведомления
+_REFRESH_ATTEMPTS = 3
+
+_AUTHORIZED_CHATS_SQL = "SELECT chat_id FROM bot_autorized_chats;"
+register_hot_statement(_AUTHORIZED_CHATS_SQL)
+
+# Кэш авторизованных чатов: неизменяемое множество, подменяется целиком
+_authorized: Optional[FrozenSet[int]] = None
+_loaded_at: float = 0.0
+_listening = False
+# Номер изменения из NOTIFY: снимок, прочитанный до изменения, подменять кэш не должен
+_generation = 0
+_refresh_task: Optional[asyncio.Task] = None
+_watch_task: Optional[asyncio.Task] = None
+# Ссылки на фоновые обновления, чтобы задачи не собрал сборщик мусора до завершения
+_background: Set[asyncio.Task] = set()
+
+
+async def refresh_authorized_chats() -> int:
+    """Перечитать bot_autorized_chats целиком и атомарно подменить кэш.
+
+    SELECT мог начаться до того, как закоммитился DELETE/INSERT, уведомление о котором уже
+    применено в _on_notify, — такой снимок отбрасывается и таблица перечитывается.
+    """
+    global _authorized, _loaded_at
+    for _ in range(_REFRESH_ATTEMPTS):
+        generation = _generation
+        rows = await fetch_all(_AUTHORIZED_CHATS_SQL)
+        if generation == _generation:
+            _authorized = frozenset(int(r["chat_id"]) for r in rows if r.get("chat_id") is not None)
+            _loaded_at = time.monotonic()
+            logger.debug(f"🔐 Кэш авторизации обновлён: {len(_authorized)} чатов")
+            return len(_authorized)
+    # Изменения идут непрерывно: остаёмся на кэше, который ведут уведомления, и пробуем позже
+    logger.warning("⚠️ Кэш авторизации не обновлён: таблица менялась во время каждого чтения")
+    return len(_authorized or ())
+
+
+async def _refresh_single_flight() -> None:
+    """Одно обновление на всех: параллельные вызовы ждут уже идущую загрузку"""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(refresh_authorized_chats())
+    await asyncio.shield(_refresh_task)
+
+
+async def _refresh_quietly() -> None:
     try:
-        # Просто проверяем существование записи в таблице
-        logger.info(f"🔍 Выполняю SQL запрос для chat_id: {chat_id}")
-        row = await fetch_one("SELECT chat_id FROM bot_autorized_chats WHERE chat_id = $1;", (chat_id,))
-        
-        logger.info(f"📋 Результат SQL запроса: {row}")
-        
-        is_authorized = bool(row)
-        logger.info(f"✅ Результат авторизации для chat_id {chat_id}: {is_authorized}")
-        
-        return is_authorized  # Если запись найдена - доступ разрешен
+        await _refresh_single_flight()
     except Exception as e:
-        logger.error(f"❌ Ошибка при проверке авторизации для chat_id {chat_id}: {e}")
-        # В случае ошибки БД - отказываем в доступе
+        logger.error(f"❌ Не удалось обновить кэш авторизации: {e}")
+
+
+def _spawn_refresh() -> None:
+    task = asyncio.create_task(_refresh_quietly())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def _is_stale() -> bool:
+    ttl = AUTH_CACHE_TTL if _listening else AUTH_CACHE_POLL_TTL
+    return (time.monotonic() - _loaded_at) > ttl
+
+
+async def check_authorized_chat(chat_id: int) -> bool:
+    """Проверить авторизацию чата (по кэшу в памяти, без обращения к БД)"""
+    if _authorized is None:
+        # Кэш ещё не загружен (старт без post_init или БД была недоступна) — грузим один раз
+        try:
+            await _refresh_single_flight()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при проверке авторизации для chat_id {chat_id}: {e}")
+            # В случае ошибки БД - отказываем в доступе
+            return False
+    elif _is_stale() and (_refresh_task is None or _refresh_task.done()):
+        # Отдаём текущий снимок, обновляемся в фоне
+        _spawn_refresh()
+
+    is_authorized = chat_id in (_authorized or ())
+    logger.debug(f"🔐 Авторизация chat_id {chat_id}: {is_authorized}")
+    return is_authorized
+
+
+async def check_admin_chat(chat_id: int) -> bool:
+    """Чат из ADMIN_CHAT_IDS, который к тому же авторизован в bot_autorized_chats"""
+    if chat_id not in ADMIN_CHAT_IDS:
+        logger.debug(f"🔐 chat_id {chat_id} не в ADMIN_CHAT_IDS, служебная команда пропущена")
         return False
+    return await check_authorized_chat(chat_id)
+
+
+def _on_notify(connection, pid: int, channel: str, payload: str) -> None:
+    """Применить изменение из NOTIFY сразу, не дожидаясь перечитывания таблицы"""
+    global _authorized, _generation
+    _generation += 1
+    op, _, raw_id = (payload or "").partition(":")
+    op = op.upper()
+    try:
+        chat_id = int(raw_id) if raw_id else None
+    except ValueError:
+        chat_id = None
+
+    current = _authorized or frozenset()
+    if op == "DELETE" and chat_id is not None:
+        _authorized = current - {chat_id}
+        logger.info(f"🔐 Доступ отозван для chat_id {chat_id}")
+    elif op == "INSERT" and chat_id is not None:
+        _authorized = current | {chat_id}
+        logger.info(f"🔐 Доступ выдан для chat_id {chat_id}")
+    else:
+        if op == "TRUNCATE":
+            _authorized = frozenset()
+        _spawn_refresh()
+
+
+async def _watch_notifications() -> None:
+    """Держит LISTEN-подписку, переподключается при обрыве и обновляет кэш по TTL"""
+    global _listening
+    while True:
+        conn = None
+        try:
+            conn = await connect()
+            await conn.add_listener(AUTH_NOTIFY_CHANNEL, _on_notify)
+            _listening = True
+            logger.info(f"👂 Подписка на {AUTH_NOTIFY_CHANNEL} активна")
+            # Всё, что изменилось, пока подписки не было
+            await _refresh_quietly()
+            while True:
+                await asyncio.sleep(_LISTEN_PING_INTERVAL)
+                await conn.fetchval("SELECT 1;")
+                if _is_stale():
+                    await _refresh_quietly()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ LISTEN {AUTH_NOTIFY_CHANNEL} прерван: {e}; переподключение")
+        finally:
+            _listening = False
+            if conn is not None and not conn.is_closed():
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+        await asyncio.sleep(AUTH_CACHE_POLL_TTL)
+
+
+async def start_auth_cache() -> None:
+    """Предзагрузка кэша при старте и запуск фоновой подписки на изменения"""
+    global _watch_task
+    try:
+        count = await refresh_authorized_chats()
+        logger.info(f"✅ Кэш авторизации загружен: {count} чатов")
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить кэш авторизации при старте: {e}")
+    if not ADMIN_CHAT_IDS:
+        logger.info("ℹ️ ADMIN_CHAT_IDS не задан: служебные команды выключены")
+    if _watch_task is None or _watch_task.done():
+        _watch_task = asyncio.create_task(_watch_notifications())
+
+
+async def stop_auth_cache() -> None:
+    global _watch_task
+    for task in list(_background):
+        task.cancel()
+    if _watch_task is not None:
+        _watch_task.cancel()
+        try:
+            await _watch_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _watch_task = None
@@ -0,0 +1,144 @@
+from __future__ import annotations
+import asyncio
+import os
+from typing import Callable, Dict, Iterable, List, Optional
+
+from src.db.pool import connect, fetch_all
+from src.utils.logger import get_logger
+
+logger = get_logger("db.data_version")
+
+# Откуда брать версии бизнес-таблиц:
+#   table   — bot_data_version (migrations/006_bot_data_version.sql): номер растёт в той же транзакции,
+#             что и данные, изменения приходят через NOTIFY сразу после commit;
+#   pg_stat — счётчики pg_stat_user_tables без миграции. Они не транзакционные: попадают в статистику
+#             с задержкой после commit, могут теряться и обнуляются pg_stat_reset() — после сброса
+#             старое значение может повториться. Только если миграцию применить нельзя
+DATA_VERSION_SOURCE = os.getenv("DATA_VERSION_SOURCE", "table").strip().lower() or "table"
+
+DATA_VERSION_CHANNEL = "bot_data_changed"
+_LISTEN_PING_INTERVAL = 15
+_RECONNECT_DELAY = 10
+
+_VERSIONS_SQL = "SELECT table_name, version FROM public.bot_data_version WHERE table_name = ANY($1::text[]);"
+_PG_STAT_SQL = (
+    "SELECT relname AS table_name, n_tup_ins + n_tup_upd + n_tup_del AS version "
+    "FROM pg_stat_user_tables WHERE schemaname = 'public' AND relname = ANY($1::text[]);"
+)
+
+# Последние известные версии (из чтений и NOTIFY) — для проверок без запроса к БД
+_known: Dict[str, int] = {}
+_subscribers: List[Callable[[str], None]] = []
+_listening = False
+_watch_task: Optional[asyncio.Task] = None
+
+
+def notifications_enabled() -> bool:
+    return DATA_VERSION_SOURCE == "table"
+
+
+def is_listening() -> bool:
+    """Подписка LISTEN жива: об изменениях таблиц известно сразу, без опроса"""
+    return _listening
+
+
+def _remember(table: str, version: int) -> None:
+    if DATA_VERSION_SOURCE == "table":
+        # Версии только растут: чтение, начатое до NOTIFY, не должно откатить номер назад
+        version = max(version, _known.get(table, 0))
+    _known[table] = version
+
+
+async def read_versions(tables: Iterable[str]) -> Dict[str, int]:
+    """Версии таблиц из БД; таблица, которую ещё не меняли, — 0"""
+    names = list(tables)
+    sql = _VERSIONS_SQL if DATA_VERSION_SOURCE == "table" else _PG_STAT_SQL
+    rows = await fetch_all(sql, (names,))
+    found = {row["table_name"]: int(row["version"]) for row in rows}
+    for name in names:
+        _remember(name, found.get(name, 0))
+    return {name: _known[name] for name in names}
+
+
+def known_version(table: str) -> Optional[int]:
+    """Последняя известная версия таблицы (None — ещё не читали)"""
+    return _known.get(table)
+
+
+def subscribe(callback: Callable[[str], None]) -> None:
+    """callback(table) на каждое изменение из NOTIFY; вызывается в цикле событий, должен быть быстрым"""
+    if callback not in _subscribers:
+        _subscribers.append(callback)
+
+
+def _on_notify(connection, pid: int, channel: str, payload: str) -> None:
+    table, _, raw_version = (payload or "").partition(":")
+    if not table:
+        return
+    try:
+        _remember(table, int(raw_version))
+    except ValueError:
+        pass
+    for callback in list(_subscribers):
+        try:
+            callback(table)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработчика изменения {table}: {e}")
+
+
+def _notify_all() -> None:
+    """Подписка прервалась или восстановилась: изменения могли потеряться — пусть все перепроверят"""
+    for callback in list(_subscribers):
+        try:
+            callback("*")
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработчика изменения данных: {e}")
+
+
+async def _watch_notifications() -> None:
+    global _listening
+    while True:
+        conn = None
+        try:
+            conn = await connect()
+            await conn.add_listener(DATA_VERSION_CHANNEL, _on_notify)
+            _listening = True
+            logger.info(f"👂 Подписка на {DATA_VERSION_CHANNEL} активна")
+            _notify_all()
+            while True:
+                await asyncio.sleep(_LISTEN_PING_INTERVAL)
+                await conn.fetchval("SELECT 1;")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ LISTEN {DATA_VERSION_CHANNEL} прерван: {e}; переподключение")
+        finally:
+            _listening = False
+            if conn is not None and not conn.is_closed():
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+        _notify_all()
+        await asyncio.sleep(_RECONNECT_DELAY)
+
+
+async def start_data_version() -> None:
+    """Подписка на изменения бизнес-таблиц (только DATA_VERSION_SOURCE=table)"""
+    global _watch_task
+    if not notifications_enabled():
+        logger.info("ℹ️ DATA_VERSION_SOURCE=pg_stat: изменения данных видны только при опросе счётчиков")
+        return
+    if _watch_task is None or _watch_task.done():
+        _watch_task = asyncio.create_task(_watch_notifications())
+
+
+async def stop_data_version() -> None:
+    global _watch_task
+    if _watch_task is not None:
+        _watch_task.cancel()
+        try:
+            await _watch_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _watch_task = None
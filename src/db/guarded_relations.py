@@ -0,0 +1,257 @@
+from __future__ import annotations
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.db import data_version
+from src.db.pool import fetch_all, get_pool
+from src.utils.logger import get_logger
+
+logger = get_logger("db.guarded_relations")
+
+# Куда guard_sql переписывает ссылки на таблицы с клиентами:
+#   subquery — подзапрос с NOT IN прямо в запросе (миграция не нужна);
+#   view     — представления bonus_excluded.<таблица> (migrations/002_bonus_excluded_relations.sql);
+#   matview  — материализованные bonus_excluded.<таблица>_mv, обновляются ботом после изменения данных
+SQL_GUARD_MODE = os.getenv("SQL_GUARD_MODE", "subquery").strip().lower() or "subquery"
+# Как часто проверять, изменились ли исходные таблицы, если уведомлений нет (сек);
+# по NOTIFY bot_data_changed обновление начинается сразу
+SQL_GUARD_REFRESH_INTERVAL = float(os.getenv("SQL_GUARD_REFRESH_INTERVAL", "30"))
+
+BONUS_EXCLUDED_SCHEMA = "bonus_excluded"
+
+# Таблица -> таблицы, от которых зависит отфильтрованная версия
+GUARDED_TABLES: Dict[str, Tuple[str, ...]] = {
+    "profit": ("profit", "clients"),
+    "orders": ("orders", "clients"),
+    "debt": ("debt", "clients"),
+    "managers_plan": ("managers_plan", "clients"),
+    "stock": ("stock", "products", "clients"),
+}
+
+_SOURCE_TABLES = sorted({t for deps in GUARDED_TABLES.values() for t in deps})
+
+_EXISTING_SQL = (
+    "SELECT c.relname, c.relkind, c.relispopulated FROM pg_class c "
+    "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = $1;"
+)
+
+# Текущая подмена: ((таблица, отношение), ...) — hashable, входит в ключ мемоизации guard_sql
+_targets: Tuple[Tuple[str, str], ...] = ()
+_views: Set[str] = set()
+_matviews: Set[str] = set()
+_refreshing: Set[str] = set()
+# Версии исходных таблиц, по которым обновлены материализованные (src/db/data_version.py)
+_last_changes: Dict[str, int] = {}
+# Подписка на изменения прерывалась: пока версии не перечитаны, известным номерам не верим
+_resync = {"pending": True, "generation": 0}
+_refresher_task: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+# После уведомления немного ждём: загрузка обычно — серия команд подряд
+_SETTLE_DELAY = 2.0
+
+_STATS: Dict[str, Dict[str, Any]] = {
+    table: {"refreshes": 0, "failures": 0, "last_refresh_ms": 0, "last_refresh_at": None, "last_error": None}
+    for table in GUARDED_TABLES
+}
+
+
+def view_name(table: str) -> str:
+    return f"{BONUS_EXCLUDED_SCHEMA}.{table}"
+
+
+def matview_name(table: str) -> str:
+    return f"{BONUS_EXCLUDED_SCHEMA}.{table}_mv"
+
+
+def relation_targets() -> Tuple[Tuple[str, str], ...]:
+    """Для guard_sql: на какое отношение заменять каждую таблицу (остальные — подзапросом)"""
+    return _targets
+
+
+def _matview_current(table: str) -> bool:
+    """Исходные таблицы (в т.ч. clients с меткой «Бонус») не менялись с обновления материализованного.
+
+    Версии приходят через NOTIFY сразу после commit; без живой подписки об изменениях узнать
+    нечем, и запросы идут в обычные представления.
+    """
+    if not data_version.is_listening() or _resync["pending"]:
+        return False
+    return all(
+        dep in _last_changes and data_version.known_version(dep) == _last_changes[dep] for dep in GUARDED_TABLES[table]
+    )
+
+
+def _recompute_targets() -> None:
+    global _targets
+    targets: List[Tuple[str, str]] = []
+    for table in GUARDED_TABLES:
+        if SQL_GUARD_MODE == "matview" and table in _matviews and table not in _refreshing and _matview_current(table):
+            targets.append((table, matview_name(table)))
+        elif SQL_GUARD_MODE in ("view", "matview") and table in _views:
+            # Пока материализованное устарело, обновляется (или его нет) — обычное представление, оно всегда актуально
+            targets.append((table, view_name(table)))
+    _targets = tuple(targets)
+
+
+async def _load_existing() -> None:
+    """Какие из отношений миграции есть в БД (без миграции остаёмся на подзапросах)"""
+    rows = await fetch_all(_EXISTING_SQL, (BONUS_EXCLUDED_SCHEMA,))
+    _views.clear()
+    _matviews.clear()
+    for row in rows:
+        name, kind = row["relname"], row["relkind"]
+        if kind == "v" and name in GUARDED_TABLES:
+            _views.add(name)
+        elif kind == "m" and name.endswith("_mv") and name[:-3] in GUARDED_TABLES and row["relispopulated"]:
+            _matviews.add(name[:-3])
+    missing = [t for t in GUARDED_TABLES if t not in _views]
+    if missing:
+        logger.warning(
+            f"⚠️ SQL_GUARD_MODE={SQL_GUARD_MODE}, но нет представлений {BONUS_EXCLUDED_SCHEMA} для {', '.join(missing)} "
+            f"(migrations/002_bonus_excluded_relations.sql) — для них фильтр остаётся подзапросом"
+        )
+    _recompute_targets()
+
+
+async def _read_changes() -> Dict[str, int]:
+    generation = _resync["generation"]
+    changes = await data_version.read_versions(_SOURCE_TABLES)
+    if generation == _resync["generation"]:
+        _resync["pending"] = False
+    return changes
+
+
+def _on_data_changed(table: str) -> None:
+    """NOTIFY: изменившиеся таблицы сразу уходят на обычные представления, обновление — без ожидания"""
+    if table == "*":
+        _resync["generation"] += 1
+        _resync["pending"] = True
+    elif table not in _SOURCE_TABLES:
+        return
+    _recompute_targets()
+    if _wake is not None:
+        _wake.set()
+
+
+async def refresh_matview(table: str) -> None:
+    """Обновить материализованное представление; на время обновления запросы идут в обычное"""
+    _refreshing.add(table)
+    _recompute_targets()
+    stats = _STATS[table]
+    start = time.perf_counter()
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(f"REFRESH MATERIALIZED VIEW {matview_name(table)};")
+            await conn.execute(f"ANALYZE {matview_name(table)};")
+        _matviews.add(table)
+        stats["refreshes"] += 1
+        stats["last_refresh_ms"] = int((time.perf_counter() - start) * 1000)
+        stats["last_refresh_at"] = time.time()
+        stats["last_error"] = None
+        logger.info(f"🔄 {matview_name(table)} обновлено за {stats['last_refresh_ms']} мс")
+    except Exception as e:
+        stats["failures"] += 1
+        stats["last_error"] = str(e)
+        logger.error(f"❌ Не удалось обновить {matview_name(table)}: {e}")
+        raise
+    finally:
+        _refreshing.discard(table)
+        _recompute_targets()
+
+
+async def refresh_changed_matviews(force: bool = False) -> List[str]:
+    """Обновить материализованные представления, исходные таблицы которых изменились с прошлой проверки"""
+    changes = await _read_changes()
+    stale = [
+        table for table, deps in GUARDED_TABLES.items()
+        if force or any(changes.get(dep) != _last_changes.get(dep) for dep in deps)
+    ]
+    # Изменившиеся сразу переводим на обычные представления — ответы не ждут обновления
+    _refreshing.update(stale)
+    _recompute_targets()
+    refreshed: List[str] = []
+    try:
+        for table in stale:
+            try:
+                await refresh_matview(table)
+                refreshed.append(table)
+            except Exception:
+                continue
+    finally:
+        _refreshing.difference_update(stale)
+        _recompute_targets()
+    if len(refreshed) == len(stale):
+        _last_changes.update(changes)
+    else:
+        # Зависимости неудачно обновлённых не запоминаем — попробуем снова на следующей проверке
+        failed_deps = {dep for table in stale if table not in refreshed for dep in GUARDED_TABLES[table]}
+        _last_changes.update({k: v for k, v in changes.items() if k not in failed_deps})
+    _recompute_targets()
+    if refreshed:
+        # Кэш результатов мог сохранить ответы, посчитанные по устаревшим данным
+        from src.db.result_cache import invalidate_result_cache
+
+        await invalidate_result_cache()
+    return refreshed
+
+
+async def _refresh_periodically() -> None:
+    global _wake
+    _wake = asyncio.Event()
+    while True:
+        _wake.clear()
+        try:
+            # Первая проверка обновляет всё: неизвестно, сколько данных пришло, пока бот был остановлен
+            await refresh_changed_matviews()
+        except Exception as e:
+            logger.error(f"❌ Проверка изменений для {BONUS_EXCLUDED_SCHEMA} не удалась: {e}")
+        try:
+            await asyncio.wait_for(_wake.wait(), SQL_GUARD_REFRESH_INTERVAL)
+            await asyncio.sleep(_SETTLE_DELAY)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start_guarded_relations() -> None:
+    """Подключить отфильтрованные отношения по SQL_GUARD_MODE и запустить обновление материализованных"""
+    global _refresher_task
+    if SQL_GUARD_MODE not in ("view", "matview"):
+        return
+    try:
+        await _load_existing()
+    except Exception as e:
+        logger.error(f"❌ Не удалось проверить схему {BONUS_EXCLUDED_SCHEMA}, фильтр остаётся подзапросом: {e}")
+        return
+    logger.info(f"🛡️ guard_sql: {', '.join(f'{t} -> {r}' for t, r in _targets) or 'подзапросы'}")
+    if SQL_GUARD_MODE == "matview":
+        if not data_version.notifications_enabled():
+            logger.warning("⚠️ SQL_GUARD_MODE=matview без уведомлений об изменениях (DATA_VERSION_SOURCE=pg_stat): "
+                           "запросы идут в обычные представления")
+        data_version.subscribe(_on_data_changed)
+        if _refresher_task is None or _refresher_task.done():
+            _refresher_task = asyncio.create_task(_refresh_periodically())
+
+
+async def stop_guarded_relations() -> None:
+    global _refresher_task
+    if _refresher_task is not None:
+        _refresher_task.cancel()
+        try:
+            await _refresher_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _refresher_task = None
+
+
+def get_guarded_relations_stats() -> Dict[str, Any]:
+    targets = dict(_targets)
+    return {
+        "mode": SQL_GUARD_MODE,
+        "tables": {
+            table: {"target": targets.get(table, "subquery"), "refreshing": table in _refreshing, **_STATS[table]}
+            for table in GUARDED_TABLES
+        },
+    }
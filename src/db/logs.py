@@ -1,6 +1,32 @@
 from __future__ import annotations
+import os
 from typing import Optional
-from src.db.pool import execute_returning
+from src.db.write_behind import WriteBehindQueue, SequenceIdAllocator, copy_flusher
+from src.utils.logger import get_logger
+
+logger = get_logger("logs")
+
+# id логов выдаются блоками из sequence agent_logs.id: кнопка «Отправить на обучение»
+# получает log_id сразу, а сама запись уходит в БД пачкой в фоне
+LOG_ID_BLOCK_SIZE = int(os.getenv("LOG_ID_BLOCK_SIZE", "50"))
+# Писать SQL ответа к логу в agent_log_sql (migrations/005) — примеры для промпта, AI_FEW_SHOT
+AGENT_LOG_SQL = os.getenv("AGENT_LOG_SQL", "false").lower() in ("1", "true", "yes", "on")
+
+_log_ids = SequenceIdAllocator("public.agent_logs", "id", LOG_ID_BLOCK_SIZE)
+
+# Совместимость со старой схемой: user_request, agent_response, n8n_execution
+agent_log_queue = WriteBehindQueue(
+    "agent_logs",
+    copy_flusher(
+        "agent_logs",
+        ("id", "chat_id", "user_id", "user_name", "user_request", "agent_response", "n8n_execution"),
+    ),
+)
+agent_log_sql_queue = WriteBehindQueue(
+    "agent_log_sql",
+    copy_flusher("agent_log_sql", ("log_id", "sql_query")),
+    after=(agent_log_queue,),
+)
 
 
 async def log_interaction(
@@ -11,19 +37,17 @@ async def log_interaction(
     bot_response: str,
     bot_id: str,
 ) -> Optional[int]:
-    """Записать взаимодействие в лог"""
+    """Записать взаимодействие в лог (запись отложенная, id известен сразу)"""
     try:
-        # Совместимость со старой схемой: user_request, agent_response, n8n_execution
-        row = await execute_returning(
-            """
-            INSERT INTO public.agent_logs (chat_id, user_id, user_name, user_request, agent_response, n8n_execution)
-            VALUES ($1, $2, $3, $4, $5, $6)
-            RETURNING id;
-            """,
-            (chat_id, user_id, user_name, user_message, bot_response, bot_id)
-        )
-        return row["id"] if row else None
+        log_id = await _log_ids.next_id()
     except Exception as e:
-        import logging
-        logging.getLogger("logs").error(f"Failed to log interaction: {e}")
+        logger.error(f"Failed to log interaction: {e}")
         return None
+    agent_log_queue.submit((log_id, chat_id, user_id, user_name, user_message, bot_response, bot_id))
+    return log_id
+
+
+def log_answer_sql(log_id: Optional[int], sql: Optional[str]) -> None:
+    """SQL, по которому собран ответ с данными, — к логу этого ответа (отложенно)"""
+    if AGENT_LOG_SQL and log_id is not None and sql:
+        agent_log_sql_queue.submit((log_id, sql))
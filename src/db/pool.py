@@ -1,35 +1,215 @@
 from __future__ import annotations
 import os
 import asyncio
-from typing import Optional, Dict, Any
+import hashlib
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, AsyncIterator
 import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
 from dotenv import load_dotenv
 
+from src.db.sql_tokenizer import COMMENT, WS, tokenize
+
 # Загружаем переменные окружения
 load_dotenv()
 
 # Глобальный пул соединений
 _pool: Optional[asyncpg.Pool] = None
 
+# Кэш подготовленных запросов (на каждое соединение). В режиме PgBouncer (transaction pooling)
+# именованные prepared statements не переживают смену серверного соединения — кэш выключаем.
+PG_PGBOUNCER = os.getenv("PG_PGBOUNCER", "false").lower() in ("1", "true", "yes", "on")
+PG_STATEMENT_CACHE_SIZE = int(os.getenv("PG_STATEMENT_CACHE_SIZE", "256"))
+# Очень длинные запросы не кэшируем (как max_cacheable_statement_size в asyncpg)
+_MAX_CACHEABLE_STATEMENT = 15 * 1024
+# Сколько отпечатков держим в статистике
+_MAX_TRACKED_FINGERPRINTS = 500
+
+# Частые фиксированные запросы, которые готовим заранее при открытии соединения
+_HOT_STATEMENTS: List[str] = []
+
+_STMT_STATS: Dict[str, Any] = {"hits": 0, "misses": 0, "evictions": 0, "warmed": 0, "invalidated": 0}
+_STMT_BY_FINGERPRINT: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def statement_cache_enabled() -> bool:
+    return not PG_PGBOUNCER and PG_STATEMENT_CACHE_SIZE > 0
+
+
+def normalize_sql(query: str) -> str:
+    """Схлопывает пробелы вне строк/идентификаторов/комментариев и убирает завершающую ';'.
+
+    Запросы, отличающиеся только форматированием, получают один и тот же текст,
+    а значит и один подготовленный запрос. Комментарии остаются как есть, после `--`
+    сохраняется перевод строки: `-- x\\nWHERE a` и `-- x WHERE a` — разные запросы.
+    """
+    try:
+        tokens = tokenize(query or "")
+    except ValueError:
+        # Незакрытая строка — PostgreSQL такой запрос не примет, нормализовать нечего
+        return (query or "").strip()
+    out: List[str] = []
+    separator = ""
+    for token in tokens:
+        if token.kind == WS:
+            separator = separator or " "
+            continue
+        if out:
+            out.append(separator)
+        out.append(token.text)
+        separator = "\n" if token.kind == COMMENT and token.text.startswith("--") else ""
+
+    text = "".join(out).rstrip()
+    while text.endswith(";"):
+        text = text[:-1].rstrip()
+    return text
+
+
+def sql_fingerprint(query: str) -> str:
+    """Отпечаток запроса: sha1 от нормализованного текста"""
+    return hashlib.sha1(normalize_sql(query).encode("utf-8")).hexdigest()
+
+
+def register_hot_statement(query: str) -> None:
+    """Зарегистрировать запрос для подготовки при открытии каждого соединения пула"""
+    if query not in _HOT_STATEMENTS:
+        _HOT_STATEMENTS.append(query)
+
+
+def _track(fingerprint: str, query: str, hit: bool) -> None:
+    entry = _STMT_BY_FINGERPRINT.get(fingerprint)
+    if entry is None:
+        if len(_STMT_BY_FINGERPRINT) >= _MAX_TRACKED_FINGERPRINTS:
+            _STMT_BY_FINGERPRINT.popitem(last=False)
+        entry = _STMT_BY_FINGERPRINT[fingerprint] = {"hits": 0, "misses": 0, "sql": normalize_sql(query)[:200]}
+    else:
+        _STMT_BY_FINGERPRINT.move_to_end(fingerprint)
+    entry["hits" if hit else "misses"] += 1
+
+
+class StatementCachingConnection(asyncpg.Connection):
+    """Соединение asyncpg с LRU-кэшем подготовленных запросов по отпечатку SQL"""
+
+    __slots__ = ("_prepared",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prepared: "OrderedDict[str, PreparedStatement]" = OrderedDict()
+
+    async def prepare_cached(self, query: str, *, warm: bool = False) -> PreparedStatement:
+        fingerprint = sql_fingerprint(query)
+        stmt = self._prepared.get(fingerprint)
+        if stmt is not None:
+            self._prepared.move_to_end(fingerprint)
+            if not warm:
+                _STMT_STATS["hits"] += 1
+                _track(fingerprint, query, hit=True)
+            return stmt
+
+        stmt = await self.prepare(query)
+        self._prepared[fingerprint] = stmt
+        if warm:
+            _STMT_STATS["warmed"] += 1
+        else:
+            _STMT_STATS["misses"] += 1
+            _track(fingerprint, query, hit=False)
+
+        # Вытесняем самые старые; asyncpg закроет statement на сервере, когда на него не останется ссылок
+        while len(self._prepared) > PG_STATEMENT_CACHE_SIZE:
+            self._prepared.popitem(last=False)
+            _STMT_STATS["evictions"] += 1
+        return stmt
+
+    def forget_prepared(self, query: str) -> None:
+        if self._prepared.pop(sql_fingerprint(query), None) is not None:
+            _STMT_STATS["invalidated"] += 1
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    """Прогрев кэша: готовим частые фиксированные запросы сразу при открытии соединения"""
+    if not statement_cache_enabled() or not isinstance(conn, StatementCachingConnection):
+        return
+    from src.utils.logger import get_logger
+    logger = get_logger("db.pool")
+    for query in _HOT_STATEMENTS:
+        try:
+            await conn.prepare_cached(query, warm=True)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось подготовить запрос при прогреве: {e}")
+
+
+async def _run(conn, method: str, query: str, params: tuple):
+    """Выполнить запрос через кэш подготовленных запросов (или напрямую в режиме PgBouncer).
+
+    method: fetch | fetchrow | execute
+    """
+    if not statement_cache_enabled() or len(query) > _MAX_CACHEABLE_STATEMENT:
+        return await getattr(conn, method)(query, *params)
+
+    stmt_method = "fetch" if method == "execute" else method
+    for attempt in range(2):
+        stmt = await conn.prepare_cached(query)
+        try:
+            return await getattr(stmt, stmt_method)(*params)
+        except asyncpg.exceptions.InvalidCachedStatementError:
+            # Схема таблицы поменялась — подготовленный запрос устарел, готовим заново
+            conn.forget_prepared(query)
+            if attempt == 1:
+                raise
+
+
+def get_statement_cache_stats() -> Dict[str, Any]:
+    """Статистика кэша подготовленных запросов"""
+    total = _STMT_STATS["hits"] + _STMT_STATS["misses"]
+    top = sorted(_STMT_BY_FINGERPRINT.items(), key=lambda kv: kv[1]["hits"] + kv[1]["misses"], reverse=True)[:10]
+    return {
+        "enabled": statement_cache_enabled(),
+        "pgbouncer_mode": PG_PGBOUNCER,
+        "capacity_per_connection": PG_STATEMENT_CACHE_SIZE,
+        **_STMT_STATS,
+        "hit_ratio": (_STMT_STATS["hits"] / total) if total else 0.0,
+        "top": [{"fingerprint": fp[:12], **info} for fp, info in top],
+    }
+
+
+def _connect_kwargs() -> Dict[str, Any]:
+    """Параметры подключения к Postgres из окружения"""
+    return dict(
+        host=os.getenv("PG_HOST", "localhost"),
+        port=int(os.getenv("PG_PORT", "5432")),
+        database=os.getenv("PG_DB", "milk"),
+        user=os.getenv("PG_USER"),
+        password=os.getenv("PG_PASSWORD"),
+        ssl=os.getenv("PG_SSLMODE", "prefer") == "require",
+    )
+
 
 async def get_pool() -> asyncpg.Pool:
     """Получить или создать пул соединений"""
     global _pool
     if _pool is None:
         _pool = await asyncpg.create_pool(
-            host=os.getenv("PG_HOST", "localhost"),
-            port=int(os.getenv("PG_PORT", "5432")),
-            database=os.getenv("PG_DB", "milk"),
-            user=os.getenv("PG_USER"),
-            password=os.getenv("PG_PASSWORD"),
-            ssl=os.getenv("PG_SSLMODE", "prefer") == "require",
+            **_connect_kwargs(),
             min_size=5,
             max_size=20,
-            command_timeout=60
+            command_timeout=60,
+            # Встроенный кэш asyncpg выключаем: либо кэшируем сами, либо работаем через PgBouncer
+            statement_cache_size=0,
+            connection_class=StatementCachingConnection,
+            init=_init_connection,
         )
     return _pool
 
 
+async def connect() -> asyncpg.Connection:
+    """Отдельное (не из пула) соединение — для долгоживущих LISTEN-подписок"""
+    return await asyncpg.connect(
+        **_connect_kwargs(),
+        command_timeout=60,
+        statement_cache_size=0 if PG_PGBOUNCER else 100,
+    )
+
+
 async def close_pool():
     """Закрыть пул соединений"""
     global _pool
@@ -42,13 +222,13 @@ async def fetch_one(query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
     """Выполнить запрос и вернуть одну строку"""
     from src.utils.logger import get_logger
     logger = get_logger("db.pool")
-    
+
     max_retries = 3
     for attempt in range(max_retries):
         try:
             pool = await get_pool()
             async with pool.acquire() as conn:
-                row = await conn.fetchrow(query, *params)
+                row = await _run(conn, "fetchrow", query, params)
                 return dict(row) if row else None
         except Exception as e:
             logger.warning(f"⚠️ Попытка {attempt + 1}/{max_retries} для fetch_one: {e}")
@@ -62,13 +242,13 @@ async def fetch_all(query: str, params: tuple = ()) -> list[Dict[str, Any]]:
     """Выполнить запрос и вернуть все строки"""
     from src.utils.logger import get_logger
     logger = get_logger("db.pool")
-    
+
     max_retries = 3
     for attempt in range(max_retries):
         try:
             pool = await get_pool()
             async with pool.acquire() as conn:
-                rows = await conn.fetch(query, *params)
+                rows = await _run(conn, "fetch", query, params)
                 return [dict(row) for row in rows]
         except Exception as e:
             logger.warning(f"⚠️ Попытка {attempt + 1}/{max_retries} для fetch_all: {e}")
@@ -78,11 +258,46 @@ async def fetch_all(query: str, params: tuple = ()) -> list[Dict[str, Any]]:
             await asyncio.sleep(0.1 * (attempt + 1))  # Экспоненциальная задержка
 
 
+# Ошибки соединения, после которых запрос можно повторить на другом соединении пула
+# (ошибки самого запроса — синтаксис, таймаут выполнения — не повторяем)
+_TRANSIENT_ERRORS = (
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.exceptions.AdminShutdownError,
+    asyncpg.exceptions.CannotConnectNowError,
+    OSError,
+    asyncio.TimeoutError,
+)
+
+
+async def fetch_records(query: str, params: tuple = ()) -> List[asyncpg.Record]:
+    """Выполнить запрос одним обращением к серверу и вернуть asyncpg.Record без копирования в dict.
+
+    Обрыв соединения повторяется (до трёх попыток), как в fetch_all.
+    """
+    from src.utils.logger import get_logger
+    logger = get_logger("db.pool")
+
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            pool = await get_pool()
+            async with pool.acquire() as conn:
+                return await _run(conn, "fetch", query, params)
+        except _TRANSIENT_ERRORS as e:
+            logger.warning(f"⚠️ Попытка {attempt + 1}/{max_retries} для fetch_records: {e}")
+            if attempt == max_retries - 1:
+                logger.error(f"❌ Все попытки fetch_records исчерпаны: {e}")
+                raise
+            await asyncio.sleep(0.1 * (attempt + 1))
+    return []
+
+
 async def execute_returning(query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
     """Выполнить запрос с возвратом результата"""
     pool = await get_pool()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(query, *params)
+        row = await _run(conn, "fetchrow", query, params)
         return dict(row) if row else None
 
 
@@ -90,4 +305,29 @@ async def execute(query: str, params: tuple = ()) -> None:
     """Выполнить запрос без возврата результата"""
     pool = await get_pool()
     async with pool.acquire() as conn:
-        await conn.execute(query, *params)
+        await _run(conn, "execute", query, params)
+
+
+async def fetch_iter(query: str, params: tuple = (), batch_size: int = 1000) -> AsyncIterator[List[asyncpg.Record]]:
+    """Читать результат серверным курсором пачками по batch_size строк.
+
+    Курсор живёт внутри read-only транзакции на выделенном соединении пула, поэтому
+    в памяти одновременно находится не больше одной пачки. Строки отдаются как
+    asyncpg.Record (доступ по имени колонки, .get/.keys/.items) без копирования в dict.
+
+    При досрочном выходе из цикла оборачивайте итератор в contextlib.aclosing, чтобы
+    курсор и соединение освободились сразу, а не при сборке мусора.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            if statement_cache_enabled() and len(query) <= _MAX_CACHEABLE_STATEMENT:
+                stmt = await conn.prepare_cached(query)
+                cursor = await stmt.cursor(*params)
+            else:
+                cursor = await conn.cursor(query, *params)
+            while True:
+                batch = await cursor.fetch(batch_size)
+                if not batch:
+                    break
+                yield batch
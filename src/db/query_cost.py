@@ -0,0 +1,173 @@
+from __future__ import annotations
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from src.db.pool import fetch_one, normalize_sql, sql_fingerprint
+from src.utils.logger import get_logger
+
+logger = get_logger("db.query_cost")
+
+# Оценка запроса через EXPLAIN перед выполнением (выключена по умолчанию)
+SQL_COST_GATE = os.getenv("SQL_COST_GATE", "false").lower() in ("1", "true", "yes", "on")
+# Запросы с оценкой стоимости выше порога не выполняются (единицы планировщика PostgreSQL)
+SQL_MAX_PLAN_COST = float(os.getenv("SQL_MAX_PLAN_COST", "5000000"))
+# Потоковая выгрузка в файл, по оценке больше этого числа строк, не выполняется
+SQL_MAX_PLAN_ROWS = int(os.getenv("SQL_MAX_PLAN_ROWS", "1000000"))
+# Сколько держать оценки в кэше планов (сек) и сколько отпечатков помнить
+SQL_PLAN_CACHE_TTL = int(os.getenv("SQL_PLAN_CACHE_TTL", "600"))
+SQL_PLAN_CACHE_SIZE = int(os.getenv("SQL_PLAN_CACHE_SIZE", "1000"))
+
+# Отпечаток запроса -> (истекает, стоимость, строк)
+_PLANS: "OrderedDict[str, Tuple[float, float, int]]" = OrderedDict()
+
+# Самые дорогие из отклонённых запросов — для /db_stats
+_MAX_TRACKED_REJECTIONS = 20
+
+_STATS: Dict[str, Any] = {
+    "explains": 0, "plan_hits": 0, "rejected": 0, "limited": 0, "errors": 0, "explain_ms_total": 0,
+}
+_REJECTED: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+class QueryCostError(ValueError):
+    """Запрос отклонён по оценке планировщика; hint — что показать пользователю"""
+
+    def __init__(self, message: str, hint: str):
+        super().__init__(message)
+        self.hint = hint
+
+
+class QueryPlan(NamedTuple):
+    query: str               # что выполнять: исходный запрос или обёрнутый в LIMIT
+    cost: Optional[float]    # None — оценка не выполнялась
+    rows: Optional[int]
+    limited: bool
+
+
+def cost_gate_enabled() -> bool:
+    return SQL_COST_GATE
+
+
+def _cached_estimate(fingerprint: str) -> Optional[Tuple[float, int]]:
+    entry = _PLANS.get(fingerprint)
+    if entry is None:
+        return None
+    expires, cost, rows = entry
+    if expires < time.monotonic():
+        del _PLANS[fingerprint]
+        return None
+    _PLANS.move_to_end(fingerprint)
+    return cost, rows
+
+
+def _remember_estimate(fingerprint: str, cost: float, rows: int) -> None:
+    _PLANS[fingerprint] = (time.monotonic() + SQL_PLAN_CACHE_TTL, cost, rows)
+    _PLANS.move_to_end(fingerprint)
+    while len(_PLANS) > SQL_PLAN_CACHE_SIZE:
+        _PLANS.popitem(last=False)
+
+
+async def _explain(safe_query: str) -> Tuple[float, int]:
+    start = time.perf_counter()
+    row = await fetch_one(f"EXPLAIN (FORMAT JSON) {safe_query}")
+    _STATS["explains"] += 1
+    _STATS["explain_ms_total"] += int((time.perf_counter() - start) * 1000)
+    plan = next(iter(row.values())) if row else None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    top = plan[0]["Plan"]
+    return float(top["Total Cost"]), int(top["Plan Rows"])
+
+
+async def estimate_query(safe_query: str) -> Optional[Tuple[float, int]]:
+    """(стоимость, строк) по EXPLAIN из кэша планов или из БД; None — оценить не удалось"""
+    fingerprint = sql_fingerprint(safe_query)
+    cached = _cached_estimate(fingerprint)
+    if cached is not None:
+        _STATS["plan_hits"] += 1
+        return cached
+    try:
+        cost, rows = await _explain(safe_query)
+    except Exception as e:
+        # Оценка — только подстраховка: ошибку самого запроса покажет его выполнение
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ EXPLAIN не удался, запрос выполняется без оценки: {e}")
+        return None
+    _remember_estimate(fingerprint, cost, rows)
+    return cost, rows
+
+
+def cached_estimate(safe_query: str) -> Optional[Tuple[float, int]]:
+    """Оценка из кэша планов без обращения к БД"""
+    return _cached_estimate(sql_fingerprint(safe_query))
+
+
+def _reject(safe_query: str, cost: float, rows: int, message: str, hint: str) -> QueryCostError:
+    _STATS["rejected"] += 1
+    fingerprint = sql_fingerprint(safe_query)
+    _REJECTED[fingerprint] = {"cost": cost, "rows": rows, "sql": normalize_sql(safe_query)[:200], "at": time.time()}
+    _REJECTED.move_to_end(fingerprint)
+    while len(_REJECTED) > _MAX_TRACKED_REJECTIONS:
+        _REJECTED.popitem(last=False)
+    logger.warning(f"🛑 SQL отклонён по оценке планировщика: {message}")
+    return QueryCostError(message, hint)
+
+
+def _thousands(n: int) -> str:
+    return f"{n:,}".replace(",", " ")
+
+
+def limit_query(safe_query: str, limit: int) -> str:
+    """Обернуть запрос в LIMIT: планировщик выбирает план с быстрым началом (top-N сортировку и т.п.)"""
+    return f"SELECT * FROM (\n{safe_query}\n) AS limited LIMIT {limit}"
+
+
+async def plan_query(safe_query: str, max_rows: Optional[int]) -> QueryPlan:
+    """Проверить запрос (уже прошедший guard_sql) по оценке EXPLAIN перед выполнением.
+
+    - стоимость выше SQL_MAX_PLAN_COST — QueryCostError;
+    - max_rows=None (потоковая выгрузка) и строк больше SQL_MAX_PLAN_ROWS — QueryCostError;
+    - строк по оценке больше max_rows — запрос оборачивается в LIMIT max_rows + 1
+      (лишняя строка, как и раньше, означает, что результат обрезан).
+    """
+    if not cost_gate_enabled():
+        return QueryPlan(safe_query, None, None, False)
+    estimate = await estimate_query(safe_query)
+    if estimate is None:
+        return QueryPlan(safe_query, None, None, False)
+    cost, rows = estimate
+    if cost > SQL_MAX_PLAN_COST:
+        raise _reject(
+            safe_query, cost, rows,
+            f"estimated cost {cost:.0f} > {SQL_MAX_PLAN_COST:.0f}",
+            "Запрос получился слишком тяжёлым для базы. Сузьте, пожалуйста, период "
+            "или добавьте фильтры (менеджер, бренд, регион, клиент).",
+        )
+    if max_rows is None and rows > SQL_MAX_PLAN_ROWS:
+        raise _reject(
+            safe_query, cost, rows,
+            f"estimated rows {rows} > {SQL_MAX_PLAN_ROWS}",
+            f"В выгрузке получилось бы около {_thousands(rows)} строк — это больше допустимых "
+            f"{_thousands(SQL_MAX_PLAN_ROWS)}. Сузьте, пожалуйста, период или добавьте фильтры.",
+        )
+    if max_rows is not None and rows > max_rows:
+        _STATS["limited"] += 1
+        return QueryPlan(limit_query(safe_query, max_rows + 1), cost, rows, True)
+    return QueryPlan(safe_query, cost, rows, False)
+
+
+def get_query_cost_stats() -> Dict[str, Any]:
+    lookups = _STATS["explains"] + _STATS["plan_hits"]
+    return {
+        "enabled": cost_gate_enabled(),
+        "max_cost": SQL_MAX_PLAN_COST,
+        "max_rows": SQL_MAX_PLAN_ROWS,
+        **_STATS,
+        "plan_hit_ratio": _STATS["plan_hits"] / lookups if lookups else 0.0,
+        "avg_explain_ms": _STATS["explain_ms_total"] / _STATS["explains"] if _STATS["explains"] else 0.0,
+        "cached_plans": len(_PLANS),
+        "rejections": sorted(_REJECTED.values(), key=lambda r: r["cost"], reverse=True),
+    }
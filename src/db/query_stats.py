@@ -0,0 +1,304 @@
+from __future__ import annotations
+import asyncio
+import datetime as _dt
+import hashlib
+import os
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from src.db.pool import fetch_all
+from src.db.sql_tokenizer import IDENT, NUMBER, OP, STRING, tokenize
+from src.db.write_behind import WriteBehindQueue, copy_flusher
+from src.utils.logger import get_logger
+
+logger = get_logger("db.query_stats")
+
+# Статистика по форме запроса (SQL без литералов): выключается QUERY_STATS=false
+QUERY_STATS = os.getenv("QUERY_STATS", "true").lower() in ("1", "true", "yes", "on")
+# Как часто закрывать окно и писать его в bot_query_stats (сек)
+QUERY_STATS_FLUSH_INTERVAL = float(os.getenv("QUERY_STATS_FLUSH_INTERVAL", "300"))
+# Сколько форм запросов держать в памяти и сколько последних задержек на форму для перцентилей
+QUERY_STATS_MAX_SHAPES = int(os.getenv("QUERY_STATS_MAX_SHAPES", "500"))
+QUERY_STATS_SAMPLES = int(os.getenv("QUERY_STATS_SAMPLES", "1000"))
+# Запросы дольше порога пишутся в лог предупреждением (мс)
+SQL_SLOW_QUERY_MS = int(os.getenv("SQL_SLOW_QUERY_MS", "2000"))
+
+_SHAPE_CACHE_SIZE = 1024
+_MAX_SHAPE_LENGTH = 2000
+
+_COLUMNS = (
+    "window_start", "window_end", "fingerprint", "query_shape", "calls", "cached", "errors",
+    "rows_total", "rows_max", "total_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms",
+)
+
+query_stats_queue = WriteBehindQueue("bot_query_stats", copy_flusher("bot_query_stats", _COLUMNS))
+
+_TOP_FROM_DB_SQL = """
+SELECT fingerprint, min(query_shape) AS query_shape,
+       sum(calls) AS calls, sum(cached) AS cached, sum(errors) AS errors,
+       sum(rows_total) AS rows_total, max(rows_max) AS rows_max, sum(total_ms) AS total_ms,
+       max(p95_ms) AS p95_ms, max(p99_ms) AS p99_ms, max(max_ms) AS max_ms
+FROM public.bot_query_stats
+WHERE window_end >= now() - make_interval(hours => $1)
+GROUP BY fingerprint
+ORDER BY sum(total_ms) DESC
+LIMIT $2;
+"""
+
+
+class _Agg:
+    """Счётчики одной формы запроса за период; задержки — только выполненных в БД (не из кэша)"""
+
+    __slots__ = ("calls", "cached", "errors", "rows_total", "rows_max", "total_ms", "max_ms", "samples")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.cached = 0
+        self.errors = 0
+        self.rows_total = 0
+        self.rows_max = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples: Deque[float] = deque(maxlen=QUERY_STATS_SAMPLES)
+
+    def add(self, duration_ms: float, rows: int, cached: bool, error: bool) -> None:
+        self.calls += 1
+        if cached:
+            self.cached += 1
+            return
+        if error:
+            self.errors += 1
+        self.rows_total += rows
+        self.rows_max = max(self.rows_max, rows)
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.samples.append(duration_ms)
+
+    def percentiles(self) -> Tuple[float, float, float]:
+        ordered = sorted(self.samples)
+        return _percentile(ordered, 0.50), _percentile(ordered, 0.95), _percentile(ordered, 0.99)
+
+
+class _Shape:
+    __slots__ = ("shape", "total", "window")
+
+    def __init__(self, shape: str) -> None:
+        self.shape = shape
+        self.total = _Agg()    # с запуска бота (задержки — последние QUERY_STATS_SAMPLES)
+        self.window = _Agg()   # с последней записи в bot_query_stats
+
+
+_SHAPES: "OrderedDict[str, _Shape]" = OrderedDict()
+_window_started = _dt.datetime.now(_dt.timezone.utc)
+_roller_task: Optional[asyncio.Task] = None
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу (ordered — по возрастанию)"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+
+
+# После этих токенов минус — унарный
+_UNARY_CONTEXT = frozenset(("(", ",", "=", "<", ">", "<=", ">=", "<>", "!=", "select", "between", "and", "then", "else"))
+
+
+# Слова, после которых скобка — не вызов функции: «in (?)», но «sum(x)»
+_KEYWORDS_BEFORE_PAREN = frozenset((
+    "all", "and", "any", "as", "between", "by", "case", "else", "exists", "filter", "from", "in", "is",
+    "join", "lateral", "not", "on", "or", "over", "recursive", "select", "some", "then", "union",
+    "using", "values", "when", "where", "with", "within",
+))
+
+
+def _glue(prev: str, cur: str) -> bool:
+    """Писать ли токены слитно: a.b, sum(x), x::int, (a, b)"""
+    if cur == "(":
+        return bool(prev) and (prev[-1].isalnum() or prev[-1] in '_"') and prev not in _KEYWORDS_BEFORE_PAREN
+    return cur in (",", ")", ".", "::", ";") or prev in ("(", ".", "::")
+
+
+@lru_cache(maxsize=_SHAPE_CACHE_SIZE)
+def query_shape(query: str) -> str:
+    """Форма запроса: литералы заменены на ?, списки (?, ?, ...) свёрнуты в (?),
+    слова — в нижнем регистре, пробелы и комментарии убраны.
+
+    Запросы, которые LLM сгенерировала для разных периодов/менеджеров, получают одну форму.
+    """
+    try:
+        tokens = tokenize(query, trivia=False)
+    except ValueError:
+        return " ".join(query.split())[:_MAX_SHAPE_LENGTH]
+    out: List[str] = []
+    for i, tok in enumerate(tokens):
+        if tok.kind == STRING or tok.kind == NUMBER:
+            text = "?"
+        elif tok.kind == IDENT:
+            text = tok.value
+        elif (
+            tok.value == "-" and tok.kind == OP and i + 1 < len(tokens) and tokens[i + 1].kind == NUMBER
+            and (not out or out[-1] in _UNARY_CONTEXT)
+        ):
+            continue  # знак отрицательного числа: -5 и 5 — один литерал
+        else:
+            text = tok.text
+        if text == "?" and len(out) >= 2 and out[-1] == "," and out[-2] == "?":
+            out.pop()  # (?, ?, ?) -> (?)
+            continue
+        out.append(text)
+    while out and out[-1] == ";":
+        out.pop()
+    parts: List[str] = []
+    prev = ""
+    for text in out:
+        if parts and not _glue(prev, text):
+            parts.append(" ")
+        parts.append(text)
+        prev = text
+    return "".join(parts)[:_MAX_SHAPE_LENGTH]
+
+
+def shape_fingerprint(shape: str) -> str:
+    return hashlib.sha1(shape.encode("utf-8")).hexdigest()[:16]
+
+
+def _submit_window(fingerprint: str, entry: _Shape, start: _dt.datetime, end: _dt.datetime) -> None:
+    w = entry.window
+    if not w.calls:
+        return
+    p50, p95, p99 = w.percentiles()
+    query_stats_queue.submit((
+        start, end, fingerprint, entry.shape, w.calls, w.cached, w.errors,
+        w.rows_total, w.rows_max, round(w.total_ms, 3), round(p50, 3), round(p95, 3), round(p99, 3), round(w.max_ms, 3),
+    ))
+    entry.window = _Agg()
+
+
+def record_query(query: str, duration_ms: float, rows: int = 0, *, cached: bool = False, error: bool = False) -> None:
+    """Учесть выполнение запроса (execute_sql / iter_sql)"""
+    if not QUERY_STATS:
+        return
+    shape = query_shape(query)
+    fingerprint = shape_fingerprint(shape)
+    entry = _SHAPES.get(fingerprint)
+    if entry is None:
+        if len(_SHAPES) >= QUERY_STATS_MAX_SHAPES:
+            # Вытесняемая форма не теряет текущее окно — оно уходит в БД сразу
+            old_fp, old = _SHAPES.popitem(last=False)
+            _submit_window(old_fp, old, _window_started, _dt.datetime.now(_dt.timezone.utc))
+        entry = _SHAPES[fingerprint] = _Shape(shape)
+    else:
+        _SHAPES.move_to_end(fingerprint)
+    entry.total.add(duration_ms, rows, cached, error)
+    entry.window.add(duration_ms, rows, cached, error)
+    if not cached and duration_ms >= SQL_SLOW_QUERY_MS:
+        logger.warning(f"🐢 SLOW SQL {fingerprint}: {duration_ms:.0f}ms, {rows} rows — {shape[:300]}")
+
+
+def roll_window() -> int:
+    """Закрыть текущее окно: агрегаты уходят в очередь записи bot_query_stats"""
+    global _window_started
+    end = _dt.datetime.now(_dt.timezone.utc)
+    submitted = 0
+    for fingerprint, entry in _SHAPES.items():
+        if entry.window.calls:
+            _submit_window(fingerprint, entry, _window_started, end)
+            submitted += 1
+    _window_started = end
+    return submitted
+
+
+async def _roll_periodically() -> None:
+    while True:
+        await asyncio.sleep(QUERY_STATS_FLUSH_INTERVAL)
+        try:
+            roll_window()
+        except Exception as e:
+            logger.error(f"❌ Не удалось закрыть окно статистики запросов: {e}")
+
+
+def start_query_stats() -> None:
+    """Запускать до start_write_behind — очередь bot_query_stats стартует вместе с остальными"""
+    global _roller_task
+    if QUERY_STATS and QUERY_STATS_FLUSH_INTERVAL > 0 and (_roller_task is None or _roller_task.done()):
+        _roller_task = asyncio.create_task(_roll_periodically())
+
+
+async def stop_query_stats() -> None:
+    """Остановить и закрыть последнее окно (до stop_write_behind, чтобы оно успело записаться)"""
+    global _roller_task
+    if _roller_task is not None:
+        _roller_task.cancel()
+        try:
+            await _roller_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _roller_task = None
+    if QUERY_STATS:
+        roll_window()
+
+
+def _row(fingerprint: str, shape: str, agg: _Agg) -> Dict[str, Any]:
+    executed = agg.calls - agg.cached
+    p50, p95, p99 = agg.percentiles()
+    return {
+        "fingerprint": fingerprint,
+        "shape": shape,
+        "calls": agg.calls,
+        "cached": agg.cached,
+        "errors": agg.errors,
+        "error_rate": agg.errors / executed if executed else 0.0,
+        "avg_rows": agg.rows_total / executed if executed else 0.0,
+        "rows_max": agg.rows_max,
+        "total_ms": agg.total_ms,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "max_ms": agg.max_ms,
+    }
+
+
+def get_top_queries(limit: int = 10, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+    """Самые тяжёлые формы запросов с запуска бота (по суммарному времени, p95, числу ошибок...)"""
+    rows = [_row(fp, entry.shape, entry.total) for fp, entry in _SHAPES.items()]
+    rows.sort(key=lambda r: r[order_by], reverse=True)
+    return rows[:limit]
+
+
+async def get_top_queries_from_db(hours: int, limit: int = 10) -> List[Dict[str, Any]]:
+    """То же по bot_query_stats за последние hours часов (переживает перезапуски).
+
+    Перцентили окон не складываются — показываем худшее окно (max p95/p99).
+    """
+    rows = await fetch_all(_TOP_FROM_DB_SQL, (hours, limit))
+    result = []
+    for r in rows:
+        executed = int(r["calls"]) - int(r["cached"])
+        result.append({
+            "fingerprint": r["fingerprint"],
+            "shape": r["query_shape"],
+            "calls": int(r["calls"]),
+            "cached": int(r["cached"]),
+            "errors": int(r["errors"]),
+            "error_rate": int(r["errors"]) / executed if executed else 0.0,
+            "avg_rows": int(r["rows_total"]) / executed if executed else 0.0,
+            "rows_max": int(r["rows_max"]),
+            "total_ms": float(r["total_ms"]),
+            "p50_ms": None,
+            "p95_ms": float(r["p95_ms"]),
+            "p99_ms": float(r["p99_ms"]),
+            "max_ms": float(r["max_ms"]),
+        })
+    return result
+
+
+def get_query_stats_summary() -> Dict[str, Any]:
+    return {
+        "enabled": QUERY_STATS,
+        "shapes": len(_SHAPES),
+        "window_started": _window_started,
+        "calls": sum(e.total.calls for e in _SHAPES.values()),
+        "errors": sum(e.total.errors for e in _SHAPES.values()),
+    }
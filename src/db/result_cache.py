@@ -0,0 +1,372 @@
+from __future__ import annotations
+import asyncio
+import datetime as _dt
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.db import data_version
+from src.db.guarded_relations import BONUS_EXCLUDED_SCHEMA, GUARDED_TABLES
+from src.db.pool import fetch_one, normalize_sql, sql_fingerprint
+from src.db.rollups import ROLLUP_SCHEMA, SOURCE_TABLES as ROLLUP_SOURCE_TABLES
+from src.db.sql_guard import referenced_relations
+from src.models.rowset import RowSet
+from src.utils.logger import get_logger
+
+logger = get_logger("db.result_cache")
+
+# memory — в процессе бота, redis — общий для нескольких экземпляров, off — выключен
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory").strip().lower() or "memory"
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "600"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "500"))
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "64"))
+# Большие выборки не кэшируем: одна такая запись вытеснила бы десятки частых
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "5000"))
+# Как часто перечитывать токен свежести данных (сек); при живой подписке на bot_data_changed
+# токен перечитывается сразу после изменения таблицы
+RESULT_CACHE_FRESHNESS_INTERVAL = float(os.getenv("RESULT_CACHE_FRESHNESS_INTERVAL", "5"))
+# Таблицы с бизнес-данными: запись в них (загрузка ETL) сбрасывает кэш.
+# Логи и обратная связь бота сюда не входят — иначе кэш сбрасывался бы каждым ответом.
+RESULT_CACHE_TABLES = [
+    t.strip() for t in os.getenv(
+        "RESULT_CACHE_TABLES",
+        "profit,orders,debt,stock,managers_plan,clients,products,purchase_prices,sales_representatives",
+    ).split(",") if t.strip()
+]
+_CACHED_TABLES = frozenset(RESULT_CACHE_TABLES)
+# Свой запрос токена свежести (одна строка, одно значение), например SELECT max(loaded_at) FROM etl_loads.
+# По умолчанию токен — версии RESULT_CACHE_TABLES из src/db/data_version.py
+RESULT_CACHE_FRESHNESS_SQL = os.getenv("RESULT_CACHE_FRESHNESS_SQL", "").strip()
+
+# Результат зависит не только от данных — такие запросы не кэшируем
+_VOLATILE_PATTERN = re.compile(
+    r"\b(now|random|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday|"
+    r"current_time|current_timestamp|localtime|localtimestamp|current_user|session_user|nextval)\b",
+    re.IGNORECASE,
+)
+# CURRENT_DATE меняется раз в сутки — дата входит в ключ
+_CURRENT_DATE_PATTERN = re.compile(r"\bcurrent_date\b", re.IGNORECASE)
+
+_REDIS_PREFIX = "sql_result"
+_REDIS_LRU_KEY = f"{_REDIS_PREFIX}:lru"
+
+# Сколько отпечатков держим в статистике
+_MAX_TRACKED_FINGERPRINTS = 500
+
+_STATS: Dict[str, Any] = {
+    "hits": 0, "misses": 0, "stale": 0, "stores": 0, "skipped": 0, "evictions": 0,
+    "invalidations": 0, "errors": 0,
+}
+_BY_FINGERPRINT: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+# changes — сколько NOTIFY об изменениях пришло: проверка, начатая до уведомления, токен свежим не считает
+_freshness: Dict[str, Any] = {"token": None, "checked_at": 0.0, "task": None, "error_logged": False, "changes": 0}
+
+
+def result_cache_enabled() -> bool:
+    return RESULT_CACHE_BACKEND in ("memory", "redis") and RESULT_CACHE_TTL > 0 and RESULT_CACHE_MAX_ENTRIES > 0
+
+
+def _track(fingerprint: str, query: str, outcome: str) -> None:
+    entry = _BY_FINGERPRINT.get(fingerprint)
+    if entry is None:
+        if len(_BY_FINGERPRINT) >= _MAX_TRACKED_FINGERPRINTS:
+            _BY_FINGERPRINT.popitem(last=False)
+        entry = _BY_FINGERPRINT[fingerprint] = {"hits": 0, "misses": 0, "stale": 0, "sql": normalize_sql(query)[:200]}
+    else:
+        _BY_FINGERPRINT.move_to_end(fingerprint)
+    entry[outcome] += 1
+
+
+class _MemoryBackend:
+    """LRU в памяти процесса с ограничением по числу записей и объёму"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        # key -> (token, expires_at, nbytes, rows)
+        self._entries: "OrderedDict[str, Tuple[str, float, int, RowSet]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def _drop(self, key: str) -> None:
+        _, _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get(self, key: str, token: str) -> Tuple[Optional[RowSet], bool]:
+        """(результат, устарел ли найденный) — устаревшая запись сразу удаляется"""
+        item = self._entries.get(key)
+        if item is None:
+            return None, False
+        entry_token, expires_at, _, rows = item
+        if entry_token != token or expires_at <= time.monotonic():
+            self._drop(key)
+            return None, True
+        self._entries.move_to_end(key)
+        return rows, False
+
+    async def set(self, key: str, token: str, rows: RowSet) -> bool:
+        size = rows.nbytes()
+        if size > self._max_bytes:
+            return False
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (token, time.monotonic() + RESULT_CACHE_TTL, size, rows)
+        self._bytes += size
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            self._drop(next(iter(self._entries)))
+            _STATS["evictions"] += 1
+        return True
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+
+class _RedisBackend:
+    """Redis: токен свежести входит в ключ (старые записи недостижимы и истекают по TTL),
+    порядок использования — в sorted set, лишнее сверх лимита удаляется с хвоста"""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+
+    @staticmethod
+    def _key(key: str, token: str) -> str:
+        return f"{_REDIS_PREFIX}:{token}:{key}"
+
+    async def get(self, key: str, token: str) -> Tuple[Optional[RowSet], bool]:
+        from src.utils.memory import get_redis
+
+        r = get_redis()
+        redis_key = self._key(key, token)
+        raw = await r.get(redis_key)
+        if raw is None:
+            return None, False
+        await r.zadd(_REDIS_LRU_KEY, {redis_key: time.time()})
+        return RowSet.from_payload(json.loads(raw)), False
+
+    async def set(self, key: str, token: str, rows: RowSet) -> bool:
+        from src.utils.memory import get_redis
+
+        try:
+            # Значения, которые JSON не умеет (Decimal в смешанной колонке, bytes и т.п.), не кэшируем
+            raw = json.dumps(rows.to_payload(), ensure_ascii=False)
+        except (TypeError, ValueError):
+            return False
+        if len(raw) > RESULT_CACHE_MAX_MB * 1024 * 1024:
+            return False
+        r = get_redis()
+        redis_key = self._key(key, token)
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.set(redis_key, raw, ex=RESULT_CACHE_TTL)
+            pipe.zadd(_REDIS_LRU_KEY, {redis_key: time.time()})
+            pipe.zcard(_REDIS_LRU_KEY)
+            _, _, count = await pipe.execute()
+        if count > self._max_entries:
+            evicted = await r.zpopmin(_REDIS_LRU_KEY, count - self._max_entries)
+            if evicted:
+                await r.delete(*(k for k, _ in evicted))
+                _STATS["evictions"] += len(evicted)
+        return True
+
+    async def clear(self) -> None:
+        from src.utils.memory import get_redis
+
+        r = get_redis()
+        keys = await r.zrange(_REDIS_LRU_KEY, 0, -1)
+        if keys:
+            await r.delete(*keys)
+        await r.delete(_REDIS_LRU_KEY)
+
+
+_backend: Optional[Any] = None
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        if RESULT_CACHE_BACKEND == "redis":
+            _backend = _RedisBackend(RESULT_CACHE_MAX_ENTRIES)
+        else:
+            _backend = _MemoryBackend(RESULT_CACHE_MAX_ENTRIES, int(RESULT_CACHE_MAX_MB * 1024 * 1024))
+    return _backend
+
+
+async def _load_freshness_token() -> Optional[str]:
+    if not RESULT_CACHE_FRESHNESS_SQL:
+        versions = await data_version.read_versions(RESULT_CACHE_TABLES)
+        return "v" + "-".join(str(versions[t]) for t in RESULT_CACHE_TABLES)
+    row = await fetch_one(RESULT_CACHE_FRESHNESS_SQL)
+    if not row:
+        return None
+    value = next(iter(row.values()))
+    return None if value is None else str(value)
+
+
+async def _refresh_freshness_token() -> None:
+    changes = _freshness["changes"]
+    try:
+        token = await _load_freshness_token()
+        _freshness["error_logged"] = False
+    except Exception as e:
+        token = None
+        if not _freshness["error_logged"]:
+            logger.warning(f"⚠️ Не удалось получить токен свежести данных, кэш результатов не используется: {e}")
+            _freshness["error_logged"] = True
+    if token != _freshness["token"]:
+        if _freshness["token"] is not None:
+            _STATS["invalidations"] += 1
+            logger.info(f"🔄 Данные обновились (токен {_freshness['token']} -> {token}), кэш результатов сброшен")
+            if RESULT_CACHE_BACKEND == "memory":
+                await _get_backend().clear()
+        _freshness["token"] = token
+    _freshness["checked_at"] = time.monotonic() if changes == _freshness["changes"] else 0.0
+
+
+async def _current_token() -> Optional[str]:
+    """Токен свежести не старше RESULT_CACHE_FRESHNESS_INTERVAL; одновременные запросы ждут одну проверку.
+    Проверка, начатая до NOTIFY об изменении, не считается — ждём следующую."""
+    for _ in range(2):
+        if time.monotonic() - _freshness["checked_at"] < RESULT_CACHE_FRESHNESS_INTERVAL:
+            break
+        task = _freshness["task"]
+        if task is None or task.done():
+            task = _freshness["task"] = asyncio.create_task(_refresh_freshness_token())
+        await asyncio.shield(task)
+    return _freshness["token"]
+
+
+def _on_data_changed(table: str) -> None:
+    """NOTIFY об изменении таблицы: следующий запрос к кэшу перечитает токен, не дожидаясь интервала"""
+    if table == "*" or table in RESULT_CACHE_TABLES:
+        _freshness["changes"] += 1
+        _freshness["checked_at"] = 0.0
+
+
+if not RESULT_CACHE_FRESHNESS_SQL:
+    data_version.subscribe(_on_data_changed)
+
+
+def _source_tables(safe_query: str) -> Optional[Set[str]]:
+    """Бизнес-таблицы, от которых зависит результат: отфильтрованные представления bonus_excluded
+    и сводные таблицы rollup — по своим исходным таблицам. None — есть неизвестные отношения"""
+    relations = referenced_relations(safe_query)
+    if not relations:
+        return None
+    tables: Set[str] = set()
+    for relation in relations:
+        schema, _, name = relation.rpartition(".")
+        base = name[:-3] if name.endswith("_mv") else name
+        if not schema:
+            tables.add(name)
+        elif schema == BONUS_EXCLUDED_SCHEMA and base in GUARDED_TABLES:
+            tables.update(GUARDED_TABLES[base])
+        elif schema == ROLLUP_SCHEMA:
+            tables.update(ROLLUP_SOURCE_TABLES)
+        else:
+            return None
+    return tables
+
+
+def cache_key(safe_query: str, max_rows: Optional[int]) -> Optional[Tuple[str, str]]:
+    """(отпечаток запроса, ключ записи) или None, если результат запроса кэшировать нельзя.
+
+    Кэшируются только запросы к RESULT_CACHE_TABLES: изменения остальных таблиц (логи, обратная
+    связь, авторизация) кэш не сбрасывают, и ответ по ним устарел бы до конца TTL.
+    """
+    if _VOLATILE_PATTERN.search(safe_query):
+        return None
+    tables = _source_tables(safe_query)
+    if tables is None or not tables <= _CACHED_TABLES:
+        return None
+    fingerprint = sql_fingerprint(safe_query)
+    key = f"{fingerprint}:{'all' if max_rows is None else max_rows}"
+    if _CURRENT_DATE_PATTERN.search(safe_query):
+        key += f":{_dt.date.today().isoformat()}"
+    return fingerprint, key
+
+
+async def get_cached_result(safe_query: str, max_rows: Optional[int]) -> Tuple[Optional[RowSet], Optional[Tuple[str, str, str]]]:
+    """Результат из кэша (или None) и «билет» для put_cached_result после выполнения запроса.
+
+    Билет None — кэш выключен, запрос не кэшируемый или токен свежести недоступен.
+    """
+    if not result_cache_enabled():
+        return None, None
+    key = cache_key(safe_query, max_rows)
+    if key is None:
+        _STATS["skipped"] += 1
+        return None, None
+    fingerprint, entry_key = key
+    try:
+        token = await _current_token()
+        if token is None:
+            return None, None
+        rows, stale = await _get_backend().get(entry_key, token)
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Кэш результатов недоступен: {e}")
+        return None, None
+    if rows is not None:
+        _STATS["hits"] += 1
+        _track(fingerprint, safe_query, "hits")
+        return rows, None
+    _STATS["stale" if stale else "misses"] += 1
+    _track(fingerprint, safe_query, "stale" if stale else "misses")
+    return None, (fingerprint, entry_key, token)
+
+
+async def put_cached_result(ticket: Optional[Tuple[str, str, str]], rows: RowSet) -> None:
+    if ticket is None:
+        return
+    if len(rows) > RESULT_CACHE_MAX_ROWS:
+        _STATS["skipped"] += 1
+        return
+    _, entry_key, token = ticket
+    try:
+        if await _get_backend().set(entry_key, token, rows):
+            _STATS["stores"] += 1
+        else:
+            _STATS["skipped"] += 1
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Не удалось сохранить результат в кэш: {e}")
+
+
+async def invalidate_result_cache() -> None:
+    """Сбросить кэш результатов (например, после ручной правки данных)"""
+    _STATS["invalidations"] += 1
+    _freshness["checked_at"] = 0.0
+    await _get_backend().clear()
+
+
+def get_result_cache_stats() -> Dict[str, Any]:
+    """Статистика кэша результатов, в т.ч. по отпечаткам запросов"""
+    lookups = _STATS["hits"] + _STATS["misses"] + _STATS["stale"]
+    top: List[Dict[str, Any]] = []
+    for fingerprint, entry in sorted(
+        _BY_FINGERPRINT.items(), key=lambda kv: kv[1]["hits"] + kv[1]["misses"] + kv[1]["stale"], reverse=True
+    )[:10]:
+        total = entry["hits"] + entry["misses"] + entry["stale"]
+        top.append({"fingerprint": fingerprint, **entry, "lookups": total, "hit_ratio": entry["hits"] / total if total else 0.0})
+    backend = _backend
+    return {
+        "enabled": result_cache_enabled(),
+        "backend": RESULT_CACHE_BACKEND,
+        **_STATS,
+        "lookups": lookups,
+        "hit_ratio": _STATS["hits"] / lookups if lookups else 0.0,
+        "entries": len(backend) if isinstance(backend, _MemoryBackend) else None,
+        "size_mb": round(backend.nbytes / (1024 * 1024), 1) if isinstance(backend, _MemoryBackend) else None,
+        "token": _freshness["token"],
+        "top": top,
+    }
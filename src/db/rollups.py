@@ -0,0 +1,691 @@
+from __future__ import annotations
+import asyncio
+import datetime as _dt
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from src.db import data_version
+from src.db.pool import fetch_all, get_pool
+from src.db.sql_tokenizer import IDENT, NUMBER, QIDENT, STRING, Token, identifier_name, tokenize
+from src.utils.logger import get_logger
+
+logger = get_logger("db.rollups")
+
+# Агрегаты profit по месяцам (migrations/004_profit_rollups.sql): подходящие запросы
+# переписываются на самую маленькую подходящую сводную таблицу (выключено по умолчанию)
+SQL_ROLLUPS = os.getenv("SQL_ROLLUPS", "false").lower() in ("1", "true", "yes", "on")
+# Как часто проверять, изменились ли исходные таблицы, если уведомлений нет (сек);
+# по NOTIFY bot_data_changed пересчёт начинается сразу
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "300"))
+# Сколько последних месяцев пересчитывать при обычном обновлении (поздние проводки, возвраты)
+ROLLUP_REFRESH_LOOKBACK_MONTHS = int(os.getenv("ROLLUP_REFRESH_LOOKBACK_MONTHS", "1"))
+# Раз в сколько часов пересчитывать сводные таблицы целиком (правки задним числом)
+ROLLUP_FULL_REFRESH_HOURS = float(os.getenv("ROLLUP_FULL_REFRESH_HOURS", "24"))
+
+ROLLUP_SCHEMA = "rollup"
+
+
+class Rollup(NamedTuple):
+    name: str
+    dimensions: Tuple[str, ...]   # кроме месяца и знака выручки
+
+
+# Разрез -> (выражение при сборке, таблица-источник)
+DIMENSIONS: Dict[str, Tuple[str, str]] = {
+    "manager": ("p.manager", "profit"),
+    "channel": ("p.channel", "profit"),
+    "region": ("c.region", "clients"),
+    "brand": ("pr.brand", "products"),
+}
+
+# Сводные таблицы: меньшие — раньше (пока нет статистики размеров, выбирается первая подходящая)
+ROLLUPS: Tuple[Rollup, ...] = (
+    Rollup("profit_month_brand", ("brand",)),
+    Rollup("profit_month_region", ("region",)),
+    Rollup("profit_month_manager_channel", ("manager", "channel")),
+    Rollup("profit_month_full", ("manager", "brand", "region", "channel")),
+)
+
+MEASURES = ("revenue", "weight_kg", "quantity")
+
+# Таблицы, из которых собраны сводные
+SOURCE_TABLES = ("profit", "clients", "products")
+
+# Колонки, которые может упоминать запрос к profit/clients/products (остальные — не для сводных)
+_TABLE_COLUMNS: Dict[str, Set[str]] = {
+    "profit": {
+        "order_number", "client_code", "product_code", "order_date", "profit_date", "quantity",
+        "weight_kg", "revenue", "manager", "channel", "warehouse",
+    },
+    "clients": {"client_code", "client_name", "public_name", "region", "manager", "marker"},
+    "products": {"product_code", "product_name", "brand", "category_1", "category_group_1", "client_code"},
+}
+# Колонка -> разрез сводной таблицы
+_DIMENSION_COLUMNS: Dict[Tuple[str, str], str] = {
+    ("profit", "manager"): "manager",
+    ("profit", "channel"): "channel",
+    ("clients", "region"): "region",
+    ("products", "brand"): "brand",
+}
+_JOIN_KEYS = {"clients": "client_code", "products": "product_code"}
+_EXISTS_FLAGS = {"clients": "has_client", "products": "has_product"}
+
+# Функции, которые не меняют смысла при подсчёте по месячным суммам (агрегат — только sum)
+_FUNCTIONS = frozenset((
+    "sum", "round", "coalesce", "nullif", "lower", "upper", "replace", "trim", "initcap", "date_trunc",
+    "to_char", "extract", "abs", "concat", "greatest", "least", "split_part", "length",
+))
+# Слова, которые могут стоять в запросе без кавычек и не являются колонками
+_KEYWORDS = frozenset((
+    "select", "from", "where", "and", "or", "not", "as", "group", "by", "order", "asc", "desc", "nulls",
+    "first", "last", "limit", "offset", "in", "is", "null", "like", "ilike", "between", "case", "when",
+    "then", "else", "end", "date", "numeric", "integer", "int", "bigint", "text", "varchar", "interval",
+    "true", "false", "having", "year", "month", "quarter", "similar", "to",
+))
+# С этими конструкциями запрос в сводные таблицы не переписывается
+_UNSUPPORTED = frozenset((
+    "with", "union", "intersect", "except", "over", "distinct", "lateral", "filter", "within", "window",
+    "grouping", "rollup", "cube", "sets", "for", "fetch",
+))
+_CLAUSE_END = frozenset(("where", "group", "order", "limit", "offset", "having"))
+# Что может стоять вокруг сравнения, чтобы оно было отдельным условием, а не частью арифметики:
+# profit_date >= '2025-01-01' - INTERVAL '10 days' или 0 - revenue > 0 в сводную не переписываются
+_PREDICATE_START = frozenset(("where", "and", "or", "not", "(", "when", "having"))
+_PREDICATE_END = frozenset(("and", "or", ")", "then", "group", "order", "limit", "offset", "having"))
+_TRUNC_UNITS = frozenset(("'month'", "'quarter'", "'year'"))
+_DATE_RE = re.compile(r"^'(\d{4})-(\d{2})-(\d{2})'$")
+
+_available: Tuple[Tuple[str, Tuple[str, ...], float], ...] = ()   # (имя, разрезы, строк)
+_stale: Set[str] = set()
+# Версии profit/clients/products, по которым собраны сводные (src/db/data_version.py)
+_last_changes: Dict[str, int] = {}
+# Подписка на изменения прерывалась: пока версии не перечитаны, известным номерам не верим
+_resync = {"pending": True, "generation": 0}
+_last_full_refresh = 0.0
+_refresher_task: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+# После уведомления немного ждём: загрузка ETL обычно — серия команд подряд
+_SETTLE_DELAY = 2.0
+
+_STATS: Dict[str, Any] = {
+    "routed": 0, "not_eligible": 0, "refreshes": 0, "full_refreshes": 0, "failures": 0,
+    "last_refresh_ms": 0, "last_refresh_at": None, "last_error": None,
+}
+_ROUTED_BY_ROLLUP: Dict[str, int] = {r.name: 0 for r in ROLLUPS}
+
+_EXISTING_SQL = """
+SELECT c.relname, greatest(c.reltuples, 0) AS reltuples, s.refreshed_at IS NOT NULL AS populated
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN rollup.refresh_state s ON s.rollup_name = c.relname
+WHERE n.nspname = 'rollup' AND c.relkind = 'r';
+"""
+
+
+def rollups_enabled() -> bool:
+    return SQL_ROLLUPS
+
+
+def rollup_table(rollup: Rollup, schema: str = ROLLUP_SCHEMA) -> str:
+    return f"{schema}.{rollup.name}"
+
+
+def _sources(rollup: Rollup) -> List[str]:
+    return [t for t in ("clients", "products") if any(DIMENSIONS[d][1] == t for d in rollup.dimensions)]
+
+
+def rollup_columns(rollup: Rollup) -> List[str]:
+    return ["period_month", *rollup.dimensions, *(_EXISTS_FLAGS[t] for t in _sources(rollup)),
+            "revenue_sign", *MEASURES, "rows_count"]
+
+
+def build_refresh_sql(rollup: Rollup, source_schema: str = "public", target_schema: str = ROLLUP_SCHEMA) -> str:
+    """INSERT ... SELECT сводной таблицы из profit без бонусных клиентов; $1 — с какой даты (NULL — всё)"""
+    sources = _sources(rollup)
+    keys = [
+        "date_trunc('month', p.profit_date)::date",
+        *(DIMENSIONS[d][0] for d in rollup.dimensions),
+        *(f"{alias}.{_JOIN_KEYS[t]} IS NOT NULL" for t, alias in (("clients", "c"), ("products", "pr")) if t in sources),
+        "sign(p.revenue)::smallint",
+    ]
+    joins = []
+    if "clients" in sources:
+        joins.append(f"LEFT JOIN {source_schema}.clients c ON c.client_code = p.client_code")
+    if "products" in sources:
+        joins.append(f"LEFT JOIN {source_schema}.products pr ON pr.product_code = p.product_code")
+    # Фильтр бонусных клиентов — как в bonus_excluded.profit (migrations/002)
+    return "\n".join([
+        f"INSERT INTO {rollup_table(rollup, target_schema)} ({', '.join(rollup_columns(rollup))})",
+        f"SELECT {', '.join(keys)},",
+        "       sum(p.revenue), sum(p.weight_kg), sum(p.quantity), count(*)",
+        f"FROM {source_schema}.profit p",
+        *joins,
+        "WHERE p.client_code IS NOT NULL",
+        f"  AND NOT EXISTS (SELECT 1 FROM {source_schema}.clients b "
+        "WHERE b.client_code = p.client_code AND b.marker = 'Бонус')",
+        "  AND ($1::date IS NULL OR p.profit_date >= $1::date)",
+        f"GROUP BY {', '.join(str(i + 1) for i in range(len(keys)))}",
+    ])
+
+
+async def refresh_rollup(
+    conn, rollup: Rollup, since: Optional[_dt.date],
+    source_schema: str = "public", target_schema: str = ROLLUP_SCHEMA,
+) -> None:
+    """Пересчитать месяцы начиная с since (None — всю таблицу) одной транзакцией:
+    читатели видят либо старые, либо новые суммы, но не половину"""
+    table = rollup_table(rollup, target_schema)
+    async with conn.transaction():
+        if since is None:
+            await conn.execute(f"DELETE FROM {table};")
+        else:
+            await conn.execute(f"DELETE FROM {table} WHERE period_month >= $1::date;", since)
+        await conn.execute(build_refresh_sql(rollup, source_schema, target_schema), since)
+        await conn.execute(
+            f"INSERT INTO {target_schema}.refresh_state (rollup_name, refreshed_from, refreshed_at) "
+            "VALUES ($1, $2, now()) ON CONFLICT (rollup_name) "
+            "DO UPDATE SET refreshed_from = EXCLUDED.refreshed_from, refreshed_at = EXCLUDED.refreshed_at;",
+            rollup.name, since,
+        )
+    await conn.execute(f"ANALYZE {table};")
+
+
+# ---------------- маршрутизация ----------------
+
+class _Route(NamedTuple):
+    sql: str
+    rollup: str
+
+
+def _date_literal(sig: List[Token], vals: List[str], i: int) -> Optional[Tuple[_dt.date, int]]:
+    """DATE 'YYYY-MM-DD' | 'YYYY-MM-DD'[::date] с позиции i -> (дата, следующая позиция)"""
+    n = len(vals)
+    if i < n and vals[i] == "date":
+        i += 1
+    if i >= n or sig[i].kind != STRING:
+        return None
+    m = _DATE_RE.match(sig[i].text)
+    if not m:
+        return None
+    try:
+        value = _dt.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    except ValueError:
+        return None
+    i += 1
+    if i + 1 < n and vals[i] == "::" and vals[i + 1] == "date":
+        i += 2
+    return value, i
+
+
+def _is_month_start(d: _dt.date) -> bool:
+    return d.day == 1
+
+
+def _is_month_end(d: _dt.date) -> bool:
+    return (d + _dt.timedelta(days=1)).day == 1
+
+
+def _starts_predicate(vals: List[str], start: int) -> bool:
+    return start == 0 or vals[start - 1] in _PREDICATE_START
+
+
+def _ends_predicate(vals: List[str], i: int) -> bool:
+    return i >= len(vals) or vals[i] in _PREDICATE_END
+
+
+def _month_boundary(sig: List[Token], vals: List[str], start: int, k: int) -> bool:
+    """profit_date на позиции k (с алиасом — с позиции start) сравнивается с границей месяца —
+    по месячным суммам то же самое"""
+    n = len(vals)
+    if k + 1 >= n or not _starts_predicate(vals, start):
+        return False
+    op = vals[k + 1]
+    if op == "between":
+        first = _date_literal(sig, vals, k + 2)
+        if first is None or first[1] >= n or vals[first[1]] != "and":
+            return False
+        second = _date_literal(sig, vals, first[1] + 1)
+        return (
+            second is not None and _ends_predicate(vals, second[1])
+            and _is_month_start(first[0]) and _is_month_end(second[0])
+        )
+    literal = _date_literal(sig, vals, k + 2)
+    if literal is None or not _ends_predicate(vals, literal[1]):
+        return False
+    if op in (">=", "<"):
+        return _is_month_start(literal[0])
+    if op in (">", "<="):
+        return _is_month_end(literal[0])
+    return False
+
+
+def _sign_test(sig: List[Token], vals: List[str], start: int, k: int) -> bool:
+    """revenue > 0 / revenue < 0 — по знаку, который хранится в сводной таблице"""
+    return (
+        k + 2 < len(vals) and vals[k + 1] in (">", "<")
+        and sig[k + 2].kind == NUMBER and float(sig[k + 2].value) == 0
+        and _starts_predicate(vals, start) and _ends_predicate(vals, k + 3)
+    )
+
+
+def _parse_table(sig: List[Token], vals: List[str], i: int) -> Optional[Tuple[str, Optional[Token], int]]:
+    """[public.]таблица [AS] [алиас] -> (таблица, токен алиаса, следующая позиция)"""
+    n = len(vals)
+    if i + 1 < n and vals[i] == "public" and vals[i + 1] == ".":
+        i += 2
+    if i >= n:
+        return None
+    table = identifier_name(sig[i])
+    if table is None:
+        return None
+    i += 1
+    alias: Optional[Token] = None
+    if i < n and vals[i] == "as":
+        i += 1
+        if i >= n or identifier_name(sig[i]) is None:
+            return None
+        alias = sig[i]
+        i += 1
+    elif i < n and sig[i].kind in (IDENT, QIDENT) and vals[i] not in _CLAUSE_END and vals[i] not in (
+        "join", "inner", "left", "right", "full", "cross", "on", "using",
+    ):
+        alias = sig[i]
+        i += 1
+    return table, alias, i
+
+
+def _route(query: str, available: Tuple[Tuple[str, Tuple[str, ...], float], ...]) -> Optional[_Route]:
+    sig = tokenize(query, trivia=False)
+    while sig and sig[-1].value == ";":
+        sig.pop()
+    vals = [t.value for t in sig]
+    n = len(vals)
+    if not n or vals[0] != "select" or "profit" not in vals or vals.count("select") != 1:
+        return None
+    if not _UNSUPPORTED.isdisjoint(vals):
+        return None
+
+    # Глубина скобок и функция, открывшая каждую скобку
+    depth: List[int] = []
+    inner: List[Optional[int]] = []  # ближайшая открытая "(" для каждого токена
+    closer: Dict[int, int] = {}     # индекс "(" -> индекс ")"
+    func_of: Dict[int, str] = {}    # индекс "(" -> имя функции ("" — просто скобки)
+    stack: List[int] = []
+    for i, v in enumerate(vals):
+        if v == ")":
+            if not stack:
+                return None
+            closer[stack.pop()] = i
+        depth.append(len(stack))
+        inner.append(stack[-1] if stack else None)
+        if v == "(":
+            func_of[i] = vals[i - 1] if i > 0 and sig[i - 1].kind == IDENT else ""
+            stack.append(i)
+        elif v == "*" and i > 0 and vals[i - 1] in ("select", "(", ",", "."):
+            return None  # SELECT *, count(*)
+    if stack:
+        return None
+
+    # FROM profit [JOIN clients|products ON ключ = ключ]...
+    f = next((i for i, v in enumerate(vals) if v == "from" and depth[i] == 0), None)
+    if f is None:
+        return None
+    parsed = _parse_table(sig, vals, f + 1)
+    if parsed is None or parsed[0] != "profit":
+        return None
+    _, profit_alias, i = parsed
+    alias_names: Dict[str, str] = {identifier_name(profit_alias) if profit_alias else "profit": "profit"}
+    joined: List[str] = []
+    while i < n and vals[i] in ("join", "inner"):
+        if vals[i] == "inner":
+            i += 1
+            if i >= n or vals[i] != "join":
+                return None
+        parsed = _parse_table(sig, vals, i + 1)
+        if parsed is None or parsed[0] not in _JOIN_KEYS or parsed[0] in joined:
+            return None
+        table, alias, i = parsed
+        name = identifier_name(alias) if alias else table
+        if name in alias_names:
+            return None
+        alias_names[name] = table
+        joined.append(table)
+        # ON a.key = b.key
+        if i + 7 > n or vals[i] != "on" or vals[i + 2] != "." or vals[i + 4] != "=" or vals[i + 6] != ".":
+            return None
+        sides = {
+            (alias_names.get(identifier_name(sig[i + 1]) or ""), identifier_name(sig[i + 3])),
+            (alias_names.get(identifier_name(sig[i + 5]) or ""), identifier_name(sig[i + 7])),
+        }
+        key = _JOIN_KEYS[table]
+        if sides != {("profit", key), (table, key)}:
+            return None
+        i += 8
+    from_end = i
+    if from_end < n and vals[from_end] not in _CLAUSE_END:
+        return None
+
+    # Итоговые выражения SUM(...): мера напрямую или CASE WHEN ... THEN мера [ELSE 0] END
+    payload: Set[int] = set()
+    for o, name in func_of.items():
+        if name != "sum":
+            continue
+        close = closer[o]
+        j = o + 1
+        if vals[j] == "case":
+            then = next((t for t in range(j, close) if vals[t] == "then" and depth[t] == depth[j]), None)
+            if then is None:
+                return None
+            j = then + 1
+        if j + 2 < close and vals[j + 1] == ".":
+            j += 2
+        if vals[j] not in MEASURES:
+            return None
+        payload.add(j)
+        rest = vals[j + 1:close]
+        if vals[o + 1] == "case":
+            if rest not in (["end"], ["else", "0", "end"], ["else", "null", "end"]):
+                return None
+        elif rest:
+            return None
+
+    order_start = next((k for k in range(from_end, n) if vals[k] == "order" and depth[k] == 0), n)
+    select_aliases = {identifier_name(sig[k + 1]) for k in range(n - 1) if vals[k] == "as"}
+    tables_in_query = ["profit", *joined]
+
+    needed: Set[str] = set()
+    replacements: List[Tuple[int, int, str]] = []
+    alias_text = profit_alias.text if profit_alias else "profit"
+
+    def use_column(table: str, column: str, k: int, qualifier: Optional[int]) -> bool:
+        dimension = _DIMENSION_COLUMNS.get((table, column))
+        if dimension:
+            needed.add(dimension)
+            if qualifier is not None and table != "profit":
+                replacements.append((sig[qualifier].start, sig[qualifier].end, alias_text))
+            return True
+        if table != "profit":
+            return False
+        start = k - 2 if qualifier is not None else k
+        if column in MEASURES:
+            if k in payload:
+                return True
+            if column == "revenue" and _sign_test(sig, vals, start, k):
+                replacements.append((sig[k].start, sig[k].end, "revenue_sign"))
+                return True
+            return False
+        if column != "profit_date":
+            return False
+        enclosing = inner[start]
+        func = func_of[enclosing] if enclosing is not None else ""
+        ok = (
+            (func == "date_trunc" and vals[enclosing + 1] in _TRUNC_UNITS and vals[enclosing + 2] == ","
+             and enclosing + 3 == start)
+            or (func == "extract" and vals[enclosing + 1] in ("year", "month", "quarter")
+                and vals[enclosing + 2] == "from" and enclosing + 3 == start)
+            or _month_boundary(sig, vals, start, k)
+        )
+        if ok:
+            replacements.append((sig[k].start, sig[k].end, "period_month"))
+        return ok
+
+    for k in [*range(1, f), *range(from_end, n)]:
+        tok = sig[k]
+        if tok.kind not in (IDENT, QIDENT):
+            continue
+        prev = vals[k - 1] if k else ""
+        nxt = vals[k + 1] if k + 1 < n else ""
+        if prev == ".":
+            continue  # колонка после алиаса — разобрана вместе с алиасом
+        if prev == "as":
+            continue  # имя столбца результата
+        name = identifier_name(tok)
+        if nxt == ".":
+            table = alias_names.get(name or "")
+            column = identifier_name(sig[k + 2]) if k + 2 < n else None
+            if table is None or column is None or column not in _TABLE_COLUMNS[table]:
+                return None
+            if not use_column(table, column, k + 2, k):
+                return None
+            continue
+        if nxt == "(" and tok.kind == IDENT:
+            if name not in _FUNCTIONS:
+                return None
+            continue
+        owners = [t for t in tables_in_query if name in _TABLE_COLUMNS[t]]
+        if k > order_start and name in select_aliases:
+            continue
+        if len(owners) == 1:
+            if not use_column(owners[0], name, k, None):
+                return None
+            continue
+        if owners or tok.kind == QIDENT or name not in _KEYWORDS:
+            return None  # неоднозначная или неизвестная колонка
+
+    # Внутренний JOIN отбрасывал строки без клиента/товара — в сводной это флаг
+    for table in joined:
+        needed.add(next(d for (t, _), d in _DIMENSION_COLUMNS.items() if t == table))
+    candidates = [(rows, idx, name) for idx, (name, dims, rows) in enumerate(available) if needed <= set(dims)]
+    if not candidates:
+        return None
+    _, _, rollup_name = min(candidates)
+
+    flags = [f"{alias_text}.{_EXISTS_FLAGS[t]}" for t in joined]
+    replacements.append((sig[f + 1].start, sig[from_end - 1].end, f"{ROLLUP_SCHEMA}.{rollup_name} {alias_text}"))
+    if flags:
+        where = from_end if from_end < n and vals[from_end] == "where" else None
+        if where is None:
+            replacements.append((sig[from_end - 1].end, sig[from_end - 1].end, f" WHERE {' AND '.join(flags)}"))
+        else:
+            end = next((k for k in range(where + 1, n) if depth[k] == 0 and vals[k] in _CLAUSE_END), None)
+            replacements.append((sig[where].start, sig[where].end, f"WHERE {' AND '.join(flags)} AND ("))
+            pos = sig[end - 1].end if end is not None else sig[-1].end
+            replacements.append((pos, pos, ")"))
+
+    out: List[str] = []
+    pos = 0
+    for start, end, text in sorted(replacements, key=lambda r: (r[0], r[1])):
+        out.append(query[pos:start])
+        out.append(text)
+        pos = end
+    out.append(query[pos:sig[-1].end])
+    return _Route("".join(out), rollup_name)
+
+
+@lru_cache(maxsize=1024)
+def _route_cached(query: str, available: Tuple[Tuple[str, Tuple[str, ...], float], ...]) -> Optional[_Route]:
+    try:
+        return _route(query, available)
+    except ValueError:
+        return None
+
+
+def _sources_unchanged() -> bool:
+    """profit/clients/products не менялись с последнего пересчёта сводных.
+
+    Версии приходят через NOTIFY сразу после commit загрузки, поэтому проверка — без запроса к БД.
+    Без живой подписки об изменениях узнать нечем, и сводные не используются.
+    """
+    if not data_version.is_listening() or _resync["pending"]:
+        return False
+    return all(t in _last_changes and data_version.known_version(t) == _last_changes[t] for t in SOURCE_TABLES)
+
+
+def _routable() -> Tuple[Tuple[str, Tuple[str, ...], float], ...]:
+    if not _sources_unchanged():
+        return ()
+    if not _stale:
+        return _available
+    return tuple(a for a in _available if a[0] not in _stale)
+
+
+def route_query(query: str) -> Optional[str]:
+    """Запрос, уже проверенный guard_sql, переписанный на сводную таблицу; None — только по profit.
+
+    Подходят агрегаты SUM(revenue | weight_kg | quantity) из profit (с JOIN clients/products по ключу)
+    по месяцу, менеджеру, каналу, региону и бренду с фильтрами по этим колонкам, знаку выручки
+    и границам месяцев. Сводные таблицы уже без бонусных клиентов, guard_sql их не трогает.
+    """
+    available = _routable()
+    if not available or not query:
+        return None
+    route = _route_cached(query.strip(), available)
+    if route is None:
+        _STATS["not_eligible"] += 1
+        return None
+    _STATS["routed"] += 1
+    _ROUTED_BY_ROLLUP[route.rollup] += 1
+    return route.sql
+
+
+# ---------------- обновление ----------------
+
+async def _load_existing() -> None:
+    """Какие сводные таблицы созданы миграцией и уже заполнены, и сколько в них строк"""
+    global _available
+    rows = await fetch_all(_EXISTING_SQL)
+    found = {row["relname"]: row for row in rows}
+    _available = tuple(
+        (r.name, r.dimensions, float(found[r.name]["reltuples"]))
+        for r in ROLLUPS if r.name in found and found[r.name]["populated"]
+    )
+
+
+async def _read_changes() -> Dict[str, int]:
+    generation = _resync["generation"]
+    changes = await data_version.read_versions(SOURCE_TABLES)
+    if generation == _resync["generation"]:
+        _resync["pending"] = False
+    return changes
+
+
+def _on_data_changed(table: str) -> None:
+    """NOTIFY: новые строки в исходных таблицах — запросы сразу идут в profit, пересчёт начинается без ожидания"""
+    if table == "*":
+        _resync["generation"] += 1
+        _resync["pending"] = True
+    elif table not in SOURCE_TABLES:
+        return
+    if _wake is not None:
+        _wake.set()
+
+
+async def refresh_rollups(full: bool = False) -> Optional[str]:
+    """Обновить сводные таблицы: новые месяцы (и ROLLUP_REFRESH_LOOKBACK_MONTHS последних) или целиком.
+
+    Возвращает "full" / "incremental" или None, если исходные таблицы не менялись.
+    """
+    global _last_full_refresh
+    changes = await _read_changes()
+    changed = {t for t in SOURCE_TABLES if changes.get(t) != _last_changes.get(t)}
+    if not changed and not full:
+        return None
+    # Справочники влияют на все месяцы (регион, бренд, метка «Бонус»), как и правки задним числом
+    full = (
+        full or bool(changed & {"clients", "products"}) or not _available
+        or time.time() - _last_full_refresh > ROLLUP_FULL_REFRESH_HOURS * 3600
+    )
+    since: Optional[_dt.date] = None
+    pool = await get_pool()
+    start = time.perf_counter()
+    # До конца пересчёта запросы идут в profit: в сводных ещё нет новых строк
+    _stale.update(r.name for r in ROLLUPS)
+    try:
+        async with pool.acquire() as conn:
+            if not full:
+                newest = await conn.fetchval("SELECT max(profit_date) FROM public.profit")
+                if newest is None:
+                    full = True
+                else:
+                    month = newest.replace(day=1)
+                    for _ in range(ROLLUP_REFRESH_LOOKBACK_MONTHS):
+                        month = (month - _dt.timedelta(days=1)).replace(day=1)
+                    since = month
+            for rollup in ROLLUPS:
+                await refresh_rollup(conn, rollup, None if full else since)
+        await _load_existing()
+    except Exception as e:
+        _STATS["failures"] += 1
+        _STATS["last_error"] = str(e)
+        logger.error(f"❌ Не удалось обновить сводные таблицы {ROLLUP_SCHEMA}: {e}")
+        raise
+    finally:
+        _stale.clear()
+    _last_changes.update(changes)
+    if full:
+        _last_full_refresh = time.time()
+        _STATS["full_refreshes"] += 1
+    _STATS["refreshes"] += 1
+    _STATS["last_refresh_ms"] = int((time.perf_counter() - start) * 1000)
+    _STATS["last_refresh_at"] = time.time()
+    _STATS["last_error"] = None
+    kind = "full" if full else "incremental"
+    logger.info(
+        f"🔄 Сводные таблицы {ROLLUP_SCHEMA} обновлены ({'целиком' if full else f'с {since}'}) "
+        f"за {_STATS['last_refresh_ms']} мс"
+    )
+    # Кэш результатов мог сохранить ответы, посчитанные по устаревшим сводным
+    from src.db.result_cache import invalidate_result_cache
+
+    await invalidate_result_cache()
+    return kind
+
+
+async def _refresh_periodically() -> None:
+    global _wake
+    _wake = asyncio.Event()
+    while True:
+        _wake.clear()
+        try:
+            await refresh_rollups()
+        except Exception as e:
+            logger.error(f"❌ Проверка изменений для {ROLLUP_SCHEMA} не удалась: {e}")
+        try:
+            await asyncio.wait_for(_wake.wait(), ROLLUP_REFRESH_INTERVAL)
+            await asyncio.sleep(_SETTLE_DELAY)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start_rollups() -> None:
+    """Подключить сводные таблицы (если есть миграция) и запустить их обновление"""
+    global _refresher_task
+    if not rollups_enabled():
+        return
+    try:
+        await _load_existing()
+    except Exception as e:
+        logger.error(f"❌ Нет сводных таблиц {ROLLUP_SCHEMA} (migrations/004_profit_rollups.sql): {e}")
+        return
+    logger.info(f"📦 Сводные таблицы: {', '.join(a[0] for a in _available) or 'ещё не заполнены'}")
+    if not data_version.notifications_enabled():
+        logger.warning("⚠️ SQL_ROLLUPS без уведомлений об изменениях (DATA_VERSION_SOURCE=pg_stat): запросы идут в profit")
+    data_version.subscribe(_on_data_changed)
+    if _refresher_task is None or _refresher_task.done():
+        _refresher_task = asyncio.create_task(_refresh_periodically())
+
+
+async def stop_rollups() -> None:
+    global _refresher_task
+    if _refresher_task is not None:
+        _refresher_task.cancel()
+        try:
+            await _refresher_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _refresher_task = None
+
+
+def get_rollup_stats() -> Dict[str, Any]:
+    return {
+        "enabled": rollups_enabled(),
+        **_STATS,
+        "in_sync": _sources_unchanged(),
+        "rollups": [
+            {"name": name, "rows": int(rows), "routed": _ROUTED_BY_ROLLUP[name], "stale": name in _stale}
+            for name, _, rows in _available
+        ],
+    }
@@ -1,54 +1,157 @@
 from __future__ import annotations
-from typing import List, Dict, Any
-from src.db.pool import fetch_all
+from contextlib import aclosing
+from typing import List, AsyncIterator, Optional
+import asyncpg
+from src.db.pool import fetch_iter, fetch_records
+from src.db.query_cost import QueryCostError, cached_estimate, cost_gate_enabled, limit_query, plan_query
+from src.db.query_stats import record_query
+from src.db.result_cache import get_cached_result, put_cached_result
+from src.db.rollups import route_query
 from src.db.sql_guard import guard_sql
+from src.models.rowset import RowSet, RowSetBuilder
+import os
 import time
 import logging
 
+# Размер пачки серверного курсора при потоковом чтении
+SQL_STREAM_BATCH_SIZE = int(os.getenv("SQL_STREAM_BATCH_SIZE", "2000"))
 
-async def execute_sql(query: str) -> List[Dict[str, Any]]:
-    """Выполнить SQL-запрос и вернуть результаты"""
+
+def _strip_leading_comments(query: str) -> str:
+    """Удаляет ведущие комментарии перед валидацией (чтобы guard не отклонял SELECT)"""
+    q = (query or "")
+    q = q.lstrip()
+    changed = True
+    while changed:
+        changed = False
+        if q.startswith("--"):
+            nl = q.find("\n")
+            q = q[nl + 1:] if nl != -1 else ""
+            q = q.lstrip()
+            changed = True
+        elif q.startswith("/*"):
+            end = q.find("*/")
+            if end != -1:
+                q = q[end + 2:]
+                q = q.lstrip()
+                changed = True
+    return q
+
+
+def _guard_and_route(query: str) -> str:
+    """guard_sql, затем (с SQL_ROLLUPS) подмена profit на сводную таблицу для подходящих агрегатов"""
+    safe_query = guard_sql(query)
+    routed = route_query(query)
+    if routed is None:
+        return safe_query
+    logging.getLogger("sql").info("📦 SQL ROUTED TO ROLLUP")
+    # Сводные таблицы уже без бонусных клиентов — guard_sql только проверит запрос
+    return guard_sql(routed)
+
+
+async def _fetch_rowset(query: str, max_rows: Optional[int], limited: bool) -> RowSet:
+    """Читает результат одним обращением к серверу (с повтором при обрыве соединения) сразу в RowSet.
+
+    При max_rows запрос оборачивается в LIMIT max_rows + 1 (если этого ещё не сделала оценка
+    стоимости): лишняя строка — признак обрезки, полный набор выгружается курсором (iter_sql).
+    """
+    if max_rows is not None and not limited:
+        query = limit_query(query, max_rows + 1)
+    builder = RowSetBuilder()
+    builder.extend(await fetch_records(query))
+    return builder.build()
+
+
+async def execute_sql(query: str, max_rows: Optional[int] = None) -> RowSet:
+    """Выполнить SQL-запрос и вернуть результаты колоночным RowSet.
+
+    max_rows — ограничить выборку: читается не больше max_rows + 1 строк, так что
+    len(rows) > max_rows означает, что результат обрезан и полный набор нужно
+    выгружать потоково (iter_sql).
+
+    Результаты повторяющихся запросов берутся из кэша (src.db.result_cache), пока
+    данные в таблицах не изменились. Агрегаты по месяцам с SQL_ROLLUPS считаются
+    по сводным таблицам (src.db.rollups).
+
+    С SQL_COST_GATE запрос сначала оценивается EXPLAIN (src.db.query_cost): слишком
+    дорогой не выполняется — QueryCostError пробрасывается вызывающему коду с подсказкой
+    для пользователя, а при оценке больше max_rows строк в запрос добавляется LIMIT.
+    """
     logger = logging.getLogger("sql")
-    
+
     # Логируем начало выполнения запроса
     logger.info(f"🚀 EXECUTING SQL QUERY: {query[:200]}{'...' if len(query) > 200 else ''}")
-    
+
+    start = time.perf_counter()
+    stripped = _strip_leading_comments(query)
     try:
-        start = time.perf_counter()
-        # Удаляем ведущие комментарии перед валидацией (чтобы guard не отклонял SELECT)
-        q = (query or "")
-        q = q.lstrip()
-        changed = True
-        while changed:
-            changed = False
-            if q.startswith("--"):
-                nl = q.find("\n")
-                q = q[nl + 1:] if nl != -1 else ""
-                q = q.lstrip()
-                changed = True
-            elif q.startswith("/*"):
-                end = q.find("*/")
-                if end != -1:
-                    q = q[end + 2:]
-                    q = q.lstrip()
-                    changed = True
-        safe_query = guard_sql(q)
-        rows = await fetch_all(safe_query)
-        dur_ms = int((time.perf_counter() - start) * 1000)
-        
+        safe_query = _guard_and_route(stripped)
+        rows, ticket = await get_cached_result(safe_query, max_rows)
+        if rows is not None:
+            dur_ms = int((time.perf_counter() - start) * 1000)
+            logger.info(f"⚡ SQL QUERY CACHE HIT: {dur_ms}ms, {len(rows)} rows")
+            record_query(stripped, (time.perf_counter() - start) * 1000, len(rows), cached=True)
+            return rows
+        plan = await plan_query(safe_query, max_rows)
+        if plan.limited:
+            logger.info(f"✂️ SQL AUTO-LIMIT: ~{plan.rows} rows estimated, reading {max_rows + 1}")
+        rows = await _fetch_rowset(plan.query, max_rows, plan.limited)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        record_query(stripped, elapsed_ms, len(rows))
+        await put_cached_result(ticket, rows)
+        dur_ms = int(elapsed_ms)
+
         # Детальное логирование результата
         logger.info(f"✅ SQL QUERY SUCCESS: {dur_ms}ms, {len(rows)} rows returned")
-        
-        # Логируем первые несколько строк для отладки
-        if rows and len(rows) > 0:
-            first_row = rows[0]
-            logger.info(f"📊 FIRST ROW DATA: {dict(first_row)}")
-            if len(rows) > 1:
-                logger.info(f"📊 TOTAL ROWS: {len(rows)} (showing first row only)")
-        
+
+        # Первая строка — только для отладки: на INFO это лишний шум и данные клиентов в логах
+        if rows and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📊 FIRST ROW DATA: {rows[0]}")
+
         return rows
+    except QueryCostError:
+        record_query(stripped, (time.perf_counter() - start) * 1000, error=True)
+        raise
     except Exception as e:
+        record_query(stripped, (time.perf_counter() - start) * 1000, error=True)
         # Детальное логирование ошибки
         logger.error(f"❌ SQL QUERY FAILED: {e}")
         logger.error(f"❌ FAILED QUERY: {query}")
-        return []
+        return RowSet.empty()
+
+
+async def iter_sql(query: str, batch_size: int = SQL_STREAM_BATCH_SIZE) -> AsyncIterator[List[asyncpg.Record]]:
+    """Потоковое выполнение SQL (с теми же проверками guard_sql) пачками строк.
+
+    В отличие от execute_sql ошибки не глотаются — вызывающий код сам решает,
+    что показать пользователю (для QueryCostError — её hint).
+    """
+    logger = logging.getLogger("sql")
+    stripped = _strip_leading_comments(query)
+    safe_query = _guard_and_route(stripped)
+    start = time.perf_counter()
+    total = 0
+    try:
+        plan = await plan_query(safe_query, None)
+        async with aclosing(fetch_iter(plan.query, batch_size=batch_size)) as batches:
+            async for batch in batches:
+                total += len(batch)
+                yield batch
+    except Exception:
+        record_query(stripped, (time.perf_counter() - start) * 1000, total, error=True)
+        raise
+    # Время выгрузки включает запись файла потребителем — курсор читается по мере записи
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    record_query(stripped, elapsed_ms, total)
+    logger.info(f"✅ SQL STREAM DONE: {int(elapsed_ms)}ms, {total} rows streamed")
+
+
+def estimated_rows(query: str) -> Optional[int]:
+    """Оценка числа строк результата из кэша планов (без запроса к БД); None — оценки нет"""
+    if not cost_gate_enabled():
+        return None
+    try:
+        estimate = cached_estimate(guard_sql(_strip_leading_comments(query)))
+    except ValueError:
+        return None
+    return estimate[1] if estimate else None
@@ -1,9 +1,33 @@
 from __future__ import annotations
-import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple
 
+from src.db.guarded_relations import relation_targets
+from src.db.sql_tokenizer import IDENT, QIDENT, Token, identifier_name, matching_parens, tokenize
 
-_DDL_DML_PATTERN = re.compile(r"\b(insert|update|delete|merge|alter|drop|truncate|create|grant|revoke|call|copy)\b", re.IGNORECASE)
-_MULTI_STMT_PATTERN = re.compile(r";\s*\S")
+
+_DDL_DML_KEYWORDS = frozenset({
+    "insert", "update", "delete", "merge", "alter", "drop", "truncate", "create", "grant", "revoke", "call", "copy",
+})
+
+# Слова, которые не могут быть алиасом таблицы (после имени таблицы начинается следующая часть запроса)
+_NOT_ALIAS = frozenset({
+    "where", "group", "order", "having", "limit", "offset", "fetch", "for", "window", "union", "intersect", "except",
+    "join", "inner", "left", "right", "full", "cross", "natural", "on", "using", "lateral", "tablesample", "returning",
+    "select", "from", "and", "or", "not", "with", "into", "values",
+})
+
+# После этих слов список FROM текущего SELECT закончился — запятая дальше уже не перечисляет таблицы
+_FROM_LIST_END = frozenset({
+    "where", "group", "having", "order", "limit", "offset", "fetch", "for", "window", "union", "intersect", "except",
+    "returning",
+})
+
+# Начало подзапроса в скобках после FROM: (SELECT ...), (WITH ...), (VALUES ...), (TABLE ...)
+_SUBQUERY_START = frozenset({"select", "with", "values", "table"})
+
+# Сколько разных запросов помним (повторы одного SQL не разбираются заново)
+_GUARD_CACHE_SIZE = 1024
 
 
 def _wrap_table_with_filter(table_name: str, client_column: str) -> str:
@@ -13,45 +37,247 @@ def _wrap_table_with_filter(table_name: str, client_column: str) -> str:
     )
 
 
-def _replace_from_join(query: str, table_name: str, client_column: str) -> str:
-    """
-    Replace FROM/JOIN occurrences of a table with a filtered subquery enforcing the bonus-client filter.
-    Handles optional schema qualification and optional alias, e.g.:
-      FROM profit p  -> FROM (SELECT * FROM public.profit WHERE ...) p
-      JOIN public.orders AS o -> JOIN (SELECT * FROM public.orders WHERE ...) o
-      FROM debt -> FROM (SELECT * FROM public.debt WHERE ...) debt
-    Also handles CTE queries (WITH statements).
-    """
-    # FROM <schema?>table [AS] <alias> | FROM <schema?>table
-    from_pattern = re.compile(
-        rf"\bFROM\s+(?:public\.)?{table_name}\b(\s+(?:AS\s+)?(?P<alias>[a-zA-Z_][a-zA-Z0-9_]*))?",
-        re.IGNORECASE,
+def _wrap_stock() -> str:
+    # Остатки фильтруются через products -> clients: исключаем продукцию бонусных клиентов
+    return (
+        "(SELECT * FROM public.stock WHERE product_code IN ("
+        "SELECT pr.product_code FROM public.products pr "
+        "LEFT JOIN public.clients c ON pr.client_code = c.client_code "
+        "WHERE c.client_code IS NULL OR c.marker <> 'Бонус'"
+        "))"
     )
-    join_pattern = re.compile(
-        rf"\bJOIN\s+(?:public\.)?{table_name}\b(\s+(?:AS\s+)?(?P<alias>[a-zA-Z_][a-zA-Z0-9_]*))?",
-        re.IGNORECASE,
+
+
+# Таблица -> подзапрос с фильтром бонусных клиентов, которым заменяется ссылка на неё
+_WRAPPERS: Dict[str, str] = {
+    "profit": _wrap_table_with_filter("profit", "client_code"),
+    "orders": _wrap_table_with_filter("orders", "client_code"),
+    "debt": _wrap_table_with_filter("debt", "client_code"),
+    "managers_plan": _wrap_table_with_filter("managers_plan", "client_code"),
+    "stock": _wrap_stock(),
+}
+
+
+def _validate(vals: List[str]) -> None:
+    """Один оператор SELECT/WITH без DDL/DML; ключевые слова внутри строк и комментариев не считаются"""
+    if ";" in vals:
+        raise ValueError("Multiple SQL statements are not allowed")
+
+    if vals[0] != "select" and vals[0] != "with":
+        raise ValueError("Only SELECT or WITH (CTE) statements are allowed")
+
+    if not _DDL_DML_KEYWORDS.isdisjoint(vals):
+        raise ValueError("DDL/DML statements are not allowed")
+
+
+def _cte_scopes(vals: List[str], sig: List[Token], match: List[int]) -> List[Tuple[str, int, int]]:
+    """(имя CTE, начало, конец) — диапазон индексов sig, где имя ссылается на CTE, а не на таблицу.
+
+    Имя видно в следующих CTE того же WITH и в основном запросе (в своём теле — только при RECURSIVE),
+    но не за пределами скобок, в которых стоит WITH.
+    """
+    scopes: List[Tuple[str, int, int]] = []
+    n = len(vals)
+    depth_open: List[int] = []  # индексы открывающих скобок по глубине
+    for i, val in enumerate(vals):
+        if val == "(":
+            depth_open.append(i)
+        elif val == ")":
+            if depth_open:
+                depth_open.pop()
+        if val != "with":
+            continue
+        scope_end = match[depth_open[-1]] if depth_open else n
+        j = i + 1
+        recursive = j < n and vals[j] == "recursive"
+        if recursive:
+            j += 1
+        while j < n:
+            name = identifier_name(sig[j])
+            if name is None:
+                break
+            j += 1
+            if j < n and vals[j] == "(":  # список колонок
+                j = match[j] + 1
+            if not (j < n and vals[j] == "as"):
+                break
+            j += 1
+            while j < n and vals[j] in ("not", "materialized"):
+                j += 1
+            if not (j < n and vals[j] == "("):
+                break
+            body_end = match[j]
+            scopes.append((name, j if recursive else body_end, scope_end))
+            j = body_end + 1
+            if not (j < n and vals[j] == ","):
+                break
+            j += 1
+    return scopes
+
+
+def _table_ref(
+    sql: str, vals: List[str], sig: List[Token], j: int, scopes: List[Tuple[str, int, int]], targets: Dict[str, str]
+) -> Optional[Tuple[int, int, str]]:
+    """Если с позиции j начинается ссылка на фильтруемую таблицу — (начало, конец в тексте, замена)"""
+    n = len(vals)
+    if j < n and vals[j] == "only":
+        j += 1
+    if j >= n or vals[j] == "lateral" or identifier_name(sig[j]) is None:
+        return None
+    first = last = j
+    k = j + 1
+    while k + 1 < n and vals[k] == "." and identifier_name(sig[k + 1]) is not None:
+        last = k + 1
+        k += 2
+    if k < n and vals[k] == "(":
+        return None  # функция: generate_series(...) и т.п.
+
+    table = identifier_name(sig[last])
+    wrapper = _WRAPPERS.get(table)
+    if wrapper is None:
+        return None
+    if last > first:
+        if identifier_name(sig[last - 2]) != "public":
+            return None
+    elif any(name == table and start <= j < end for name, start, end in scopes):
+        return None  # это CTE с тем же именем
+
+    # Уже обёрнутая ссылка (повторный guard_sql или фильтр, написанный в точности так же) — не трогаем
+    if first >= 4 and vals[first - 4] == "(" and sql.startswith(wrapper, sig[first - 4].start):
+        return None
+
+    has_alias = k < n and (
+        vals[k] == "as"
+        or sig[k].kind == QIDENT
+        or (sig[k].kind == IDENT and vals[k] not in _NOT_ALIAS)
     )
+    # Отфильтрованное представление (SQL_GUARD_MODE=view | matview) вместо подзапроса
+    replacement = targets.get(table, wrapper)
+    # Без алиаса оставляем имя таблицы алиасом — чтобы работали ссылки вида profit.revenue
+    return sig[first].start, sig[last].end, replacement if has_alias else f"{replacement} {table}"
+
+
+def _table_slots(vals: List[str]) -> Iterator[int]:
+    """Позиции слов, сразу после которых может стоять ссылка на таблицу: FROM, JOIN, запятая в списке
+    FROM, TABLE и скобка вокруг соединения внутри FROM"""
+    # По уровням скобок: был ли SELECT и идёт ли сейчас список FROM
+    select_seen: List[bool] = [False]
+    in_from: List[bool] = [False]
+    # Предыдущий токен открыл место для таблицы (FROM, JOIN, запятая в списке FROM)
+    table_slot = False
+    for i, val in enumerate(vals):
+        slot, table_slot = table_slot, False
+        if val == "(":
+            select_seen.append(False)
+            # FROM (a JOIN b ON ...) — скобки вокруг соединения: внутри тоже список таблиц
+            in_from.append(slot)
+            if not slot:
+                continue
+        elif val == ")":
+            if len(select_seen) > 1:
+                select_seen.pop()
+                in_from.pop()
+            continue
+        elif val == ",":
+            if not in_from[-1]:
+                continue
+        elif val == "select":
+            select_seen[-1] = True
+            in_from[-1] = False
+            continue
+        elif val == "from":
+            # EXTRACT(YEAR FROM x), IS DISTINCT FROM — не список таблиц
+            if not select_seen[-1] or (i > 0 and vals[i - 1] == "distinct"):
+                continue
+            in_from[-1] = True
+        elif val != "join" and val != "table":  # (TABLE profit) — сокращение SELECT * FROM profit
+            if val in _FROM_LIST_END:
+                in_from[-1] = False
+            continue
+
+        table_slot = True
+        yield i
+
 
-    def _from_repl(m: re.Match) -> str:
-        alias = m.group('alias')
-        wrapped = _wrap_table_with_filter(table_name, client_column)
-        if alias:
-            return f"FROM {wrapped} {alias}"
-        else:
-            # Keep table name as alias for compatibility with column qualifiers
-            return f"FROM {wrapped} {table_name}"
+def _rewrite(sql: str, vals: List[str], sig: List[Token], targets: Dict[str, str]) -> str:
+    """Заменить каждую ссылку на фильтруемую таблицу (FROM, JOIN, перечисление через запятую, TABLE)
+    подзапросом с фильтром бонусных клиентов"""
+    if _WRAPPERS.keys().isdisjoint(vals) and not any(t.kind == QIDENT for t in sig):
+        return sql  # фильтруемых таблиц в запросе нет — разбирать нечего
+    match = matching_parens(sig)
+    scopes = _cte_scopes(vals, sig, match) if "with" in vals else []
+
+    replacements: List[Tuple[int, int, str]] = []
+    for i in _table_slots(vals):
+        ref = _table_ref(sql, vals, sig, i + 1, scopes, targets)
+        if ref is not None:
+            if vals[i] == "table":
+                # TABLE (подзапрос) недопустим — разворачиваем в SELECT * FROM
+                ref = (sig[i].start, ref[1], f"SELECT * FROM {ref[2]}")
+            replacements.append(ref)
+
+    if not replacements:
+        return sql
+    out: List[str] = []
+    pos = 0
+    for start, end, text in replacements:
+        out.append(sql[pos:start])
+        out.append(text)
+        pos = end
+    out.append(sql[pos:])
+    return "".join(out)
+
+
+@lru_cache(maxsize=_GUARD_CACHE_SIZE)
+def referenced_relations(sql: str) -> Optional[FrozenSet[str]]:
+    """Таблицы и представления, которые читает запрос: public — без схемы, остальные — schema.name;
+    CTE и подзапросы не входят.
+
+    None — в FROM стоит функция (generate_series(...) и т.п.: что она читает, неизвестно)
+    или запрос не разбирается.
+    """
+    try:
+        sig = tokenize(sql, trivia=False)
+    except ValueError:
+        return None
+    vals = [t.value for t in sig]
+    n = len(vals)
+    match = matching_parens(sig)
+    scopes = _cte_scopes(vals, sig, match) if "with" in vals else []
+    relations = set()
+    for i in _table_slots(vals):
+        j = i + 1
+        while j < n and vals[j] in ("only", "lateral"):
+            j += 1
+        if j >= n or identifier_name(sig[j]) is None or (sig[j].kind == IDENT and vals[j] in _SUBQUERY_START):
+            continue  # подзапрос или скобки вокруг соединения — их таблицы найдутся внутри
+        names = [identifier_name(sig[j])]
+        k = j + 1
+        while k + 1 < n and vals[k] == "." and identifier_name(sig[k + 1]) is not None:
+            names.append(identifier_name(sig[k + 1]))
+            k += 2
+        if k < n and vals[k] == "(":
+            return None
+        if len(names) == 1 and any(name == names[0] and start <= j < end for name, start, end in scopes):
+            continue
+        if names[0] == "public" and len(names) == 2:
+            names = names[1:]
+        relations.add(".".join(names))
+    return frozenset(relations)
 
-    def _join_repl(m: re.Match) -> str:
-        alias = m.group('alias')
-        wrapped = _wrap_table_with_filter(table_name, client_column)
-        if alias:
-            return f"JOIN {wrapped} {alias}"
-        else:
-            return f"JOIN {wrapped} {table_name}"
 
-    query = from_pattern.sub(_from_repl, query)
-    query = join_pattern.sub(_join_repl, query)
-    return query
+@lru_cache(maxsize=_GUARD_CACHE_SIZE)
+def _guard_cached(query: str, targets: Tuple[Tuple[str, str], ...] = ()) -> str:
+    sig = tokenize(query, trivia=False)
+    # Завершающие ';' отбрасываем вместе с хвостом после них (комментарии, пробелы)
+    while sig and sig[-1].value == ";":
+        query = query[:sig[-1].start].rstrip()
+        sig.pop()
+    if not sig:
+        raise ValueError("Empty SQL query")
+    vals = [t.value for t in sig]
+    _validate(vals)
+    return _rewrite(query, vals, sig, dict(targets))
 
 
 def guard_sql(sql: str) -> str:
@@ -59,66 +285,13 @@ def guard_sql(sql: str) -> str:
     Enforce safety and business filters for incoming SQL:
     - Allow only single SELECT statements
     - For tables profit, orders, debt, managers_plan add filter to exclude clients with marker='Бонус'
-    - Support CTEs (WITH)
+      (stock — via products -> clients): either an inline subquery or, with SQL_GUARD_MODE=view | matview,
+      the precomputed relation from the bonus_excluded schema (src/db/guarded_relations.py)
+    - Support CTEs (WITH), comma joins, schema-qualified and quoted table names
+
+    The query is tokenized once (strings, comments and quoted identifiers are never rewritten);
+    results are memoized by query text. Applying guard_sql to its own output is a no-op.
     """
     if not sql or not sql.strip():
         raise ValueError("Empty SQL query")
-
-    # Trim whitespace and remove trailing semicolon
-    query = sql.strip()
-    if query.endswith(';'):
-        query = query[:-1]
-
-    # Disallow multiple statements
-    if _MULTI_STMT_PATTERN.search(query):
-        raise ValueError("Multiple SQL statements are not allowed")
-
-    # Allow only SELECT or WITH (CTE)
-    if not re.match(r"^\s*(select|with)\b", query, re.IGNORECASE):
-        raise ValueError("Only SELECT or WITH (CTE) statements are allowed")
-
-    # Block obvious DDL/DML keywords anywhere
-    if _DDL_DML_PATTERN.search(query):
-        raise ValueError("DDL/DML statements are not allowed")
-
-    # Inject bonus-client filter via table wrapping
-    table_client_map = {
-        'profit': 'client_code',
-        'orders': 'client_code',
-        'debt': 'client_code',
-        'managers_plan': 'client_code',
-    }
-
-    guarded = query
-    for table, client_col in table_client_map.items():
-        guarded = _replace_from_join(guarded, table, client_col)
-
-    # Handle stock via products->clients relationship
-    # Wrap stock with product filter excluding products whose linked client has marker = 'Бонус'
-    def _wrap_stock() -> str:
-        return (
-            "(SELECT * FROM public.stock WHERE product_code IN ("
-            "SELECT pr.product_code FROM public.products pr "
-            "LEFT JOIN public.clients c ON pr.client_code = c.client_code "
-            "WHERE c.client_code IS NULL OR c.marker <> 'Бонус'"
-            "))"
-        )
-
-    def _stock_repl_from(m: re.Match) -> str:
-        alias = m.group('alias')
-        wrapped = _wrap_stock()
-        return f"FROM {wrapped} {alias or 'stock'}"
-
-    def _stock_repl_join(m: re.Match) -> str:
-        alias = m.group('alias')
-        wrapped = _wrap_stock()
-        return f"JOIN {wrapped} {alias or 'stock'}"
-
-    stock_from = re.compile(r"\bFROM\s+(?:public\.)?stock\b(\s+(?:AS\s+)?(?P<alias>[a-zA-Z_][a-zA-Z0-9_]*))?", re.IGNORECASE)
-    stock_join = re.compile(r"\bJOIN\s+(?:public\.)?stock\b(\s+(?:AS\s+)?(?P<alias>[a-zA-Z_][a-zA-Z0-9_]*))?", re.IGNORECASE)
-    guarded = stock_from.sub(_stock_repl_from, guarded)
-    guarded = stock_join.sub(_stock_repl_join, guarded)
-
-    return guarded
-
-
+    return _guard_cached(sql.strip(), relation_targets())
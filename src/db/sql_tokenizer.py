@@ -0,0 +1,114 @@
+from __future__ import annotations
+import re
+from typing import List, NamedTuple, Optional
+
+# Виды токенов
+WS = "ws"
+COMMENT = "comment"
+STRING = "string"
+IDENT = "ident"          # слово без кавычек (ключевое слово или идентификатор)
+QIDENT = "qident"        # "идентификатор в кавычках"
+NUMBER = "number"
+PARAM = "param"          # $1
+OP = "op"                # пунктуация и операторы
+
+# Один проход регуляркой-альтернативой: сканирование идёт на C, Python видит только готовые токены.
+# Порядок важен: комментарии раньше операторов, $1 раньше dollar-quoting.
+# В E'…' кроме '' экранирует и обратная косая черта (E'\'' — одна кавычка), в прочих строках — нет
+# (standard_conforming_strings = on). Строка без закрывающей кавычки попадает в unterminated.
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<ws>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+    | (?P<string>[Ee]'(?:[^'\\]|\\.|'')*'|[BbXxNn]?'(?:[^']|'')*')
+    | (?P<unterminated>[EeBbXxNn]?')
+    | (?P<qident>"(?:[^"]|"")*(?:"|\Z))
+    | (?P<param>\$\d+)
+    | (?P<dollar>\$(?P<tag>(?:[A-Za-z_][A-Za-z0-9_]*)?)\$.*?(?:\$(?P=tag)\$|\Z))
+    | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<ident>[^\W\d][\w$]*)
+    | (?P<op>::|<>|!=|<=|>=|\|\||[^\s])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    value: str   # для слов без кавычек — в нижнем регистре, иначе совпадает с text
+    start: int
+    end: int
+
+
+_new_token = tuple.__new__
+
+
+def tokenize(sql: str, trivia: bool = True) -> List[Token]:
+    """Разбить SQL (диалект PostgreSQL) на токены; trivia=False — без пробелов и комментариев.
+
+    Ключевые слова сравниваются по Token.value: у строк и идентификаторов в кавычках
+    value содержит кавычки, поэтому 'select' в литерале не совпадёт со словом select.
+
+    Незакрытые строка, идентификатор в кавычках или dollar-quoted блок — ValueError
+    (PostgreSQL такой запрос всё равно не примет).
+    """
+    tokens: List[Token] = []
+    append = tokens.append
+    for m in _TOKEN_RE.finditer(sql):
+        kind = m.lastgroup
+        if kind == WS or kind == COMMENT:
+            if not trivia:
+                continue
+            text = m.group()
+            value = text
+        elif kind == IDENT:
+            text = m.group()
+            value = text.lower()
+        else:
+            text = value = m.group()
+            if kind == "dollar":
+                kind = STRING
+                tag_len = text.index("$", 1) + 1
+                if len(text) < 2 * tag_len or not text.endswith(text[:tag_len]):
+                    raise ValueError("Unterminated dollar-quoted string in SQL")
+            elif kind == "unterminated":
+                raise ValueError("Unterminated string literal in SQL")
+            elif kind == QIDENT:
+                if len(text) < 2 or not text.endswith('"'):
+                    raise ValueError("Unterminated quoted identifier in SQL")
+        start, end = m.span()
+        append(_new_token(Token, (kind, text, value, start, end)))
+    return tokens
+
+
+def significant(tokens: List[Token]) -> List[Token]:
+    """Токены без пробелов и комментариев"""
+    return [t for t in tokens if t.kind != WS and t.kind != COMMENT]
+
+
+def identifier_name(token: Token) -> Optional[str]:
+    """Имя объекта так, как его видит PostgreSQL: без кавычек — в нижнем регистре, в кавычках — как есть"""
+    if token.kind == IDENT:
+        return token.value
+    if token.kind == QIDENT:
+        return token.text[1:-1].replace('""', '"')
+    return None
+
+
+def matching_parens(tokens: List[Token]) -> List[int]:
+    """Для каждой скобки — индекс парной (по списку tokens), для прочих токенов -1"""
+    match = [-1] * len(tokens)
+    stack: List[int] = []
+    for i, tok in enumerate(tokens):
+        if tok.kind == OP:
+            if tok.value == "(":
+                stack.append(i)
+            elif tok.value == ")":
+                if not stack:
+                    raise ValueError("Unbalanced parentheses in SQL")
+                j = stack.pop()
+                match[i], match[j] = j, i
+    if stack:
+        raise ValueError("Unbalanced parentheses in SQL")
+    return match
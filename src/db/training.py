@@ -1,17 +1,61 @@
 from __future__ import annotations
-from src.db.pool import execute
+from typing import Any, List, Tuple
+import asyncpg
+from src.db.logs import agent_log_queue
+from src.db.write_behind import WriteBehindQueue, statement_flusher
+
+# Комментарий к ответу: обновляем клик пользователя по этому логу, если он есть, иначе
+# вставляем новый — одним запросом на всю пачку (unnest по массивам колонок)
+_UPSERT_COMMENTS_SQL = """
+    WITH v AS (
+        SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::text[])
+            AS v(log_id, clicked_by, chat_id, comment)
+    ), upd AS (
+        UPDATE public.training_clicks t
+        SET comment = v.comment, status = 'в очереди', clicked_at = NOW()
+        FROM v
+        WHERE t.log_id = v.log_id AND t.clicked_by = v.clicked_by
+        RETURNING t.log_id, t.clicked_by
+    )
+    INSERT INTO public.training_clicks (log_id, clicked_by, chat_id, status, comment, clicked_at)
+    SELECT v.log_id, v.clicked_by, v.chat_id, 'в очереди', v.comment, NOW()
+    FROM v
+    WHERE NOT EXISTS (SELECT 1 FROM upd WHERE upd.log_id = v.log_id AND upd.clicked_by = v.clicked_by);
+"""
+
+_INSERT_CLICKS_SQL = """
+    INSERT INTO public.training_clicks (log_id, chat_id, clicked_by, status, clicked_at)
+    SELECT log_id, chat_id, clicked_by, 'в очереди', NOW()
+    FROM unnest($1::bigint[], $2::bigint[], $3::bigint[]) AS v(log_id, chat_id, clicked_by);
+"""
+
+_upsert_comments = statement_flusher(_UPSERT_COMMENTS_SQL)
+
+
+async def _flush_comments(conn: asyncpg.Connection, rows: List[Tuple[Any, ...]]) -> None:
+    # Повторный комментарий к тому же логу в одной пачке — оставляем последний
+    latest = {(r[0], r[1]): r for r in rows}
+    await _upsert_comments(conn, list(latest.values()))
+
+
+# Логи пишутся раньше кликов/комментариев, которые на них ссылаются
+training_click_queue = WriteBehindQueue(
+    "training_clicks",
+    statement_flusher(_INSERT_CLICKS_SQL),
+    after=(agent_log_queue,),
+)
+training_comment_queue = WriteBehindQueue(
+    "training_comments",
+    _flush_comments,
+    after=(agent_log_queue, training_click_queue),
+)
 
 
 async def log_training_click(log_id: int, chat_id: int, clicked_by: int) -> None:
     """Записать клик по кнопке обучения (совместимо с n8n-схемой)."""
-    try:
-        await execute(
-            """
-            INSERT INTO public.training_clicks (log_id, chat_id, clicked_by, status, clicked_at)
-            VALUES ($1, $2, $3, 'в очереди', NOW());
-            """,
-            (log_id, chat_id, clicked_by)
-        )
-    except Exception as e:
-        import logging
-        logging.getLogger("training").error(f"Failed to log training click: {e}")
\ No newline at end of file
+    training_click_queue.submit((log_id, chat_id, clicked_by))
+
+
+async def save_training_comment(log_id: int, chat_id: int, comment: str) -> None:
+    """Сохранить комментарий к ответу (отложенно, одним запросом на пачку)."""
+    training_comment_queue.submit((log_id, chat_id, chat_id, comment))
@@ -0,0 +1,244 @@
+from __future__ import annotations
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+from src.db.pool import get_pool
+from src.utils.logger import get_logger
+
+logger = get_logger("db.write_behind")
+
+# Сброс пачки: по размеру, по таймеру и при остановке бота
+WRITE_BEHIND_FLUSH_SIZE = int(os.getenv("WRITE_BEHIND_FLUSH_SIZE", "100"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+# Сколько записей может ждать в памяти, пока БД недоступна (дальше старые отбрасываются)
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+# Сколько раз повторяем неудачную пачку, прежде чем отбросить её
+_MAX_FLUSH_ATTEMPTS = 3
+
+FlushFn = Callable[[asyncpg.Connection, List[Tuple[Any, ...]]], Awaitable[None]]
+
+# Все созданные очереди — для общего старта/остановки и статистики
+_QUEUES: List["WriteBehindQueue"] = []
+
+
+def copy_flusher(table: str, columns: Sequence[str], schema: str = "public") -> FlushFn:
+    """Пачка уходит одним COPY ... FROM STDIN (binary)"""
+    async def _flush(conn: asyncpg.Connection, rows: List[Tuple[Any, ...]]) -> None:
+        await conn.copy_records_to_table(table, records=rows, columns=list(columns), schema_name=schema)
+    return _flush
+
+
+def statement_flusher(query: str) -> FlushFn:
+    """Пачка уходит одним запросом: строки транспонируются в массивы-параметры ($1 — первая колонка и т.д.),
+    запрос разворачивает их через unnest"""
+    async def _flush(conn: asyncpg.Connection, rows: List[Tuple[Any, ...]]) -> None:
+        columns = [list(col) for col in zip(*rows)]
+        await conn.execute(query, *columns)
+    return _flush
+
+
+class WriteBehindQueue:
+    """Отложенная пакетная запись: submit() не ждёт БД, фоновая задача сбрасывает накопленное.
+
+    after — очереди, которые нужно сбросить перед этой (например, лог ответа раньше
+    комментария к нему, если между таблицами есть внешний ключ).
+    """
+
+    __slots__ = (
+        "name", "_flush_fn", "_flush_size", "_flush_interval", "_max_pending", "_after",
+        "_pending", "_wakeup", "_task", "_direct_task", "_flush_lock", "_stats",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        flush_fn: FlushFn,
+        *,
+        flush_size: int = WRITE_BEHIND_FLUSH_SIZE,
+        flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        after: Sequence["WriteBehindQueue"] = (),
+    ):
+        self.name = name
+        self._flush_fn = flush_fn
+        self._flush_size = max(1, flush_size)
+        self._flush_interval = flush_interval
+        self._max_pending = max(self._flush_size, max_pending)
+        self._after = tuple(after)
+        self._pending: Deque[Tuple[Any, ...]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Сброс без фоновой задачи: ссылка держит задачу от сборщика мусора, и она одна на очередь
+        self._direct_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stats: Dict[str, Any] = {
+            "submitted": 0, "written": 0, "dropped": 0, "flushes": 0, "failed_flushes": 0,
+            "last_flush_ms": 0, "max_batch": 0,
+        }
+        _QUEUES.append(self)
+
+    def submit(self, row: Tuple[Any, ...]) -> None:
+        """Поставить строку в очередь (без ожидания записи)"""
+        if len(self._pending) >= self._max_pending:
+            self._pending.popleft()
+            self._stats["dropped"] += 1
+            if self._stats["dropped"] % 1000 == 1:
+                logger.warning(f"⚠️ Очередь {self.name} переполнена, старые записи отбрасываются")
+        self._pending.append(row)
+        self._stats["submitted"] += 1
+        if self._task is None:
+            # Фоновая задача не запущена (скрипт/старт без post_init) — пишем сами; уже идущий
+            # сброс заберёт и эту строку, он крутится, пока очередь не опустеет
+            if self._direct_task is None or self._direct_task.done():
+                self._direct_task = asyncio.get_running_loop().create_task(self._flush_quietly())
+        elif len(self._pending) >= self._flush_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Сбросить всё накопленное; возвращает число записанных строк"""
+        for queue in self._after:
+            await queue.flush()
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        written = 0
+        async with self._flush_lock:
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(self._flush_size, len(self._pending)))]
+                try:
+                    await self._write(batch)
+                except BaseException:
+                    # Возвращаем пачку в начало очереди (и при отмене задачи) — повторим при следующем сбросе
+                    self._pending.extendleft(reversed(batch))
+                    raise
+                written += len(batch)
+        return written
+
+    async def _write(self, batch: List[Tuple[Any, ...]]) -> None:
+        start = time.perf_counter()
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await self._flush_fn(conn, batch)
+        self._stats["flushes"] += 1
+        self._stats["written"] += len(batch)
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+        self._stats["last_flush_ms"] = int((time.perf_counter() - start) * 1000)
+
+    async def _flush_quietly(self) -> None:
+        for attempt in range(_MAX_FLUSH_ATTEMPTS):
+            try:
+                await self.flush()
+                return
+            except Exception as e:
+                self._stats["failed_flushes"] += 1
+                logger.error(f"❌ Не удалось записать пачку {self.name} (попытка {attempt + 1}): {e}")
+                await asyncio.sleep(min(self._flush_interval, 1.0) * (attempt + 1))
+        # БД так и не приняла пачку — отбрасываем её, чтобы не блокировать следующие
+        dropped = min(self._flush_size, len(self._pending))
+        for _ in range(dropped):
+            self._pending.popleft()
+        self._stats["dropped"] += dropped
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                await self._flush_quietly()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить фоновую задачу и дописать хвост"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self._direct_task is not None:
+            try:
+                await self._direct_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._direct_task = None
+        if self._pending:
+            try:
+                written = await self.flush()
+                logger.info(f"💾 {self.name}: при остановке дописано {written} записей")
+            except Exception as e:
+                logger.error(f"❌ {self.name}: при остановке потеряно {len(self._pending)} записей: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "pending": len(self._pending), **self._stats}
+
+
+def start_write_behind() -> None:
+    """Запустить фоновый сброс всех очередей"""
+    for queue in _QUEUES:
+        queue.start()
+
+
+async def stop_write_behind() -> None:
+    """Остановить очереди и дописать всё накопленное (до закрытия пула)"""
+    for queue in _QUEUES:
+        await queue.stop()
+
+
+def get_write_behind_stats() -> List[Dict[str, Any]]:
+    return [queue.get_stats() for queue in _QUEUES]
+
+
+class SequenceIdAllocator:
+    """Выдаёт id заранее из sequence блоками — id записи известен до её вставки.
+
+    Неиспользованный остаток блока теряется при перезапуске (дырки в нумерации допустимы).
+    """
+
+    __slots__ = ("_table", "_column", "_block_size", "_ids", "_refill_task")
+
+    def __init__(self, table: str, column: str = "id", block_size: int = 50):
+        self._table = table
+        self._column = column
+        self._block_size = max(1, block_size)
+        self._ids: Deque[int] = deque()
+        self._refill_task: Optional[asyncio.Task] = None
+
+    async def _refill(self) -> None:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT nextval(pg_get_serial_sequence($1, $2)) AS id FROM generate_series(1, $3);",
+                self._table, self._column, self._block_size,
+            )
+        self._ids.extend(int(r["id"]) for r in rows)
+
+    async def _refill_single_flight(self) -> None:
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+        await asyncio.shield(self._refill_task)
+
+    @staticmethod
+    def _log_refill_error(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ Не удалось заранее получить блок id: {task.exception()}")
+
+    async def next_id(self) -> int:
+        while not self._ids:
+            await self._refill_single_flight()
+        if len(self._ids) <= self._block_size // 4 and (self._refill_task is None or self._refill_task.done()):
+            # Подкачиваем следующий блок заранее, чтобы ответ не ждал sequence
+            self._refill_task = asyncio.create_task(self._refill())
+            self._refill_task.add_done_callback(self._log_refill_error)
+        return self._ids.popleft()
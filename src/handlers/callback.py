@@ -2,6 +2,7 @@ from __future__ import annotations
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from src.ai.intent_cache import invalidate_answer
 from src.db.training import log_training_click
 from src.utils.logger import get_logger
 from src.db.auth import check_authorized_chat
@@ -39,6 +40,7 @@ async def process_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 )
 
                 await log_training_click(log_id, chat_id, clicked_by)
+                await invalidate_answer(log_id)
 
                 # Имитация завершения стадии очереди: удаляем pending-сообщение и сообщаем об успехе
                 try:
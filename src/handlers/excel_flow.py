@@ -1,15 +1,25 @@
 from __future__ import annotations
 import os
-from typing import List, Dict, Any
-from src.services.excel.service import build_excel_bytes
+import tempfile
+from contextlib import aclosing
+from typing import List, Dict, Any, Optional, Tuple, Union
+from src.db.query_cost import QueryCostError
+from src.db.sql import iter_sql
+from src.models.rowset import RowSet
+from src.services.excel.service import (
+    XLSX_MAX_DATA_ROWS, build_excel_bytes, write_csv_from_batches, write_excel_from_batches,
+)
 from src.services.excel.script_runner import build_excel_bytes_via_script
 from src.services.mail.service import send_email, _resolve_recipient
 from src.utils.logger import get_logger
 
 logger = get_logger("excel_flow")
 
+# Формат потоковой выгрузки больших результатов: xlsx | csv
+EXPORT_STREAM_FORMAT = os.getenv("EXPORT_STREAM_FORMAT", "xlsx").lower()
 
-async def send_excel_via_email(recipient: str, subject: str, body: str, table_data: List[Dict[str, Any]]):
+
+async def send_excel_via_email(recipient: str, subject: str, body: str, table_data: Union[RowSet, List[Dict[str, Any]]]):
     # Always use external script for beautiful formatted Excel
     try:
         _, excel_bytes = build_excel_bytes_via_script(table_data)
@@ -27,7 +37,7 @@ async def send_excel_via_email(recipient: str, subject: str, body: str, table_da
     )
 
 
-async def send_excel_in_chat(context, chat_id: int, table_data: List[Dict[str, Any]]):
+async def send_excel_in_chat(context, chat_id: int, table_data: Union[RowSet, List[Dict[str, Any]]]):
     """Generate excel and send as Telegram document to the chat."""
     # Always use external script for beautiful formatted Excel
     path = None
@@ -58,3 +68,78 @@ async def send_excel_in_chat(context, chat_id: int, table_data: List[Dict[str, A
     except Exception as e:
         logger.error(f"❌ Error sending Excel to chat: {e}")
         await context.bot.send_message(chat_id=chat_id, text="❌ Ошибка отправки файла в чат")
+
+
+def _truncated_note(truncated: bool) -> Optional[str]:
+    if not truncated:
+        return None
+    limit = f"{XLSX_MAX_DATA_ROWS:,}".replace(",", " ")
+    return f"⚠️ Файл обрезан на лимите листа Excel: первые {limit} строк. Уточните период или добавьте фильтры."
+
+
+async def _export_query_to_file(sql_query: str) -> Tuple[str, str, int, bool]:
+    """Потоково выгрузить результат запроса во временный файл.
+
+    Возвращает (path, filename, rows, truncated). Файл удаляет вызывающий код.
+    """
+    is_csv = EXPORT_STREAM_FORMAT == "csv"
+    filename = "report.csv" if is_csv else "report.xlsx"
+    fd, path = tempfile.mkstemp(prefix="report_", suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    truncated = False
+    try:
+        # aclosing: xlsx на лимите листа перестаёт читать — курсор и соединение освобождаются сразу
+        async with aclosing(iter_sql(sql_query)) as batches:
+            if is_csv:
+                rows = await write_csv_from_batches(batches, path)
+            else:
+                rows, truncated = await write_excel_from_batches(batches, path)
+    except Exception:
+        os.unlink(path)
+        raise
+    logger.info(f"✅ Streamed export: {rows} rows{' (обрезано)' if truncated else ''} -> {path}")
+    return path, filename, rows, truncated
+
+
+async def send_excel_stream_in_chat(context, chat_id: int, sql_query: str):
+    """Выгрузить большой результат запроса в файл (без загрузки всех строк в память) и отправить в чат."""
+    path = None
+    try:
+        path, filename, rows, truncated = await _export_query_to_file(sql_query)
+        if not rows:
+            await context.bot.send_message(chat_id=chat_id, text="❌ Нет данных для Excel")
+            return
+        with open(path, 'rb') as f:
+            await context.bot.send_document(
+                chat_id=chat_id, document=f, filename=filename, caption=_truncated_note(truncated),
+            )
+        logger.info(f"📧 Streamed export sent to chat ({rows} rows)")
+    except QueryCostError as e:
+        await context.bot.send_message(chat_id=chat_id, text=f"❌ {e.hint}")
+    except Exception as e:
+        logger.error(f"❌ Error streaming export to chat: {e}")
+        await context.bot.send_message(chat_id=chat_id, text="❌ Не удалось сформировать Excel")
+    finally:
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+
+async def send_excel_stream_via_email(recipient: str, subject: str, body: str, sql_query: str):
+    """Потоковая выгрузка результата запроса и отправка вложением на почту."""
+    path, filename, _, truncated = await _export_query_to_file(sql_query)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    finally:
+        os.unlink(path)
+    content_type = 'text/csv' if filename.endswith('.csv') else 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    note = _truncated_note(truncated)
+    if note:
+        body = f"{body}\n\n{note}" if body else note
+    resolved = await _resolve_recipient(recipient)
+    send_email(
+        recipient=resolved,
+        subject=subject or 'Без темы',
+        body=body or '',
+        attachments=[(filename, data, content_type)]
+    )
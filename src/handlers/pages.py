@@ -0,0 +1,57 @@
+from __future__ import annotations
+from typing import List
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+
+from src.db.auth import check_authorized_chat
+from src.utils.logger import get_logger
+from src.utils.pager import CALLBACK_PREFIX, get_page, page_callback_data, parse_page_callback
+
+logger = get_logger("handlers.pages")
+
+
+def page_buttons(page_id: str, page: int, total: int) -> List[InlineKeyboardButton]:
+    """Ряд кнопок «◀ i/N ▶» (листание по кругу)"""
+    return [
+        InlineKeyboardButton("◀", callback_data=page_callback_data(page_id, (page - 1) % total)),
+        InlineKeyboardButton(f"{page + 1}/{total}", callback_data=page_callback_data(page_id, page)),
+        InlineKeyboardButton("▶", callback_data=page_callback_data(page_id, (page + 1) % total)),
+    ]
+
+
+async def handle_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показать другую страницу ответа: текст берётся из Redis, без LLM и повторного SQL"""
+    query = update.callback_query
+    parsed = parse_page_callback(query.data or "")
+    chat_id = query.message.chat_id if query.message else None
+    if parsed is None or chat_id is None or not await check_authorized_chat(chat_id):
+        await query.answer()
+        return
+
+    page_id, page = parsed
+    found = await get_page(page_id, page)
+    if found is None:
+        await query.answer("Страницы этого ответа уже недоступны — повторите запрос", show_alert=True)
+        return
+    html, total = found
+    await query.answer()
+
+    # Остальные кнопки сообщения (например, «Отправить на обучение») сохраняем
+    markup = query.message.reply_markup
+    other_rows = [
+        list(row) for row in (markup.inline_keyboard if markup else ())
+        if not any((button.callback_data or "").startswith(CALLBACK_PREFIX) for button in row)
+    ]
+    try:
+        await query.edit_message_text(
+            html,
+            parse_mode=ParseMode.HTML,
+            reply_markup=InlineKeyboardMarkup([page_buttons(page_id, page, total), *other_rows]),
+        )
+    except BadRequest as e:
+        # Повторное нажатие на текущую страницу
+        if "not modified" not in str(e).lower():
+            logger.error(f"❌ Не удалось показать страницу {page + 1} ответа {page_id}: {e}")
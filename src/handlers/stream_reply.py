@@ -0,0 +1,100 @@
+from __future__ import annotations
+import time
+from typing import Any, Optional
+
+from telegram import InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+
+from src.ai.streaming import AI_STREAM_EDIT_INTERVAL, AI_STREAM_MIN_CHARS, preview_text
+from src.utils.logger import get_logger
+
+logger = get_logger("handlers.stream_reply")
+
+_CURSOR = " ▌"
+
+
+class StreamingReply:
+    """Сообщение «⌛ Ваш запрос принят», которое становится ответом.
+
+    Пока LLM пишет ответ, update() правит сообщение на месте (не чаще AI_STREAM_EDIT_INTERVAL
+    и только когда текста прибавилось), finish() заменяет его готовым HTML с кнопками —
+    вместо отдельной отправки ответа и удаления уведомления. Если правка невозможна
+    (сообщение удалено, уведомление не отправилось), ответ уходит новым сообщением.
+    """
+
+    def __init__(self, bot: Any, chat_id: int, message_id: Optional[int]) -> None:
+        self._bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self._shown = ""
+        self._next_edit_at = 0.0
+        self._broken = message_id is None
+
+    @classmethod
+    async def start(cls, bot: Any, chat_id: int, text: str) -> "StreamingReply":
+        try:
+            ack = await bot.send_message(chat_id=chat_id, text=text)
+            return cls(bot, chat_id, ack.message_id)
+        except Exception:
+            return cls(bot, chat_id, None)
+
+    async def update(self, partial_html: str) -> None:
+        """Промежуточный текст ответа (без разметки: незакрытые теги сломали бы HTML)"""
+        if self._broken:
+            return
+        now = time.monotonic()
+        if now < self._next_edit_at:
+            return
+        text = preview_text(partial_html)
+        if not text or len(text) - len(self._shown) < AI_STREAM_MIN_CHARS:
+            return
+        try:
+            await self._bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text + _CURSOR)
+        except RetryAfter as e:
+            self._next_edit_at = now + float(e.retry_after)
+            return
+        except Exception as e:
+            # Сообщение удалили или правка отклонена — дальше ответ придёт отдельным сообщением
+            logger.debug(f"Промежуточная правка ответа не удалась: {e}")
+            self._broken = True
+            return
+        self._shown = text
+        self._next_edit_at = now + AI_STREAM_EDIT_INTERVAL
+
+    async def finish(self, html: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """Показать готовый ответ на месте уведомления"""
+        if self.message_id is not None:
+            try:
+                await self._bot.edit_message_text(
+                    chat_id=self.chat_id,
+                    message_id=self.message_id,
+                    text=html,
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=reply_markup,
+                )
+                return
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return
+                logger.warning(f"⚠️ Не удалось заменить уведомление ответом, отправляем отдельно: {e}")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось заменить уведомление ответом, отправляем отдельно: {e}")
+            await self.discard()
+        await self._bot.send_message(
+            chat_id=self.chat_id,
+            text=html,
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup,
+        )
+
+    async def discard(self) -> None:
+        """Убрать уведомление (ответ — файл или карточка, либо правка не удалась)"""
+        if self.message_id is None:
+            return
+        message_id, self.message_id = self.message_id, None
+        self._broken = True
+        try:
+            await self._bot.delete_message(chat_id=self.chat_id, message_id=message_id)
+        except Exception:
+            pass
@@ -1,16 +1,18 @@
 from __future__ import annotations
 import os
-from typing import Optional
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
 from src.db.auth import check_authorized_chat
 from src.ai.agent import run_ai_for_text
+from src.ai.intent_cache import link_answer
 from src.utils.html_sanitize import sanitize_html
-from src.db.logs import log_interaction
+from src.db.logs import log_answer_sql, log_interaction
 from src.utils.logger import get_logger
 from src.utils.memory import append_message, clear_history
+from src.utils.pager import store_pages
+from src.handlers.pages import page_buttons
+from src.handlers.stream_reply import StreamingReply
 from src.utils.debug import tg_debug, is_debug
 from typing import List, Dict
 import re
@@ -32,6 +34,10 @@ def validate_text(text: str) -> bool:
     return True
 
 
+def _training_row(log_id) -> List[InlineKeyboardButton]:
+    return [InlineKeyboardButton(text="🚀 Отправить на обучение", callback_data=f"training_{log_id}")]
+
+
 async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик текстовых сообщений"""
     chat_id = update.effective_chat.id
@@ -65,10 +71,7 @@ async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 
         # 1) Проверка авторизации
-        logger.info(f"🔐 Начинаю проверку авторизации для chat_id: {chat_id}")
-        
         is_authorized = await check_authorized_chat(chat_id)
-        logger.info(f"🔐 Результат check_authorized_chat({chat_id}): {is_authorized}")
         
         if not is_authorized:
             logger.warning(f"⛔ ОТКАЗ В ДОСТУПЕ для chat_id: {chat_id}")
@@ -79,19 +82,12 @@ async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             await tg_debug(context, chat_id, "⛔ Неавторизованный чат")
             return
 
-        logger.info(f"✅ Авторизация пройдена для chat_id: {chat_id}")
+        logger.debug(f"✅ Авторизация пройдена для chat_id: {chat_id}")
         await tg_debug(context, chat_id, "✅ Авторизация пройдена")
 
-        # Мгновенное сообщение-уведомление пользователю
-        ack_msg_id: Optional[int] = None
-        try:
-            ack = await context.bot.send_message(
-                chat_id=chat_id,
-                text="⌛ Ваш запрос принят в работу. Ожидайте"
-            )
-            ack_msg_id = ack.message_id
-        except Exception:
-            pass
+        # Мгновенное сообщение-уведомление пользователю: по ходу генерации в нём появляется
+        # текст ответа LLM, а в конце оно само становится ответом
+        reply = await StreamingReply.start(context.bot, chat_id, "⌛ Ваш запрос принят в работу. Ожидайте")
 
         # Записываем пользовательское сообщение в память
         try:
@@ -107,7 +103,8 @@ async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 chat_id=chat_id, 
                 user_id=user.id if user else None, 
                 user_name=user.full_name if user else None, 
-                text=text
+                text=text,
+                on_partial=reply.update,
             )
         await tg_debug(context, chat_id, f"✅ AI ответ получен. send_excel={result.send_excel}, send_card={result.send_card}")
 
@@ -117,7 +114,7 @@ async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 if result.sql_query:
                     await tg_debug(context, chat_id, f"<pre>{sanitize_html(result.sql_query)}</pre>")
                 if result.table_data:
-                    sample = result.table_data[:3]
+                    sample = list(result.table_data[:3])
                     await tg_debug(context, chat_id, f"<code>rows:</code> {sanitize_html(str(sample))}")
         except Exception:
             pass
@@ -137,6 +134,11 @@ async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             str(context.application.bot.id),
         )
         await tg_debug(context, chat_id, f"📝 Лог записан id={log_id}")
+        # Кнопка «Отправить на обучение» этого ответа сбросит его SQL в кэше вопросов
+        await link_answer(log_id, result.sql_query)
+        # Ответ с данными — пример «вопрос → SQL» для промпта (пустой результат не годится)
+        if result.table_data is None or result.table_data:
+            log_answer_sql(log_id, result.sql_query)
 
         # Сохраняем ответ ассистента в память
         try:
@@ -150,75 +152,70 @@ async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
         if result.send_excel:
             await tg_debug(context, chat_id, "📧 Отправка Excel...")
+            # Большая выборка (полный результат — потоково по sql_query): её начало и подсказку,
+            # как сузить запрос, показываем на месте уведомления ещё до того, как готов файл
+            preview = result.table_data is None and bool(result.sql_query)
+            if preview:
+                await reply.finish(html, InlineKeyboardMarkup([_training_row(log_id)]))
             # Если указан получатель — отправляем на почту, иначе в чат
             if result.recipient:
                 await handle_excel_request(context, chat_id, result)
             else:
-                from src.handlers.excel_flow import send_excel_in_chat
+                from src.handlers.excel_flow import send_excel_in_chat, send_excel_stream_in_chat
                 if result.table_data:
                     await send_excel_in_chat(context, chat_id, result.table_data)
+                elif result.sql_query:
+                    # Результат слишком большой для памяти — выгружаем курсором прямо из БД
+                    await send_excel_stream_in_chat(context, chat_id, result.sql_query)
                 else:
                     await context.bot.send_message(chat_id=chat_id, text="❌ Нет данных для Excel")
             # Удаляем уведомление после отправки
-            try:
-                if ack_msg_id:
-                    await context.bot.delete_message(chat_id=chat_id, message_id=ack_msg_id)
-            except Exception:
-                pass
+            if not preview:
+                await reply.discard()
             return
 
         if result.send_card:
             await tg_debug(context, chat_id, f"🗂️ Отправка карточки: {result.rep_name}")
             await handle_card_request(context, chat_id, result)
             # Удаляем уведомление после отправки
-            try:
-                if ack_msg_id:
-                    await context.bot.delete_message(chat_id=chat_id, message_id=ack_msg_id)
-            except Exception:
-                pass
+            await reply.discard()
             return
 
         # 6) Отправка текстового ответа
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton(
-                text="🚀 Отправить на обучение", 
-                callback_data=f"training_{log_id}"
-            )
-        ]])
+        keyboard_rows = [_training_row(log_id)]
+        pages = getattr(result, "pages", None)
+        if pages and len(pages) > 1:
+            # Длинный ответ: первая страница (с дописанными агентом примечаниями) + остальные
+            # в Redis, кнопки ◀ ▶ листают их без LLM и повторного SQL
+            page_id = await store_pages([html] + pages[1:])
+            if page_id:
+                keyboard_rows.insert(0, page_buttons(page_id, 0, len(pages)))
+            else:
+                html += "\n<i>Остальные страницы недоступны — полный список пришлю в Excel, напишите: в excel</i>"
+        keyboard = InlineKeyboardMarkup(keyboard_rows)
 
-        await context.bot.send_message(
-            chat_id=chat_id, 
-            text=html, 
-            parse_mode=ParseMode.HTML, 
-            reply_markup=keyboard
-        )
-        # Удаляем уведомление после отправки
-        try:
-            if ack_msg_id:
-                await context.bot.delete_message(chat_id=chat_id, message_id=ack_msg_id)
-        except Exception:
-            pass
+        # Уведомление заменяется ответом (или ответ уходит отдельным сообщением)
+        await reply.finish(html, keyboard)
         await tg_debug(context, chat_id, "✅ Ответ отправлен")
 
     except Exception as e:
         logger.error(f"Error processing text message: {e}", exc_info=True)
         await tg_debug(context, chat_id, f"❌ Ошибка обработки: {e}")
-        # Удаляем уведомление при ошибке
-        try:
-            if 'ack_msg_id' in locals() and ack_msg_id:
-                await context.bot.delete_message(chat_id=chat_id, message_id=ack_msg_id)
-        except Exception:
-            pass
-        await context.bot.send_message(
-            chat_id=chat_id, 
-            text="❌ Произошла ошибка при обработке сообщения"
-        )
+        # Уведомление (если успели отправить) заменяется сообщением об ошибке
+        error_text = "❌ Произошла ошибка при обработке сообщения"
+        if 'reply' in locals():
+            await reply.finish(error_text)
+        else:
+            await context.bot.send_message(
+                chat_id=chat_id, 
+                text=error_text
+            )
 
 
 async def handle_excel_request(context: ContextTypes.DEFAULT_TYPE, chat_id: int, result) -> None:
     """Обработка запроса на отправку Excel"""
     try:
-        from src.handlers.excel_flow import send_excel_via_email
+        from src.handlers.excel_flow import send_excel_via_email, send_excel_stream_via_email
         
         recipient = result.recipient or 'default@example.com'
         subject = result.subject or 'Отчет по запросу'
@@ -230,6 +227,12 @@ async def handle_excel_request(context: ContextTypes.DEFAULT_TYPE, chat_id: int,
                 chat_id=chat_id, 
                 text=f"✅ Excel отправлен на почту: {recipient}"
             )
+        elif result.sql_query:
+            await send_excel_stream_via_email(recipient, subject, body, result.sql_query)
+            await context.bot.send_message(
+                chat_id=chat_id, 
+                text=f"✅ Excel отправлен на почту: {recipient}"
+            )
         else:
             await context.bot.send_message(
                 chat_id=chat_id, 
@@ -5,8 +5,8 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from src.utils.logger import get_logger
-from src.db.pool import get_pool
-import asyncio
+from src.db.training import save_training_comment
+from src.ai.intent_cache import invalidate_answer
 
 logger = get_logger(__name__)
 
@@ -35,6 +35,9 @@ async def handle_training_feedback(update: Update, context: ContextTypes.DEFAULT
         if len(parts) >= 2:  # training_624 -> 2 части
             log_id = int(parts[1])  # Берем вторую часть (индекс 1)
             logger.info(f"🔍 Извлечен log_id: {log_id}")
+
+            # Ответ считают неудачным — его SQL больше не отдаём из кэша вопросов
+            await invalidate_answer(log_id)
             
             # Сохраняем состояние пользователя
             user_states[chat_id] = {
@@ -161,26 +164,10 @@ async def handle_comment_text(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
 
 async def save_comment_to_db(log_id: int, chat_id: int, comment: str) -> None:
-    """Сохраняет комментарий в базу данных"""
+    """Сохраняет комментарий в базу данных (отложенной пакетной записью, без ожидания БД)"""
     try:
-        pool = await get_pool()
-        async with pool.acquire() as conn:
-            # Обновляем существующую запись или создаем новую
-            await conn.execute('''
-                UPDATE training_clicks 
-                SET comment = $1, status = 'в очереди', clicked_at = NOW()
-                WHERE log_id = $2 AND clicked_by = $3
-            ''', comment, log_id, chat_id)
-            
-            # Если запись не найдена, создаем новую
-            if await conn.fetchval('SELECT COUNT(*) FROM training_clicks WHERE log_id = $1 AND clicked_by = $2', log_id, chat_id) == 0:
-                await conn.execute('''
-                    INSERT INTO training_clicks (log_id, clicked_by, chat_id, status, comment, clicked_at)
-                    VALUES ($1, $2, $3, 'в очереди', $4, NOW())
-                ''', log_id, chat_id, chat_id, comment)
-            
-            logger.info(f"✅ Комментарий сохранен для log_id: {log_id}")
-            
+        await save_training_comment(log_id, chat_id, comment)
+        logger.info(f"✅ Комментарий поставлен в очередь записи для log_id: {log_id}")
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения комментария в БД: {e}")
         raise
@@ -0,0 +1,6 @@
+from .rowset import RowSet, RowSetBuilder
+
+__all__ = [
+    'RowSet',
+    'RowSetBuilder',
+]
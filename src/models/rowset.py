@@ -0,0 +1,281 @@
+from __future__ import annotations
+import datetime as _dt
+import sys
+from decimal import Decimal
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Сколько строк материализуем в dict за раз при итерации
+_ITER_CHUNK = 1024
+
+# Типы колонок
+KIND_INT = "int"
+KIND_FLOAT = "float"
+KIND_OBJECT = "object"
+
+_INT64_MIN, _INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+
+
+_FLOAT_TYPES = frozenset({int, float, Decimal, type(None)})
+
+# Типы значений object-колонок, которые to_payload пишет строкой ISO и from_payload восстанавливает
+_ISO_TYPES: Dict[type, str] = {_dt.date: "date", _dt.datetime: "datetime", _dt.time: "time"}
+_FROM_ISO = {"date": _dt.date.fromisoformat, "datetime": _dt.datetime.fromisoformat, "time": _dt.time.fromisoformat}
+
+
+def _column_kind(values: Sequence[Any]) -> str:
+    """int — только целые без NULL, float — дробные числа (в т.ч. Decimal) с возможными NULL, иначе object.
+
+    Целые с NULL остаются object: во float64 теряется точность bigint, а id выводились бы как 123.0.
+    """
+    # set(map(type, ...)) проходит колонку на C, без isinstance на каждую ячейку;
+    # bool сюда не попадает: type(True) is bool — в отчётах это не число
+    types = set(map(type, values))
+    if not types or types == {type(None)}:
+        return KIND_OBJECT
+    if types == {int}:
+        if _INT64_MIN <= min(values) and max(values) <= _INT64_MAX:
+            return KIND_INT
+        return KIND_OBJECT
+    if types == {int, type(None)}:
+        return KIND_OBJECT
+    if types <= _FLOAT_TYPES:
+        return KIND_FLOAT
+    return KIND_OBJECT
+
+
+def _iso_type(values: Sequence[Any]) -> Optional[str]:
+    """date / datetime / time — все значения object-колонки (кроме NULL) этого типа; None — дат нет.
+
+    Даты вперемешку с другими значениями по JSON не восстановить — TypeError, как у json.dumps.
+    """
+    types = set(map(type, values))
+    types.discard(type(None))
+    if len(types) == 1 and next(iter(types)) in _ISO_TYPES:
+        return _ISO_TYPES[next(iter(types))]
+    if not types.isdisjoint(_ISO_TYPES):
+        raise TypeError("Column mixes dates with other values")
+    return None
+
+
+class RowSet:
+    """Компактный результат запроса: общие метаданные колонок + по массиву на колонку.
+
+    Числовые колонки хранятся в NumPy (int64/float64, NULL — маска), остальные — обычными
+    списками значений. Имена колонок не повторяются в каждой строке, как в list[dict].
+
+    Для совместимости с кодом, который ждёт список словарей, поддерживаются len(),
+    итерация (строки-словари создаются по требованию пачками), rs[i] -> dict и
+    rs[a:b] -> RowSet (срез без копирования числовых данных).
+    """
+
+    __slots__ = ("columns", "kinds", "_data", "_nulls", "_length")
+
+    def __init__(
+        self,
+        columns: Sequence[str],
+        kinds: Sequence[str],
+        data: Sequence[Union[np.ndarray, List[Any]]],
+        nulls: Optional[Sequence[Optional[np.ndarray]]] = None,
+        length: Optional[int] = None,
+    ):
+        self.columns: Tuple[str, ...] = tuple(columns)
+        self.kinds: Tuple[str, ...] = tuple(kinds)
+        self._data: Tuple[Union[np.ndarray, List[Any]], ...] = tuple(data)
+        self._nulls: Tuple[Optional[np.ndarray], ...] = tuple(nulls) if nulls is not None else (None,) * len(self.columns)
+        self._length = length if length is not None else (len(self._data[0]) if self._data else 0)
+
+    # ---------- построение ----------
+
+    @classmethod
+    def empty(cls, columns: Sequence[str] = ()) -> "RowSet":
+        return cls(columns, [KIND_OBJECT] * len(columns), [[] for _ in columns], length=0)
+
+    @classmethod
+    def from_columns(cls, columns: Sequence[str], values: Sequence[List[Any]]) -> "RowSet":
+        """Собрать из списков значений по колонкам (типы определяются автоматически)"""
+        kinds: List[str] = []
+        data: List[Union[np.ndarray, List[Any]]] = []
+        nulls: List[Optional[np.ndarray]] = []
+        length = len(values[0]) if values else 0
+        for col_values in values:
+            kind = _column_kind(col_values)
+            kinds.append(kind)
+            if kind == KIND_INT:
+                data.append(np.array(col_values, dtype=np.int64))
+                nulls.append(None)
+            elif kind == KIND_FLOAT:
+                if None in col_values:
+                    mask = np.fromiter((v is None for v in col_values), dtype=bool, count=len(col_values))
+                    data.append(np.array([np.nan if v is None else v for v in col_values], dtype=np.float64))
+                    nulls.append(mask)
+                else:
+                    data.append(np.array(col_values, dtype=np.float64))
+                    nulls.append(None)
+            else:
+                data.append(list(col_values))
+                nulls.append(None)
+        return cls(columns, kinds, data, nulls, length)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Mapping[str, Any]], columns: Optional[Sequence[str]] = None) -> "RowSet":
+        """Собрать из asyncpg.Record или словарей"""
+        builder = RowSetBuilder(columns)
+        builder.extend(records)
+        return builder.build()
+
+    # ---------- доступ ----------
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    @property
+    def numeric_columns(self) -> FrozenSet[str]:
+        return frozenset(c for c, k in zip(self.columns, self.kinds) if k != KIND_OBJECT)
+
+    def column(self, name: str) -> Union[np.ndarray, List[Any]]:
+        """Колонка как есть: np.ndarray для числовых, list для остальных (NULL в float — NaN)"""
+        return self._data[self.columns.index(name)]
+
+    def _column_values(self, idx: int, start: int, stop: int) -> List[Any]:
+        values = self._data[idx][start:stop]
+        if isinstance(values, np.ndarray):
+            out = values.tolist()
+            mask = self._nulls[idx]
+            if mask is not None:
+                for pos in np.flatnonzero(mask[start:stop]).tolist():
+                    out[pos] = None
+            return out
+        return values
+
+    def _rows(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        cols = [self._column_values(i, start, stop) for i in range(len(self.columns))]
+        names = self.columns
+        return [dict(zip(names, values)) for values in zip(*cols)]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for start in range(0, self._length, _ITER_CHUNK):
+            yield from self._rows(start, min(start + _ITER_CHUNK, self._length))
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Dict[str, Any], "RowSet"]:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._length)
+            if step != 1:
+                raise ValueError("RowSet supports only contiguous slices")
+            stop = max(start, stop)
+            return RowSet(
+                self.columns,
+                self.kinds,
+                [d[start:stop] for d in self._data],
+                [m[start:stop] if m is not None else None for m in self._nulls],
+                stop - start,
+            )
+        if key < 0:
+            key += self._length
+        if not 0 <= key < self._length:
+            raise IndexError("RowSet index out of range")
+        return self._rows(key, key + 1)[0]
+
+    def head(self, n: int) -> "RowSet":
+        return self[:n]
+
+    def __repr__(self) -> str:
+        return f"RowSet(rows={self._length}, columns={list(self.columns)})"
+
+    # ---------- конвертация ----------
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Список словарей (Decimal уже приведены к float) — для внешних скриптов и JSON"""
+        return self._rows(0, self._length)
+
+    def to_dataframe(self):
+        """pandas.DataFrame напрямую из колонок, без промежуточного list[dict]"""
+        import pandas as pd
+        # NULL в float-колонках уже NaN — в Excel это пустая ячейка
+        return pd.DataFrame(dict(zip(self.columns, self._data)), columns=list(self.columns))
+
+    def to_payload(self) -> Dict[str, Any]:
+        """Компактное JSON-представление (колонки, а не строки) — для кэшей в Redis/памяти.
+
+        Даты и время пишутся строками ISO, их тип — в "types": from_payload вернёт те же значения.
+        """
+        values = []
+        types: List[Optional[str]] = []
+        for i in range(len(self.columns)):
+            col = self._column_values(i, 0, self._length)
+            iso_type = _iso_type(col) if self.kinds[i] == KIND_OBJECT else None
+            if iso_type is not None:
+                col = [None if v is None else v.isoformat() for v in col]
+            types.append(iso_type)
+            values.append(col)
+        return {"columns": list(self.columns), "kinds": list(self.kinds), "types": types, "values": values}
+
+    @classmethod
+    def from_payload(cls, payload: Mapping[str, Any]) -> "RowSet":
+        columns = payload.get("columns") or []
+        kinds = payload.get("kinds") or [KIND_OBJECT] * len(columns)
+        types = payload.get("types") or [None] * len(columns)
+        data: List[Union[np.ndarray, List[Any]]] = []
+        nulls: List[Optional[np.ndarray]] = []
+        for kind, iso_type, col in zip(kinds, types, payload.get("values") or []):
+            if kind == KIND_INT:
+                data.append(np.asarray(col, dtype=np.int64))
+                nulls.append(None)
+            elif kind == KIND_FLOAT:
+                mask = np.fromiter((v is None for v in col), dtype=bool, count=len(col))
+                data.append(np.asarray([np.nan if v is None else v for v in col], dtype=np.float64))
+                nulls.append(mask if mask.any() else None)
+            elif iso_type in _FROM_ISO:
+                parse = _FROM_ISO[iso_type]
+                data.append([None if v is None else parse(v) for v in col])
+                nulls.append(None)
+            else:
+                data.append(list(col))
+                nulls.append(None)
+        return cls(columns, kinds, data, nulls)
+
+    def nbytes(self) -> int:
+        """Приблизительный объём данных в памяти (массивы + списки + объекты значений)"""
+        total = 0
+        for col in self._data:
+            if isinstance(col, np.ndarray):
+                total += col.nbytes
+            else:
+                total += sys.getsizeof(col) + sum(sys.getsizeof(v) for v in col)
+        total += sum(m.nbytes for m in self._nulls if m is not None)
+        return total
+
+
+class RowSetBuilder:
+    """Накопление строк пачками (например, из курсора fetch_iter) в RowSet"""
+
+    __slots__ = ("columns", "_values")
+
+    def __init__(self, columns: Optional[Sequence[str]] = None):
+        self.columns: Optional[Tuple[str, ...]] = tuple(columns) if columns is not None else None
+        self._values: Optional[List[List[Any]]] = [[] for _ in columns] if columns is not None else None
+
+    def __len__(self) -> int:
+        return len(self._values[0]) if self._values else 0
+
+    def extend(self, records: Iterable[Mapping[str, Any]]) -> None:
+        if not isinstance(records, Sequence):
+            records = list(records)
+        if not records:
+            return
+        rows = [tuple(rec.values()) for rec in records]
+        if self.columns is None:
+            self.columns = tuple(records[0].keys())
+            self._values = [[] for _ in self.columns]
+        # Транспонируем пачку целиком: по одному extend на колонку вместо append на ячейку
+        for values, column in zip(self._values, zip(*rows)):
+            values.extend(column)
+
+    def build(self) -> RowSet:
+        if self.columns is None:
+            return RowSet.empty()
+        return RowSet.from_columns(self.columns, self._values)
@@ -1,10 +1,11 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Union
 import json
 import subprocess
 import os
 import time
 from decimal import Decimal
+from src.models.rowset import RowSet
 
 
 def _convert_decimals(obj):
@@ -19,7 +20,7 @@ def _convert_decimals(obj):
         return obj
 
 
-def _run_generate_excel_script(table_data: List[Dict[str, Any]]) -> Tuple[str, bytes]:
+def _run_generate_excel_script(table_data: Union[RowSet, List[Dict[str, Any]]]) -> Tuple[str, bytes]:
     """Run the external /home/adminvm/scripts/generate_excel.py to produce an xlsx.
 
     Returns tuple (path_on_disk, file_bytes).
@@ -29,7 +30,11 @@ def _run_generate_excel_script(table_data: List[Dict[str, Any]]) -> Tuple[str, b
         raise FileNotFoundError(f"Excel script not found: {script_path}")
 
     # Convert Decimal objects to float for JSON serialization
-    converted_data = _convert_decimals(table_data)
+    # (RowSet already stores numeric columns as floats — no deep copy needed)
+    if isinstance(table_data, RowSet):
+        converted_data = table_data.to_dicts()
+    else:
+        converted_data = _convert_decimals(table_data)
     payload = json.dumps({"table_data": converted_data}, ensure_ascii=False).encode("utf-8")
 
     # Call script with --json-out so it prints JSON including output path
@@ -71,7 +76,7 @@ def _run_generate_excel_script(table_data: List[Dict[str, Any]]) -> Tuple[str, b
         return out_path, data
 
 
-def build_excel_bytes_via_script(table_data: List[Dict[str, Any]]) -> Tuple[str, bytes]:
+def build_excel_bytes_via_script(table_data: Union[RowSet, List[Dict[str, Any]]]) -> Tuple[str, bytes]:
     """Public API: generate xlsx using the external script and return (path, bytes)."""
     return _run_generate_excel_script(table_data)
 
@@ -1,12 +1,105 @@
 from __future__ import annotations
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterable, Sequence, Mapping, Tuple, Union
+import asyncio
+import csv
+import datetime as _dt
+from decimal import Decimal
 import pandas as pd
+import xlsxwriter
 from io import BytesIO
+from src.models.rowset import RowSet
 
+# Лимит строк листа Excel (минус строка заголовка)
+XLSX_MAX_DATA_ROWS = 1_048_575
 
-def build_excel_bytes(table_data: List[Dict[str, Any]], sheet_name: str = "Данные") -> bytes:
-    df = pd.DataFrame(table_data)
+
+def build_excel_bytes(table_data: Union[RowSet, List[Dict[str, Any]]], sheet_name: str = "Данные") -> bytes:
+    if isinstance(table_data, RowSet):
+        # Колонки RowSet уходят в DataFrame без промежуточного списка словарей
+        df = table_data.to_dataframe()
+    else:
+        df = pd.DataFrame(table_data)
     output = BytesIO()
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         df.to_excel(writer, index=False, sheet_name=sheet_name)
     return output.getvalue()
+
+
+def _cell(value: Any) -> Any:
+    """Приводит значение из БД к типу, который понимают xlsxwriter/csv"""
+    if value is None or isinstance(value, (str, int, float, bool, _dt.date, _dt.datetime)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+async def write_excel_from_batches(
+    batches: AsyncIterable[Sequence[Mapping[str, Any]]],
+    path: str,
+    sheet_name: str = "Данные",
+) -> Tuple[int, bool]:
+    """Пишет xlsx потоково: строки каждой пачки сразу уходят на диск (constant_memory).
+
+    Возвращает (число записанных строк данных, обрезан ли результат на XLSX_MAX_DATA_ROWS).
+    На лимите листа чтение пачек прекращается — итератор курсора закрывает вызывающий код
+    (contextlib.aclosing), иначе соединение пула остаётся занятым. Запись пачки выполняется
+    в отдельном потоке, чтобы не блокировать event loop на больших выгрузках.
+    """
+    workbook = xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "default_date_format": "dd.mm.yyyy",
+        "strings_to_numbers": False,
+    })
+    sheet = workbook.add_worksheet(sheet_name)
+    columns: List[str] = []
+    written = 0
+    truncated = False
+
+    def _write_batch(batch: Sequence[Mapping[str, Any]], start_row: int) -> int:
+        n = 0
+        for row in batch:
+            if start_row + n >= XLSX_MAX_DATA_ROWS:
+                break
+            sheet.write_row(start_row + n + 1, 0, [_cell(row[c]) for c in columns])
+            n += 1
+        return n
+
+    try:
+        async for batch in batches:
+            if not batch:
+                continue
+            if written >= XLSX_MAX_DATA_ROWS:
+                truncated = True
+                break
+            if not columns:
+                columns = list(batch[0].keys())
+                sheet.write_row(0, 0, columns)
+            n = await asyncio.to_thread(_write_batch, batch, written)
+            written += n
+            if n < len(batch):
+                truncated = True
+                break
+    finally:
+        await asyncio.to_thread(workbook.close)
+    return written, truncated
+
+
+async def write_csv_from_batches(
+    batches: AsyncIterable[Sequence[Mapping[str, Any]]],
+    path: str,
+) -> int:
+    """Пишет CSV (UTF-8 с BOM, разделитель ';' — открывается в Excel без импорта) потоково."""
+    written = 0
+    columns: List[str] = []
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        async for batch in batches:
+            if not batch:
+                continue
+            if not columns:
+                columns = list(batch[0].keys())
+                writer.writerow(columns)
+            writer.writerows([_cell(row[c]) for c in columns] for row in batch)
+            written += len(batch)
+    return written
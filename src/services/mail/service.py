@@ -6,7 +6,10 @@ from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 from typing import List, Tuple
-from src.db.pool import fetch_one
+from src.db.pool import fetch_one, register_hot_statement
+
+_RESOLVE_EMAIL_SQL = "SELECT email FROM public.resolve_sales_rep_email($1);"
+register_hot_statement(_RESOLVE_EMAIL_SQL)
 
 
 async def _resolve_recipient(recipient: str) -> str:
@@ -14,7 +17,7 @@ async def _resolve_recipient(recipient: str) -> str:
     try:
         if '@' in (recipient or ''):
             return recipient
-        row = await fetch_one("SELECT email FROM public.resolve_sales_rep_email($1);", (recipient,))
+        row = await fetch_one(_RESOLVE_EMAIL_SQL, (recipient,))
         return (row or {}).get('email') or recipient
     except Exception:
         return recipient
@@ -14,14 +14,14 @@ def _norm(s: str) -> str:
     return (s or "").lower().replace("ё", "е")
 
 
-def _pick_metric(t: str) -> str:
+def _pick_metric(t: str) -> Optional[str]:
     if any(k in t for k in ["выручк", "продаж", "доход", "оборот"]):
         return "revenue"
     if any(k in t for k in ["вес", "кг", "тонн"]):
         return "weight_kg"
     if any(k in t for k in ["шт", "штук", "количеств"]):
         return "quantity"
-    return "revenue"
+    return None
 
 
 def _pick_dimension(t: str) -> Optional[str]:
@@ -37,6 +37,8 @@ def _pick_dimension(t: str) -> Optional[str]:
         return "channel"
     if re.search(r"по\s+(товар|продукт)", t):
         return "product"
+    if re.search(r"по\s+категор", t):
+        return "category"
     return None
 
 
@@ -57,15 +59,15 @@ def _parse_period(t: str, current_date: Optional[datetime.date]) -> Tuple[Option
     if current_date is None:
         current_date = datetime.date.today()
 
-    # Год: "за 2025"
-    m = re.search(r"за\s+(20\d{2})", t)
+    # Год: "за 2025", "в 2025 году"
+    m = re.search(r"\b(?:за|в)\s+(20\d{2})", t)
     if m:
         y = int(m.group(1))
         return datetime.date(y, 1, 1), datetime.date(y + 1, 1, 1)
 
-    # Месяц: "за март" или "за март 2025"
+    # Месяц: "за март", "за март 2025", "в марте"
     for stem, mm in RU_MONTHS.items():
-        m = re.search(rf"за\s+{stem}[а-я]*\s*(20\d{{2}})?", t)
+        m = re.search(rf"\b(?:за|в)\s+{stem}[а-я]*\s*(20\d{{2}})?", t)
         if m:
             y = int(m.group(1)) if m.group(1) else current_date.year
             start = datetime.date(y, mm, 1)
@@ -73,7 +75,7 @@ def _parse_period(t: str, current_date: Optional[datetime.date]) -> Tuple[Option
             return start, end
 
     # Квартал: "за квартал" (текущий) или "за 2 квартал 2025"
-    m = re.search(r"за\s*(\d)\s*квартал\s*(20\d{2})?", t)
+    m = re.search(r"\bза\s*(\d)\s*квартал\s*(20\d{2})?", t)
     if m:
         q = int(m.group(1))
         y = int(m.group(2)) if m.group(2) else current_date.year
@@ -100,7 +102,9 @@ def parse_intent(text: str, current_date: Optional[datetime.date]) -> Dict[str,
     gran = _pick_granularity(t)
     start, end = _parse_period(t, current_date)
     return {
-        "metric": metric,
+        "metric": metric or "revenue",
+        # False — метрика не названа в вопросе и взята по умолчанию
+        "metric_explicit": metric is not None,
         "dimension": dimension,
         "time_granularity": gran,
         "period": {
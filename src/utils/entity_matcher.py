@@ -0,0 +1,106 @@
+from __future__ import annotations
+from collections import deque
+from typing import Dict, Iterable, List, Mapping, Set, Tuple
+
+
+def _is_word_char(ch: str) -> bool:
+    # То же определение «символа слова», что у \w в re (Unicode)
+    return ch.isalnum() or ch == "_"
+
+
+def _is_boundary(text: str, pos: int) -> bool:
+    """Аналог \\b: граница между символом слова и не-словом (края текста — не-слово)"""
+    before = pos > 0 and _is_word_char(text[pos - 1])
+    after = pos < len(text) and _is_word_char(text[pos])
+    return before != after
+
+
+class EntityMatcher:
+    """Поиск всех названий из справочников за один проход по тексту (Aho-Corasick).
+
+    Совпадение засчитывается так же, как re.search(r"\\b" + re.escape(name) + r"\\b"):
+    по обе стороны вхождения должна быть граница слова. Названия передаются уже
+    нормализованными (нижний регистр, ё -> е), текст — тоже.
+
+    Строится один раз на снимок справочников; match() не компилирует регулярок.
+    """
+
+    __slots__ = ("_goto", "_fail", "_out", "_lengths", "_by_type")
+
+    def __init__(self, entries: Mapping[str, Iterable[str]]):
+        # entries: тип сущности -> названия в порядке справочника (порядок сохраняется в ответе)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        self._lengths: List[int] = []
+        self._by_type: Dict[str, List[Tuple[int, str]]] = {}
+
+        pattern_ids: Dict[str, int] = {}
+        outputs: List[List[int]] = [[]]
+        for entity_type, names in entries.items():
+            ordered: List[Tuple[int, str]] = []
+            for name in names:
+                if not name:
+                    continue
+                pid = pattern_ids.get(name)
+                if pid is None:
+                    pid = pattern_ids[name] = len(self._lengths)
+                    self._lengths.append(len(name))
+                    node = 0
+                    for ch in name:
+                        nxt = self._goto[node].get(ch)
+                        if nxt is None:
+                            nxt = len(self._goto)
+                            self._goto[node][ch] = nxt
+                            self._goto.append({})
+                            self._fail.append(0)
+                            outputs.append([])
+                        node = nxt
+                    outputs[node].append(pid)
+                ordered.append((pid, name))
+            self._by_type[entity_type] = ordered
+
+        # Суффиксные ссылки (BFS); выходы узла дополняются выходами его fail-узла
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                outputs[child].extend(outputs[self._fail[child]])
+        self._out = [tuple(o) for o in outputs]
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def find(self, text: str) -> Set[int]:
+        """id всех названий, которые встречаются в тексте целыми словами"""
+        goto, fail, out, lengths = self._goto, self._fail, self._out, self._lengths
+        found: Set[int] = set()
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not out[node]:
+                continue
+            end = i + 1
+            for pid in out[node]:
+                if pid in found:
+                    continue
+                start = end - lengths[pid]
+                if _is_boundary(text, start) and _is_boundary(text, end):
+                    found.add(pid)
+        return found
+
+    def match(self, text: str) -> Dict[str, List[str]]:
+        """Найденные названия по типам, в порядке справочника"""
+        found = self.find(text)
+        return {
+            entity_type: [name for pid, name in ordered if pid in found]
+            for entity_type, ordered in self._by_type.items()
+        }
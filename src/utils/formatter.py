@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional, Sequence, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 import datetime as _dt
 import os
 from decimal import Decimal
@@ -7,6 +7,7 @@ import re
 
 # ВАЖНО: используем корректный модуль sanitize_html
 from src.utils.html_sanitize import sanitize_html
+from src.models.rowset import RowSet
 
 
 # =========================
@@ -102,6 +103,20 @@ def _looks_numeric(val: Any) -> bool:
     return _to_float(val) is not None
 
 
+def _numeric_check(rows: Union[RowSet, List[Dict[str, Any]]]) -> Callable[[str, Any], bool]:
+    """Проверка «значение — число» для ключа. У RowSet типы колонок известны заранее,
+    поэтому числовые колонки не разбираются заново в каждой ячейке."""
+    if isinstance(rows, RowSet):
+        numeric = rows.numeric_columns
+
+        def _check(key: str, value: Any) -> bool:
+            if key in numeric:
+                return value is not None
+            return _looks_numeric(value)
+        return _check
+    return lambda key, value: _looks_numeric(value)
+
+
 def _parse_dt(val: Any) -> Optional[_dt.date]:
     """Пытается разобрать дату (date/datetime/ISO/ YYYY-MM → 1-е число)."""
     if val is None:
@@ -192,7 +207,7 @@ def _extract_title_and_period(existing_title: Optional[str]) -> Tuple[str, Optio
 
 
 def build_html_from_rows(
-    rows: List[Dict[str, Any]],
+    rows: Union[RowSet, List[Dict[str, Any]]],
     existing_title: Optional[str] = None
 ) -> str:
     """Собирает аккуратный HTML:
@@ -202,10 +217,34 @@ def build_html_from_rows(
       - Поддерживает time-series (месяцы/даты), weekN_* поля и двухуровневые группировки.
       - На выходе: СРАЗУ санитизированный HTML (под Telegram), обрезанный по лимиту.
     """
+    head, lines = _build_blocks(rows, existing_title)
+    return head if lines is None else _assemble_with_limit(head, lines)
+
+
+def build_html_pages(
+    rows: Union[RowSet, List[Dict[str, Any]]],
+    existing_title: Optional[str] = None,
+    max_pages: int = 50,
+) -> List[str]:
+    """То же, что build_html_from_rows, но вместо обрезки — страницы в лимите Telegram.
+
+    Каждая страница повторяет заголовок и заканчивается номером «Страница i из N»;
+    строки сверх max_pages страниц не попадают никуда (последняя страница говорит об этом).
+    """
+    head, lines = _build_blocks(rows, existing_title)
+    return [head] if lines is None else _paginate(head, lines, max_pages)
+
+
+def _build_blocks(
+    rows: Union[RowSet, List[Dict[str, Any]]],
+    existing_title: Optional[str] = None
+) -> Tuple[str, Optional[List[str]]]:
+    """(шапка, строки списка) для сборки с лимитом; строки None — ответ короткий и уже готов в шапке"""
     if not rows:
-        return "<b>Нет данных по заданным условиям.</b>"
+        return "<b>Нет данных по заданным условиям.</b>", None
 
     title, period_line = _extract_title_and_period(existing_title)
+    is_numeric = _numeric_check(rows)
 
     # === time-series (помесячно/по датам)
     probe_keys = set(rows[0].keys())
@@ -229,7 +268,7 @@ def build_html_from_rows(
             for k, v in r.items():
                 if k in ("month_start", "month", "month_period", "date", "дата", "месяц"):
                     continue
-                if _looks_numeric(v):
+                if is_numeric(k, v):
                     unit = unit_for_key(k.lower())
                     label_metric = _label_for_metric(k.lower())
                     parts.append(f"{label_metric}: {with_unit(v, unit)}")
@@ -240,15 +279,14 @@ def build_html_from_rows(
         if lines_ts:
             # Сначала санитизируем заголовок/период и каждую строку, затем собираем.
             head = sanitize_html(title) + (("\n" + sanitize_html(period_line)) if period_line else "")
-            sanitized_lines = [sanitize_html(ln) for ln in lines_ts]
-            return _assemble_with_limit(head, sanitized_lines)
+            return head, lines_ts
 
     # === определяем числовые и нечисловые поля
     probe = rows[0]
     non_numeric_keys: List[str] = []
     numeric_keys: List[str] = []
     for k, v in probe.items():
-        (numeric_keys if _looks_numeric(v) else non_numeric_keys).append(k)
+        (numeric_keys if is_numeric(k, v) else non_numeric_keys).append(k)
 
     # === один ряд, одна метрика → краткий вывод
     if (len(rows) == 1) and (len(numeric_keys) == 1):
@@ -260,7 +298,7 @@ def build_html_from_rows(
             parts.append(sanitize_html(period_line))
         parts.append(sanitize_html(with_unit(value, unit)))
         # Здесь нет длинных списков → просто вернуть склеенный текст
-        return "\n".join(parts)
+        return "\n".join(parts), None
 
     # === weekN_* (например: week1_kg, week2_qty, week3_revenue)
     week_pattern = re.compile(r"^week(\d+)_(kg|quantity|qty|revenue)$", re.IGNORECASE)
@@ -289,8 +327,7 @@ def build_html_from_rows(
                 lines.append(f"<b>{primary_name}</b> — {'; '.join(parts)}")
 
         head = sanitize_html(title) + (("\n" + sanitize_html(period_line)) if period_line else "")
-        sanitized_lines = [sanitize_html(ln) for ln in lines]
-        return _assemble_with_limit(head, sanitized_lines)
+        return head, lines
 
     # === weekN (без суффиксов: считаем ₽ по умолчанию)
     week_simple_pattern = re.compile(r"^week(\d+)$", re.IGNORECASE)
@@ -317,8 +354,7 @@ def build_html_from_rows(
                 lines.append(f"<b>{primary_name}</b> — {'; '.join(parts)}")
 
         head = sanitize_html(title) + (("\n" + sanitize_html(period_line)) if period_line else "")
-        sanitized_lines = [sanitize_html(ln) for ln in lines]
-        return _assemble_with_limit(head, sanitized_lines)
+        return head, lines
 
     # === общий случай: одна или две размерности + до 3 метрик
     name_key = non_numeric_keys[0] if non_numeric_keys else list(probe.keys())[0]
@@ -375,18 +411,18 @@ def build_html_from_rows(
             if not metrics:
                 # возьмём первый числовой
                 for k, v in r.items():
-                    if _looks_numeric(v):
+                    if is_numeric(k, v):
                         parts.append(with_unit(v, unit_for_key(k.lower())))
                         break
             else:
                 if len(metrics) == 1:
                     k = metrics[0]
-                    if k in r and _looks_numeric(r[k]):
+                    if k in r and is_numeric(k, r[k]):
                         unit = unit_for_key(k.lower())
                         parts.append(with_unit(r[k], unit))
                 else:
                     for k in metrics:
-                        if k in r and _looks_numeric(r[k]):
+                        if k in r and is_numeric(k, r[k]):
                             unit = unit_for_key(k.lower())
                             label = _label_for_metric(k.lower())
                             parts.append(f"{label}: {with_unit(r[k], unit)}")
@@ -396,30 +432,43 @@ def build_html_from_rows(
             lines.append(line)
 
     head = sanitize_html(title) + (("\n" + sanitize_html(period_line)) if period_line else "")
-    sanitized_lines = [sanitize_html(ln) for ln in lines]
-    return _assemble_with_limit(head, sanitized_lines)
+    return head, lines
 
 
 # =========================
 # СБОРКА С УЧЁТОМ ЛИМИТА TELEGRAM
 # =========================
 
-def _assemble_with_limit(header_block: str, sanitized_lines: List[str]) -> str:
-    """Собирает итог: header + пустая строка + список строк, при необходимости обрезает,
-    не ломая HTML (строки уже санитизированы и самодостаточны).
-    """
-    # Лимит Telegram
+def _message_limit() -> int:
+    """Лимит длины сообщения Telegram"""
     try:
         hard_limit = int(os.getenv("TELEGRAM_MAX_MESSAGE", "4000"))
     except Exception:
         hard_limit = 4000
-    hard_limit = max(500, hard_limit)
+    return max(500, hard_limit)
+
+
+def _assemble_with_limit(header_block: str, lines: List[str]) -> str:
+    """Собирает итог: header + пустая строка + список строк, при необходимости обрезает,
+    не ломая HTML (каждая строка санитизируется отдельно и самодостаточна).
+
+    Строки санитизируются лениво — только те, что могут попасть в сообщение: на больших
+    выборках это основная стоимость рендера.
+    """
+    hard_limit = _message_limit()
     safety_tail = 200  # на футер
 
     header_block = sanitize_html(header_block)
-    full_text = header_block + "\n\n" + "\n".join(sanitized_lines)
-    if len(full_text) <= hard_limit:
-        return full_text
+    sanitized_lines: List[str] = []
+    full_len = len(header_block) + 2
+    for ln in lines:
+        sanitized = sanitize_html(ln)
+        sanitized_lines.append(sanitized)
+        full_len += len(sanitized) + (1 if len(sanitized_lines) > 1 else 0)
+        if full_len > hard_limit:
+            break
+    else:
+        return header_block + "\n\n" + "\n".join(sanitized_lines)
 
     kept: List[str] = []
     current_len = len(header_block) + 2
@@ -433,10 +482,52 @@ def _assemble_with_limit(header_block: str, sanitized_lines: List[str]) -> str:
         current_len += add_len
 
     shown = len(kept)
-    total = len(sanitized_lines)
+    total = len(lines)
     footer = (
         f"\n\nПоказаны первые {shown} из {total} строк. "
         f"Могу отправить полный список в Excel — напишите: в excel"
     )
     # Футер тоже санитизируем (на будущее, если появятся ссылки/теги)
     return header_block + "\n\n" + ("\n".join(kept)) + sanitize_html(footer)
+
+
+def _paginate(header_block: str, lines: List[str], max_pages: int) -> List[str]:
+    """Разложить строки по страницам: header + пустая строка + строки + номер страницы.
+
+    Строка длиннее страницы целиком не помещается нигде — она всё равно занимает свою
+    страницу (Telegram обрежет её так же, как обрезал бы единственное сообщение).
+    """
+    limit_for_lines = _message_limit() - 200  # на номер страницы и подсказку
+    header_block = sanitize_html(header_block)
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    current_len = len(header_block) + 2
+    shown = 0
+    for ln in lines:
+        sanitized = sanitize_html(ln)
+        add_len = len(sanitized) + 1
+        if current and current_len + add_len > limit_for_lines:
+            chunks.append(current)
+            if len(chunks) == max_pages:
+                current = []
+                break
+            current, current_len = [], len(header_block) + 2
+        current.append(sanitized)
+        current_len += add_len
+        shown += 1
+    if current:
+        chunks.append(current)
+
+    if len(chunks) <= 1:
+        return [header_block + "\n\n" + "\n".join(chunks[0] if chunks else [])]
+    total = len(chunks)
+    pages: List[str] = []
+    for i, chunk in enumerate(chunks, 1):
+        footer = f"\n\n<i>Страница {i} из {total}</i>"
+        if i == total and shown < len(lines):
+            footer += (
+                f"\n<i>Показаны первые {shown} из {len(lines)} строк. "
+                f"Полный список — в Excel, напишите: в excel</i>"
+            )
+        pages.append(header_block + "\n\n" + "\n".join(chunk) + footer)
+    return pages
@@ -0,0 +1,142 @@
+from __future__ import annotations
+import os
+import secrets
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.logger import get_logger
+from src.utils.memory import get_redis
+
+logger = get_logger("utils.pager")
+
+# Сколько хранить страницы ответа для кнопок ◀ ▶ (сек)
+PAGER_TTL = int(os.getenv("PAGER_TTL", "86400"))
+# Сколько страниц максимум у одного ответа (остальное — в Excel)
+PAGER_MAX_PAGES = int(os.getenv("PAGER_MAX_PAGES", "50"))
+# Пределы для всех сохранённых ответов: число и объём; старые вытесняются первыми
+PAGER_MAX_RESULTS = int(os.getenv("PAGER_MAX_RESULTS", "2000"))
+PAGER_MAX_MB = float(os.getenv("PAGER_MAX_MB", "32"))
+
+CALLBACK_PREFIX = "page:"
+
+_PREFIX = "pager"
+_LRU_KEY = f"{_PREFIX}:lru"        # ZSET id -> время сохранения
+_SIZES_KEY = f"{_PREFIX}:sizes"    # HASH id -> байт
+_BYTES_KEY = f"{_PREFIX}:bytes"    # сумма _SIZES_KEY
+
+_STATS: Dict[str, Any] = {"stored": 0, "flips": 0, "expired": 0, "evictions": 0, "errors": 0}
+
+
+def pager_enabled() -> bool:
+    return PAGER_TTL > 0 and PAGER_MAX_PAGES > 1 and PAGER_MAX_RESULTS > 0
+
+
+def _pages_key(page_id: str) -> str:
+    return f"{_PREFIX}:{page_id}"
+
+
+def page_callback_data(page_id: str, page: int) -> str:
+    return f"{CALLBACK_PREFIX}{page_id}:{page}"
+
+
+def parse_page_callback(data: str) -> Optional[Tuple[str, int]]:
+    """page:<id>:<номер> -> (id, номер с нуля) или None"""
+    if not data or not data.startswith(CALLBACK_PREFIX):
+        return None
+    page_id, _, page = data[len(CALLBACK_PREFIX):].partition(":")
+    if not page_id or not page.isdigit():
+        return None
+    return page_id, int(page)
+
+
+async def _drop(r, page_ids: List[str]) -> int:
+    """Удалить ответы и вернуть, сколько байт освободилось"""
+    if not page_ids:
+        return 0
+    sizes = await r.hmget(_SIZES_KEY, page_ids)
+    freed = sum(int(s) for s in sizes if s)
+    pipe = r.pipeline(transaction=False)
+    pipe.delete(*[_pages_key(pid) for pid in page_ids])
+    pipe.zrem(_LRU_KEY, *page_ids)
+    pipe.hdel(_SIZES_KEY, *page_ids)
+    if freed:
+        pipe.decrby(_BYTES_KEY, freed)
+    await pipe.execute()
+    return freed
+
+
+async def _evict(r, incoming_bytes: int) -> None:
+    """Освободить место под новый ответ: сначала истёкшие, затем самые старые"""
+    expired = await r.zrangebyscore(_LRU_KEY, "-inf", time.time() - PAGER_TTL)
+    if expired:
+        await _drop(r, expired)
+    max_bytes = int(PAGER_MAX_MB * 1024 * 1024)
+    count = await r.zcard(_LRU_KEY)
+    used = int(await r.get(_BYTES_KEY) or 0)
+    while count and (count >= PAGER_MAX_RESULTS or used + incoming_bytes > max_bytes):
+        oldest = await r.zrange(_LRU_KEY, 0, 0)
+        if not oldest:
+            break
+        used -= await _drop(r, oldest)
+        count -= len(oldest)
+        _STATS["evictions"] += len(oldest)
+
+
+async def store_pages(pages: List[str]) -> Optional[str]:
+    """Сохранить страницы ответа и вернуть короткий id для callback-кнопок (None — не сохранили)"""
+    if not pager_enabled() or len(pages) < 2:
+        return None
+    size = sum(len(p.encode("utf-8")) for p in pages)
+    if size > PAGER_MAX_MB * 1024 * 1024:
+        return None
+    page_id = secrets.token_urlsafe(6)
+    try:
+        r = get_redis()
+        await _evict(r, size)
+        pipe = r.pipeline(transaction=True)
+        pipe.rpush(_pages_key(page_id), *pages)
+        # Запас к TTL: ключ удаляет _evict, Redis — только если вытеснение не дошло до него
+        pipe.expire(_pages_key(page_id), PAGER_TTL + 3600)
+        pipe.zadd(_LRU_KEY, {page_id: time.time()})
+        pipe.hset(_SIZES_KEY, page_id, size)
+        pipe.incrby(_BYTES_KEY, size)
+        await pipe.execute()
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Не удалось сохранить страницы ответа: {e}")
+        return None
+    _STATS["stored"] += 1
+    return page_id
+
+
+async def get_page(page_id: str, page: int) -> Optional[Tuple[str, int]]:
+    """(HTML страницы, всего страниц) или None, если ответ истёк или вытеснен"""
+    try:
+        r = get_redis()
+        pipe = r.pipeline(transaction=False)
+        pipe.lindex(_pages_key(page_id), page)
+        pipe.llen(_pages_key(page_id))
+        # Листание продлевает жизнь ответа и отодвигает его в очереди на вытеснение
+        pipe.expire(_pages_key(page_id), PAGER_TTL + 3600)
+        pipe.zadd(_LRU_KEY, {page_id: time.time()}, xx=True)
+        html, total, _, _ = await pipe.execute()
+    except Exception as e:
+        _STATS["errors"] += 1
+        logger.warning(f"⚠️ Не удалось прочитать страницу ответа: {e}")
+        return None
+    if html is None or not total:
+        _STATS["expired"] += 1
+        return None
+    _STATS["flips"] += 1
+    return html, int(total)
+
+
+async def get_pager_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = {"enabled": pager_enabled(), **_STATS, "results": None, "size_mb": None}
+    try:
+        r = get_redis()
+        stats["results"] = await r.zcard(_LRU_KEY)
+        stats["size_mb"] = round(int(await r.get(_BYTES_KEY) or 0) / (1024 * 1024), 1)
+    except Exception:
+        pass
+    return stats
@@ -1,14 +1,17 @@
 from __future__ import annotations
-from typing import Dict, List, Set, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Set, Optional, Tuple
+import os
 import re
 import asyncio
 import time  # Добавляем импорт time
 from src.db.pool import fetch_all, fetch_one
 from src.utils.logger import get_logger
+from src.utils.entity_matcher import EntityMatcher
 
 logger = get_logger("reference_data")
 
-# Кэш справочников (обновляется из БД)
+# Кэш справочников (обновляется из БД). Снимок неизменяем после сборки: обновление
+# собирает новый словарь и подменяет ссылку целиком, читатели никогда не видят полусобранный кэш.
 _REFERENCE_CACHE = {
     "brands": {},
     "categories": {},
@@ -19,23 +22,37 @@ _REFERENCE_CACHE = {
     "last_update": None
 }
 
-# Время жизни кэша (5 минут)
-CACHE_TTL = 300
+# Время жизни кэша (5 минут): после него отдаём старый снимок и обновляем в фоне
+CACHE_TTL = int(os.getenv("REFERENCE_CACHE_TTL", "300"))
+# Пауза перед повтором, если обновление упало (старый снимок продолжает работать)
+REFERENCE_RETRY_INTERVAL = int(os.getenv("REFERENCE_RETRY_INTERVAL", "30"))
+
+_refresh_task: Optional[asyncio.Task] = None
+_refresher_task: Optional[asyncio.Task] = None
+_loaded_from_db = False
+_last_attempt: float = 0.0
+
+# Метрики обновлений
+_REFRESH_STATS: Dict[str, Any] = {
+    "refreshes": 0,
+    "failures": 0,
+    "background_refreshes": 0,
+    "blocked_requests": 0,
+    "last_duration_ms": None,
+    "max_duration_ms": 0,
+    "total_duration_ms": 0,
+    "last_error": None,
+    "queries_ms": {},
+}
 
-async def load_references_from_db():
-    """Загружает актуальные справочники из базы данных."""
-    try:
-        # Загружаем бренды из таблицы products
-        brands_query = """
+_BRANDS_SQL = """
         SELECT DISTINCT LOWER(brand) as brand_name
         FROM products 
         WHERE brand IS NOT NULL AND brand != ''
         ORDER BY brand_name
         """
-        brands_result = await fetch_all(brands_query)
-        
-        # Загружаем категории из таблицы products
-        categories_query = """
+
+_CATEGORIES_SQL = """
         SELECT DISTINCT 
             LOWER(category_1) as category_name,
             LOWER(category_group_1) as category_group
@@ -43,122 +60,177 @@ async def load_references_from_db():
         WHERE category_1 IS NOT NULL AND category_1 != ''
         ORDER BY category_name
         """
-        categories_result = await fetch_all(categories_query)
-        
-        # Загружаем каналы сбыта из таблицы profit
-        channels_query = """
+
+_CHANNELS_SQL = """
         SELECT DISTINCT LOWER(channel) as channel_name
         FROM profit 
         WHERE channel IS NOT NULL AND channel != ''
         ORDER BY channel_name
         """
-        channels_result = await fetch_all(channels_query)
-        
-        # Загружаем регионы из таблицы clients
-        regions_query = """
+
+_REGIONS_SQL = """
         SELECT DISTINCT LOWER(region) as region_name
         FROM clients 
         WHERE region IS NOT NULL AND region != ''
         ORDER BY region_name
         """
-        regions_result = await fetch_all(regions_query)
-        
-        # Загружаем клиентов (публичные/юридические названия)
-        clients_query = """
+
+_CLIENTS_SQL = """
         SELECT DISTINCT LOWER(COALESCE(NULLIF(public_name,''), client_name)) AS client_name
         FROM clients
         WHERE COALESCE(NULLIF(public_name,''), client_name) IS NOT NULL
         ORDER BY client_name
         """
-        clients_result = await fetch_all(clients_query)
 
-        # Загружаем менеджеров из sales_representatives и union c profit.manager
-        managers_result = []
-        try:
-            managers_query = """
+_MANAGERS_SQL = """
             SELECT DISTINCT LOWER(full_name) AS manager_name
             FROM sales_representatives
             WHERE full_name IS NOT NULL AND full_name != ''
             """
-            managers_result = await fetch_all(managers_query)
-        except Exception:
-            managers_result = []
-        profit_managers_result = []
-        try:
-            profit_mgr_query = """
+
+_PROFIT_MANAGERS_SQL = """
             SELECT DISTINCT LOWER(manager) AS manager_name
             FROM profit
             WHERE manager IS NOT NULL AND manager != ''
             """
-            profit_managers_result = await fetch_all(profit_mgr_query)
-        except Exception:
-            profit_managers_result = []
-        # Объединяем и нормализуем
-        manager_names: Set[str] = set()
-        for row in managers_result:
-            if row.get("manager_name"):
-                manager_names.add(row["manager_name"])
-        for row in profit_managers_result:
-            if row.get("manager_name"):
-                manager_names.add(row["manager_name"])
-        
-        # Обновляем кэш
-        _REFERENCE_CACHE["brands"] = {
-            row["brand_name"]: "brand" for row in brands_result
-        }
-        
-        _REFERENCE_CACHE["categories"] = {}
-        for row in categories_result:
-            if row["category_name"]:
-                _REFERENCE_CACHE["categories"][row["category_name"]] = "category"
-            if row["category_group"]:
-                _REFERENCE_CACHE["categories"][row["category_group"]] = "category"
-        
-        _REFERENCE_CACHE["channels"] = {
-            row["channel_name"]: "channel" for row in channels_result
-        }
-        
-        _REFERENCE_CACHE["regions"] = {
-            row["region_name"]: "region" for row in regions_result
-        }
-        
-        _REFERENCE_CACHE["clients"] = {
-            row["client_name"]: "client" for row in clients_result
-        }
-        
-        _REFERENCE_CACHE["managers"] = {name: "manager" for name in manager_names}
-        
-        _REFERENCE_CACHE["last_update"] = time.time()
-        
+
+
+async def _timed_fetch(name: str, query: str, optional: bool = False) -> List[Dict[str, Any]]:
+    """fetch_all с замером времени; optional — ошибка не валит всё обновление"""
+    start = time.perf_counter()
+    try:
+        return await fetch_all(query)
+    except Exception as e:
+        if not optional:
+            raise
+        logger.warning(f"⚠️ Справочник {name} не загружен: {e}")
+        return []
+    finally:
+        _REFRESH_STATS["queries_ms"][name] = int((time.perf_counter() - start) * 1000)
+
+
+def _build_snapshot(
+    brands_result, categories_result, channels_result, regions_result,
+    clients_result, managers_result, profit_managers_result,
+) -> Dict[str, Any]:
+    # Объединяем и нормализуем менеджеров из sales_representatives и profit.manager
+    manager_names: Set[str] = set()
+    for row in managers_result:
+        if row.get("manager_name"):
+            manager_names.add(row["manager_name"])
+    for row in profit_managers_result:
+        if row.get("manager_name"):
+            manager_names.add(row["manager_name"])
+
+    categories: Dict[str, str] = {}
+    for row in categories_result:
+        if row["category_name"]:
+            categories[row["category_name"]] = "category"
+        if row["category_group"]:
+            categories[row["category_group"]] = "category"
+
+    return {
+        "brands": {row["brand_name"]: "brand" for row in brands_result},
+        "categories": categories,
+        "channels": {row["channel_name"]: "channel" for row in channels_result},
+        "regions": {row["region_name"]: "region" for row in regions_result},
+        "clients": {row["client_name"]: "client" for row in clients_result},
+        "managers": {name: "manager" for name in manager_names},
+        "last_update": time.time(),
+    }
+
+
+# Типы сущностей, которые ищутся в тексте по точному вхождению названия
+_MATCHED_TYPES = ("brands", "categories", "channels", "regions", "managers", "clients")
+
+
+def _build_matcher(snapshot: Dict[str, Any]) -> EntityMatcher:
+    """Автомат по нормализованным названиям снимка — строится один раз на снимок"""
+    return EntityMatcher({t: [_norm(name) for name in snapshot[t]] for t in _MATCHED_TYPES})
+
+
+def _build_indexes(snapshot: Dict[str, Any]) -> Tuple[EntityMatcher, "ManagerIndex"]:
+    return _build_matcher(snapshot), ManagerIndex(snapshot["managers"].keys())
+
+
+def _get_matcher() -> EntityMatcher:
+    snapshot = _REFERENCE_CACHE
+    matcher = snapshot.get("matcher")
+    if matcher is None:
+        matcher = snapshot["matcher"] = _build_matcher(snapshot)
+    return matcher
+
+
+async def load_references_from_db():
+    """Загружает актуальные справочники из базы данных (все запросы параллельно) и атомарно
+    подменяет снимок. При ошибке остаётся предыдущий снимок; базовые справочники — только
+    если из БД ещё ни разу ничего не загрузили."""
+    global _REFERENCE_CACHE, _loaded_from_db, _last_attempt
+    _last_attempt = time.time()
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(
+            _timed_fetch("brands", _BRANDS_SQL),
+            _timed_fetch("categories", _CATEGORIES_SQL),
+            _timed_fetch("channels", _CHANNELS_SQL),
+            _timed_fetch("regions", _REGIONS_SQL),
+            _timed_fetch("clients", _CLIENTS_SQL),
+            _timed_fetch("managers", _MANAGERS_SQL, optional=True),
+            _timed_fetch("profit_managers", _PROFIT_MANAGERS_SQL, optional=True),
+        )
+        snapshot = _build_snapshot(*results)
+        # Индексы строим в потоке, чтобы тысячи клиентов не стопорили event loop
+        snapshot["matcher"], snapshot["manager_index"] = await asyncio.to_thread(_build_indexes, snapshot)
+        _REFERENCE_CACHE = snapshot
+        _loaded_from_db = True
+
+        dur_ms = int((time.perf_counter() - start) * 1000)
+        _REFRESH_STATS["refreshes"] += 1
+        _REFRESH_STATS["last_duration_ms"] = dur_ms
+        _REFRESH_STATS["max_duration_ms"] = max(_REFRESH_STATS["max_duration_ms"], dur_ms)
+        _REFRESH_STATS["total_duration_ms"] += dur_ms
+        _REFRESH_STATS["last_error"] = None
+
         logger.info(
-            f"✅ Справочники обновлены: {len(_REFERENCE_CACHE['brands'])} брендов, "
-            f"{len(_REFERENCE_CACHE['categories'])} категорий, "
-            f"{len(_REFERENCE_CACHE['channels'])} каналов, "
-            f"{len(_REFERENCE_CACHE['regions'])} регионов, "
-            f"{len(_REFERENCE_CACHE['clients'])} клиентов, "
-            f"{len(_REFERENCE_CACHE['managers'])} менеджеров"
+            f"✅ Справочники обновлены за {dur_ms} мс: {len(snapshot['brands'])} брендов, "
+            f"{len(snapshot['categories'])} категорий, "
+            f"{len(snapshot['channels'])} каналов, "
+            f"{len(snapshot['regions'])} регионов, "
+            f"{len(snapshot['clients'])} клиентов, "
+            f"{len(snapshot['managers'])} менеджеров"
         )
-        
+
     except Exception as e:
+        _REFRESH_STATS["failures"] += 1
+        _REFRESH_STATS["last_error"] = str(e)
         logger.error(f"❌ Ошибка загрузки справочников из БД: {e}")
-        # В случае ошибки используем базовые справочники
-        _load_fallback_references()
+        if not _loaded_from_db:
+            # В случае ошибки используем базовые справочники
+            _load_fallback_references()
+        else:
+            logger.warning("⚠️ Продолжаем работать на предыдущем снимке справочников")
 
 def _load_fallback_references():
     """Загружает базовые справочники в случае ошибки БД."""
-    _REFERENCE_CACHE["brands"] = {
-        "чабан": "brand", "молочный": "brand", "сырный": "brand"
-    }
-    _REFERENCE_CACHE["categories"] = {
-        "молочная продукция": "category", "сыр": "category", "мясо": "category"
+    global _REFERENCE_CACHE
+    _REFERENCE_CACHE = {
+        "brands": {
+            "чабан": "brand", "молочный": "brand", "сырный": "brand"
+        },
+        "categories": {
+            "молочная продукция": "category", "сыр": "category", "мясо": "category"
+        },
+        "channels": {
+            "розница": "channel", "опт": "channel", "интернет": "channel"
+        },
+        "regions": {
+            "москва": "region", "спб": "region", "краснодар": "region"
+        },
+        "clients": {},
+        "managers": {},
+        "last_update": time.time(),
     }
-    _REFERENCE_CACHE["channels"] = {
-        "розница": "channel", "опт": "channel", "интернет": "channel"
-    }
-    _REFERENCE_CACHE["regions"] = {
-        "москва": "region", "спб": "region", "краснодар": "region"
-    }
-    _REFERENCE_CACHE["last_update"] = time.time()
+    _REFERENCE_CACHE["matcher"], _REFERENCE_CACHE["manager_index"] = _build_indexes(_REFERENCE_CACHE)
     logger.warning("⚠️ Используются базовые справочники")
 
 def _is_cache_expired():
@@ -168,18 +240,63 @@ def _is_cache_expired():
     current_time = time.time()
     return (current_time - _REFERENCE_CACHE["last_update"]) > CACHE_TTL
 
+
+async def _refresh_single_flight() -> None:
+    """Одно обновление на всех: параллельные вызовы ждут уже идущую загрузку"""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(load_references_from_db())
+    await asyncio.shield(_refresh_task)
+
+
+def _refresh_in_background() -> None:
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _REFRESH_STATS["background_refreshes"] += 1
+        _refresh_task = asyncio.create_task(load_references_from_db())
+
+
 async def ensure_references_loaded():
-    """Убеждается, что справочники загружены и актуальны."""
-    if _is_cache_expired():
-        await load_references_from_db()
+    """Убеждается, что справочники загружены. Устаревший снимок отдаётся сразу,
+    а обновление идёт в фоне (stale-while-revalidate); ждём только самую первую загрузку."""
+    if _REFERENCE_CACHE["last_update"] is None:
+        _REFRESH_STATS["blocked_requests"] += 1
+        await _refresh_single_flight()
+    elif _is_cache_expired() and (time.time() - _last_attempt) > REFERENCE_RETRY_INTERVAL:
+        _refresh_in_background()
 
 async def force_refresh_references():
     """Принудительно обновляет справочники из БД."""
-    _REFERENCE_CACHE["last_update"] = None
-    await load_references_from_db()
+    await _refresh_single_flight()
+
+
+async def _refresh_periodically() -> None:
+    """Фоновое обновление по TTL, чтобы запросы пользователей не натыкались на устаревший кэш"""
+    while True:
+        await _refresh_single_flight()
+        await asyncio.sleep(CACHE_TTL if _REFRESH_STATS["last_error"] is None else REFERENCE_RETRY_INTERVAL)
+
+
+def start_reference_refresher() -> None:
+    """Загрузить справочники при старте (в фоне) и обновлять их по TTL"""
+    global _refresher_task
+    if _refresher_task is None or _refresher_task.done():
+        _refresher_task = asyncio.create_task(_refresh_periodically())
+
+
+async def stop_reference_refresher() -> None:
+    global _refresher_task
+    if _refresher_task is not None:
+        _refresher_task.cancel()
+        try:
+            await _refresher_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _refresher_task = None
 
 def get_references_stats():
     """Возвращает статистику по загруженным справочникам."""
+    refreshes = _REFRESH_STATS["refreshes"]
     return {
         "brands_count": len(_REFERENCE_CACHE["brands"]),
         "categories_count": len(_REFERENCE_CACHE["categories"]),
@@ -188,7 +305,11 @@ def get_references_stats():
         "clients_count": len(_REFERENCE_CACHE["clients"]),
         "managers_count": len(_REFERENCE_CACHE["managers"]),
         "last_update": _REFERENCE_CACHE["last_update"],
-        "cache_expired": _is_cache_expired()
+        "cache_expired": _is_cache_expired(),
+        "refresh_in_progress": _refresh_task is not None and not _refresh_task.done(),
+        **{k: v for k, v in _REFRESH_STATS.items() if k != "queries_ms"},
+        "avg_duration_ms": (_REFRESH_STATS["total_duration_ms"] // refreshes) if refreshes else None,
+        "queries_ms": dict(_REFRESH_STATS["queries_ms"]),
     }
 
 def _norm(s: str) -> str:
@@ -244,6 +365,93 @@ def _tokens_match_approx(a: str, b: str) -> bool:
     return False
 
 
+def _substrings(word: str, min_len: int = 1):
+    n = len(word)
+    for i in range(n):
+        for j in range(i + min_len, n + 1):
+            yield word[i:j]
+
+
+class ManagerIndex:
+    """Индекс фамилий менеджеров для _tokens_match_approx без перебора всех менеджеров.
+
+    Правило совпадения фамилии (стем aa) со стемом токена bb: aa == bb, либо при len(aa) >= 4
+    одно содержится в другом. Поэтому храним:
+      - стем фамилии -> менеджеры (точное совпадение);
+      - каждую подстроку стема фамилии длиной >= 4 -> менеджеры (bb внутри aa);
+      - стемы фамилий длиной >= 4 -> менеджеры, их ищем среди подстрок bb (aa внутри bb).
+    Строится один раз на снимок справочников.
+    """
+
+    __slots__ = ("names", "norm_names", "first_stems", "_by_norm", "_exact", "_inside", "_long")
+
+    def __init__(self, managers: Iterable[str]):
+        self.names: List[str] = []
+        self.norm_names: List[str] = []
+        self.first_stems: List[str] = []
+        self._by_norm: Dict[str, List[int]] = {}
+        self._exact: Dict[str, List[int]] = {}
+        self._inside: Dict[str, List[int]] = {}
+        self._long: Dict[str, List[int]] = {}
+        for idx, name in enumerate(managers):
+            m = _norm(name)
+            parts = [p for p in re.split(r"\s+", m) if p]
+            self.names.append(name)
+            self.norm_names.append(m)
+            self.first_stems.append(_stem_simple(parts[1]) if len(parts) >= 2 else "")
+            self._by_norm.setdefault(m, []).append(idx)
+            if not parts:
+                continue
+            aa = _stem_simple(parts[0])
+            self._exact.setdefault(aa, []).append(idx)
+            if len(aa) >= 4:
+                self._long.setdefault(aa, []).append(idx)
+                for sub in set(_substrings(aa)):
+                    self._inside.setdefault(sub, []).append(idx)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @staticmethod
+    def query_stems(stems: Iterable[str]) -> Set[str]:
+        # _tokens_match_approx стеммит второй аргумент ещё раз
+        return {_stem_simple(st) for st in stems if st}
+
+    def match_surnames(self, query: Set[str]) -> Set[int]:
+        """Индексы менеджеров, чья фамилия совпадает хотя бы с одним стемом (как _tokens_match_approx)"""
+        found: Set[int] = set()
+        for bb in query:
+            found.update(self._exact.get(bb, ()))
+            found.update(self._inside.get(bb, ()))
+            if len(bb) >= 4 and self._long:
+                for sub in _substrings(bb, 4):
+                    found.update(self._long.get(sub, ()))
+        return found
+
+    def first_name_matches(self, idx: int, query: Set[str]) -> bool:
+        ff = self.first_stems[idx]
+        if not ff:
+            return False
+        for bb in query:
+            if ff == bb or (len(ff) >= 4 and (ff in bb or bb in ff)):
+                return True
+        return False
+
+    def exact_indices(self, norm_names: Iterable[str]) -> Set[int]:
+        found: Set[int] = set()
+        for m in norm_names:
+            found.update(self._by_norm.get(m, ()))
+        return found
+
+
+def _get_manager_index() -> ManagerIndex:
+    snapshot = _REFERENCE_CACHE
+    index = snapshot.get("manager_index")
+    if index is None:
+        index = snapshot["manager_index"] = ManagerIndex(snapshot.get("managers", {}).keys())
+    return index
+
+
 def resolve_manager_name_from_text(text: str) -> Optional[str]:
     """Attempt to resolve a manager full name from free text using cached managers.
     Returns lower-cased full name if uniquely resolved, else None.
@@ -252,27 +460,17 @@ def resolve_manager_name_from_text(text: str) -> Optional[str]:
     stems = [_stem_simple(t) for t in text_tokens]
     if not stems:
         return None
-    candidates: List[str] = []
-    for name in _REFERENCE_CACHE.get("managers", {}).keys():
-        parts = [p for p in (name or "").split() if p]
-        if not parts:
-            continue
-        surname = parts[0]
-        if any(_tokens_match_approx(surname, st) for st in stems):
-            candidates.append(name)
+    index = _get_manager_index()
+    query = index.query_stems(stems)
+    candidates = sorted(index.match_surnames(query))
     if not candidates:
         return None
     if len(candidates) == 1:
-        return candidates[0]
+        return index.names[candidates[0]]
     # Try to disambiguate by first name token
-    filtered: List[str] = []
-    for cand in candidates:
-        parts = [p for p in cand.split() if p]
-        first = parts[1] if len(parts) >= 2 else ""
-        if first and any(_tokens_match_approx(first, st) for st in stems):
-            filtered.append(cand)
+    filtered = [idx for idx in candidates if index.first_name_matches(idx, query)]
     if len(filtered) == 1:
-        return filtered[0]
+        return index.names[filtered[0]]
     return None
 
 
@@ -283,61 +481,24 @@ async def extract_entities(text: str) -> Dict[str, List[str]]:
     await ensure_references_loaded()
 
     text_lower = _norm(text)
+    # Бренды, категории, каналы, регионы, клиенты и точные ФИО — за один проход автомата
+    # с проверкой границ слов, чтобы "динамика" не совпадала с "мика"
+    found = _get_matcher().match(text_lower)
     entities = {
-        "brands": [],
-        "categories": [],
-        "channels": [],
-        "regions": [],
+        "brands": found["brands"],
+        "categories": found["categories"],
+        "channels": found["channels"],
+        "regions": found["regions"],
         "managers": [],
-        "clients": [],
+        "clients": found["clients"],
         "unknown": []
     }
 
-    # Бренды — по границам слов, чтобы "динамика" не совпадала с "мика"
-    for brand, entity_type in _REFERENCE_CACHE["brands"].items():
-        b = _norm(brand)
-        if _has_word(text_lower, b):
-            entities["brands"].append(b)
-
-    # Категории
-    for category, entity_type in _REFERENCE_CACHE["categories"].items():
-        c = _norm(category)
-        if _has_word(text_lower, c):
-            entities["categories"].append(c)
-
-    # Каналы
-    for channel, entity_type in _REFERENCE_CACHE["channels"].items():
-        ch = _norm(channel)
-        if _has_word(text_lower, ch):
-            entities["channels"].append(ch)
-
-    # Регионы
-    for region, entity_type in _REFERENCE_CACHE["regions"].items():
-        r = _norm(region)
-        if _has_word(text_lower, r):
-            entities["regions"].append(r)
-
     # Менеджеры (ФИО целиком или части через границы слов) + грубая нормализация падежей
-    tokens = _tokenize(text)
-    stems = [_stem_simple(t) for t in tokens]
-    for manager, entity_type in _REFERENCE_CACHE["managers"].items():
-        m = _norm(manager)
-        # прямое точное совпадение слова
-        if _has_word(text_lower, m):
-            entities["managers"].append(m)
-            continue
-        # по фамилии/части с учётом стемминга
-        parts = [p for p in re.split(r"\s+", m) if p]
-        if parts:
-            surname = parts[0]
-            if any(_tokens_match_approx(surname, st) for st in stems):
-                entities["managers"].append(m)
-
-    # Клиенты
-    for client, entity_type in _REFERENCE_CACHE["clients"].items():
-        cl = _norm(client)
-        if _has_word(text_lower, cl):
-            entities["clients"].append(cl)
+    index = _get_manager_index()
+    stems = [_stem_simple(t) for t in _tokenize(text)]
+    matched = index.exact_indices(found["managers"]) | index.match_surnames(index.query_stems(stems))
+    entities["managers"] = [index.norm_names[idx] for idx in sorted(matched)]
 
     return entities
 
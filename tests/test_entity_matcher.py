@@ -0,0 +1,37 @@
+"""Автомат Aho-Corasick (EntityMatcher) в extract_entities против прежнего regex на каждое название"""
+import asyncio
+
+import pytest
+
+import src.utils.reference_data as rd
+from bench.entity_matcher_bench import TEXTS, legacy_extract, synthetic_snapshot
+
+_SNAPSHOT = synthetic_snapshot(2000)
+_SNAPSHOT["matcher"] = rd._build_matcher(_SNAPSHOT)
+
+# Границы слов и пересекающиеся названия: «ромашка 170» — не «ромашка 17», «динамика» — не «мика»
+_EDGE_TEXTS = [
+    "выручка ромашка 170 и магнит 30 за март",
+    "ромашка 17, магнит 3; ип петров 42.",
+    "горная долина горная долина эльбрус 12",
+    "эльбрус 1 и эльбрус 12 по весу",
+    "динамика продаж в сети и в сетях",
+    "ОПТ и Розница, НАЛЬЧИК",
+    "",
+]
+
+
+@pytest.fixture(autouse=True)
+def _snapshot(monkeypatch):
+    monkeypatch.setattr(rd, "_REFERENCE_CACHE", _SNAPSHOT)
+
+
+@pytest.mark.parametrize("text", TEXTS + _EDGE_TEXTS)
+def test_matcher_matches_legacy_regex(text):
+    assert asyncio.run(rd.extract_entities(text)) == legacy_extract(text, _SNAPSHOT)
+
+
+def test_corpus_finds_entities():
+    # без этого сверка с regex прошла бы и на пустом справочнике
+    entities = asyncio.run(rd.extract_entities(TEXTS[2]))
+    assert entities["clients"] == ["ромашка 17", "ип петров 42"]
@@ -0,0 +1,18 @@
+"""Потоковая выгрузка в xlsx (src/services/excel/service.py)"""
+import asyncio
+
+import pytest
+
+from src.services.excel import service
+
+
+async def _batches(total: int, size: int = 2):
+    for start in range(0, total, size):
+        yield [{"n": i} for i in range(start, min(total, start + size))]
+
+
+@pytest.mark.parametrize("total, expected", [(3, (3, False)), (5, (5, False)), (6, (5, True)), (9, (5, True))])
+def test_sheet_limit_is_reported(monkeypatch, tmp_path, total, expected):
+    monkeypatch.setattr(service, "XLSX_MAX_DATA_ROWS", 5)
+    result = asyncio.run(service.write_excel_from_batches(_batches(total), str(tmp_path / "out.xlsx")))
+    assert result == expected
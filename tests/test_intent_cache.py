@@ -0,0 +1,78 @@
+"""Ключ кэша вопросов (src/ai/intent_cache.py): один смысл — один ключ, другой смысл — другой ключ"""
+import datetime as _dt
+
+import pytest
+
+intent_cache = pytest.importorskip("src.ai.intent_cache")
+parser = pytest.importorskip("src.services.nlu.parser")
+
+_TODAY = _dt.date(2025, 6, 15)
+_NO_ENTITIES = {}
+_CHABAN = {"brands": ["чабан"]}
+
+
+def _key(text, entities=_NO_ENTITIES, today=_TODAY):
+    return intent_cache.intent_key(text, parser.parse_intent(text, _TODAY), entities, today=today)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("продажи по брендам за март", "выручка брендов в марте"),
+    ("выручка по менеджерам за 2024", "покажи выручку менеджеров в 2024"),
+    ("вес по регионам за март", "какой вес по регионам в марте"),
+    ("выручка за вчера", "покажи выручку за вчера"),
+    ("выручка бренда чабан за март", "продажи бренду чабан в марте"),
+])
+def test_same_meaning_same_key(a, b):
+    entities = _CHABAN if "чабан" in a else _NO_ENTITIES
+    assert _key(a, entities) is not None
+    assert _key(a, entities) == _key(b, entities)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("выручка по брендам за март", "выручка по брендам за март без возвратов"),
+    ("выручка клиентов за март", "выручка топ-10 клиентов за март"),
+    ("выручка по менеджерам за март", "выручка по менеджерам и брендам за март"),
+    ("выручка по менеджерам за март", "вес по менеджерам за март"),
+    ("выручка по брендам за март", "выручка по брендам за апрель"),
+])
+def test_extra_filter_or_other_meaning_changes_key(a, b):
+    assert _key(a) != _key(b)
+
+
+def test_entity_filter_changes_key():
+    assert _key("выручка брендов за март") != _key("выручка бренда чабан за март", _CHABAN)
+
+
+def test_dimension_order_changes_key():
+    assert _key("выручка менеджеров по брендам за март") != _key("выручка брендов по менеджерам за март")
+
+
+@pytest.mark.parametrize("relative", [
+    "выручка за вчера", "выручка за этот месяц", "выручка за неделю", "выручка за год", "выручка на май",
+])
+def test_relative_period_differs_from_absolute(relative):
+    assert _key(relative) != _key("выручка за март")
+    assert _key(relative) != _key("выручка за 2025")
+
+
+def test_relative_period_key_lives_one_day():
+    tomorrow = _TODAY + _dt.timedelta(days=1)
+    assert _key("выручка за вчера") != _key("выручка за вчера", today=tomorrow)
+    # период понят — даты в ключе, день вопроса не важен
+    assert _key("выручка за март") == _key("выручка за март", today=tomorrow)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("выручка за неделю", "выручка по неделям"),
+    ("выручка за месяц", "выручка по месяцам"),
+    ("выручка за год", "выручка"),
+    ("выручка с мая", "выручка на май"),
+    ("выручка за вчера", "выручка за позавчера"),
+    ("выручка за прошлый месяц", "выручка за этот месяц"),
+])
+def test_unrecognised_periods_do_not_share_a_key(a, b):
+    assert _key(a) != _key(b)
+
+
+def test_question_without_metric_is_not_cached():
+    assert _key("покажи менеджеров за март") is None
@@ -0,0 +1,40 @@
+"""Индекс фамилий менеджеров (ManagerIndex) против прежнего перебора на корпусе bench.manager_resolver_bench"""
+import asyncio
+
+import pytest
+
+import src.utils.reference_data as rd
+from bench.manager_resolver_bench import (
+    GOLDEN,
+    legacy_extract_managers,
+    legacy_resolve,
+    make_managers,
+    make_texts,
+    managers_snapshot,
+)
+
+_MANAGERS = make_managers(150)
+_TEXTS = make_texts(_MANAGERS, 150)
+_SNAPSHOT = managers_snapshot(_MANAGERS)
+
+
+@pytest.fixture(autouse=True)
+def _snapshot(monkeypatch):
+    monkeypatch.setattr(rd, "_REFERENCE_CACHE", _SNAPSHOT)
+
+
+@pytest.mark.parametrize("text", _TEXTS)
+def test_resolve_matches_legacy(text):
+    assert rd.resolve_manager_name_from_text(text) == legacy_resolve(text, _MANAGERS)
+
+
+@pytest.mark.parametrize("text", _TEXTS)
+def test_extract_entities_managers_match_legacy(text):
+    entities = asyncio.run(rd.extract_entities(text))
+    assert entities["managers"] == legacy_extract_managers(text, _MANAGERS)
+
+
+def test_golden_phrases_find_managers():
+    # без этого сверка с перебором прошла бы и на пустом справочнике
+    found = [t for t in GOLDEN if asyncio.run(rd.extract_entities(t))["managers"]]
+    assert len(found) >= len(GOLDEN) // 2
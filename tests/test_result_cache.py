@@ -0,0 +1,110 @@
+"""Кэш результатов SQL (src/db/result_cache.py): что кэшируется и как записи переживают Redis"""
+import asyncio
+import datetime as _dt
+from decimal import Decimal
+
+import pytest
+
+from src.db import result_cache
+from src.db.sql_guard import _guard_cached
+from src.models.rowset import RowSet
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT manager, SUM(revenue) FROM profit WHERE profit_date >= '2025-01-01' GROUP BY 1",
+    "SELECT c.region, SUM(p.revenue) FROM public.profit p JOIN public.clients c ON c.client_code = p.client_code GROUP BY 1",
+    "WITH m AS (SELECT manager, SUM(plan) AS plan FROM managers_plan GROUP BY 1) SELECT * FROM m",
+    "SELECT s.warehouse, SUM(s.final_quantity) FROM stock s WHERE s.stock_date = CURRENT_DATE GROUP BY 1",
+])
+def test_business_tables_are_cached(sql):
+    assert result_cache.cache_key(_guard_cached(sql), 100) is not None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM bonus_excluded.profit_mv p WHERE p.revenue > 0",
+    "SELECT manager, SUM(revenue) FROM rollup.profit_month_manager_channel p GROUP BY 1",
+])
+def test_derived_relations_are_cached(sql):
+    assert result_cache.cache_key(sql, None) is not None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT count(*) FROM agent_logs WHERE chat_id = 1",
+    "SELECT * FROM training_clicks",
+    "SELECT chat_id FROM bot_autorized_chats",
+    "SELECT p.manager, count(*) FROM profit p JOIN agent_logs l ON l.user_name = p.manager GROUP BY 1",
+    "SELECT column_name FROM information_schema.columns WHERE table_name = 'profit'",
+    "SELECT * FROM plan_perf_manager_reports WHERE kpi < 95",
+    "SELECT d FROM generate_series(DATE '2025-01-01', DATE '2025-12-01', INTERVAL '1 month') d",
+    "SELECT get_control_anomalies(current_date)",
+    "SELECT SUM(revenue), now() FROM profit",
+])
+def test_other_queries_are_not_cached(sql):
+    assert result_cache.cache_key(_guard_cached(sql), 100) is None
+
+
+class _FakeRedis:
+    """Словарь с теми командами Redis, которые вызывает _RedisBackend"""
+
+    def __init__(self):
+        self.values, self.lru = {}, {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def zadd(self, key, mapping):
+        self.lru.update(mapping)
+
+    async def zpopmin(self, key, count):
+        return []
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def pipeline(self, transaction=False):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self._redis, self._calls = redis, []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, key, value, ex=None):
+        self._calls.append(lambda: self._redis.values.__setitem__(key, value))
+
+    def zadd(self, key, mapping):
+        self._calls.append(lambda: self._redis.lru.update(mapping))
+
+    def zcard(self, key):
+        self._calls.append(lambda: len(self._redis.lru))
+
+    async def execute(self):
+        return [call() for call in self._calls]
+
+
+def test_redis_hit_matches_miss(monkeypatch):
+    import src.utils.memory
+
+    monkeypatch.setattr(src.utils.memory, "get_redis", lambda: _FakeRedis.instance)
+    _FakeRedis.instance = _FakeRedis()
+    rows = RowSet.from_records([
+        {"day": _dt.date(2025, 1, 31), "at": _dt.datetime(2025, 1, 31, 12, 0), "revenue": Decimal("1.5"), "id": None},
+        {"day": _dt.date(2025, 2, 1), "at": None, "revenue": 2, "id": 7},
+    ])
+    backend = result_cache._RedisBackend(10)
+
+    async def scenario():
+        assert await backend.set("key", "v1", rows)
+        return await backend.get("key", "v1")
+
+    cached, stale = asyncio.run(scenario())
+    assert not stale
+    assert cached.kinds == rows.kinds
+    assert cached.to_dicts() == rows.to_dicts()
@@ -0,0 +1,47 @@
+"""Маршрутизация запросов на сводные таблицы profit (src/db/rollups.py)"""
+import pytest
+
+from src.db.rollups import ROLLUPS, _route
+
+_AVAILABLE = tuple((r.name, r.dimensions, 1000.0) for r in ROLLUPS)
+
+
+def _routed(sql: str):
+    route = _route(sql, _AVAILABLE)
+    return route.sql if route else None
+
+
+@pytest.mark.parametrize("condition", [
+    "p.profit_date >= DATE '2025-01-01' AND p.profit_date < DATE '2025-02-01'",
+    "p.profit_date BETWEEN '2025-01-01' AND '2025-03-31'",
+    "p.profit_date >= '2025-01-01'::date",
+    "p.revenue < 0",
+])
+def test_month_boundaries_and_sign_are_routed(condition):
+    sql = _routed(f"SELECT p.manager, SUM(p.revenue) FROM public.profit p WHERE {condition} GROUP BY 1")
+    assert sql is not None
+    assert "rollup.profit_month_manager_channel" in sql
+    assert "profit_date" not in sql
+
+
+def test_sign_test_inside_case_is_routed():
+    sql = _routed(
+        "SELECT channel, SUM(CASE WHEN revenue < 0 THEN revenue ELSE 0 END) FROM public.profit GROUP BY 1"
+    )
+    assert sql is not None and "revenue_sign < 0" in sql
+
+
+@pytest.mark.parametrize("condition", [
+    "p.profit_date >= '2025-01-01' - INTERVAL '10 days'",
+    "p.profit_date >= '2025-01-01'::date + 3",
+    "p.profit_date < '2025-02-01' + 1",
+    "p.profit_date >= DATE '2025-01-01' + INTERVAL '1 day' AND p.revenue > 0",
+    "p.profit_date BETWEEN '2025-01-01' AND '2025-03-31'::date - 1",
+    "p.revenue > 0 - 5",
+    "p.revenue > 0 * p.quantity",
+    "0 - p.revenue > 0",
+    "-p.revenue < 0",
+    "p.revenue > 0 IS TRUE",
+])
+def test_arithmetic_around_comparison_stays_on_profit(condition):
+    assert _routed(f"SELECT p.manager, SUM(p.revenue) FROM public.profit p WHERE {condition} GROUP BY 1") is None
@@ -0,0 +1,46 @@
+"""RowSet (src/models/rowset.py): типы колонок и JSON-представление для кэша результатов"""
+import datetime as _dt
+import json
+from decimal import Decimal
+
+import pytest
+
+from src.models.rowset import KIND_FLOAT, KIND_INT, KIND_OBJECT, RowSet
+
+
+def _round_trip(rows: RowSet) -> RowSet:
+    return RowSet.from_payload(json.loads(json.dumps(rows.to_payload(), ensure_ascii=False)))
+
+
+def test_payload_round_trip_keeps_values_and_types():
+    tz = _dt.timezone(_dt.timedelta(hours=3))
+    rows = RowSet.from_records([
+        {"id": 1, "day": _dt.date(2025, 1, 31), "at": _dt.datetime(2025, 1, 31, 10, 5, tzinfo=tz),
+         "revenue": Decimal("10.50"), "name": "Нальчик", "opened": _dt.time(9, 30)},
+        {"id": 2, "day": None, "at": None, "revenue": None, "name": None, "opened": None},
+    ])
+    restored = _round_trip(rows)
+    assert restored.kinds == rows.kinds
+    assert restored.to_dicts() == rows.to_dicts()
+    assert type(restored[0]["day"]) is _dt.date
+    assert type(restored[0]["at"]) is _dt.datetime and restored[0]["at"].utcoffset() == _dt.timedelta(hours=3)
+
+
+def test_int_column_with_nulls_keeps_exact_ints():
+    big = 2 ** 62 + 1
+    rows = RowSet.from_records([{"client_id": big}, {"client_id": None}])
+    assert rows.kinds == (KIND_OBJECT,)
+    assert [r["client_id"] for r in rows] == [big, None]
+    assert [r["client_id"] for r in _round_trip(rows)] == [big, None]
+
+
+def test_numeric_kinds():
+    rows = RowSet.from_records([{"a": 1, "b": 1.5, "c": Decimal("2")}, {"a": 2, "b": None, "c": 3}])
+    assert rows.kinds == (KIND_INT, KIND_FLOAT, KIND_FLOAT)
+    assert rows[1] == {"a": 2, "b": None, "c": 3.0}
+
+
+def test_dates_mixed_with_other_values_are_not_serialized():
+    rows = RowSet.from_records([{"v": _dt.date(2025, 1, 1)}, {"v": "итого"}])
+    with pytest.raises(TypeError):
+        rows.to_payload()
@@ -0,0 +1,74 @@
+"""Каталог таблиц для AI_SCHEMA_PRUNING (src/ai/schema_catalog.py) против промпта из workflow"""
+import datetime as _dt
+import json
+from pathlib import Path
+
+import pytest
+
+from src.services.nlu.parser import parse_intent
+
+schema_catalog = pytest.importorskip("src.ai.schema_catalog")
+
+_WORKFLOW = Path(__file__).resolve().parents[1] / "workflow"
+_TODAY = _dt.date(2025, 6, 15)
+
+
+@pytest.fixture(scope="module")
+def prompt() -> str:
+    data = json.loads(_WORKFLOW.read_text(encoding="utf-8"))
+    for node in data["nodes"]:
+        message = ((node.get("parameters") or {}).get("options") or {}).get("systemMessage")
+        if node.get("type", "").endswith(".agent") and message:
+            return message[1:] if message.startswith("=") else message
+    pytest.fail("в workflow нет промпта агента")
+
+
+def test_catalog_matches_prompt(prompt):
+    stripped, ok = schema_catalog.strip_schema_sections(prompt)
+    assert ok
+    assert "client_code, client_name" not in stripped
+    assert "🔒 ВАЖНОЕ ПРАВИЛО" in stripped and "📣 Общий вопрос" in stripped
+
+
+@pytest.mark.parametrize("marker", ["📦 Структура базы данных", "🔒 ВАЖНОЕ ПРАВИЛО", "📍 Точки контроля", "📣 Общий вопрос"])
+def test_missing_marker_keeps_prompt_untouched(prompt, marker):
+    broken = prompt.replace(marker, "")
+    assert schema_catalog.strip_schema_sections(broken) == (broken, False)
+
+
+@pytest.mark.parametrize("old, new", [
+    ("manager,client_code,", "manager,client_cod,"),
+    ("debt.client_code → clients.client_code", ""),
+    ("total_sales_kg (numeric)", "total_sold_kg (numeric)"),
+])
+def test_catalog_drift_keeps_prompt_untouched(prompt, old, new):
+    assert old in prompt
+    changed = prompt.replace(old, new)
+    assert schema_catalog.strip_schema_sections(changed) == (changed, False)
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return pytest.importorskip("bench.schema_bench").CORPUS
+
+
+def test_pruned_schema_covers_corpus(corpus):
+    # все таблицы, без которых правильный SQL не написать, попадают в промпт вместе со связями между ними
+    for item in corpus:
+        question = item["question"]
+        selection = schema_catalog.select_tables(question, parse_intent(question, _TODAY))
+        missing = set(item["tables"]) - set(selection.tables)
+        assert not missing, f"{question}: нет {sorted(missing)}"
+        schema = schema_catalog.render_schema(selection.tables)
+        for name in selection.tables:
+            assert f"\n{name}({schema_catalog.CATALOG[name].title})" in schema, f"{question}: {name}"
+        for left, right in schema_catalog.JOINS:
+            if {left.split(".")[0], right.split(".")[0]} <= set(selection.tables):
+                assert f"{left} → {right}" in schema, f"{question}: {left} → {right}"
+
+
+def test_corpus_is_not_answered_by_full_catalog(corpus):
+    # весь каталог покрыл бы любой вопрос — сокращение должно срабатывать на размеченных вопросах
+    full = [item["question"] for item in corpus
+            if schema_catalog.select_tables(item["question"], parse_intent(item["question"], _TODAY)).full]
+    assert not full
@@ -0,0 +1,88 @@
+"""guard_sql на токенизаторе против прежних регулярок на корпусе bench.sql_guard_bench"""
+import pytest
+
+from bench.sql_guard_bench import BONUS, CORPUS, MUST_REJECT, legacy_guard_sql
+from src.db import sql_guard
+from src.db.sql_guard import guard_sql
+
+
+def _try(fn, query):
+    try:
+        return fn(query)
+    except ValueError:
+        return None
+
+
+def _filtered(table: str) -> str:
+    return sql_guard._wrap_table_with_filter(table, "client_code")
+
+
+@pytest.mark.parametrize("query", CORPUS)
+def test_guarded_query_is_stable(query):
+    # повторный разбор ничего не меняет — необёрнутых ссылок на таблицы с фильтром не осталось
+    guarded = _try(guard_sql, query)
+    if guarded is not None:
+        assert guard_sql(guarded) == guarded
+
+
+@pytest.mark.parametrize("query", CORPUS)
+def test_rejects_only_what_legacy_rejected(query):
+    if _try(guard_sql, query) is None:
+        assert _try(legacy_guard_sql, query) is None
+
+
+@pytest.mark.parametrize("query", CORPUS)
+def test_keeps_every_bonus_filter_legacy_added(query):
+    new, old = _try(guard_sql, query), _try(legacy_guard_sql, query)
+    if new is not None and old is not None and old.count(BONUS) > query.count(BONUS):
+        assert new.count(BONUS) > query.count(BONUS)
+
+
+@pytest.mark.parametrize("query", MUST_REJECT + [
+    "SELECT 1; SELECT 2",
+    "UPDATE profit SET revenue = 0",
+    "SELECT * FROM profit; DROP TABLE profit",
+    "",
+])
+def test_rejects(query):
+    with pytest.raises(ValueError):
+        guard_sql(query)
+
+
+@pytest.mark.parametrize("query, expected", [
+    (
+        "SELECT * FROM \"profit\" p WHERE p.channel = 'Розница'",
+        f"SELECT * FROM {_filtered('profit')} p WHERE p.channel = 'Розница'",
+    ),
+    (
+        "SELECT 1 FROM orders o, clients c, profit WHERE true",
+        f"SELECT 1 FROM {_filtered('orders')} o, clients c, {_filtered('profit')} profit WHERE true",
+    ),
+    (
+        "WITH profit AS (SELECT * FROM profit WHERE revenue > 0) SELECT channel, SUM(revenue) FROM profit GROUP BY channel",
+        f"WITH profit AS (SELECT * FROM {_filtered('profit')} profit WHERE revenue > 0) "
+        "SELECT channel, SUM(revenue) FROM profit GROUP BY channel",
+    ),
+    (
+        "SELECT COUNT(*) FROM (TABLE debt) d",
+        f"SELECT COUNT(*) FROM (SELECT * FROM {_filtered('debt')} debt) d",
+    ),
+    (
+        "SELECT s.warehouse FROM stock s",
+        f"SELECT s.warehouse FROM {sql_guard._wrap_stock()} s",
+    ),
+    (
+        "SELECT E'\\'', revenue FROM profit --'",
+        f"SELECT E'\\'', revenue FROM {_filtered('profit')} profit --'",
+    ),
+    (
+        "SELECT 'delete from profit; drop table x' AS note, COUNT(*) FROM profit",
+        f"SELECT 'delete from profit; drop table x' AS note, COUNT(*) FROM {_filtered('profit')} profit",
+    ),
+    (
+        "SELECT full_name FROM sales_representatives WHERE full_name ILIKE '%альборов%'",
+        "SELECT full_name FROM sales_representatives WHERE full_name ILIKE '%альборов%'",
+    ),
+])
+def test_expected_rewrites(query, expected):
+    assert guard_sql(query) == expected
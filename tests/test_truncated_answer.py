@@ -0,0 +1,84 @@
+"""Большая выборка: начало результата и подсказка сузить запрос доходят до пользователя вместе с файлом"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+agent = pytest.importorskip("src.ai.agent")
+text_handler = pytest.importorskip("src.handlers.text")
+excel_flow = pytest.importorskip("src.handlers.excel_flow")
+
+from src.models.rowset import RowSet  # noqa: E402
+
+_HINT = "уточните период или добавьте фильтры"
+
+
+class _Bot:
+    id = 1
+
+    def __init__(self):
+        self.sent, self.edited, self.deleted = [], [], []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+        return SimpleNamespace(message_id=len(self.sent))
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self.edited.append(text)
+
+    async def delete_message(self, chat_id, message_id):
+        self.deleted.append(message_id)
+
+
+def _truncated_result(monkeypatch):
+    monkeypatch.setattr(agent, "SQL_INLINE_MAX_ROWS", 3)
+    monkeypatch.setattr(agent, "estimated_rows", lambda sql: 120_000)
+    rows = RowSet.from_records([{"client": f"Клиент {i}", "revenue": 100.0 * i} for i in range(10)])
+    return agent._render_db_rows(rows, "выручка по клиентам", "SELECT client, revenue FROM profit")
+
+
+def test_hint_is_added_to_truncated_answer(monkeypatch):
+    result = _truncated_result(monkeypatch)
+    assert result.send_excel and result.table_data is None
+    assert _HINT in result.output
+    assert "120 000" in result.output
+
+
+def test_hint_reaches_user_message(monkeypatch):
+    result = _truncated_result(monkeypatch)
+    streamed = []
+
+    async def _async(value=None):
+        return value
+
+    async def run_ai_for_text(**kwargs):
+        return result
+
+    async def send_excel_stream_in_chat(context, chat_id, sql_query):
+        streamed.append(sql_query)
+
+    for name, value in {
+        "check_authorized_chat": lambda chat_id: _async(True),
+        "run_ai_for_text": run_ai_for_text,
+        "log_interaction": lambda *args: _async(42),
+        "link_answer": lambda *args: _async(),
+        "log_answer_sql": lambda *args: None,
+        "append_message": lambda *args: _async(),
+        "tg_debug": lambda *args: _async(),
+        "is_debug": lambda chat_id: _async(False),
+    }.items():
+        monkeypatch.setattr(text_handler, name, value)
+    monkeypatch.setattr(excel_flow, "send_excel_stream_in_chat", send_excel_stream_in_chat)
+
+    bot = _Bot()
+    update = SimpleNamespace(
+        effective_chat=SimpleNamespace(id=10),
+        effective_user=SimpleNamespace(id=20, full_name="Тест"),
+        effective_message=SimpleNamespace(text="выручка по клиентам"),
+    )
+    context = SimpleNamespace(bot=bot, application=SimpleNamespace(bot=bot))
+    asyncio.run(text_handler.process_text(update, context))
+
+    assert streamed == ["SELECT client, revenue FROM profit"]
+    assert not bot.deleted
+    assert any(_HINT in message for message in bot.edited + bot.sent[1:])
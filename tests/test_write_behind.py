@@ -0,0 +1,44 @@
+"""Очередь отложенной записи (src/db/write_behind.py) без фоновой задачи: сброс из submit()"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import src.db.write_behind as wb
+
+
+class _FakePool:
+    @asynccontextmanager
+    async def acquire(self):
+        yield None
+
+
+def test_submit_without_background_task_keeps_one_flush_task(monkeypatch):
+    async def _get_pool():
+        return _FakePool()
+
+    monkeypatch.setattr(wb, "get_pool", _get_pool)
+    monkeypatch.setattr(wb, "_QUEUES", [])
+    written = []
+
+    async def _flush(conn, rows):
+        await asyncio.sleep(0)
+        written.extend(rows)
+
+    async def _scenario():
+        queue = wb.WriteBehindQueue("test", _flush, flush_size=2)
+        queue.submit((1,))
+        task = queue._direct_task
+        assert task is not None and not task.done()
+        for i in range(2, 6):
+            queue.submit((i,))
+        # пока идёт сброс, новые строки забирает он же — второй задачи нет
+        assert queue._direct_task is task
+        await task
+        assert written == [(1,), (2,), (3,), (4,), (5,)]
+        queue.submit((6,))
+        assert queue._direct_task is not task
+        await queue.stop()
+        assert queue._direct_task is None
+        assert written[-1] == (6,)
+        assert queue.get_stats()["pending"] == 0
+
+    asyncio.run(_scenario())